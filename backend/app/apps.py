@@ -4,3 +4,13 @@ from django.apps import AppConfig as DjangoAppConfig
 class AppConfig(DjangoAppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "app"
+
+    def ready(self):
+        # リクエストの処理時間などをメトリクスに記録する
+        from utils import metrics
+
+        from .pipeline import add_input_listener, add_request_listener, add_stage_listener
+
+        add_stage_listener(metrics.observe_stage)
+        add_request_listener(metrics.observe_request)
+        add_input_listener(metrics.observe_input)
@@ -0,0 +1,56 @@
+import asyncio
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    """
+    設定値 ASYNC_EXECUTOR_THREADS のスレッド数で、プロセス共通のスレッドプールを作成して返す
+    """
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=settings.ASYNC_EXECUTOR_THREADS, thread_name_prefix="view"
+            )
+        return _executor
+
+
+def run_in_executor(view):
+    """
+    同期のビューを、スレッドプールで実行する非同期のビューにする
+
+    ASGI では同期のビューは1つのスレッドで順番に実行されるため、そのままでは
+    リクエストを並行に処理できない。検証・ハッシュ計算・エンコードなどはスレッドプールで、
+    デコードや推論などの重い処理はジョブのワーカーで実行し、イベントループは止めない。
+    逐次返すレスポンスも、チャンクごとにスレッドプールで読み出す。
+    """
+
+    @functools.wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        response = await sync_to_async(
+            view, thread_sensitive=False, executor=get_executor()
+        )(request, *args, **kwargs)
+        if response.streaming and not response.is_async:
+            response.streaming_content = _iterate_in_executor(response.streaming_content)
+        return response
+
+    return wrapper
+
+
+async def _iterate_in_executor(iterator):
+    loop = asyncio.get_running_loop()
+    iterator = iter(iterator)
+    done = object()
+    while True:
+        chunk = await loop.run_in_executor(get_executor(), next, iterator, done)
+        if chunk is done:
+            return
+        yield chunk
@@ -0,0 +1,134 @@
+import re
+from urllib.parse import quote
+
+from django.conf import settings
+from django.http import FileResponse, HttpResponse, StreamingHttpResponse
+from django.utils.http import content_disposition_header
+from utils.result_store import get_result_store
+
+RANGE_PATTERN = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+# 範囲を返すときに一度に読み込むバイト数
+CHUNK_SIZE = 64 * 1024
+
+
+class RangeNotSatisfiableError(Exception):
+    pass
+
+
+def parse_range(header, size):
+    """
+    Range ヘッダ（1つの範囲だけに対応する）から返す範囲を求める
+
+    :param header: Range ヘッダの値（例: "bytes=0-1023", "bytes=1024-", "bytes=-512"）
+    :param size: ファイルのサイズ
+    :return: (開始, 終了)（終了の位置を含む）。ヘッダがない・複数の範囲・形式が正しくない
+        （"bytes=5-3" のように終了が開始より前の場合を含む）場合は None（全体を返す）
+    :raises RangeNotSatisfiableError: 範囲がファイルと重ならない場合
+    """
+    match = RANGE_PATTERN.match((header or "").strip())
+    if match is None or match.groups() == ("", ""):
+        return None
+    first, last = match.groups()
+    if not first:
+        # 末尾から last バイト
+        length = int(last)
+        if length == 0 or size == 0:
+            raise RangeNotSatisfiableError()
+        return max(0, size - length), size - 1
+    start = int(first)
+    if last and int(last) < start:
+        return None
+    if start >= size:
+        raise RangeNotSatisfiableError()
+    end = min(int(last), size - 1) if last else size - 1
+    return start, end
+
+
+def etag_matches(header, etag):
+    """
+    If-None-Match の値に ETag が含まれるか（弱い比較）
+    """
+    if header is None:
+        return False
+    if header.strip() == "*":
+        return True
+    tags = [tag.strip() for tag in header.split(",")]
+    return any(tag.removeprefix("W/") == etag for tag in tags)
+
+
+def stored_result_response(request, result_id, filename=None, content_type=None):
+    """
+    utils.result_store に保存した結果を返す
+
+    - ETag は内容の ID（強い ETag）。If-None-Match が一致すれば 304 を返す
+    - Range（1つの範囲）には 206 を返す。If-Range が ETag と異なる場合は全体を返す
+    - RESULT_STORE_SENDFILE を設定した場合はファイルの送信をフロントのプロキシに任せる
+      （Range もプロキシが処理する）
+
+    :param result_id: 結果の ID
+    :param filename: ダウンロードするファイル名（None の場合は保存時のファイル名）
+    :param content_type: Content-Type（None の場合は保存時の Content-Type）
+    :raises utils.result_store.ResultNotFoundError: 保存されていない、または保存期間を過ぎた場合
+    """
+    store = get_result_store()
+    info = store.info(result_id)
+    filename = filename or info["filename"]
+    content_type = content_type or info["content_type"]
+    etag = f'"{result_id}"'
+
+    if etag_matches(request.META.get("HTTP_IF_NONE_MATCH"), etag):
+        response = HttpResponse(status=304)
+    elif settings.RESULT_STORE_SENDFILE:
+        response = HttpResponse(content_type=content_type)
+        if settings.RESULT_STORE_SENDFILE == "x-accel-redirect":
+            prefix = settings.RESULT_STORE_ACCEL_PREFIX.rstrip("/")
+            response["X-Accel-Redirect"] = f"{prefix}/{quote(store.relative_path(result_id))}"
+        else:
+            response["X-Sendfile"] = info["path"]
+    else:
+        response = _file_response(request, info, content_type, etag)
+
+    response["ETag"] = etag
+    response["Accept-Ranges"] = "bytes"
+    response["Cache-Control"] = settings.RESULT_STORE_CACHE_CONTROL
+    if response.status_code != 304:
+        response["Content-Disposition"] = content_disposition_header(True, filename or "result")
+    return response
+
+
+def _file_response(request, info, content_type, etag):
+    size = info["size"]
+    byte_range = None
+    if_range = request.META.get("HTTP_IF_RANGE")
+    if if_range is None or if_range.strip() == etag:
+        try:
+            byte_range = parse_range(request.META.get("HTTP_RANGE"), size)
+        except RangeNotSatisfiableError:
+            response = HttpResponse(status=416)
+            response["Content-Range"] = f"bytes */{size}"
+            return response
+
+    f = open(info["path"], "rb")
+    if byte_range is None:
+        # 全体はファイルのまま渡す（WSGI サーバーが sendfile で送れる）
+        return FileResponse(f, content_type=content_type)
+
+    start, end = byte_range
+    f.seek(start)
+    response = StreamingHttpResponse(
+        _read_range(f, end - start + 1), status=206, content_type=content_type
+    )
+    response["Content-Length"] = str(end - start + 1)
+    response["Content-Range"] = f"bytes {start}-{end}/{size}"
+    return response
+
+
+def _read_range(f, length):
+    with f:
+        while length > 0:
+            chunk = f.read(min(CHUNK_SIZE, length))
+            if not chunk:
+                return
+            length -= len(chunk)
+            yield chunk
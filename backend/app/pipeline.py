@@ -0,0 +1,504 @@
+import io
+import logging
+import time
+from contextlib import ExitStack, contextmanager
+from dataclasses import dataclass
+from typing import Callable, Optional
+
+from django.conf import settings
+from django.core.exceptions import RequestDataTooBig
+from django.http import FileResponse, JsonResponse, StreamingHttpResponse
+from django.urls import reverse
+from django.utils.http import content_disposition_header
+from utils.admission import AdmissionRejectedError, client_id, get_admission_controller
+from utils.jobs import (
+    DONE,
+    JobCancelledError,
+    JobNotFoundError,
+    JobQueueFullError,
+    JobTimeoutError,
+    download_filename,
+    get_job_manager,
+    user_error_message,
+)
+from utils.result_cache import cache_key, get_result_cache, hash_upload
+from utils.result_store import ResultNotFoundError, get_result_store
+from utils.uploads import (
+    StoredUpload,
+    UploadTooLargeError,
+    get_upload_store,
+    upload_too_large_message,
+)
+
+logger = logging.getLogger(__name__)
+
+# ジョブの待ち行列が一杯の場合に再試行を促すまでの秒数
+RETRY_AFTER_SECONDS = 5
+# 同期 API でジョブが JOB_SYNC_TIMEOUT 秒以内に終わらなかった場合のメッセージ
+TIMEOUT_MESSAGE = "Processing took too long. Please try again later."
+# ダウンロードする処理の結果のキャッシュに入れる値（結果の保存先の ID）の接頭辞
+RESULT_ID_PREFIX = b"result-id:"
+
+_stage_listeners = []
+_request_listeners = []
+_input_listeners = []
+
+
+class RequestError(Exception):
+    """
+    ユーザーにそのまま返すエラー（入力の誤りなど）
+    """
+
+
+def add_stage_listener(listener):
+    """
+    段階ごとの処理時間を受け取る関数を登録する
+
+    :param listener: listener(処理名, 段階名, 秒) の形で呼ばれる関数
+    """
+    _stage_listeners.append(listener)
+
+
+def add_request_listener(listener):
+    """
+    リクエストの完了を受け取る関数を登録する
+
+    :param listener: listener(処理名, ステータスコード, 秒, キャッシュの結果) の形で呼ばれる関数
+    """
+    _request_listeners.append(listener)
+
+
+def add_input_listener(listener):
+    """
+    入力の大きさを受け取る関数を登録する
+
+    :param listener: listener(処理名, バイト数, 再生時間（秒、不明な場合は None）) の形で呼ばれる関数
+    """
+    _input_listeners.append(listener)
+
+
+def notify_input(operation, file, probe=None):
+    duration = getattr(probe, "duration", None)
+    for listener in _input_listeners:
+        listener(operation.name, file.size, duration)
+
+
+class StageTimer:
+    """
+    リクエストの段階ごとの処理時間を記録するクラス
+    """
+
+    def __init__(self, operation):
+        self.operation = operation
+        self.started = time.perf_counter()
+        self.durations = {}
+
+    @contextmanager
+    def stage(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - started)
+
+    def record(self, name, seconds):
+        self.durations[name] = self.durations.get(name, 0.0) + seconds
+        for listener in _stage_listeners:
+            listener(self.operation, name, seconds)
+
+    @property
+    def total(self):
+        return time.perf_counter() - self.started
+
+    def server_timing(self):
+        """
+        Server-Timing ヘッダの値を返す（例: "ingest;dur=1.2, process;dur=830.5, total;dur=840.1"）
+        """
+        metrics = [f"{name};dur={seconds * 1000:.1f}" for name, seconds in self.durations.items()]
+        metrics.append(f"total;dur={self.total * 1000:.1f}")
+        return ", ".join(metrics)
+
+
+@dataclass
+class Operation:
+    """
+    ツールの API の定義（受信 → 検証 → 処理 → 応答はすべて handle で共通に行う）
+
+    :param name: ジョブの処理名（utils.job_operations.OPERATIONS のキー）
+    :param serializer_class: リクエストのシリアライザ
+    :param field_errors: 検証エラーのフィールドとユーザーに返すメッセージ（先に書いたものを優先）
+    :param build_params: 検証済みのデータからジョブのパラメータを作る関数
+    :param respond: 結果のバイト列とパラメータからレスポンスを作る関数 respond(request, data, params)
+    :param cache_name: 結果のキャッシュキーに使う名前（None の場合はキャッシュしない）
+    :param cache_params: パラメータからキャッシュキーに含める値を返す関数
+    :param probe: 入力ファイルのパスを受け取り、ジョブの投入前に検証する関数
+    :param stream: パラメータの stream が真の場合に、結果を逐次返すイテレータと Content-Type を返す関数
+    :param download: 結果をファイルとして返す処理か（ETag と、Range などで取り直せる
+        /api/results/ の URL（Content-Location）を付ける）
+    :param cost_units: 入力ファイルのパス・パラメータ・probe の結果から処理量を返す関数
+        cost_units(input_path, params, probe)（処理のコストの見積もりと受け付けの制御に使う。
+        utils.admission を参照）。None の場合は制御しない
+    :param keep_upload: 処理に成功した場合に、取り込んだファイルをアップロードストア
+        （utils.uploads）に保存し、そのトークンを X-Upload-Token で返すか
+        （後のリクエストで upload_token を送れば、同じファイルをアップロードし直さずに済む）
+    """
+
+    name: str
+    serializer_class: type
+    field_errors: dict
+    build_params: Callable
+    respond: Callable
+    cache_name: Optional[str] = None
+    cache_params: Optional[Callable] = None
+    probe: Optional[Callable] = None
+    stream: Optional[Callable] = None
+    download: bool = False
+    cost_units: Optional[Callable] = None
+    keep_upload: bool = False
+
+
+def attachment_response(data, content_type, filename):
+    """
+    結果のバイト列をダウンロード用のレスポンスにする
+    """
+    return FileResponse(
+        io.BytesIO(data),
+        content_type=content_type,
+        as_attachment=True,
+        filename=filename,
+    )
+
+
+def validate(request, operation):
+    """
+    リクエストを検証し、検証済みのデータを返す
+
+    :raises RequestError: 検証に失敗した場合
+    """
+    serializer = operation.serializer_class(data=request.data)
+    if not serializer.is_valid():
+        for field, message in operation.field_errors.items():
+            if field in serializer.errors:
+                raise RequestError(message)
+        raise RequestError(f"Invalid parameters: {', '.join(sorted(serializer.errors))}.")
+    return serializer.validated_data
+
+
+def error_response(operation, error):
+    """
+    例外をエラーレスポンスにする（想定外の例外はログに出力し、汎用のメッセージを返す）
+    """
+    if isinstance(error, JobQueueFullError):
+        response = JsonResponse({"error": str(error)}, status=429)
+        response["Retry-After"] = str(RETRY_AFTER_SECONDS)
+        return response
+    if isinstance(error, JobTimeoutError):
+        return JsonResponse({"error": TIMEOUT_MESSAGE}, status=504)
+    if isinstance(error, AdmissionRejectedError):
+        response = JsonResponse({"error": str(error)}, status=429)
+        response["Retry-After"] = str(error.retry_after)
+        return response
+    if isinstance(error, (UploadTooLargeError, RequestDataTooBig)):
+        return JsonResponse({"error": upload_too_large_message()}, status=413)
+    if isinstance(error, RequestError):
+        return JsonResponse({"error": str(error)}, status=400)
+
+    logger.exception("Request for %s failed", operation.name)
+    return JsonResponse({"error": user_error_message(error)}, status=400)
+
+
+def handle(request, operation):
+    """
+    ツールの API の共通処理
+
+    受信（検証・ジョブの入力の保存）→ キャッシュの確認 → 入力の検証（probe）→ 受け付けの制御
+    → 処理（ジョブ）→ 応答の順に実行する。ジョブのディレクトリなどの後片付けは応答を作る前に必ず行い、
+    段階ごとの処理時間を Server-Timing ヘッダとログに出力する。
+    """
+    timer = StageTimer(operation.name)
+    cache_status = None
+    try:
+        with ExitStack() as stack:
+            with timer.stage("ingest"):
+                data = validate(request, operation)
+                params = operation.build_params(data)
+                file = data["file"]
+
+            # 同じ入力・同じパラメータの結果があれば処理せずに返す
+            key = result = result_id = None
+            if operation.cache_name is not None:
+                with timer.stage("cache"):
+                    key = cache_key(
+                        operation.cache_name,
+                        hash_upload(file),
+                        **operation.cache_params(params),
+                    )
+                    result, result_id = cached_result(operation, key)
+                cache_status = "miss" if result is None else "hit"
+
+            if result is not None:
+                notify_input(operation, file)
+            else:
+                manager = get_job_manager()
+                with timer.stage("ingest"):
+                    job_id, input_path = manager.create(operation.name, file, params)
+                # 待つのをやめたジョブも、ワーカーが使い終わってから削除する
+                stack.callback(manager.delete_when_done, job_id)
+
+                probe = None
+                if operation.probe is not None:
+                    with timer.stage("probe"):
+                        probe = operation.probe(input_path)
+                notify_input(operation, file, probe)
+                with timer.stage("admission"):
+                    ticket = admit(request, operation, input_path, params, probe)
+
+                if operation.stream is not None and params.get("stream"):
+                    # 入力ファイルは開いた状態なので、ジョブのディレクトリは削除してよい
+                    try:
+                        with timer.stage("process"):
+                            chunks, content_type = operation.stream(input_path, params, probe)
+                    except Exception:
+                        release(ticket)
+                        raise
+                    response = StreamingHttpResponse(
+                        ReleasingChunks(chunks, ticket), content_type=content_type
+                    )
+                    response["Content-Disposition"] = content_disposition_header(
+                        True, params["file_name"]
+                    )
+                    return finish(operation, timer, response, cache_status)
+
+                try:
+                    result = run_job(manager, job_id, timer)
+                except JobTimeoutError:
+                    # キャンセルしたジョブが実際に止まるまでは予算を返さない
+                    manager.when_done(job_id, lambda _: release(ticket))
+                    raise
+                except Exception:
+                    release(ticket)
+                    raise
+                release(ticket, worker_seconds(manager.store, job_id))
+                result_id = manager.store.read(job_id).get("result_id")
+                if key is not None:
+                    cache_result(operation, key, result, result_id)
+
+        with timer.stage("respond"):
+            response = operation.respond(request, result, params)
+            if operation.keep_upload:
+                # 失敗したリクエストのファイルは保存しない
+                response["X-Upload-Token"] = get_upload_store().save(file)
+            if operation.download:
+                if result_id is None:
+                    # ジョブが保存していない場合も、取り直せるよう保存しておく
+                    content_type = response["Content-Type"]
+                    result_id = get_result_store().save(
+                        result, content_type, download_filename(params, content_type)
+                    )
+                response["ETag"] = f'"{result_id}"'
+                response["Content-Location"] = reverse("stored_result", args=[result_id])
+    except Exception as e:
+        response = error_response(operation, e)
+    return finish(operation, timer, response, cache_status)
+
+
+def submit(request, operation, respond):
+    """
+    ジョブの API の共通処理（受信 → 入力の検証 → ジョブの投入）
+
+    :param respond: 投入したジョブの状態からレスポンスを作る関数 respond(state)
+    """
+    timer = StageTimer(operation.name)
+    try:
+        manager = get_job_manager()
+        with timer.stage("ingest"):
+            data = validate(request, operation)
+            params = operation.build_params(data)
+            job_id, input_path = manager.create(operation.name, data["file"], params)
+
+        ticket = None
+        try:
+            # 音声ファイルかどうかなどは投入前にヘッダだけでチェックする
+            probe = None
+            if operation.probe is not None:
+                with timer.stage("probe"):
+                    probe = operation.probe(input_path)
+            notify_input(operation, data["file"], probe)
+            with timer.stage("admission"):
+                ticket = admit(request, operation, input_path, params, probe)
+            with timer.stage("enqueue"):
+                future = manager.enqueue(job_id)
+        except Exception:
+            release(ticket)
+            manager.store.delete(job_id)
+            raise
+        if ticket is not None:
+            # 受け付けた分の予算はジョブが終わったときに返す
+            future.add_done_callback(
+                lambda _: release(ticket, worker_seconds(manager.store, job_id))
+            )
+        if operation.keep_upload:
+            upload = (data["file"].name, hash_upload(data["file"]))
+            future.add_done_callback(lambda _: keep_job_upload(manager, job_id, *upload))
+
+        response = respond(manager.store.read(job_id))
+    except Exception as e:
+        response = error_response(operation, e)
+    return finish(operation, timer, response, None)
+
+
+def cached_result(operation, key):
+    """
+    キャッシュから結果を取り出す
+
+    ダウンロードする処理（operation.download）の結果は utils.result_store に保存しているので、
+    キャッシュには結果の ID だけを入れ、内容は保存先から読む（同じ結果を2か所に持たない）。
+
+    :return: (結果のバイト列, 結果の ID)。キャッシュにない・保存期間を過ぎた場合は (None, None)
+    """
+    value = get_result_cache().get(key)
+    if value is None or not operation.download:
+        return value, None
+    if not value.startswith(RESULT_ID_PREFIX):
+        return None, None
+    result_id = value[len(RESULT_ID_PREFIX) :].decode()
+    try:
+        with open(get_result_store().info(result_id)["path"], "rb") as f:
+            return f.read(), result_id
+    except (ResultNotFoundError, FileNotFoundError):
+        return None, None
+
+
+def cache_result(operation, key, result, result_id):
+    """
+    結果をキャッシュする（ダウンロードする処理は結果の ID だけを入れる。cached_result を参照）
+    """
+    if not operation.download:
+        get_result_cache().set(key, result)
+    elif result_id is not None:
+        get_result_cache().set(key, RESULT_ID_PREFIX + result_id.encode())
+
+
+def admit(request, operation, input_path, params, probe):
+    """
+    処理量からコストを見積もり、受け付けるかを決める（utils.admission）
+
+    :return: 受け付けた Ticket（制御しない処理の場合は None）
+    :raises utils.admission.AdmissionRejectedError: 混雑していて受け付けられない場合
+    """
+    if operation.cost_units is None:
+        return None
+    units = operation.cost_units(input_path, params, probe)
+    return get_admission_controller().admit(operation.name, client_id(request), units)
+
+
+def release(ticket, seconds=None):
+    """
+    受け付けた処理の終了を記録する（seconds を渡した場合はコストの見積もりを補正する）
+    """
+    if ticket is not None:
+        get_admission_controller().release(ticket, seconds)
+
+
+class ReleasingChunks:
+    """
+    逐次返すイテレータを、レスポンスが閉じられたとき（返し終えた・接続が切れた）に
+    受け付けた分の予算を返すようにする
+    """
+
+    def __init__(self, chunks, ticket):
+        self.chunks = iter(chunks)
+        self.ticket = ticket
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return next(self.chunks)
+
+    def close(self):
+        try:
+            if hasattr(self.chunks, "close"):
+                self.chunks.close()
+        finally:
+            release(self.ticket)
+
+
+def keep_job_upload(manager, job_id, name, content_hash):
+    """
+    完了したジョブの入力をアップロードストアに保存し、トークンをジョブの状態に記録する
+    （ジョブの結果の API が X-Upload-Token で返す。Operation.keep_upload を参照）
+    """
+    try:
+        if manager.store.read(job_id)["status"] != DONE:
+            return
+        upload = StoredUpload(manager.store.input_path(job_id), name, content_hash)
+        manager.store.update(job_id, upload_token=get_upload_store().save(upload))
+    except (JobNotFoundError, OSError):
+        # ジョブが削除された場合など。トークンは返さない
+        logger.warning("Could not keep the upload of job %s", job_id, exc_info=True)
+
+
+def worker_seconds(store, job_id):
+    """
+    完了したジョブのワーカーで計測した処理時間の合計（完了していない場合は None）
+    """
+    try:
+        state = store.read(job_id)
+    except JobNotFoundError:
+        return None
+    if state["status"] != DONE or not state.get("timings"):
+        return None
+    return sum(state["timings"].values())
+
+
+def run_job(manager, job_id, timer):
+    """
+    ジョブを実行して完了まで待ち、結果のバイト列を返す
+
+    ワーカーで計測した段階（process, encode など）の時間と、待ち行列で待った時間も記録する。
+    """
+    started = time.perf_counter()
+    try:
+        result, _ = manager.run(job_id, timeout=settings.JOB_SYNC_TIMEOUT)
+    except (JobQueueFullError, JobCancelledError, JobTimeoutError):
+        raise
+    except Exception as e:
+        # 失敗の詳細はワーカー側でログに出力しているので、ここではメッセージだけを返す
+        raise RequestError(user_error_message(e)) from e
+    elapsed = time.perf_counter() - started
+
+    worker_timings = manager.store.read(job_id).get("timings", {})
+    for name, seconds in worker_timings.items():
+        timer.record(name, seconds)
+    timer.record("queue", max(0.0, elapsed - sum(worker_timings.values())))
+    return result
+
+
+def finish(operation, timer, response, cache_status):
+    """
+    Server-Timing ヘッダを付け、段階ごとの処理時間をログに出力する
+    """
+    response["Server-Timing"] = timer.server_timing()
+    total = timer.total
+    stages = " ".join(
+        f"{name}_ms={seconds * 1000:.1f}" for name, seconds in timer.durations.items()
+    )
+    logger.info(
+        "operation=%s status=%s cache=%s total_ms=%.1f %s",
+        operation.name,
+        response.status_code,
+        cache_status or "-",
+        total * 1000,
+        stages,
+        extra={
+            "operation": operation.name,
+            "status_code": response.status_code,
+            "cache": cache_status,
+            "duration": total,
+            "stages": dict(timer.durations),
+        },
+    )
+    for listener in _request_listeners:
+        listener(operation.name, response.status_code, total, cache_status)
+    return response
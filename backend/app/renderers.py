@@ -0,0 +1,23 @@
+from rest_framework.renderers import BaseRenderer
+from rest_framework.settings import api_settings
+from utils.contour_codec import CONTENT_TYPE
+
+
+class ContourRenderer(BaseRenderer):
+    """
+    輪郭のバイナリ形式（Accept: application/x-contours）を受け付けるためのレンダラー
+
+    レスポンスはビューで作成するので、ここではバイト列をそのまま返す。
+    """
+
+    media_type = CONTENT_TYPE
+    format = "contours"
+    charset = None
+    render_style = "binary"
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return data
+
+
+# 輪郭を返すビューで使うレンダラー
+CONTOUR_RENDERER_CLASSES = api_settings.DEFAULT_RENDERER_CLASSES + [ContourRenderer]
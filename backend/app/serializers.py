@@ -1,15 +1,48 @@
 from rest_framework import serializers
+from utils.uploads import UploadNotFoundError, get_upload_store
 
 
 class FileUploadSerializer(serializers.Serializer):
     file = serializers.FileField()  # ファイルフィールド
     pitch = serializers.IntegerField()  # pitchを追加（整数）
+    stream = serializers.BooleanField(required=False, default=False)  # 逐次返却するか
+    # 処理の品質（fast: プレビュー用、full: 元の音質）。省略時は設定値 AUDIO_DEFAULT_QUALITY
+    quality = serializers.ChoiceField(choices=["fast", "full"], required=False)
+    # ピッチシフトの方式（utils.audio_stream.PITCH_ENGINES）。省略時は品質ごとの設定値
+    engine = serializers.ChoiceField(choices=["phase-vocoder", "wsola"], required=False)
+
+
+class PitchBatchSerializer(serializers.Serializer):
+    file = serializers.FileField()  # ファイルフィールド
+    # ピッチシフトする半音の数のリスト（例: -2, -1, 1, 2）
+    pitches = serializers.ListField(child=serializers.IntegerField(), min_length=1)
 
 
 class AudioClipSerializer(serializers.Serializer):
+    file = serializers.FileField(required=False)  # ファイルフィールド
+    # ファイルの代わりに、audio-peaks で取り込み済みのファイルをトークンで指定する
+    upload_token = serializers.CharField(required=False)
+    start = serializers.IntegerField(min_value=0)
+    end = serializers.IntegerField(min_value=0)
+    # 再エンコードせずに切り取るか（圧縮形式のみ、精度はフレーム単位）
+    stream_copy = serializers.BooleanField(required=False, default=False)
+
+    def validate(self, data):
+        if data["end"] <= data["start"]:
+            raise serializers.ValidationError({"end": "End must be greater than start."})
+        if data.get("file"):
+            return data
+        if not data.get("upload_token"):
+            raise serializers.ValidationError({"file": "This field is required."})
+        try:
+            data["file"] = get_upload_store().open(data["upload_token"])
+        except UploadNotFoundError:
+            raise serializers.ValidationError({"upload_token": "Upload has expired."})
+        return data
+
+
+class AudioPeaksSerializer(serializers.Serializer):
     file = serializers.FileField()  # ファイルフィールド
-    start = serializers.IntegerField()
-    end = serializers.IntegerField()
 
 
 class ImageContourSerializer(serializers.Serializer):
@@ -18,4 +51,25 @@ class ImageContourSerializer(serializers.Serializer):
 
 class ImageClipSerializer(serializers.Serializer):
     file = serializers.FileField()  # ファイルフィールド
-    contours = serializers.CharField()
+    # 輪郭（JSON、または contours_format が compact の場合は base64 のバイナリ形式）
+    contours = serializers.CharField(required=False)
+    contours_format = serializers.ChoiceField(
+        choices=["json", "compact"], required=False, default="json"
+    )
+    # 輪郭を送らずに、輪郭抽出の結果（contours_id）とその中の番号で指定する
+    contours_id = serializers.CharField(required=False)
+    contour_index = serializers.IntegerField(required=False, min_value=0)
+    # 輪郭を囲む矩形の大きさで切り抜くか（False の場合は元画像と同じ大きさ）
+    crop = serializers.BooleanField(required=False, default=False)
+    # 輪郭の外側を透明にして返す形式（省略時は元画像と同じ形式で、外側は黒）
+    output_format = serializers.ChoiceField(choices=["png", "webp"], required=False)
+    # 返し方（image: すべての物体をまとめて1枚の画像、zip: 物体ごとの透明な画像、
+    # sprite: 物体ごとの画像を並べた1枚の画像。zip と sprite は manifest.json と一緒に zip で返す）
+    package = serializers.ChoiceField(
+        choices=["image", "zip", "sprite"], required=False, default="image"
+    )
+
+    def validate(self, data):
+        if not data.get("contours") and not data.get("contours_id"):
+            raise serializers.ValidationError({"contours": "This field is required."})
+        return data
@@ -1,3 +1,1382 @@
-from django.test import TestCase
+import io
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from types import SimpleNamespace
+from unittest import mock
 
-# Create your tests here.
+import cv2
+import librosa
+import numpy as np
+import soundfile as sf
+from django.test import SimpleTestCase
+
+from utils.admission import AdmissionController, AdmissionRejectedError, CostModel
+from utils.audio_stream import StreamingPitchShifter, stream_pitch_shift
+from utils.image_util import get_contours, load_inference_image
+
+
+def make_signal(sr=22050, seconds=3.3):
+    rng = np.random.default_rng(0)
+    t = np.arange(int(sr * seconds)) / sr
+    y = (
+        0.3 * np.sin(2 * np.pi * 440 * t)
+        + 0.2 * np.sin(2 * np.pi * 1234 * t * (1 + 0.1 * t))
+        + 0.05 * rng.standard_normal(len(t))
+    )
+    return y.astype(np.float32)
+
+
+class StreamingPitchShiftTests(SimpleTestCase):
+    sr = 22050
+    # 全体を一度に処理した場合との差の許容値
+    max_abs_error = 1e-3
+
+    def shift_in_blocks(self, y, n_steps, blocksize):
+        shifter = StreamingPitchShifter(self.sr, n_steps)
+        output = [
+            shifter.process(y[i : i + blocksize]) for i in range(0, len(y), blocksize)
+        ]
+        output.append(shifter.flush())
+        return np.concatenate(output)
+
+    def test_matches_full_buffer_pitch_shift(self):
+        y = make_signal(self.sr)
+        for n_steps in (-5, 2, 7):
+            expected = librosa.effects.pitch_shift(
+                y=y, sr=self.sr, n_steps=n_steps, n_fft=2048, hop_length=512
+            )
+            for blocksize in (1000, 4096, 65536):
+                with self.subTest(n_steps=n_steps, blocksize=blocksize):
+                    actual = self.shift_in_blocks(y, n_steps, blocksize)
+                    self.assertEqual(len(actual), len(expected))
+                    self.assertLess(np.abs(actual - expected).max(), self.max_abs_error)
+
+    def test_stream_wav_response(self):
+        y = make_signal(self.sr, seconds=1.5)
+        with tempfile.TemporaryDirectory() as directory:
+            input_file = os.path.join(directory, "input.wav")
+            sf.write(input_file, y, self.sr)
+            data = b"".join(stream_pitch_shift(input_file, "wav", 3, blocksize=2048))
+
+        shifted, sr = sf.read(io.BytesIO(data), dtype="float32")
+        self.assertEqual(sr, self.sr)
+        self.assertEqual(len(shifted), len(y))
+
+
+# 別のプロセスで Django を起動してトップページを表示し、読み込まれたモジュールを調べるスクリプト
+STARTUP_SCRIPT = """
+import json, os, sys, time
+started = time.perf_counter()
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "config.settings")
+import django
+django.setup()
+from django.test import Client
+from django.test.utils import setup_test_environment
+setup_test_environment()
+status = Client().get("/").status_code
+seconds = time.perf_counter() - started
+frontend = sorted(sys.modules)
+from app.tools import get_tool
+get_tool("clip-audio")
+audio = sorted(sys.modules)
+print(json.dumps({"status": status, "seconds": seconds, "frontend": frontend, "audio": audio}))
+"""
+
+
+def profile_startup():
+    """
+    起動時の読み込み時間を計測する
+
+    :return: (計測結果, パッケージごとの読み込み時間（ミリ秒）の降順のリスト)
+    """
+    backend_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    completed = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", STARTUP_SCRIPT],
+        cwd=backend_dir,
+        # テストを実行している環境に SECRET_KEY がなくても起動できるようにする
+        env={**os.environ, "SECRET_KEY": os.environ.get("SECRET_KEY") or "startup-test"},
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    result = json.loads(completed.stdout.strip().splitlines()[-1])
+
+    # -X importtime の出力（"import time: 自身の時間 | 累積 | モジュール名"、マイクロ秒）を
+    # トップレベルのパッケージごとに集計する
+    packages = {}
+    for line in completed.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, _, name = line[len("import time:") :].split("|")
+        package = name.strip().split(".")[0]
+        packages[package] = packages.get(package, 0) + int(self_us) / 1000
+    breakdown = sorted(packages.items(), key=lambda item: item[1], reverse=True)
+    return result, breakdown
+
+
+class StartupImportTests(SimpleTestCase):
+    """
+    フロントエンドだけを返すワーカーの起動時に、ツールの重いライブラリを読み込まないことを確認する
+
+    環境変数 STARTUP_REPORT を設定すると、パッケージごとの読み込み時間を出力する。
+    起動時間は環境によってばらつくので、STARTUP_TIME_BUDGET（秒）を設定した場合だけ確認する。
+    """
+
+    # ツールが初めて使われるまで読み込まないモジュール
+    tool_modules = (
+        "torch",
+        "ultralytics",
+        "cv2",
+        "PIL",
+        "librosa",
+        "numba",
+        "soundfile",
+        "soxr",
+        "scipy",
+    )
+    # 画像のツールだけで使うモジュール
+    image_modules = ("torch", "ultralytics", "cv2", "PIL")
+    # Django の起動からトップページの表示までの時間の上限（秒、-X importtime の計測分を含む）。
+    # 重いライブラリを読み込むと数秒かかる（目安は 1.5 秒）
+    startup_budget = os.environ.get("STARTUP_TIME_BUDGET")
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.result, cls.breakdown = profile_startup()
+        if os.environ.get("STARTUP_REPORT"):
+            print(f"\n{cls.report()}", file=sys.stderr)
+
+    @classmethod
+    def report(cls):
+        lines = [f"startup {cls.result['seconds'] * 1000:.0f} ms"]
+        lines += [f"{ms:9.1f} ms  {package}" for package, ms in cls.breakdown[:15]]
+        return "\n".join(lines)
+
+    def test_frontend_does_not_import_tools(self):
+        self.assertEqual(self.result["status"], 200)
+        loaded = [name for name in self.tool_modules if name in self.result["frontend"]]
+        self.assertEqual(loaded, [], self.report())
+
+    def test_audio_tools_do_not_import_image_tools(self):
+        self.assertIn("utils.audio_stream", self.result["audio"])
+        loaded = [name for name in self.image_modules if name in self.result["audio"]]
+        self.assertEqual(loaded, [], self.report())
+
+    @unittest.skipUnless(startup_budget, "STARTUP_TIME_BUDGET is not set")
+    def test_startup_time(self):
+        self.assertLess(self.result["seconds"], float(self.startup_budget), self.report())
+
+
+def threshold_segmentation(image, model_size=None):
+    """
+    YOLO の代わりに、明るい領域をセグメンテーションするスタブ
+
+    YOLO と同じく長辺 640 ピクセルに縮小した画像でマスクを求め、ポリゴンを入力画像の座標で返す。
+    """
+    height, width = image.shape[:2]
+    ratio = 640 / max(height, width)
+    small = cv2.resize(
+        np.clip(image, 0, 255).astype(np.uint8),
+        (round(width * ratio), round(height * ratio)),
+        interpolation=cv2.INTER_AREA,
+    )
+    mask = np.where(cv2.cvtColor(small, cv2.COLOR_BGR2GRAY) > 128, np.uint8(255), np.uint8(0))
+    contours = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_NONE)[0]
+    polygons = [(c.reshape(-1, 2) + 0.5).astype(np.float32) / ratio for c in contours]
+    return SimpleNamespace(masks=SimpleNamespace(xy=polygons))
+
+
+def contours_mask(contours, shape):
+    mask = np.zeros(shape, dtype=np.uint8)
+    cv2.fillPoly(mask, contours, 255)
+    return mask > 0
+
+
+def iou(a, b):
+    return (a & b).sum() / (a | b).sum()
+
+
+class InferenceResolutionTests(SimpleTestCase):
+    """
+    縮小して読み込んだ画像から求めた輪郭が、元の大きさで求めた輪郭と一致することを確認する
+
+    輪郭で塗った領域を元の大きさで比べる。モデル（スタブ）のマスク自体が長辺 640 ピクセルで
+    求めたものなので、描いた物体との IoU が元の大きさで求めた場合より下がらないことも確認する。
+    """
+
+    # 元の大きさで求めた輪郭で塗った領域との IoU の下限
+    min_iou = 0.98
+    # 描いた物体との IoU の、元の大きさで求めた場合からの低下の上限
+    max_iou_loss = 0.005
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.directory = tempfile.TemporaryDirectory()
+        rng = np.random.default_rng(0)
+        # 灰色の背景に明るい物体を描く（大きさが縮小の倍率で割り切れない場合も確認する）
+        for name, (width, height) in (("photo.jpg", (6000, 4000)), ("scan.png", (3001, 2001))):
+            image = rng.integers(90, 110, size=(height, width, 3), dtype=np.uint8)
+            center, axes = (width // 3, height // 2), (width // 6, height // 4)
+            cv2.ellipse(image, center, axes, 20, 0, 360, (230, 220, 210), -1)
+            # 黒い画素は輪郭から除かれる（縮小した画像で輪郭を求めてから元の大きさに戻す）
+            corner = (center[0] + width // 20, center[1] + height // 8)
+            cv2.rectangle(image, center, corner, (0, 0, 0), -1)
+            angles = np.linspace(0, 2 * np.pi, 10, endpoint=False)
+            radius = np.where(np.arange(10) % 2, 0.08, 0.2) * height
+            star = np.stack(
+                [0.72 * width + radius * np.cos(angles), 0.45 * height + radius * np.sin(angles)],
+                axis=1,
+            )
+            cv2.fillPoly(image, [star.astype(np.int32)], (250, 250, 250))
+            cv2.imwrite(os.path.join(cls.directory.name, name), image)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.directory.cleanup()
+        super().tearDownClass()
+
+    def test_decodes_at_reduced_scale(self):
+        image, scale = load_inference_image(os.path.join(self.directory.name, "photo.jpg"), 640)
+        self.assertEqual(image.shape[:2], (500, 750))
+        self.assertEqual(scale, (8.0, 8.0))
+
+    def test_contours_match_full_resolution(self):
+        for name in ("photo.jpg", "scan.png"):
+            path = os.path.join(self.directory.name, name)
+            truth = cv2.imread(path, cv2.IMREAD_GRAYSCALE) > 128
+            for method in ("exact", "polygon"):
+                with self.subTest(name=name, method=method), mock.patch(
+                    "utils.image_util.predict_segmentation", threshold_segmentation
+                ):
+                    expected = contours_mask(get_contours(path, method=method, size=0), truth.shape)
+                    actual = contours_mask(get_contours(path, method=method, size=640), truth.shape)
+                    self.assertGreater(iou(expected, actual), self.min_iou)
+                    self.assertGreater(iou(actual, truth), iou(expected, truth) - self.max_iou_loss)
+
+
+class AdmissionControllerTests(SimpleTestCase):
+    """
+    処理のコストによる受け付けの制御（utils.admission）を確認する
+
+    コストは処理量1あたり1秒にして、処理量をそのままコスト（秒）として渡す。
+    """
+
+    def controller(self, **options):
+        options = {"client_share": 0.6, "cheap_cost": 0.5, "max_wait": 1.0, **options}
+        model = CostModel({}, {"op": 1.0}, weight=0.5)
+        return AdmissionController(model, budget=10, drain_rate=2, **options)
+
+    def release_later(self, controller, ticket, delay=0.05):
+        thread = threading.Thread(
+            target=lambda: (time.sleep(delay), controller.release(ticket))
+        )
+        thread.start()
+        self.addCleanup(thread.join)
+
+    def test_cheap_requests_bypass_the_budget(self):
+        controller = self.controller()
+        controller.admit("op", "a", 9)
+        ticket = controller.admit("op", "b", 0.5)
+        self.assertFalse(ticket.counted)
+        self.assertEqual(controller.in_flight, 9)
+
+    def test_deferred_until_budget_is_released(self):
+        controller = self.controller()
+        first = controller.admit("op", "a", 6)
+        self.release_later(controller, first)
+        started = time.monotonic()
+        second = controller.admit("op", "b", 5)
+        self.assertGreater(time.monotonic() - started, 0.03)
+        self.assertTrue(second.counted)
+        self.assertEqual(controller.in_flight, 5)
+
+    def test_rejected_when_wait_times_out(self):
+        controller = self.controller(max_wait=0.05)
+        controller.admit("op", "a", 6)
+        with self.assertRaises(AdmissionRejectedError) as raised:
+            controller.admit("op", "b", 5)
+        # 予算を超える分（6 + 5 - 10 = 1 秒）をワーカー数で割って切り上げる
+        self.assertEqual(raised.exception.retry_after, 1)
+        self.assertEqual(controller.in_flight, 6)
+
+    def test_rejected_without_waiting_when_too_many_wait(self):
+        controller = self.controller(max_waiting=0)
+        controller.admit("op", "a", 6)
+        started = time.monotonic()
+        with self.assertRaises(AdmissionRejectedError):
+            controller.admit("op", "b", 5)
+        self.assertLess(time.monotonic() - started, 0.5)
+
+    def test_client_share_is_rejected_immediately(self):
+        controller = self.controller()
+        controller.admit("op", "a", 5)
+        with self.assertRaises(AdmissionRejectedError) as raised:
+            controller.admit("op", "a", 2)
+        # 使っている 5 秒をワーカー数 2 で割って切り上げる
+        self.assertEqual(raised.exception.retry_after, 3)
+        # 他のクライアントは受け付ける
+        self.assertTrue(controller.admit("op", "b", 2).counted)
+
+    def test_first_request_larger_than_the_budget_is_admitted_alone(self):
+        controller = self.controller()
+        ticket = controller.admit("op", "a", 50)
+        self.assertEqual(controller.in_flight, 50)
+        controller.release(ticket)
+        self.assertEqual(controller.in_flight, 0)
+
+    def test_release_is_idempotent(self):
+        controller = self.controller()
+        first = controller.admit("op", "a", 4)
+        second = controller.admit("op", "b", 3)
+        controller.release(first)
+        controller.release(first)
+        self.assertEqual(controller.in_flight, 3)
+        controller.release(second)
+        self.assertEqual(controller.in_flight, 0)
+
+    def test_release_calibrates_the_cost_model(self):
+        controller = self.controller()
+        ticket = controller.admit("op", "a", 4)
+        # 4 の処理量に 12 秒かかった（3 秒/処理量）を重み 0.5 で反映する
+        controller.release(ticket, seconds=12)
+        controller.release(ticket, seconds=12)
+        self.assertEqual(controller.model.coefficients()["op"], 2.0)
+
+
+class GunicornInputTests(SimpleTestCase):
+    """
+    gunicorn の wsgi.input を包んだ GunicornInput から、元と同じ内容を読めることを確認する
+    """
+
+    def make_body(self, data, chunk=1000):
+        from gunicorn.http.body import Body, LengthReader
+        from gunicorn.http.unreader import IterUnreader
+
+        chunks = [data[i : i + chunk] for i in range(0, len(data), chunk)]
+        return Body(LengthReader(IterUnreader(chunks), len(data)))
+
+    def test_reads_the_same_bytes(self):
+        from utils.runtime import GunicornInput
+
+        data = bytes(range(256)) * 1000
+        for size in (1, 4096, 65536, len(data) + 1):
+            with self.subTest(size=size):
+                body = GunicornInput(self.make_body(data))
+                chunks = list(iter(lambda: body.read(size), b""))
+                self.assertEqual(b"".join(chunks), data)
+
+    def test_reads_after_readline(self):
+        from utils.runtime import GunicornInput
+
+        data = b"--boundary\r\n" + bytes(range(256)) * 100
+        body = GunicornInput(self.make_body(data))
+        first = body.readline()
+        self.assertEqual(first, b"--boundary\r\n")
+        self.assertEqual(first + body.read(5) + body.read(-1), data)
+
+
+class DiskCacheBackendTests(SimpleTestCase):
+    """
+    ディスクのキャッシュ（utils.result_cache.DiskCacheBackend）の削除を確認する
+    """
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+    def backend(self, **options):
+        from utils.result_cache import DiskCacheBackend
+
+        return DiskCacheBackend(self.directory.name, **{"max_size": 100, **options})
+
+    def test_scans_only_when_over_the_limit(self):
+        backend = self.backend()
+        with mock.patch("utils.result_cache.os.walk", wraps=os.walk) as walk:
+            for i in range(4):
+                backend.set(f"{i:02d}key", b"x" * 20)
+            # 最初の書き込みで数えた後は、上限を超えるまで走査しない
+            self.assertEqual(walk.call_count, 1)
+            backend.set("04key", b"x" * 30)
+            self.assertEqual(walk.call_count, 2)
+        # 最後に参照された時刻が古いものから削除する
+        self.assertIsNone(backend.get("00key"))
+        self.assertEqual(backend.get("04key"), b"x" * 30)
+        self.assertLessEqual(backend._size, 100)
+
+    def test_removes_stale_temp_files(self):
+        backend = self.backend(evict_interval=0)
+        os.makedirs(os.path.join(self.directory.name, "ab"))
+        stale = os.path.join(self.directory.name, "ab", "tmpcrashed.tmp")
+        fresh = os.path.join(self.directory.name, "ab", "tmpwriting.tmp")
+        for path in (stale, fresh):
+            with open(path, "wb") as f:
+                f.write(b"x" * 1000)
+        old = time.time() - backend.temp_max_age - 1
+        os.utime(stale, (old, old))
+
+        backend.set("abkey", b"value")
+        self.assertFalse(os.path.exists(stale))
+        self.assertTrue(os.path.exists(fresh))
+        # 一時ファイルは合計サイズに数えない
+        self.assertEqual(backend.get("abkey"), b"value")
+
+
+class ContoursHandleTests(SimpleTestCase):
+    """
+    輪郭抽出の結果の ID（contours_id）が、結果のキャッシュを無効にしても使えることを確認する
+    """
+
+    def setUp(self):
+        import utils.result_store
+
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        store = utils.result_store.ResultStore(directory.name, 1024 * 1024, ttl=60)
+        patcher = mock.patch.object(utils.result_store, "_result_store", store)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_handle_survives_without_the_result_cache(self):
+        from app.pipeline import RequestError
+        from app.tools.image import load_contours_handle, save_contours_handle
+        from utils.contour_codec import encode_contours
+
+        contours = [np.array([[0, 0], [10, 0], [10, 10]], dtype=np.int32)]
+        with mock.patch("utils.result_cache._result_cache", None), self.settings(
+            RESULT_CACHE_BACKEND="none"
+        ):
+            contours_id = save_contours_handle(encode_contours(contours))
+            loaded = load_contours_handle(contours_id)
+        np.testing.assert_array_equal(np.asarray(loaded[0]).reshape(-1, 2), contours[0])
+
+        with self.assertRaises(RequestError):
+            load_contours_handle("0" * 64)
+
+
+class ContourCodecTests(SimpleTestCase):
+    """
+    輪郭のバイナリ形式（utils.contour_codec）と、Accept-Encoding による圧縮を確認する
+    """
+
+    def contours(self):
+        rng = np.random.default_rng(0)
+        return [
+            rng.integers(0, 100000, size=(n, 1, 2)).astype(np.int32) for n in (1, 3, 500)
+        ] + [np.array([[[5, -3]], [[-70000, 2]]], dtype=np.int32)]
+
+    def test_round_trip(self):
+        from utils.contour_codec import (
+            decode_contours,
+            decode_contours_base64,
+            encode_contours,
+            encode_contours_base64,
+        )
+
+        contours = self.contours()
+        for decoded in (
+            decode_contours(encode_contours(contours)),
+            decode_contours_base64(encode_contours_base64(contours)),
+        ):
+            self.assertEqual(len(decoded), len(contours))
+            for actual, expected in zip(decoded, contours):
+                np.testing.assert_array_equal(actual, expected)
+        self.assertEqual(decode_contours(encode_contours([])), [])
+
+    def test_rejects_truncated_and_invalid_data(self):
+        from utils.contour_codec import (
+            ContourFormatError,
+            decode_contours,
+            decode_contours_base64,
+            encode_contours,
+        )
+
+        data = encode_contours(self.contours())
+        for invalid in (b"", b"XXXX" + data[4:], data[:-1], data[:-3], data + b"\x01"):
+            with self.subTest(invalid=invalid[:8]), self.assertRaises(ContourFormatError):
+                decode_contours(invalid)
+        with self.assertRaises(ContourFormatError):
+            decode_contours_base64("not base64!")
+
+    def test_negotiates_encoding(self):
+        from utils.contour_codec import compress
+
+        fake_brotli = SimpleNamespace(compress=lambda data, quality: b"br:" + data)
+        data = b"x" * 4096
+        cases = [
+            (None, None),
+            ("gzip", "gzip"),
+            ("gzip;q=0", None),
+            ("gzip; q=0.0, deflate", None),
+            ("*", "br"),
+            ("*;q=0.5, br;q=0", "gzip"),
+            ("gzip, *;q=0", "gzip"),
+            ("br;q=0.5, gzip;q=0.8", "gzip"),
+            ("br, gzip", "br"),
+            ("GZIP;Q=1", "gzip"),
+        ]
+        with mock.patch("utils.contour_codec.brotli", fake_brotli):
+            for header, expected in cases:
+                with self.subTest(header=header):
+                    body, encoding = compress(data, header)
+                    self.assertEqual(encoding, expected)
+                    if encoding is None:
+                        self.assertEqual(body, data)
+        # 小さいレスポンスは圧縮しない
+        self.assertEqual(compress(b"x", "gzip"), (b"x", None))
+
+
+class StoredResultResponseTests(SimpleTestCase):
+    """
+    保存した結果のレスポンス（app.delivery）の ETag・Range・X-Accel-Redirect を確認する
+    """
+
+    data = bytes(range(256)) * 4
+
+    def setUp(self):
+        import utils.result_store
+
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.store = utils.result_store.ResultStore(directory.name, 1024 * 1024, ttl=60)
+        patcher = mock.patch.object(utils.result_store, "_result_store", self.store)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.result_id = self.store.save(self.data, "audio/wav", "result.wav")
+        self.etag = f'"{self.result_id}"'
+
+    def get(self, **headers):
+        from django.test import RequestFactory
+
+        from app.delivery import stored_result_response
+
+        request = RequestFactory().get("/", **headers)
+        response = stored_result_response(request, self.result_id)
+        self.addCleanup(response.close)
+        return response
+
+    def body(self, response):
+        return b"".join(response.streaming_content)
+
+    def test_full_response(self):
+        response = self.get()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["ETag"], self.etag)
+        self.assertEqual(response["Accept-Ranges"], "bytes")
+        self.assertIn("result.wav", response["Content-Disposition"])
+        self.assertEqual(self.body(response), self.data)
+
+    def test_range(self):
+        size = len(self.data)
+        cases = [
+            ("bytes=10-19", 10, 19),
+            ("bytes=1000-", 1000, size - 1),
+            ("bytes=-24", size - 24, size - 1),
+            ("bytes=-5000", 0, size - 1),
+            ("bytes=1020-5000", 1020, size - 1),
+        ]
+        for header, start, end in cases:
+            with self.subTest(header=header):
+                response = self.get(HTTP_RANGE=header)
+                self.assertEqual(response.status_code, 206)
+                self.assertEqual(response["Content-Range"], f"bytes {start}-{end}/{size}")
+                self.assertEqual(response["Content-Length"], str(end - start + 1))
+                self.assertEqual(self.body(response), self.data[start : end + 1])
+
+    def test_unsatisfiable_range(self):
+        for header in ("bytes=1024-", "bytes=5000-6000", "bytes=-0"):
+            with self.subTest(header=header):
+                response = self.get(HTTP_RANGE=header)
+                self.assertEqual(response.status_code, 416)
+                self.assertEqual(response["Content-Range"], f"bytes */{len(self.data)}")
+
+    def test_invalid_range_returns_the_whole_file(self):
+        for header in ("bytes=5-3", "bytes=0-1,5-9", "items=0-1", "bytes=-"):
+            with self.subTest(header=header):
+                response = self.get(HTTP_RANGE=header)
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(self.body(response), self.data)
+
+    def test_if_none_match(self):
+        for header in (self.etag, f'"other", W/{self.etag}', "*"):
+            with self.subTest(header=header):
+                response = self.get(HTTP_IF_NONE_MATCH=header)
+                self.assertEqual(response.status_code, 304)
+                self.assertEqual(response["ETag"], self.etag)
+                self.assertFalse(response.has_header("Content-Disposition"))
+        self.assertEqual(self.get(HTTP_IF_NONE_MATCH='"other"').status_code, 200)
+
+    def test_if_range(self):
+        response = self.get(HTTP_RANGE="bytes=0-9", HTTP_IF_RANGE=self.etag)
+        self.assertEqual(response.status_code, 206)
+        # ETag が変わっていれば全体を返す
+        response = self.get(HTTP_RANGE="bytes=0-9", HTTP_IF_RANGE='"other"')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.body(response), self.data)
+
+    def test_x_accel_redirect(self):
+        with self.settings(
+            RESULT_STORE_SENDFILE="x-accel-redirect", RESULT_STORE_ACCEL_PREFIX="/protected/"
+        ):
+            response = self.get(HTTP_RANGE="bytes=0-9")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            response["X-Accel-Redirect"],
+            f"/protected/{self.result_id[:2]}/{self.result_id}",
+        )
+        self.assertEqual(response["ETag"], self.etag)
+        self.assertEqual(response.content, b"")
+
+
+class CachedResultTests(SimpleTestCase):
+    """
+    ダウンロードする処理の結果のキャッシュが、結果の保存先の ID だけを持つことを確認する
+    """
+
+    def setUp(self):
+        import utils.result_cache
+        import utils.result_store
+
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.store = utils.result_store.ResultStore(
+            os.path.join(directory.name, "results"), 1024 * 1024, ttl=60
+        )
+        self.cache = utils.result_cache.ResultCache(
+            utils.result_cache.DiskCacheBackend(
+                os.path.join(directory.name, "cache"), 1024 * 1024
+            )
+        )
+        for patcher in (
+            mock.patch.object(utils.result_store, "_result_store", self.store),
+            mock.patch.object(utils.result_cache, "_result_cache", self.cache),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_download_results_are_read_from_the_store(self):
+        from app.pipeline import cache_result, cached_result
+
+        operation = SimpleNamespace(download=True)
+        data = b"result" * 100
+        result_id = self.store.save(data, "audio/wav", "a.wav")
+        cache_result(operation, "key", data, result_id)
+
+        self.assertLess(len(self.cache.get("key")), 100)
+        self.assertEqual(cached_result(operation, "key"), (data, result_id))
+        # 保存期間を過ぎて削除された結果はキャッシュにないものとして扱う
+        self.store.delete(result_id)
+        self.assertEqual(cached_result(operation, "key"), (None, None))
+
+    def test_other_results_are_cached_as_bytes(self):
+        from app.pipeline import cache_result, cached_result
+
+        operation = SimpleNamespace(download=False)
+        cache_result(operation, "key", b"peaks", None)
+        self.assertEqual(cached_result(operation, "key"), (b"peaks", None))
+
+
+class KeepUploadTests(SimpleTestCase):
+    """
+    取り込んだファイルを、処理に成功した場合だけアップロードストアに保存することを確認する
+    """
+
+    def setUp(self):
+        import utils.uploads
+        from utils.jobs import JobStore
+
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.uploads = utils.uploads.UploadStore(os.path.join(directory.name, "uploads"), 60)
+        patcher = mock.patch.object(utils.uploads, "_upload_store", self.uploads)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.manager = SimpleNamespace(store=JobStore(os.path.join(directory.name, "jobs")))
+
+    def create_job(self, status):
+        from django.core.files.uploadedfile import SimpleUploadedFile
+
+        file = SimpleUploadedFile("a.wav", b"RIFF" + bytes(100))
+        job_id = self.manager.store.create("audio-peaks", {"extension": ".wav"})
+        self.manager.store.save_input(job_id, file)
+        self.manager.store.update(job_id, status=status)
+        return job_id, file
+
+    def test_build_params_does_not_save_the_upload(self):
+        from django.core.files.uploadedfile import SimpleUploadedFile
+
+        from app.tools import get_tool
+
+        operation = get_tool("audio-peaks")
+        self.assertTrue(operation.keep_upload)
+        with mock.patch("utils.uploads.UploadStore.save") as save:
+            operation.build_params({"file": SimpleUploadedFile("a.wav", b"RIFF")})
+        save.assert_not_called()
+
+    def test_finished_job_keeps_its_input(self):
+        from app.pipeline import keep_job_upload
+        from utils.result_cache import hash_upload
+
+        from utils.jobs import DONE
+
+        job_id, file = self.create_job(DONE)
+        keep_job_upload(self.manager, job_id, file.name, hash_upload(file))
+
+        token = self.manager.store.read(job_id)["upload_token"]
+        self.assertEqual(token, hash_upload(file))
+        with open(self.uploads.open(token).temporary_file_path(), "rb") as f:
+            self.assertEqual(f.read(), b"RIFF" + bytes(100))
+
+    def test_failed_job_does_not_keep_its_input(self):
+        from app.pipeline import keep_job_upload
+        from utils.result_cache import hash_upload
+
+        from utils.jobs import FAILED
+
+        job_id, file = self.create_job(FAILED)
+        keep_job_upload(self.manager, job_id, file.name, hash_upload(file))
+        self.assertNotIn("upload_token", self.manager.store.read(job_id))
+        self.assertEqual(os.listdir(self.uploads.directory), [])
+
+
+class UploadSizeLimitTests(SimpleTestCase):
+    """
+    UPLOAD_MAX_SIZE を超えるアップロードに 413 を返すことを確認する
+    """
+
+    def post(self, content):
+        from django.core.files.uploadedfile import SimpleUploadedFile
+        from django.test import RequestFactory
+
+        from app.views import clip_audio
+
+        # テストクライアントはミドルウェアで SECRET_KEY を使うので、ビューを直接呼ぶ
+        data = {"start": "0", "end": "1", "file": SimpleUploadedFile("a.wav", content)}
+        with self.settings(UPLOAD_MAX_SIZE=1024, DATA_UPLOAD_MAX_MEMORY_SIZE=4096):
+            return clip_audio(RequestFactory().post("/api/clip-audio/", data))
+
+    def test_file_over_the_limit(self):
+        response = self.post(bytes(2048))
+        self.assertEqual(response.status_code, 413)
+        self.assertIn("too large", json.loads(response.content)["error"])
+
+    def test_content_length_over_the_limit(self):
+        response = self.post(bytes(8192))
+        self.assertEqual(response.status_code, 413)
+
+    def test_limit_is_per_file(self):
+        from utils.uploads import MaxSizeUploadHandler, UploadTooLargeError
+
+        handler = MaxSizeUploadHandler()
+        with self.settings(UPLOAD_MAX_SIZE=1024):
+            for name in ("a.wav", "b.wav"):
+                handler.new_file("file", name, "audio/wav", 800)
+                handler.receive_data_chunk(bytes(800), 0)
+            with self.assertRaises(UploadTooLargeError):
+                handler.receive_data_chunk(bytes(800), 800)
+
+
+class AudioClipLengthTests(SimpleTestCase):
+    """
+    ファイルより長い範囲を指定しても、ファイルの長さ分しか確保しないことを確認する
+    """
+
+    def test_ffmpeg_buffer_is_capped_by_file_length(self):
+        from utils.audio_io import _decode_with_ffmpeg
+        from utils.audio_probe import AudioProbe
+
+        sr = 8000
+        samples = np.linspace(-1, 1, sr, dtype="<f4")
+        process = mock.MagicMock(returncode=0, stdout=io.BytesIO(samples.tobytes()))
+        process.__enter__.return_value = process
+        probe = AudioProbe("mp3", "mp3", sr, 1, duration=1.0)
+
+        with mock.patch("subprocess.Popen", return_value=process) as popen:
+            y, rate = _decode_with_ffmpeg("a.mp3", probe, start_time=0, duration=10**9)
+
+        self.assertEqual(rate, sr)
+        np.testing.assert_array_equal(y[:, 0], samples)
+        self.assertIn(str(10**9), popen.call_args.args[0])
+
+
+class AudioClipSerializerTests(SimpleTestCase):
+    def validate(self, start, end):
+        from django.core.files.uploadedfile import SimpleUploadedFile
+
+        from app.serializers import AudioClipSerializer
+
+        data = {"start": start, "end": end, "file": SimpleUploadedFile("a.wav", b"RIFF")}
+        serializer = AudioClipSerializer(data=data)
+        serializer.is_valid()
+        return serializer.errors
+
+    def test_valid_range(self):
+        self.assertEqual(self.validate(0, 1000), {})
+
+    def test_negative_start(self):
+        self.assertIn("start", self.validate(-1, 1000))
+
+    def test_end_not_after_start(self):
+        self.assertIn("end", self.validate(1000, 1000))
+        self.assertIn("end", self.validate(1000, 500))
+
+
+class JobApiTests(SimpleTestCase):
+    """
+    ジョブの API（投入・状態の取得・キャンセル・待ち行列が一杯の場合・同期 API のタイムアウト）を、
+    スレッドプールで実行するスタブの処理で確認する
+    """
+
+    def setUp(self):
+        from django import forms
+        from django.http import HttpResponse
+        from rest_framework import serializers
+
+        import utils.jobs
+        import utils.result_store
+        from app.pipeline import Operation
+
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.release = threading.Event()
+
+        def stub(input_path, params, progress):
+            while not self.release.wait(0.01):
+                progress(0.5)
+            return b"done", "application/octet-stream"
+
+        class StubSerializer(serializers.Serializer):
+            file = serializers.FileField()
+
+        operation = Operation(
+            name="stub",
+            serializer_class=StubSerializer,
+            field_errors={},
+            build_params=lambda data: {"file_name": "stub"},
+            respond=lambda request, data, params: HttpResponse(data),
+        )
+        self.manager = utils.jobs.JobManager(
+            utils.jobs.JobStore(os.path.join(directory.name, "jobs")),
+            process_workers=1,
+            thread_workers=1,
+            max_pending=1,
+            thread_operations=["stub"],
+        )
+        # 待たせたジョブを終わらせ、ワーカーが止まってからディレクトリを削除する
+        self.addCleanup(lambda: self.manager._thread_pool and self.manager._thread_pool.shutdown())
+        self.addCleanup(self.release.set)
+        result_store = utils.result_store.ResultStore(
+            os.path.join(directory.name, "results"), 1024 * 1024, ttl=60
+        )
+        patchers = [
+            mock.patch.object(utils.jobs, "_job_manager", self.manager),
+            mock.patch.object(utils.result_store, "_result_store", result_store),
+            mock.patch.dict("app.tools.TOOL_MODULES", {"stub": "app.tools.audio"}),
+            mock.patch.dict("utils.job_operations.OPERATIONS", {"stub": stub}),
+            mock.patch("app.views.get_tool", return_value=operation),
+        ]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        settings = self.settings(JOB_SYNC_TIMEOUT=0.2)
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+    def request(self, method, path, data=None):
+        from django.test import RequestFactory
+        from django.urls import resolve
+
+        # テストクライアントはミドルウェアで SECRET_KEY を使うので、URL からビューを直接呼ぶ
+        match = resolve(path)
+        return match.func(getattr(RequestFactory(), method)(path, data), **match.kwargs)
+
+    def json(self, response):
+        return json.loads(response.content)
+
+    def submit(self):
+        from django.core.files.uploadedfile import SimpleUploadedFile
+
+        file = SimpleUploadedFile("a.bin", b"input")
+        return self.request("post", "/api/jobs/stub/", {"file": file})
+
+    def wait_for(self, job_id, statuses):
+        for _ in range(200):
+            state = self.manager.store.read(job_id)
+            if state["status"] in statuses:
+                return state
+            time.sleep(0.01)
+        self.fail(f"job stayed {state['status']}")
+
+    def test_submit_poll_and_result(self):
+        from utils.jobs import DONE, RUNNING
+
+        response = self.submit()
+        self.assertEqual(response.status_code, 202)
+        body = self.json(response)
+        self.wait_for(body["id"], {RUNNING})
+
+        status = self.json(self.request("get", body["status_url"]))
+        self.assertEqual(status["status"], RUNNING)
+        self.assertNotIn("result_url", status)
+        self.assertEqual(self.request("get", f"/api/jobs/{body['id']}/result/").status_code, 409)
+
+        self.release.set()
+        self.wait_for(body["id"], {DONE})
+        status = self.json(self.request("get", body["status_url"]))
+        self.assertEqual(status["progress"], 1.0)
+        result = self.request("get", status["result_url"])
+        self.assertEqual(result.status_code, 200)
+        self.assertEqual(b"".join(result.streaming_content), b"done")
+
+    def test_cancel(self):
+        from utils.jobs import CANCELLED, RUNNING
+
+        body = self.json(self.submit())
+        self.wait_for(body["id"], {RUNNING})
+        response = self.request("post", body["cancel_url"])
+        self.assertEqual(response.status_code, 200)
+        self.wait_for(body["id"], {CANCELLED})
+        self.assertEqual(self.json(self.request("get", body["status_url"]))["status"], CANCELLED)
+
+    def test_unknown_job(self):
+        response = self.request("get", f"/api/jobs/{'0' * 32}/status/")
+        self.assertEqual(response.status_code, 404)
+
+    def test_queue_full(self):
+        self.assertEqual(self.submit().status_code, 202)
+        response = self.submit()
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response["Retry-After"], "5")
+        # 投入できなかったジョブは残さない
+        self.assertEqual(len(os.listdir(self.manager.store.directory)), 1)
+
+    def test_sync_timeout(self):
+        from django.core.files.uploadedfile import SimpleUploadedFile
+
+        from app.pipeline import TIMEOUT_MESSAGE
+
+        file = SimpleUploadedFile("a.bin", b"input")
+        response = self.request("post", "/api/clip-audio/", {"file": file})
+        self.assertEqual(response.status_code, 504)
+        self.assertEqual(self.json(response)["error"], TIMEOUT_MESSAGE)
+
+    def test_broken_process_pool_is_recreated(self):
+        from concurrent.futures import Future
+        from concurrent.futures.process import BrokenProcessPool
+
+        import utils.jobs
+
+        broken = mock.Mock()
+        broken.submit.side_effect = BrokenProcessPool()
+        self.manager._process_pool = broken
+        job_id = self.manager.store.create("pitch-shift", {})
+        with mock.patch.object(utils.jobs, "ProcessPoolExecutor") as executor:
+            executor.return_value.submit.return_value = Future()
+            self.manager.enqueue(job_id)
+        broken.shutdown.assert_called_once()
+        self.assertIs(self.manager._process_pool, executor.return_value)
+        self.assertEqual(self.manager.pending, 1)
+
+    def test_job_lost_with_broken_pool_fails(self):
+        from concurrent.futures import Future
+        from concurrent.futures.process import BrokenProcessPool
+
+        import utils.jobs
+        from utils.jobs import FAILED
+
+        job_id = self.manager.store.create("pitch-shift", {})
+        future = Future()
+        with mock.patch.object(utils.jobs, "ProcessPoolExecutor") as executor:
+            executor.return_value.submit.return_value = future
+            self.manager.enqueue(job_id)
+        future.set_exception(BrokenProcessPool())
+        self.assertEqual(self.manager.store.read(job_id)["status"], FAILED)
+        self.assertEqual(self.manager.pending, 0)
+
+
+class InferenceBatcherTests(SimpleTestCase):
+    def test_batch_sizes_are_bounded(self):
+        from utils import inference_batcher
+
+        with mock.patch.object(inference_batcher, "BATCH_SIZE_HISTORY", 3):
+            batcher = inference_batcher.InferenceBatcher(lambda images: images, window_ms=0)
+        for i in range(5):
+            self.assertEqual(batcher.submit(i).result(timeout=5), i)
+        self.assertEqual(list(batcher.batch_sizes), [1, 1, 1])
+
+
+class ReadWindowTests(SimpleTestCase):
+    """
+    画像の一部だけを読み込んだ結果が、画像全体を読み込んで切り出した結果と一致することを確認する
+    （utils.image_io は Pillow の内部のタイルを書き換えて読み込むので、Pillow の更新時に確認する）
+    """
+
+    boxes = [(0, 0, 37, 23), (5, 3, 20, 17), (30, 10, 37, 23), (0, 22, 37, 23), (36, 0, 37, 1)]
+
+    def check(self, fmt, mode, raw):
+        from PIL import Image
+
+        from utils.image_io import _read_raw_window, read_window
+
+        rng = np.random.default_rng(0)
+        pixels = rng.integers(0, 256, (23, 37, len(mode)), dtype=np.uint8)
+        image = Image.fromarray(pixels[:, :, 0] if mode == "L" else pixels, mode)
+        with tempfile.NamedTemporaryFile(suffix=f".{fmt}") as f:
+            image.save(f.name, format=fmt)
+            for box in self.boxes:
+                with self.subTest(fmt=fmt, mode=mode, box=box):
+                    with Image.open(f.name) as full:
+                        window = full.crop(box)
+                        expected = np.asarray(window.convert("RGBA" if mode == "RGBA" else "RGB"))
+                    with Image.open(f.name) as source:
+                        np.testing.assert_array_equal(read_window(source, box), expected)
+                    # 非圧縮の形式は、必要な部分だけを読む方法で読み込んでいること
+                    with Image.open(f.name) as source:
+                        self.assertEqual(_read_raw_window(source, box) is not None, raw)
+
+    def test_bmp(self):
+        self.check("BMP", "RGB", raw=True)
+        self.check("BMP", "L", raw=True)
+
+    def test_ppm(self):
+        self.check("PPM", "RGB", raw=True)
+        self.check("PPM", "L", raw=True)
+
+    def test_png(self):
+        self.check("PNG", "RGB", raw=False)
+        self.check("PNG", "RGBA", raw=False)
+
+
+class AudioProbeTests(SimpleTestCase):
+    """
+    ヘッダだけを読んで取得したオーディオファイルの情報（utils.audio_probe）を確認する
+    """
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+
+    def write(self, name, seconds=1.5, sr=22050, channels=2, **kwargs):
+        path = os.path.join(self.directory, name)
+        t = np.arange(int(seconds * sr)) / sr
+        y = np.stack([0.3 * np.sin(2 * np.pi * 440 * (c + 1) * t) for c in range(channels)], 1)
+        sf.write(path, y.astype(np.float32), sr, **kwargs)
+        return path
+
+    def test_wav(self):
+        from utils.audio_probe import probe_audio
+
+        probe = probe_audio(self.write("a.wav", subtype="PCM_16"))
+        self.assertEqual((probe.format, probe.codec), ("wav", "pcm_16"))
+        self.assertEqual((probe.sample_rate, probe.channels, probe.bit_depth), (22050, 2, 16))
+        self.assertAlmostEqual(probe.duration, 1.5)
+        self.assertEqual(probe.estimated_frames, 33075)
+
+    def test_ogg(self):
+        from utils.audio_probe import probe_audio
+
+        probe = probe_audio(self.write("a.ogg", channels=1, format="OGG", subtype="VORBIS"))
+        self.assertEqual((probe.format, probe.codec), ("ogg", "vorbis"))
+        self.assertEqual((probe.sample_rate, probe.channels), (22050, 1))
+        self.assertAlmostEqual(probe.duration, 1.5, places=2)
+        self.assertAlmostEqual(probe.estimated_frames, 33075, delta=220)
+
+    @unittest.skipUnless(shutil.which("ffprobe"), "ffprobe is not installed")
+    def test_mp3(self):
+        from utils.audio_probe import probe_audio
+
+        probe = probe_audio(self.write("a.mp3", format="MP3", subtype="MPEG_LAYER_III"))
+        self.assertEqual((probe.format, probe.codec), ("mp3", "mp3"))
+        self.assertEqual((probe.sample_rate, probe.channels), (22050, 2))
+        # MP3 はエンコーダの遅延の分だけ長くなる
+        self.assertAlmostEqual(probe.duration, 1.5, delta=0.1)
+        self.assertAlmostEqual(probe.estimated_frames, 33075, delta=2205)
+
+    def test_ffprobe_output(self):
+        from utils.audio_probe import probe_audio
+
+        output = {
+            "streams": [{"codec_name": "aac", "sample_rate": "44100", "channels": 2}],
+            "format": {"format_name": "mov,mp4,m4a,3gp,3g2,mj2", "duration": "2.500000"},
+        }
+        path = os.path.join(self.directory, "a.m4a")
+        with open(path, "wb") as f:
+            f.write(b"\x00\x00\x00\x20ftypM4A " + bytes(100))
+        with mock.patch("subprocess.run") as run:
+            run.return_value.stdout = json.dumps(output).encode()
+            probe = probe_audio(path)
+            self.assertEqual((probe.format, probe.codec), ("mov", "aac"))
+            self.assertEqual((probe.sample_rate, probe.channels), (44100, 2))
+            self.assertEqual(probe.estimated_frames, 110250)
+
+            # 再生時間が分からない場合は見積もらない
+            output["format"]["duration"] = "N/A"
+            run.return_value.stdout = json.dumps(output).encode()
+            probe = probe_audio(path)
+            self.assertIsNone(probe.duration)
+            self.assertIsNone(probe.estimated_frames)
+
+    def test_not_audio(self):
+        from utils.audio_probe import AudioProbeError, probe_audio
+
+        _, png = cv2.imencode(".png", np.zeros((8, 8, 3), np.uint8))
+        for name, content in [("a.png", png.tobytes()), ("a.txt", b"hello" * 20), ("a.wav", b"")]:
+            path = os.path.join(self.directory, name)
+            with open(path, "wb") as f:
+                f.write(content)
+            with self.subTest(name=name), mock.patch("subprocess.run") as run:
+                run.side_effect = subprocess.CalledProcessError(1, "ffprobe")
+                with self.assertRaises(AudioProbeError):
+                    probe_audio(path)
+                if name == "a.png":
+                    # 音声でないと分かる形式は ffprobe を起動しない
+                    run.assert_not_called()
+
+
+class DecodeAudioRangeTests(SimpleTestCase):
+    """
+    範囲を指定したデコードが、全体をデコードしてから切り出した結果と一致することを確認する
+    """
+
+    sr = 8000
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        rng = np.random.default_rng(0)
+        y = rng.uniform(-0.5, 0.5, (int(2.5 * self.sr), 2)).astype(np.float32)
+        self.paths = []
+        for name, subtype in [("a.wav", "FLOAT"), ("a.flac", "PCM_16")]:
+            path = os.path.join(directory.name, name)
+            sf.write(path, y, self.sr, subtype=subtype)
+            self.paths.append(path)
+
+    def test_matches_decode_then_slice(self):
+        from utils.audio_io import decode_audio, decode_audio_range
+
+        cases = [
+            (0, 0.5),  # 先頭から
+            (0.37, 0.41),  # 途中の範囲
+            (2.0, 100),  # ファイルの終わりを超える
+            (0, 100),  # ファイル全体
+        ]
+        for path in self.paths:
+            for mono in (True, False):
+                full, sr = decode_audio(path, mono=mono)
+                for start, duration in cases:
+                    with self.subTest(path=os.path.basename(path), mono=mono, start=start):
+                        y, rate = decode_audio_range(path, start, duration, mono=mono)
+                        self.assertEqual(rate, sr)
+                        begin = int(start * sr)
+                        np.testing.assert_array_equal(
+                            y, full[begin : int((start + duration) * sr)]
+                        )
+
+    def test_start_after_the_end(self):
+        from utils.audio_io import decode_audio_range
+
+        y, _ = decode_audio_range(self.paths[0], 3.0, 1.0, mono=False)
+        self.assertEqual(y.shape, (0, 2))
+
+
+class AudioPeaksTests(SimpleTestCase):
+    """
+    波形の概形（utils.audio_peaks）の計算とバイナリ形式を確認する
+    """
+
+    def expected(self, y, samples_per_peak):
+        # 全体を一度に、samples_per_peak ごとに区切って求めた最小値・最大値
+        low = y.min(axis=1) if y.ndim == 2 else y
+        high = y.max(axis=1) if y.ndim == 2 else y
+        starts = range(0, len(y), samples_per_peak)
+        return (
+            np.array([low[i : i + samples_per_peak].min() for i in starts], dtype=np.float32),
+            np.array([high[i : i + samples_per_peak].max() for i in starts], dtype=np.float32),
+        )
+
+    def build(self, y, samples_per_peak, block_sizes):
+        from utils.audio_peaks import PeaksBuilder
+
+        builder = PeaksBuilder(samples_per_peak)
+        position = 0
+        for size in block_sizes:
+            builder.add(y[position : position + size])
+            position += size
+        builder.add(y[position:])
+        self.assertEqual(builder.frames, len(y))
+        return builder.finish()
+
+    def test_blocks_not_aligned_to_peaks(self):
+        rng = np.random.default_rng(0)
+        y = rng.uniform(-1, 1, 1000).astype(np.float32)
+        # ブロックの長さが samples_per_peak の倍数でなく、1 peak より短いブロックもある
+        for block_sizes in ([1000], [7, 93, 3, 250, 1], [64] * 15, [999]):
+            with self.subTest(block_sizes=block_sizes):
+                mins, maxs = self.build(y, 64, block_sizes)
+                expected_mins, expected_maxs = self.expected(y, 64)
+                np.testing.assert_array_equal(mins, expected_mins)
+                np.testing.assert_array_equal(maxs, expected_maxs)
+                # 1000 = 64 * 15 + 40 なので、末尾の端数が 16 個目の peak になる
+                self.assertEqual(len(mins), 16)
+
+    def test_multi_channel(self):
+        t = np.arange(512) / 512
+        left = np.sin(2 * np.pi * 4 * t).astype(np.float32)
+        # 逆相のチャンネル（平均すると 0 になる）
+        y = np.stack([left, -left], axis=1)
+        mins, maxs = self.build(y, 32, [100, 100])
+        expected_mins, expected_maxs = self.expected(y, 32)
+        np.testing.assert_array_equal(mins, expected_mins)
+        np.testing.assert_array_equal(maxs, expected_maxs)
+        self.assertTrue(np.all(maxs > 0.1))
+        np.testing.assert_array_equal(mins, -maxs)
+
+    def test_empty(self):
+        mins, maxs = self.build(np.zeros(0, dtype=np.float32), 64, [])
+        self.assertEqual((len(mins), len(maxs)), (0, 0))
+
+    def test_round_trip(self):
+        from utils.audio_peaks import build_levels, decode_peaks, encode_peaks
+
+        rng = np.random.default_rng(1)
+        y = rng.uniform(-1, 1, 10000).astype(np.float32)
+        mins, maxs = self.build(y, 8, [333, 1024])
+        levels = build_levels(mins, maxs, 8, factor=4, min_peaks=100)
+        # 1250 → 313 → 79 peaks
+        self.assertEqual([(n, len(m)) for n, m, _ in levels], [(8, 1250), (32, 313), (128, 79)])
+
+        sr, frames, decoded = decode_peaks(encode_peaks(levels, 22050, len(y)))
+        self.assertEqual((sr, frames), (22050, len(y)))
+        self.assertEqual(len(decoded), len(levels))
+        for (samples_per_peak, mins, maxs), (decoded_spp, pairs) in zip(levels, decoded):
+            self.assertEqual(decoded_spp, samples_per_peak)
+            np.testing.assert_allclose(pairs[:, 0] / 32767, mins, atol=1 / 32767)
+            np.testing.assert_allclose(pairs[:, 1] / 32767, maxs, atol=1 / 32767)
+            # 粗い解像度は細かい解像度の範囲をまとめたもの
+            np.testing.assert_array_equal(mins, self.expected(y, samples_per_peak)[0])
+
+    def test_truncated(self):
+        from utils.audio_peaks import PeaksFormatError, build_levels, decode_peaks, encode_peaks
+
+        mins, maxs = self.build(np.linspace(-1, 1, 4096, dtype=np.float32), 16, [])
+        data = encode_peaks(build_levels(mins, maxs, 16, min_peaks=32), 8000, 4096)
+        decode_peaks(data)
+        # ヘッダ・解像度の表・peaks のそれぞれの途中で切れている場合
+        for size in (0, 10, 25, 30, len(data) - 1):
+            with self.subTest(size=size), self.assertRaises(PeaksFormatError):
+                decode_peaks(data[:size])
+        with self.assertRaises(PeaksFormatError):
+            decode_peaks(b"XXXX" + data[4:])
+
+
+class ClipImagePackageTests(SimpleTestCase):
+    """
+    clip-image の package=zip（物体ごとの画像）と package=sprite（スプライトシート）を、
+    2つの物体を描いた画像で確認する
+    """
+
+    # 21×16 と 21×31 の矩形
+    contours = [
+        [[10, 10], [30, 10], [30, 25], [10, 25]],
+        [[50, 40], [70, 40], [70, 70], [50, 70]],
+    ]
+
+    def setUp(self):
+        import utils.jobs
+        import utils.result_cache
+        import utils.result_store
+
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        image = np.full((80, 100, 3), 255, np.uint8)
+        for contour in self.contours:
+            cv2.fillPoly(image, [np.array(contour, np.int32)], (0, 0, 255))
+        _, self.image = cv2.imencode(".png", image)
+
+        manager = utils.jobs.JobManager(
+            utils.jobs.JobStore(os.path.join(directory.name, "jobs")),
+            process_workers=1,
+            thread_workers=1,
+            max_pending=4,
+            thread_operations=["clip-image"],
+        )
+        self.addCleanup(lambda: manager._thread_pool and manager._thread_pool.shutdown())
+        result_store = utils.result_store.ResultStore(
+            os.path.join(directory.name, "results"), 1024 * 1024, ttl=60
+        )
+        cache = utils.result_cache.ResultCache(
+            utils.result_cache.DiskCacheBackend(
+                os.path.join(directory.name, "cache"), 1024 * 1024
+            )
+        )
+        for patcher in (
+            mock.patch.object(utils.jobs, "_job_manager", manager),
+            mock.patch.object(utils.result_store, "_result_store", result_store),
+            mock.patch.object(utils.result_cache, "_result_cache", cache),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def clip(self, package):
+        import zipfile
+
+        from django.core.files.uploadedfile import SimpleUploadedFile
+        from django.test import RequestFactory
+
+        from app.views import clip_image
+
+        data = {
+            "file": SimpleUploadedFile("objects.png", self.image.tobytes()),
+            "contours": json.dumps(self.contours),
+            "package": package,
+        }
+        response = clip_image(RequestFactory().post("/api/clip-image/", data))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Content-Type"], "application/zip")
+        self.assertIn("objects.zip", response["Content-Disposition"])
+        archive = zipfile.ZipFile(io.BytesIO(b"".join(response.streaming_content)))
+        manifest = json.loads(archive.read("manifest.json"))
+        self.assertEqual(manifest["image"], {"width": 100, "height": 80})
+        positions = [(o["x"], o["y"], o["width"], o["height"]) for o in manifest["objects"]]
+        self.assertEqual(positions, [(10, 10, 21, 16), (50, 40, 21, 31)])
+        return archive, manifest
+
+    def decode(self, archive, name):
+        return cv2.imdecode(np.frombuffer(archive.read(name), np.uint8), cv2.IMREAD_UNCHANGED)
+
+    def test_zip(self):
+        archive, manifest = self.clip("zip")
+        names = ["object_001.png", "object_002.png"]
+        self.assertEqual(sorted(archive.namelist()), ["manifest.json", *names])
+        self.assertEqual([o["file"] for o in manifest["objects"]], names)
+        for name, entry in zip(names, manifest["objects"]):
+            cutout = self.decode(archive, name)
+            self.assertEqual(cutout.shape, (entry["height"], entry["width"], 4))
+            # 矩形の中はすべて不透明な赤
+            self.assertTrue(np.all(cutout[:, :, 3] == 255))
+            self.assertTrue(np.all(cutout[:, :, :3] == (0, 0, 255)))
+
+    def test_sprite(self):
+        archive, manifest = self.clip("sprite")
+        self.assertEqual(sorted(archive.namelist()), ["manifest.json", "sprite.png"])
+        self.assertEqual(manifest["sprite"], "sprite.png")
+        sheet = self.decode(archive, "sprite.png")
+        # 高い順に並べる: 21×31 を (0, 0) に置き、幅 33 に収まらない 21×16 は次の行に置く
+        self.assertEqual(sheet.shape, (48, 33, 4))
+        sprite_positions = [(o["sprite_x"], o["sprite_y"]) for o in manifest["objects"]]
+        self.assertEqual(sprite_positions, [(0, 32), (0, 0)])
+        for entry in manifest["objects"]:
+            x, y = entry["sprite_x"], entry["sprite_y"]
+            region = sheet[y : y + entry["height"], x : x + entry["width"]]
+            self.assertTrue(np.all(region[:, :, 3] == 255))
+        # 物体の間は透明
+        self.assertTrue(np.all(sheet[31, :, 3] == 0))
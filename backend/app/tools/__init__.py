@@ -0,0 +1,29 @@
+import importlib
+import os
+
+# ツールの API の定義（同期 API とジョブの API で共通）を、ツールの種類ごとのモジュールに分けている。
+# 音声・画像の処理に使う重いライブラリ（librosa・OpenCV・PyTorch など）は、そのツールが
+# 初めて使われたときに読み込まれるので、フロントエンドだけを返すワーカーは読み込まない。
+TOOL_MODULES = {
+    "pitch-shift": "app.tools.audio",
+    "pitch-shift-batch": "app.tools.audio",
+    "clip-audio": "app.tools.audio",
+    "audio-peaks": "app.tools.audio",
+    "image-contours": "app.tools.image",
+    "clip-image": "app.tools.image",
+}
+
+
+def get_tool(name):
+    """
+    処理名から API の定義（Operation）を返す（定義しているモジュールはこのとき読み込む）
+
+    :raises KeyError: 未知の処理名の場合
+    """
+    module = importlib.import_module(TOOL_MODULES[name])
+    return module.TOOLS[name]
+
+
+def file_params(data):
+    file_name, file_extension = os.path.splitext(data["file"].name)
+    return {"file_name": file_name, "extension": file_extension}
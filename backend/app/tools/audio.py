@@ -0,0 +1,212 @@
+from django.conf import settings
+from django.http import HttpResponse
+from utils.audio_io import audio_format, audio_mime_type
+from utils.audio_peaks import CONTENT_TYPE as PEAKS_CONTENT_TYPE
+from utils.audio_probe import AudioProbeError
+from utils.audio_util import AudioTooLongError, check_audio_file
+from utils.audio_stream import stream_pitch_shift
+from ..pipeline import Operation, RequestError, attachment_response
+from ..serializers import (
+    AudioClipSerializer,
+    AudioPeaksSerializer,
+    FileUploadSerializer,
+    PitchBatchSerializer,
+)
+from . import file_params
+
+
+def check_audio(file_path):
+    """
+    音声ファイルかどうかと再生時間をヘッダだけで確認し、エラーをメッセージに変換する
+    """
+    try:
+        return check_audio_file(file_path, max_duration=settings.AUDIO_MAX_DURATION)
+    except AudioProbeError:
+        raise RequestError("Selected file is not a audio file.")
+    except AudioTooLongError as e:
+        raise RequestError(str(e))
+
+
+def quality_params(quality, engine=None):
+    """
+    品質の指定から、ピッチシフトの方式・チャンネル・サンプリングレートを決める
+    """
+    if quality == "fast":
+        options = {
+            "engine": settings.AUDIO_PREVIEW_ENGINE,
+            "mono": True,
+            "sample_rate": settings.AUDIO_PREVIEW_SAMPLE_RATE,
+        }
+    else:
+        options = {"engine": settings.AUDIO_FULL_ENGINE, "mono": False, "sample_rate": None}
+    if engine:
+        options["engine"] = engine
+    return {"quality": quality, **options}
+
+
+def pitch_shift_params(data):
+    return {
+        **file_params(data),
+        "pitch": data["pitch"],
+        "stream": data.get("stream", False),
+        "format": audio_format(data["file"].name),
+        **quality_params(
+            data.get("quality") or settings.AUDIO_DEFAULT_QUALITY, data.get("engine")
+        ),
+    }
+
+
+def pitch_shift_batch_params(data):
+    # 重複を除き、指定された順に並べる
+    pitches = list(dict.fromkeys(data["pitches"]))
+    if len(pitches) > settings.AUDIO_BATCH_MAX_STEPS:
+        raise RequestError(
+            f"Up to {settings.AUDIO_BATCH_MAX_STEPS} pitches can be selected at once."
+        )
+    return {**file_params(data), "pitches": pitches, "format": audio_format(data["file"].name)}
+
+
+def clip_audio_params(data):
+    return {
+        **file_params(data),
+        "start": data["start"],
+        "end": data["end"],
+        "stream_copy": data["stream_copy"],
+        "format": audio_format(data["file"].name),
+    }
+
+
+def audio_peaks_params(data):
+    return {**file_params(data), "samples_per_peak": settings.AUDIO_PEAKS_SAMPLES_PER_PEAK}
+
+
+def peaks_response(request, data, params):
+    return HttpResponse(data, content_type=PEAKS_CONTENT_TYPE)
+
+
+def audio_response(request, data, params):
+    return attachment_response(data, audio_mime_type(params["format"]), params["file_name"])
+
+
+def zip_response(request, data, params):
+    return attachment_response(data, "application/zip", params["file_name"] + ".zip")
+
+
+def audio_units(input_path, params, probe):
+    """
+    処理するサンプル数（再生時間 × チャンネル数 × サンプリングレート）。再生時間が不明な場合は None
+
+    fast の品質のように、モノラルにしてサンプリングレートを下げて処理する場合はその分を減らす。
+    """
+    if probe is None or probe.duration is None:
+        return None
+    channels = 1 if params.get("mono") else probe.channels
+    sample_rate = min(probe.sample_rate, params.get("sample_rate") or probe.sample_rate)
+    return probe.duration * channels * sample_rate
+
+
+def pitch_shift_batch_units(input_path, params, probe):
+    units = audio_units(input_path, params, probe)
+    return units * len(params["pitches"]) if units is not None else None
+
+
+def clip_audio_units(input_path, params, probe):
+    # 指定した範囲だけをデコードする
+    if probe is None or probe.duration is None:
+        return None
+    seconds = max(0, min(params["end"], probe.duration) - params["start"])
+    return seconds * probe.channels * probe.sample_rate
+
+
+def pitch_shift_stream(input_file_path, params, probe):
+    # ブロックごとに処理し、エンコードできた分から順に返す
+    chunks = stream_pitch_shift(
+        input_file_path,
+        params["format"],
+        n_steps=params["pitch"],
+        blocksize=settings.AUDIO_STREAM_BLOCK_SIZE,
+        probe=probe,
+        engine=params["engine"],
+        mono=params["mono"],
+        sample_rate=params["sample_rate"],
+        workers=settings.WORKER_CPU_THREADS or None,
+    )
+    return chunks, audio_mime_type(params["format"])
+
+
+# ツールの API の定義
+TOOLS = {
+    "pitch-shift": Operation(
+        name="pitch-shift",
+        serializer_class=FileUploadSerializer,
+        field_errors={
+            "file": "Audio file must be selected.",
+            "pitch": "Pitch must be selected.",
+        },
+        build_params=pitch_shift_params,
+        respond=audio_response,
+        cache_name="pitch_shift",
+        cache_params=lambda params: {
+            "pitch": params["pitch"],
+            "format": params["format"],
+            "engine": params["engine"],
+            "mono": params["mono"],
+            "sample_rate": params["sample_rate"],
+        },
+        probe=check_audio,
+        stream=pitch_shift_stream,
+        download=True,
+        cost_units=audio_units,
+    ),
+    "pitch-shift-batch": Operation(
+        name="pitch-shift-batch",
+        serializer_class=PitchBatchSerializer,
+        field_errors={
+            "file": "Audio file must be selected.",
+            "pitches": "Pitches must be selected.",
+        },
+        build_params=pitch_shift_batch_params,
+        respond=zip_response,
+        cache_name="pitch_shift_batch",
+        cache_params=lambda params: {
+            "pitches": params["pitches"],
+            "format": params["format"],
+        },
+        probe=check_audio,
+        download=True,
+        cost_units=pitch_shift_batch_units,
+    ),
+    "clip-audio": Operation(
+        name="clip-audio",
+        serializer_class=AudioClipSerializer,
+        field_errors={
+            "file": "Audio file must be selected.",
+            "upload_token": "The uploaded file has expired. Please select the file again.",
+        },
+        build_params=clip_audio_params,
+        respond=audio_response,
+        cache_name="clip_audio",
+        cache_params=lambda params: {
+            "start": params["start"],
+            "end": params["end"],
+            "format": params["format"],
+            "stream_copy": params["stream_copy"],
+        },
+        probe=check_audio,
+        download=True,
+        cost_units=clip_audio_units,
+    ),
+    "audio-peaks": Operation(
+        name="audio-peaks",
+        serializer_class=AudioPeaksSerializer,
+        field_errors={"file": "Audio file must be selected."},
+        build_params=audio_peaks_params,
+        respond=peaks_response,
+        cache_name="audio_peaks",
+        cache_params=lambda params: {"samples_per_peak": params["samples_per_peak"]},
+        probe=check_audio,
+        cost_units=audio_units,
+        # 後の clip-audio でアップロードし直さずに済むよう、取り込んだファイルを保存しておく
+        keep_upload=True,
+    ),
+}
@@ -0,0 +1,188 @@
+import base64
+import hashlib
+import json
+import mimetypes
+
+from django.conf import settings
+from django.http import HttpResponse
+from utils.contour_codec import CONTENT_TYPE as CONTOUR_CONTENT_TYPE
+from utils.contour_codec import (
+    COMPACT_FORMAT,
+    ContourFormatError,
+    compress,
+    contours_to_json,
+    decode_contours,
+    decode_contours_base64,
+    encode_contours_base64,
+)
+from utils.image_io import image_megapixels
+from utils.image_util import model_version
+from utils.result_store import ResultNotFoundError, get_result_store
+from ..pipeline import Operation, RequestError, attachment_response
+from ..serializers import ImageClipSerializer, ImageContourSerializer
+from . import file_params
+
+
+def clip_image_params(data):
+    params = file_params(data)
+    output_format = data.get("output_format")
+    if data["package"] != "image":
+        # 物体ごとの透明な画像を zip にまとめて返す
+        params["extension"] = "." + (output_format or "png")
+        content_type = "application/zip"
+    elif output_format:
+        # 透明にできる形式で返す
+        params["extension"] = "." + output_format
+        content_type = f"image/{output_format}"
+    else:
+        content_type, _ = mimetypes.guess_type(data["file"].name)
+        if content_type is None:
+            raise RequestError("Content-Type of uploaded file does not exist.")
+    return {
+        **params,
+        "content_type": content_type,
+        "crop": data["crop"],
+        "transparent": bool(output_format),
+        "package": data["package"],
+        **clip_contours_params(data),
+    }
+
+
+def clip_contours_params(data):
+    """
+    切り抜く輪郭をジョブのパラメータにする
+
+    輪郭は JSON・base64 のバイナリ形式・輪郭抽出の結果の ID（contours_id）のいずれかで受け取る。
+    """
+    if data.get("contours_id"):
+        contours = load_contours_handle(data["contours_id"])
+        index = data.get("contour_index")
+        if index is not None:
+            if index >= len(contours):
+                raise RequestError("contour_index is out of range.")
+            contours = [contours[index]]
+        return {"contours_blob": encode_contours_base64(contours)}
+
+    if data["contours_format"] == "compact":
+        try:
+            decode_contours_base64(data["contours"])
+        except ContourFormatError as e:
+            raise RequestError(str(e))
+        return {"contours_blob": data["contours"]}
+
+    return {"contours": data["contours"]}
+
+
+def save_contours_handle(data):
+    """
+    輪郭抽出の結果（バイナリ形式）を保存し、clip_image から参照できる ID を返す
+
+    ID は内容のハッシュなので、同じ輪郭には同じ ID が付く。保存先は結果の保存先
+    （RESULT_STORE_TTL の間は残る）で、キャッシュを無効にしても使える。
+    保存期間を過ぎた場合は、輪郭（contours）を送れば切り抜ける。
+    """
+    return get_result_store().save(data, CONTOUR_CONTENT_TYPE, None)
+
+
+def load_contours_handle(contours_id):
+    store = get_result_store()
+    try:
+        with open(store.info(contours_id)["path"], "rb") as f:
+            data = f.read()
+    except (ResultNotFoundError, FileNotFoundError):
+        raise RequestError(
+            "Contours have expired. Please extract contours again or send the contours."
+        )
+    return decode_contours(data)
+
+
+def contours_response(request, data, params=None):
+    """
+    輪郭抽出の結果を Accept・Accept-Encoding に応じた形式で返す
+
+    - Accept: application/x-contours の場合はバイナリ形式をそのまま返す
+    - ?contours_format=compact の場合は JSON の中に base64 のバイナリ形式を入れて返す
+    - それ以外は以前と同じく、JSON の文字列を入れた JSON を返す
+    """
+    contours_id = save_contours_handle(data)
+    if CONTOUR_CONTENT_TYPE in request.META.get("HTTP_ACCEPT", ""):
+        body, content_type = data, CONTOUR_CONTENT_TYPE
+    elif request.GET.get("contours_format") == "compact":
+        body = json.dumps(
+            {
+                "contours": base64.b64encode(data).decode(),
+                "format": COMPACT_FORMAT,
+                "contours_id": contours_id,
+            }
+        ).encode()
+        content_type = "application/json"
+    else:
+        body = json.dumps(
+            {
+                "contours": contours_to_json(decode_contours(data)),
+                "contours_id": contours_id,
+            }
+        ).encode()
+        content_type = "application/json"
+
+    body, encoding = compress(body, request.META.get("HTTP_ACCEPT_ENCODING"))
+    response = HttpResponse(body, content_type=content_type)
+    if encoding is not None:
+        response["Content-Encoding"] = encoding
+    response["Vary"] = "Accept, Accept-Encoding"
+    response["X-Contours-Id"] = contours_id
+    return response
+
+
+def image_units(input_path, params, probe):
+    # 画像のヘッダだけを読んで画素数（メガピクセル）を求める
+    return image_megapixels(input_path)
+
+
+def image_response(request, data, params):
+    if params.get("package", "image") != "image":
+        return attachment_response(data, "application/zip", params["file_name"] + ".zip")
+    return attachment_response(data, params["content_type"], params["file_name"])
+
+
+# ツールの API の定義
+TOOLS = {
+    "image-contours": Operation(
+        name="image-contours",
+        serializer_class=ImageContourSerializer,
+        field_errors={"file": "Image file must be selected."},
+        build_params=file_params,
+        respond=contours_response,
+        cache_name="contours",
+        cache_params=lambda params: {
+            "model": model_version(),
+            "method": settings.CONTOUR_METHOD,
+            "epsilon": settings.CONTOUR_EPSILON,
+            "inference_size": settings.CONTOUR_INFERENCE_SIZE,
+            "format": CONTOUR_CONTENT_TYPE,
+        },
+        cost_units=image_units,
+    ),
+    "clip-image": Operation(
+        name="clip-image",
+        serializer_class=ImageClipSerializer,
+        field_errors={
+            "file": "Image file must be selected.",
+            "contours": "contours must be drawn to clip.",
+        },
+        build_params=clip_image_params,
+        respond=image_response,
+        cache_name="clip_image",
+        cache_params=lambda params: {
+            "contours": hashlib.sha256(
+                (params.get("contours_blob") or params["contours"]).encode()
+            ).hexdigest(),
+            "format": params["extension"].lower(),
+            "crop": params["crop"],
+            "transparent": params["transparent"],
+            "package": params["package"],
+        },
+        download=True,
+        cost_units=image_units,
+    ),
+}
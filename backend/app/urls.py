@@ -1,12 +1,33 @@
+from django.conf import settings
 from django.urls import path
 from rest_framework import routers
+from .async_views import run_in_executor
 from .views import *
 
 router = routers.DefaultRouter()
 # router.register("api/users", UserViewSet)
 
+
+def api(view):
+    # ASGI で起動した場合は、リクエストを並行に処理できるよう非同期のビューにする
+    return run_in_executor(view) if settings.ASYNC_VIEWS else view
+
+
 urlpatterns = [
     path("", index, name="frontend"),
     path("chorder/", index, name="frontend"),
     path("strudeler/", index, name="frontend"),
+    path("metrics", metrics, name="metrics"),
+    path("api/serve-wav/", api(serve_wav_file), name="serve_wav_file"),
+    path("api/serve-wav-batch/", api(serve_wav_batch), name="serve_wav_batch"),
+    path("api/clip-audio/", api(clip_audio), name="clip_audio"),
+    path("api/audio-peaks/", api(audio_peaks), name="audio_peaks"),
+    path("api/get-image-contours/", api(get_image_contours), name="get_image_contours"),
+    path("api/clip-image/", api(clip_image), name="clip_image"),
+    path("api/jobs/<str:operation>/", api(submit_job), name="submit_job"),
+    path("api/jobs/<str:job_id>/status/", api(job_status), name="job_status"),
+    path("api/jobs/<str:job_id>/events/", api(job_events), name="job_events"),
+    path("api/jobs/<str:job_id>/result/", api(job_result), name="job_result"),
+    path("api/jobs/<str:job_id>/cancel/", api(cancel_job), name="cancel_job"),
+    path("api/results/<str:result_id>/", api(stored_result), name="stored_result"),
 ] + router.urls
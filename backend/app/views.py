@@ -1,20 +1,25 @@
-import os
 import json
-import mimetypes
+import time
 from django.shortcuts import render
-from utils.audio_util import apply_pitch_shift, clip_audio_file, is_audio_file
-from utils.image_util import get_contours, image_clip
-from django.http import FileResponse
+from django.urls import reverse
+from utils.contour_codec import CONTENT_TYPE as CONTOUR_CONTENT_TYPE
+from utils.jobs import (
+    FINISHED_STATUSES,
+    DONE,
+    JobNotFoundError,
+    download_filename,
+    get_job_manager,
+)
+from utils.result_store import ResultNotFoundError
+from utils.metrics import render_metrics
+from django.http import HttpResponse, StreamingHttpResponse
 from django.http import JsonResponse
 from django.views.decorators.csrf import csrf_exempt
-from django.core.files.temp import NamedTemporaryFile
-from rest_framework.decorators import api_view
-from .serializers import (
-    FileUploadSerializer,
-    AudioClipSerializer,
-    ImageContourSerializer,
-    ImageClipSerializer,
-)
+from rest_framework.decorators import api_view, renderer_classes
+from .delivery import stored_result_response
+from .pipeline import handle, submit
+from .renderers import CONTOUR_RENDERER_CLASSES
+from .tools import TOOL_MODULES, get_tool
 
 
 # Create your views here.
@@ -22,232 +27,175 @@ def index(request, *args, **kwargs):
     return render(request, "frontend/index.html")
 
 
+def metrics(request):
+    """
+    Prometheus 形式のメトリクスを返す（PROMETHEUS_MULTIPROC_DIR があれば全プロセスを集計する）
+    """
+    body, content_type = render_metrics()
+    return HttpResponse(body, content_type=content_type)
+
+
 @api_view(["POST"])
 @csrf_exempt
 def serve_wav_file(request):
-    try:
-        if request.method == "POST":
-            serializer = FileUploadSerializer(data=request.data)
-
-            # シリアライズが成功した場合
-            if not serializer.is_valid():
-                if "file" in serializer.errors:
-                    raise Exception("Audio file must be selected.")
-
-                if "pitch" in serializer.errors:
-                    raise Exception("Pitch must be selected.")
-
-            # ファイルとpitchの値を取得
-            file = serializer.validated_data["file"]
-            pitch = serializer.validated_data["pitch"]
-
-            file_name, file_extension = os.path.splitext(file.name)
-            input_file = NamedTemporaryFile(suffix=file_extension)
-            input_file_path = input_file.name
-
-            # openでファイルをローカルに保存
-            with open(input_file_path, "wb") as f:
-                for chunk in file.chunks():
-                    f.write(chunk)
-
-            # 音声ファイルかどうかをチェックする
-            if not is_audio_file(input_file_path):
-                raise Exception("Selected file is not a audio file.")
+    return handle(request, get_tool("pitch-shift"))
 
-            # pitchを変更
-            output_file = NamedTemporaryFile(suffix=file_extension)
-            output_file_path = output_file.name
 
-            try:
-                apply_pitch_shift(input_file_path, output_file_path, n_steps=pitch)
-            except Exception as e:
-                print(e)
-                raise Exception("Something went wrong. Please try again.")
-
-            # フロントエンドにファイルを返却
-            content_type, _ = mimetypes.guess_type(output_file_path)
-            if content_type is None:
-                content_type = "application/octet-stream"
-
-            return FileResponse(
-                open(output_file_path, "rb"),
-                content_type=content_type,
-                as_attachment=True,
-                filename=file_name,
-            )
-
-        return FileResponse({"error": "Invalid request method"}, status=400)
-    except Exception as e:
-        error = str(e)
-        if "DATA_UPLOAD_MAX_MEMORY_SIZE" in str(
-            e
-        ) or "FILE_UPLOAD_MAX_MEMORY_SIZE" in str(e):
-            error = "The file is too large. Please select a file under 10MB."
-        return JsonResponse({"error": error}, status=400)
+@api_view(["POST"])
+@csrf_exempt
+def serve_wav_batch(request):
+    return handle(request, get_tool("pitch-shift-batch"))
 
 
 @api_view(["POST"])
 @csrf_exempt
 def clip_audio(request):
-    try:
-        if request.method == "POST":
-            serializer = AudioClipSerializer(data=request.data)
-
-            # シリアライズが成功した場合
-            if not serializer.is_valid():
-                if "file" in serializer.errors:
-                    raise Exception("Audio file must be selected.")
+    return handle(request, get_tool("clip-audio"))
 
-            # ファイルとpitchの値を取得
-            file = serializer.validated_data["file"]
-            start = serializer.validated_data["start"]
-            end = serializer.validated_data["end"]
 
-            file_name, file_extension = os.path.splitext(file.name)
-            input_file = NamedTemporaryFile(suffix=file_extension)
-            input_file_path = input_file.name
-
-            # openでファイルをローカルに保存
-            with open(input_file_path, "wb") as f:
-                for chunk in file.chunks():
-                    f.write(chunk)
-
-            # 音声ファイルかどうかをチェックする
-            if not is_audio_file(input_file_path):
-                raise Exception("Selected file is not a audio file.")
-
-            # pitchを変更
-            output_file = NamedTemporaryFile(suffix=file_extension)
-            output_file_path = output_file.name
-
-            try:
-                clip_audio_file(input_file_path, output_file_path, start, end)
-            except Exception as e:
-                print(e)
-                raise Exception("Something went wrong. Please try again.")
-
-            # フロントエンドにファイルを返却
-            content_type, _ = mimetypes.guess_type(output_file_path)
-            if content_type is None:
-                content_type = "application/octet-stream"
-
-            return FileResponse(
-                open(output_file_path, "rb"),
-                content_type=content_type,
-                as_attachment=True,
-                filename=file_name,
-            )
-
-        return FileResponse({"error": "Invalid request method"}, status=400)
-    except Exception as e:
-        error = str(e)
-        if "DATA_UPLOAD_MAX_MEMORY_SIZE" in str(
-            e
-        ) or "FILE_UPLOAD_MAX_MEMORY_SIZE" in str(e):
-            error = "The file is too large. Please select a file under 10MB."
-        return JsonResponse({"error": error}, status=400)
+@api_view(["POST"])
+@csrf_exempt
+def audio_peaks(request):
+    return handle(request, get_tool("audio-peaks"))
 
 
 @api_view(["POST"])
+@renderer_classes(CONTOUR_RENDERER_CLASSES)
 @csrf_exempt
 def get_image_contours(request):
-    try:
-        if request.method == "POST":
-            serializer = ImageContourSerializer(data=request.data)
-
-            # シリアライズが成功した場合
-            if not serializer.is_valid():
-                if "file" in serializer.errors:
-                    raise Exception("Image file must be selected.")
-
-            # ファイルとpitchの値を取得
-            file = serializer.validated_data["file"]
-            file_name, file_extension = os.path.splitext(file.name)
-            input_file = NamedTemporaryFile(suffix=file_extension)
-            input_file_path = input_file.name
+    return handle(request, get_tool("image-contours"))
 
-            # openでファイルをローカルに保存
-            with open(input_file_path, "wb") as f:
-                for chunk in file.chunks():
-                    f.write(chunk)
 
-            try:
-                contours = get_contours(input_file_path)
-                temp = []
-                for contour in contours:
-                    temp.append(contour.tolist())
-            except Exception as e:
-                print(e)
-                raise Exception("Something went wrong. Please try again.")
-
-            return JsonResponse({"contours": json.dumps(temp)}, status=200)
-
-        return JsonResponse({"error": "Invalid request method"}, status=400)
-    except Exception as e:
-        print(e)
-        error = str(e)
-        if "DATA_UPLOAD_MAX_MEMORY_SIZE" in str(
-            e
-        ) or "FILE_UPLOAD_MAX_MEMORY_SIZE" in str(e):
-            error = "The file is too large. Please select a file under 10MB."
-        return JsonResponse({"error": error}, status=400)
+@api_view(["POST"])
+@csrf_exempt
+def clip_image(request):
+    return handle(request, get_tool("clip-image"))
+
+
+def job_state_response(state, status=200):
+    """
+    ジョブの状態を JSON で返す（入力のパラメータは含めない）
+    """
+    job_id = state["id"]
+    body = {
+        "id": job_id,
+        "operation": state["operation"],
+        "status": state["status"],
+        "progress": state["progress"],
+        "error": state["error"],
+        "status_url": reverse("job_status", args=[job_id]),
+        "events_url": reverse("job_events", args=[job_id]),
+        "cancel_url": reverse("cancel_job", args=[job_id]),
+    }
+    if state["status"] == DONE:
+        body["result_url"] = reverse("job_result", args=[job_id])
+        if state.get("result_id"):
+            # ジョブを削除した後も、結果の保存期間の間はこの URL から取得できる
+            body["download_url"] = reverse("stored_result", args=[state["result_id"]])
+    return JsonResponse(body, status=status)
 
 
 @api_view(["POST"])
 @csrf_exempt
-def clip_image(request):
+def submit_job(request, operation):
+    if operation not in TOOL_MODULES:
+        return JsonResponse({"error": "Unknown operation."}, status=404)
+    return submit(
+        request,
+        get_tool(operation),
+        lambda state: job_state_response(state, status=202),
+    )
+
+
+@api_view(["GET"])
+def job_status(request, job_id):
     try:
-        if request.method == "POST":
-            serializer = ImageClipSerializer(data=request.data)
+        return job_state_response(get_job_manager().store.read(job_id))
+    except JobNotFoundError:
+        return JsonResponse({"error": "Job not found."}, status=404)
 
-            # シリアライズが成功した場合
-            if not serializer.is_valid():
-                if "file" in serializer.errors:
-                    raise Exception("Image file must be selected.")
 
-                if "contours" in serializer.errors:
-                    raise Exception("contours must be drawn to clip.")
+@api_view(["GET"])
+def job_events(request, job_id):
+    """
+    ジョブの状態が変わるたびに Server-Sent Events で通知する
+    """
+    store = get_job_manager().store
+    try:
+        store.read(job_id)
+    except JobNotFoundError:
+        return JsonResponse({"error": "Job not found."}, status=404)
 
-            # ファイルとpitchの値を取得
-            file = serializer.validated_data["file"]
-            file_name, file_extension = os.path.splitext(file.name)
-            input_file = NamedTemporaryFile(suffix=file_extension)
-            input_file_path = input_file.name
+    def events():
+        last = None
+        while True:
+            try:
+                state = store.read(job_id)
+            except JobNotFoundError:
+                return
+            current = (state["status"], state["progress"])
+            if current != last:
+                last = current
+                body = json.loads(job_state_response(state).content)
+                yield f"data: {json.dumps(body)}\n\n"
+            if state["status"] in FINISHED_STATUSES:
+                return
+            time.sleep(0.5)
+
+    response = StreamingHttpResponse(events(), content_type="text/event-stream")
+    response["Cache-Control"] = "no-cache"
+    return response
+
+
+@api_view(["GET"])
+@renderer_classes(CONTOUR_RENDERER_CLASSES)
+def job_result(request, job_id):
+    store = get_job_manager().store
+    try:
+        state = store.read(job_id)
+    except JobNotFoundError:
+        return JsonResponse({"error": "Job not found."}, status=404)
 
-            # openでファイルをローカルに保存
-            with open(input_file_path, "wb") as f:
-                for chunk in file.chunks():
-                    f.write(chunk)
+    if state["status"] != DONE:
+        return JsonResponse(
+            {"error": "Job is not finished.", "status": state["status"]}, status=409
+        )
+
+    try:
+        if state["content_type"] == CONTOUR_CONTENT_TYPE:
+            from .tools.image import contours_response
+
+            with open(store.result_path(job_id), "rb") as f:
+                return contours_response(request, f.read())
+
+        response = stored_result_response(
+            request,
+            state.get("result_id"),
+            filename=download_filename(state["params"], state["content_type"]),
+            content_type=state["content_type"],
+        )
+    except ResultNotFoundError:
+        return JsonResponse({"error": "Result has expired."}, status=404)
+    if state.get("upload_token"):
+        response["X-Upload-Token"] = state["upload_token"]
+    return response
+
+
+@api_view(["GET"])
+def stored_result(request, result_id):
+    """
+    保存した処理結果を返す（ETag・Range・If-None-Match に対応する）
+    """
+    try:
+        return stored_result_response(request, result_id)
+    except ResultNotFoundError:
+        return JsonResponse({"error": "Result not found."}, status=404)
 
-            output_file = NamedTemporaryFile(suffix=file_extension)
-            output_file_path = output_file.name
 
-            try:
-                contours = serializer.validated_data["contours"]
-                contours = json.loads(contours)
-                image_clip(input_file_path, output_file_path, contours)
-            except Exception as e:
-                print(e)
-                raise Exception("Something went wrong. Please try again.")
-
-            # フロントエンドにファイルを返却
-            content_type, _ = mimetypes.guess_type(output_file_path)
-            if content_type is None:
-                raise Exception("Content-Type of uploaded file does not exist.")
-
-            return FileResponse(
-                open(output_file_path, "rb"),
-                content_type=content_type,
-                as_attachment=True,
-                filename=file_name,
-            )
-
-        return JsonResponse({"error": "Invalid request method"}, status=400)
-    except Exception as e:
-        print(e)
-        error = str(e)
-        if "DATA_UPLOAD_MAX_MEMORY_SIZE" in str(
-            e
-        ) or "FILE_UPLOAD_MAX_MEMORY_SIZE" in str(e):
-            error = "The file is too large. Please select a file under 10MB."
-        return JsonResponse({"error": error}, status=400)
+@api_view(["POST"])
+@csrf_exempt
+def cancel_job(request, job_id):
+    try:
+        return job_state_response(get_job_manager().cancel(job_id))
+    except JobNotFoundError:
+        return JsonResponse({"error": "Job not found."}, status=404)
@@ -0,0 +1,272 @@
+"""
+処理のコストの見積もり（utils.admission）の係数を計測し、混雑時の受け付けの制御を比較する
+
+    python -m bench.admission calibrate --seconds 10,30,60 --megapixels 1,12,24
+    python -m bench.admission simulate --heavy 8 --light 40 --workers 2
+
+calibrate はジョブの処理（utils.job_operations）を大きさを変えて実行し、処理時間を
+固定のコスト + 処理量1あたりのコスト × 処理量 に当てはめて ADMISSION_BASE_COSTS・
+ADMISSION_UNIT_COSTS の値を出力する（処理量は API と同じく app.tools の cost_units で求める）。
+
+simulate は実際の処理の代わりにコストの秒数だけ待つジョブで、重い処理を続けて送るクライアントと
+軽い処理を送るクライアントが同時に使った場合の待ち時間を、先着順（制御なし）と
+AdmissionController で比較する。時間は --time-scale 倍に縮めて実行する。
+"""
+
+import argparse
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+import numpy as np
+
+from bench.common import Timer, percentile, print_table, setup_django
+from bench.fixtures import make_audio, make_image, make_polygons
+
+
+class Progress:
+    """
+    ジョブの進捗の報告先（ProgressReporter の代わりに何もしない）
+    """
+
+    @contextmanager
+    def stage(self, name):
+        yield
+
+    def __call__(self, fraction):
+        pass
+
+
+def audio_params(settings, seconds):
+    return {
+        "pitch-shift": {
+            "pitch": 2,
+            "format": "wav",
+            "engine": settings.AUDIO_FULL_ENGINE,
+            "mono": False,
+            "sample_rate": None,
+        },
+        "pitch-shift-batch": {"pitches": [2, -3], "format": "wav", "file_name": "bench"},
+        "clip-audio": {"start": 0, "end": seconds, "format": "wav", "stream_copy": False},
+        "audio-peaks": {"samples_per_peak": settings.AUDIO_PEAKS_SAMPLES_PER_PEAK},
+    }
+
+
+def image_params(width, height):
+    from utils.contour_codec import encode_contours_base64
+
+    polygons = [p.astype(int) for p in make_polygons(width, height, 8)]
+    return {
+        "image-contours": {},
+        "clip-image": {
+            "contours_blob": encode_contours_base64([max(polygons, key=len)]),
+            "extension": ".png",
+            "content_type": "image/png",
+            "crop": False,
+            "transparent": False,
+        },
+    }
+
+
+def fit(samples):
+    """
+    (処理量, 秒) の組から 秒 = base + unit × 処理量 を最小二乗法で求める（base・unit は 0 以上）
+    """
+    units, seconds = np.array(samples, dtype=float).T
+    if len(samples) < 2 or np.ptp(units) == 0:
+        return 0.0, float(seconds.mean() / units.mean())
+    unit, base = np.polyfit(units, seconds, 1)
+    if base < 0 or unit < 0:
+        return 0.0, float((units * seconds).sum() / (units * units).sum())
+    return float(base), float(unit)
+
+
+def calibrate(args):
+    os.environ.setdefault("SECRET_KEY", "bench")
+    os.environ.setdefault("YOLO_PRELOAD", "false")
+    setup_django()
+    from django.conf import settings
+
+    from app.tools import get_tool
+    from app.tools.audio import check_audio
+    from bench.stub_model import install_stub_model
+    from utils.job_operations import OPERATIONS
+
+    install_stub_model()
+    samples = {}
+
+    def measure(name, path, params, probe):
+        units = get_tool(name).cost_units(path, params, probe)
+        if name not in samples:
+            # 1回目（JIT のコンパイルやモデルの読み込みなど）は数えない
+            OPERATIONS[name](path, params, Progress())
+        timings = []
+        for _ in range(args.repeat):
+            with Timer() as timer:
+                OPERATIONS[name](path, params, Progress())
+            timings.append(timer.elapsed)
+        samples.setdefault(name, []).append((units, min(timings)))
+
+    with tempfile.TemporaryDirectory() as directory:
+        for seconds in [float(s) for s in args.seconds.split(",")]:
+            path = make_audio(directory, "noise", 44100, 2, seconds, "wav")
+            probe = check_audio(path)
+            for name, params in audio_params(settings, seconds).items():
+                measure(name, path, params, probe)
+        for megapixels in [float(m) for m in args.megapixels.split(",")]:
+            width = int(round((megapixels * 1e6 * 1.5) ** 0.5))
+            height = int(round(width / 1.5))
+            path = make_image(directory, width, height, "rgb")
+            for name, params in image_params(width, height).items():
+                measure(name, path, params, None)
+
+    rows, bases, units = [], {}, {}
+    for name, points in samples.items():
+        base, unit = fit(points)
+        bases[name], units[name] = base, unit
+        for amount, seconds in points:
+            predicted = base + unit * amount
+            rows.append([name, f"{amount:.4g}", f"{seconds:.3f}", f"{predicted:.3f}"])
+
+    print(f"cpus={os.cpu_count()}")
+    print_table(["operation", "units", "measured_s", "fitted_s"], rows)
+    print()
+    print("ADMISSION_BASE_COSTS=" + ",".join(f"{k}={v:.3g}" for k, v in bases.items() if v))
+    print("ADMISSION_UNIT_COSTS=" + ",".join(f"{k}={v:.3g}" for k, v in units.items()))
+
+
+def simulate_requests(args):
+    """
+    (クライアント, 送る時刻, コスト) のリスト
+    """
+    requests = [("heavy", i * 0.5, args.heavy_cost) for i in range(args.heavy)]
+    requests += [("light", i * args.interval, args.light_cost) for i in range(args.light)]
+    requests += [("cheap", i * args.interval + 0.25, 0.1) for i in range(args.light)]
+    return sorted(requests, key=lambda r: r[1])
+
+
+def run_simulation(args, controller):
+    """
+    リクエストごとにスレッドを作り、受け付け → ジョブのプールで実行 → 完了までの時間を記録する
+
+    :return: クライアントごとの (完了までの秒数, 429 を受けた回数) のリスト
+    """
+    from utils.admission import AdmissionRejectedError
+
+    scale = args.time_scale
+    pool = ThreadPoolExecutor(max_workers=args.workers)
+    results = {}
+    lock = threading.Lock()
+    started = time.perf_counter()
+
+    def request(client, at, cost):
+        time.sleep(max(0.0, started + at * scale - time.perf_counter()))
+        sent = time.perf_counter()
+        rejected = 0
+        ticket = None
+        while controller is not None:
+            try:
+                ticket = controller.admit("sim", client, cost)
+                break
+            except AdmissionRejectedError as e:
+                # 429 を受けたクライアントは Retry-After の秒数の後に送り直す
+                rejected += 1
+                time.sleep(e.retry_after * scale)
+        pool.submit(time.sleep, cost * scale).result()
+        if ticket is not None:
+            controller.release(ticket)
+        with lock:
+            results.setdefault(client, []).append(
+                ((time.perf_counter() - sent) / scale, rejected)
+            )
+
+    threads = [
+        threading.Thread(target=request, args=r) for r in simulate_requests(args)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    pool.shutdown()
+    return results
+
+
+def simulate(args):
+    os.environ.setdefault("SECRET_KEY", "bench")
+    setup_django()
+    from utils.admission import AdmissionController, CostModel
+
+    variants = [
+        ("fifo", None),
+        (
+            "admission",
+            AdmissionController(
+                CostModel({}, {"sim": 1.0}, weight=0),
+                args.budget,
+                client_share=args.client_share,
+                cheap_cost=args.cheap_cost,
+                # 待ち時間の上限も時間を縮めて扱う
+                max_wait=args.max_wait * args.time_scale,
+                max_waiting=args.max_waiting,
+                drain_rate=args.workers,
+            ),
+        ),
+    ]
+
+    rows = []
+    for name, controller in variants:
+        results = run_simulation(args, controller)
+        for client in ("heavy", "light", "cheap"):
+            latencies = [latency for latency, _ in results[client]]
+            rows.append(
+                [
+                    name,
+                    client,
+                    len(latencies),
+                    sum(rejected for _, rejected in results[client]),
+                    f"{percentile(latencies, 50):.1f}",
+                    f"{percentile(latencies, 99):.1f}",
+                ]
+            )
+
+    print(
+        f"workers={args.workers} heavy={args.heavy}x{args.heavy_cost:g}s "
+        f"light={args.light}x{args.light_cost:g}s budget={args.budget:g}s"
+    )
+    print_table(["variant", "client", "requests", "429s", "p50_s", "p99_s"], rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    parser_calibrate = subparsers.add_parser("calibrate")
+    parser_calibrate.add_argument("--seconds", default="10,30,60", help="audio lengths")
+    parser_calibrate.add_argument("--megapixels", default="1,12,24", help="image sizes")
+    parser_calibrate.add_argument("--repeat", type=int, default=2)
+    parser_calibrate.set_defaults(func=calibrate)
+
+    parser_simulate = subparsers.add_parser("simulate")
+    parser_simulate.add_argument("--workers", type=int, default=2)
+    parser_simulate.add_argument("--heavy", type=int, default=8, help="heavy requests")
+    parser_simulate.add_argument("--heavy-cost", type=float, default=60)
+    parser_simulate.add_argument("--light", type=int, default=40, help="light requests")
+    parser_simulate.add_argument("--light-cost", type=float, default=2)
+    parser_simulate.add_argument("--interval", type=float, default=5, help="seconds between")
+    parser_simulate.add_argument("--budget", type=float, default=120)
+    parser_simulate.add_argument("--client-share", type=float, default=0.5)
+    parser_simulate.add_argument("--cheap-cost", type=float, default=0.5)
+    parser_simulate.add_argument("--max-wait", type=float, default=2)
+    parser_simulate.add_argument("--max-waiting", type=int, default=1)
+    parser_simulate.add_argument("--time-scale", type=float, default=0.01)
+    parser_simulate.set_defaults(func=simulate)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+"""
+10秒の音声をエンコードする処理の、1秒あたりのリクエスト数（req/s）と出力サイズを比較する
+
+    python -m bench.audio_encode --seconds 10 --formats wav,flac,ogg,mp3,m4a --concurrency 1
+
+エンコードのたびに ffmpeg を起動していた以前の処理（pydub の export と同じ）と、
+libsndfile でプロセス内でエンコードする・起動しておいた ffmpeg（utils.ffmpeg_pool）に渡す処理を比較する。
+flac・ogg・mp3 は圧縮レベル・ビットレートを変えた場合の速さと大きさも測る。
+"""
+
+import argparse
+import os
+import subprocess
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from bench.common import print_table, setup_django
+
+# 形式ごとに比べるエンコーダーの設定（encoder_settings と同じ形）
+LEVELS = {
+    "flac": [{"bitrate": None, "compression_level": c} for c in (0.0, 0.625, 1.0)],
+    "ogg": [{"bitrate": None, "compression_level": c} for c in (0.3, 0.6, 0.9)],
+    "mp3": [{"bitrate": b, "compression_level": None} for b in (96, 128, 320)],
+}
+
+
+def legacy_encode_audio(y, sr, fmt):
+    # 比較用: エンコードのたびに ffmpeg を起動し、標準入力から PCM を渡していた以前の処理
+    from utils.audio_io import FFMPEG_FORMATS
+
+    ffmpeg_format, options = FFMPEG_FORMATS.get(fmt, (fmt, []))
+    command = ["ffmpeg", "-v", "error", "-f", "f32le", "-ar", str(sr), "-ac", str(y.shape[1])]
+    command += ["-i", "-", *options, "-f", ffmpeg_format, "-"]
+    process = subprocess.run(command, input=y.tobytes(), capture_output=True, check=True)
+    return process.stdout
+
+
+def describe(options):
+    if options is None:
+        return "default"
+    if options["bitrate"]:
+        return f"{options['bitrate']}k"
+    return f"level={options['compression_level']:g}"
+
+
+def throughput(encode, duration, concurrency):
+    """
+    duration 秒の間 encode を繰り返し、1秒あたりの回数と出力サイズを返す
+    """
+    size = len(encode())  # 1回目（ffmpeg のプールの補充など）は数えない
+
+    def loop(deadline):
+        count = 0
+        while time.perf_counter() < deadline:
+            encode()
+            count += 1
+        return count
+
+    started = time.perf_counter()
+    deadline = started + duration
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        count = sum(executor.map(loop, [deadline] * concurrency))
+    return count / (time.perf_counter() - started), size
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--seconds", type=float, default=10, help="clip length")
+    parser.add_argument("--formats", default="wav,flac,ogg,mp3,m4a")
+    parser.add_argument("--concurrency", type=int, default=1)
+    parser.add_argument("--duration", type=float, default=5, help="seconds to run each variant")
+    args = parser.parse_args()
+
+    setup_django()
+    from bench.fixtures import make_signal
+    from utils.audio_io import (
+        AudioEncodeError,
+        encode_audio,
+        encoder_settings,
+        soundfile_options,
+    )
+
+    sr = 44100
+    y = make_signal("sine", sr, 2, args.seconds) + make_signal("noise", sr, 2, args.seconds)
+
+    rows = []
+    for fmt in args.formats.split(","):
+        native = "libsndfile" if soundfile_options(fmt, sr) is not None else "ffmpeg-pool"
+        variants = [("subprocess", None, lambda: legacy_encode_audio(y, sr, fmt))]
+        for options in [None] + LEVELS.get(fmt, []):
+            merged = {**encoder_settings(fmt), **(options or {})}
+            variants.append(
+                (native, options, lambda merged=merged: encode_audio(y, sr, fmt, merged))
+            )
+
+        for name, options, encode in variants:
+            try:
+                rate, size = throughput(encode, args.duration, args.concurrency)
+            except (OSError, subprocess.CalledProcessError, AudioEncodeError) as e:
+                # ffmpeg がない環境など
+                rows.append([fmt, name, describe(options), "n/a", "n/a", type(e).__name__])
+                continue
+            rows.append(
+                [
+                    fmt,
+                    name,
+                    describe(options),
+                    f"{rate:.1f}",
+                    f"{1000 / rate * args.concurrency:.1f}",
+                    f"{size / 1024:.0f}",
+                ]
+            )
+
+    print(f"clip={args.seconds:g}s sr={sr} channels=2 concurrency={args.concurrency}")
+    print(f"cpus={os.cpu_count()}")
+    print_table(["format", "encoder", "settings", "req_per_s", "ms_per_req", "output_kb"], rows)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+"""
+切り取り処理のレイテンシが元ファイルの長さに依存しないことを確認する
+
+    python -m bench.clip_latency --minutes 1,10,60 --format flac --clip 5
+
+ファイル全体をデコードしていた以前の処理と、シークして範囲だけをデコードする処理を比較する。
+"""
+
+import argparse
+import os
+import tempfile
+
+from bench.common import Timer, print_table, setup_django
+from bench.pitch_pipeline import make_fixture
+
+
+def legacy_clip_audio_file(input_file, output_file, start_time, end_time):
+    # 比較用: librosa.load でファイル全体をデコードしてから切り取っていた以前の処理
+    import librosa
+    import soundfile as sf
+
+    y, sr = librosa.load(input_file, sr=None)
+    clipped_audio = y[int(start_time * sr) : int(end_time * sr)]
+    sf.write(output_file, clipped_audio, sr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--minutes", default="1,10,60")
+    parser.add_argument("--format", default="wav")
+    parser.add_argument("--clip", type=int, default=5, help="clip length in seconds")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--stream-copy", action="store_true")
+    args = parser.parse_args()
+
+    setup_django()
+    from utils.audio_util import clip_audio_file
+
+    implementations = {
+        "legacy": legacy_clip_audio_file,
+        "seek": lambda i, o, s, e: clip_audio_file(
+            i, o, s, e, stream_copy=args.stream_copy
+        ),
+    }
+
+    rows = []
+    with tempfile.TemporaryDirectory() as directory:
+        for minutes in [float(m) for m in args.minutes.split(",")]:
+            wav_path = os.path.join(directory, f"{minutes:g}min.wav")
+            make_fixture(wav_path, minutes)
+            input_file = wav_path
+            if args.format != "wav":
+                from utils.audio_io import decode_audio, encode_audio
+
+                input_file = os.path.join(directory, f"{minutes:g}min.{args.format}")
+                y, sr = decode_audio(wav_path, mono=False)
+                with open(input_file, "wb") as f:
+                    f.write(encode_audio(y, sr, args.format))
+                del y
+
+            # ファイルの中央から切り取る
+            start = int(minutes * 30)
+            output_file = os.path.join(directory, f"clip.{args.format}")
+            for name, clip in implementations.items():
+                timings = []
+                for _ in range(args.repeat):
+                    with Timer() as timer:
+                        clip(input_file, output_file, start, start + args.clip)
+                    timings.append(timer.elapsed)
+                rows.append([f"{minutes:g}", name, f"{min(timings) * 1000:.1f}"])
+
+    print_table(["source_minutes", "impl", "best_ms"], rows)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+import os
+import resource
+import sys
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def setup_django():
+    """
+    ベンチマークスクリプトから Django の設定を読み込めるようにする
+    """
+    if BACKEND_DIR not in sys.path:
+        sys.path.insert(0, BACKEND_DIR)
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "config.settings")
+
+    import django
+
+    django.setup()
+
+
+def percentile(values, p):
+    """
+    値のリストから p パーセンタイルを求める（最近傍法）
+    """
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(p / 100 * (len(ordered) - 1)))))
+    return ordered[index]
+
+
+def peak_rss_mb(who=resource.RUSAGE_SELF):
+    """
+    プロセスのピークメモリ使用量（MB）を返す
+    """
+    peak = resource.getrusage(who).ru_maxrss
+    # macOS はバイト、Linux はキロバイト単位
+    if sys.platform == "darwin":
+        return peak / (1024 * 1024)
+    return peak / 1024
+
+
+def reset_peak_rss():
+    """
+    ピークメモリ使用量をリセットする（Linux のみ。ライブラリの読み込みなどの分を除くため）
+
+    :return: リセットできたか（できない場合、peak_rss_since_reset_mb はプロセス全体のピークを返す）
+    """
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        return False
+    return True
+
+
+def peak_rss_since_reset_mb():
+    """
+    reset_peak_rss 以降のピークメモリ使用量（MB）を返す
+    """
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return peak_rss_mb()
+
+
+def current_rss_mb():
+    """
+    プロセスの現在のメモリ使用量（MB）を返す（/proc がない環境ではピークメモリ使用量）
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            pages = int(f.read().split()[1])
+    except OSError:
+        return peak_rss_mb()
+    return pages * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+
+
+class Timer:
+    """
+    with 文で囲んだ処理の経過時間を計測する
+    """
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        self.elapsed = 0.0
+        return self
+
+    def __exit__(self, *exc):
+        self.elapsed = time.perf_counter() - self.started
+        return False
+
+
+def print_table(headers, rows):
+    """
+    結果を表形式で出力する
+    """
+    widths = [
+        max(len(str(h)), *(len(str(row[i])) for row in rows)) if rows else len(str(h))
+        for i, h in enumerate(headers)
+    ]
+    line = "  ".join(str(h).rjust(w) for h, w in zip(headers, widths))
+    print(line)
+    print("-" * len(line))
+    for row in rows:
+        print("  ".join(str(c).rjust(w) for c, w in zip(row, widths)))
@@ -0,0 +1,121 @@
+"""
+セグメンテーション推論のマイクロバッチ化によるスループットとレイテンシを計測する
+
+    python -m bench.contour_batching --windows 0,10,20,30 --clients 8 --requests 64
+
+--offline を指定すると、重みファイルをダウンロードせずにランダム初期化のモデルで計測する。
+"""
+
+import argparse
+import threading
+import time
+
+import numpy as np
+
+from bench.common import Timer, percentile, print_table, setup_django
+
+
+def make_images(count, width, height, seed=0):
+    rng = np.random.default_rng(seed)
+    return [
+        rng.integers(0, 256, size=(height, width, 3), dtype=np.uint8)
+        for _ in range(count)
+    ]
+
+
+def build_predict_fn(size, offline):
+    if not offline:
+        from utils.model_registry import registry
+
+        registry.get(size)
+        return lambda images: registry.predict(images, size=size)
+
+    from ultralytics import YOLO
+
+    model = YOLO(f"yolov8{size}-seg.yaml")
+    lock = threading.Lock()
+    model(np.zeros((640, 640, 3), dtype=np.uint8), verbose=False)
+
+    def predict(images):
+        with lock:
+            return model(images, verbose=False)
+
+    return predict
+
+
+def run(predict_fn, images, clients, window_ms, max_batch):
+    from utils.inference_batcher import InferenceBatcher
+
+    if window_ms > 0:
+        batcher = InferenceBatcher(predict_fn, window_ms=window_ms, max_batch=max_batch)
+        infer = batcher.predict
+    else:
+        batcher = None
+        infer = lambda image: predict_fn(image)[0]
+
+    latencies = []
+    latencies_lock = threading.Lock()
+    pending = list(images)
+    pending_lock = threading.Lock()
+
+    def client():
+        while True:
+            with pending_lock:
+                if not pending:
+                    return
+                image = pending.pop()
+            started = time.perf_counter()
+            infer(image)
+            with latencies_lock:
+                latencies.append(time.perf_counter() - started)
+
+    threads = [threading.Thread(target=client) for _ in range(clients)]
+    with Timer() as timer:
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    sizes = batcher.batch_sizes if batcher else [1] * len(images)
+    return {
+        "images_per_sec": len(images) / timer.elapsed,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+        "mean_batch": sum(sizes) / len(sizes),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--windows", default="0,10,20,30")
+    parser.add_argument("--max-batch", type=int, default=8)
+    parser.add_argument("--clients", type=int, default=8)
+    parser.add_argument("--requests", type=int, default=64)
+    parser.add_argument("--width", type=int, default=1280)
+    parser.add_argument("--height", type=int, default=960)
+    parser.add_argument("--model-size", default="n")
+    parser.add_argument("--offline", action="store_true")
+    args = parser.parse_args()
+
+    setup_django()
+    predict_fn = build_predict_fn(args.model_size, args.offline)
+    images = make_images(args.requests, args.width, args.height)
+
+    rows = []
+    for window_ms in [int(w) for w in args.windows.split(",")]:
+        result = run(predict_fn, images, args.clients, window_ms, args.max_batch)
+        rows.append(
+            [
+                window_ms,
+                f"{result['images_per_sec']:.2f}",
+                f"{result['p50_ms']:.1f}",
+                f"{result['p99_ms']:.1f}",
+                f"{result['mean_batch']:.2f}",
+            ]
+        )
+
+    print_table(["window_ms", "images/sec", "p50_ms", "p99_ms", "mean_batch"], rows)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+"""
+マスクから輪郭を求める処理を、画像全体で処理していた以前の方法と比較する
+
+    python -m bench.contour_extraction --megapixels 12 --objects 24 --epsilon 0,1.5
+
+YOLO の推論は含めず、合成した画像と物体のポリゴンから輪郭を求める部分だけを計測する。
+"""
+
+import argparse
+import json
+import statistics
+
+import cv2
+import numpy as np
+
+from bench.common import Timer, print_table, setup_django
+
+
+def legacy_masks_to_contours(image, polygons):
+    # 比較用: 物体ごとに画像全体のマスクを作って輪郭を求めていた以前の get_contours
+    contours = []
+    for mask in polygons:
+        contour = np.array(mask, dtype=np.int32)
+        mask_img = np.zeros_like(image[:, :, 0])
+        cv2.fillPoly(mask_img, [contour], 255)
+        masked_img = cv2.bitwise_and(image, image, mask=mask_img)
+        gray = cv2.cvtColor(masked_img, cv2.COLOR_BGR2GRAY)
+        _, thresh = cv2.threshold(gray, 1, 255, cv2.THRESH_BINARY)
+        cons = cv2.findContours(thresh, cv2.RETR_TREE, cv2.CHAIN_APPROX_NONE)[0]
+        contours.extend(cons)
+    return contours
+
+
+def make_scene(megapixels, objects, seed=0):
+    """
+    ノイズの画像と、ランダムな位置・大きさの星形のポリゴンを作る
+    """
+    rng = np.random.default_rng(seed)
+    width = int(np.sqrt(megapixels * 1e6 * 4 / 3))
+    height = int(width * 3 / 4)
+    image = rng.integers(0, 256, size=(height, width, 3), dtype=np.uint8)
+
+    polygons = []
+    for _ in range(objects):
+        radius = rng.uniform(0.03, 0.15) * min(width, height)
+        cx = rng.uniform(radius, width - radius)
+        cy = rng.uniform(radius, height - radius)
+        angles = np.linspace(0, 2 * np.pi, 200, endpoint=False)
+        r = radius * (1 + 0.3 * np.sin(5 * angles + rng.uniform(0, np.pi)))
+        polygons.append(
+            np.stack([cx + r * np.cos(angles), cy + r * np.sin(angles)], axis=1).astype(
+                np.float32
+            )
+        )
+    return image, polygons
+
+
+def payload_size(contours):
+    return len(json.dumps([contour.tolist() for contour in contours]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--megapixels", type=float, default=12)
+    parser.add_argument("--objects", type=int, default=24)
+    parser.add_argument("--epsilon", default="0,1.5")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    setup_django()
+    from utils.image_util import masks_to_contours
+
+    image, polygons = make_scene(args.megapixels, args.objects)
+    implementations = {"legacy": lambda: legacy_masks_to_contours(image, polygons)}
+    for epsilon in [float(e) for e in args.epsilon.split(",")]:
+        for method in ("exact", "polygon"):
+            implementations[f"{method} eps={epsilon:g}"] = (
+                lambda method=method, epsilon=epsilon: masks_to_contours(
+                    image, polygons, method=method, epsilon=epsilon
+                )
+            )
+
+    reference = legacy_masks_to_contours(image, polygons)
+    rows = []
+    for name, implementation in implementations.items():
+        elapsed = []
+        for _ in range(args.repeat):
+            with Timer() as timer:
+                contours = implementation()
+            elapsed.append(timer.elapsed)
+        median = statistics.median(elapsed)
+        # exact は以前の処理と同じ輪郭になることを確認する
+        same = len(contours) == len(reference) and all(
+            np.array_equal(a, b) for a, b in zip(contours, reference)
+        )
+        rows.append(
+            [
+                name,
+                f"{median * 1000:.1f}",
+                len(contours),
+                payload_size(contours),
+                "yes" if same else "no",
+            ]
+        )
+
+    print(f"{image.shape[1]}x{image.shape[0]}, {len(polygons)} objects")
+    print_table(["impl", "median_ms", "contours", "json_bytes", "same_as_legacy"], rows)
+
+
+if __name__ == "__main__":
+    main()
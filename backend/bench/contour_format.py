@@ -0,0 +1,94 @@
+"""
+輪郭のレスポンス形式ごとのサイズと、シリアライズ・パースの時間を比較する
+
+    python -m bench.contour_format --megapixels 12 --objects 24
+
+大きな画像の密な輪郭（CHAIN_APPROX_NONE）を使う。legacy は以前の get_image_contours と同じく
+JSON の文字列をさらに JSON に入れた形式。
+"""
+
+import argparse
+import base64
+import gzip
+import json
+import statistics
+
+import numpy as np
+
+from bench.common import Timer, print_table, setup_django
+from bench.contour_extraction import make_scene
+
+
+def formats():
+    from utils.contour_codec import decode_contours, encode_contours
+
+    def legacy_dump(contours):
+        inner = json.dumps([contour.tolist() for contour in contours])
+        return json.dumps({"contours": inner}).encode()
+
+    def legacy_load(body):
+        return [np.array(c, np.int32) for c in json.loads(json.loads(body)["contours"])]
+
+    def compact_json_dump(contours):
+        data = base64.b64encode(encode_contours(contours)).decode()
+        return json.dumps({"contours": data, "format": "delta-varint"}).encode()
+
+    def compact_json_load(body):
+        return decode_contours(base64.b64decode(json.loads(body)["contours"]))
+
+    return {
+        "legacy json": (legacy_dump, legacy_load),
+        "compact base64": (compact_json_dump, compact_json_load),
+        "compact binary": (encode_contours, decode_contours),
+    }
+
+
+def median_time(fn, repeat):
+    elapsed = []
+    for _ in range(repeat):
+        with Timer() as timer:
+            result = fn()
+        elapsed.append(timer.elapsed)
+    return statistics.median(elapsed), result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--megapixels", type=float, default=12)
+    parser.add_argument("--objects", type=int, default=24)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    setup_django()
+    from utils.image_util import masks_to_contours
+
+    image, polygons = make_scene(args.megapixels, args.objects)
+    contours = masks_to_contours(image, polygons, method="exact", epsilon=0)
+    points = sum(len(contour) for contour in contours)
+
+    rows = []
+    for name, (dump, load) in formats().items():
+        dump_time, body = median_time(lambda: dump(contours), args.repeat)
+        load_time, _ = median_time(lambda: load(body), args.repeat)
+        gzip_time, compressed = median_time(
+            lambda: gzip.compress(body, compresslevel=6), args.repeat
+        )
+        rows.append(
+            [
+                name,
+                len(body),
+                len(compressed),
+                f"{dump_time * 1000:.1f}",
+                f"{load_time * 1000:.1f}",
+                f"{gzip_time * 1000:.1f}",
+            ]
+        )
+
+    print(f"{len(contours)} contours, {points} points")
+    print_table(
+        ["format", "bytes", "gzip_bytes", "serialize_ms", "parse_ms", "gzip_ms"], rows
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,168 @@
+"""
+輪郭抽出で画像を縮小して読み込む場合と、元の大きさで読み込んでいた以前の処理を比較する
+
+    python -m bench.contour_resolution --megapixels 24 --formats jpg,png
+
+読み込み・鮮鋭化・輪郭の計算（元画像の座標に戻すまで）の経過時間・CPU 時間・ピークメモリと、
+描いた物体との IoU を求める。モデルはスタブ（bench.stub_model）なので推論の時間は含まれないが、
+以前の処理では YOLO が元の大きさの画像を縮小する分の時間もかかっていた。
+ピークメモリは処理ごとに別のプロセスで1回だけ実行して測り、処理を始める前のメモリ使用量を差し引く。
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from bench.common import (
+    BACKEND_DIR,
+    Timer,
+    current_rss_mb,
+    peak_rss_since_reset_mb,
+    print_table,
+    reset_peak_rss,
+    setup_django,
+)
+
+# (名前, 読み込むときの長辺の目安)。None は以前の処理
+VARIANTS = [("legacy", None), ("full", 0), ("reduced", 640)]
+
+
+def legacy_get_contours(image_path):
+    # 比較用: 元の大きさで読み込み、画像全体を unsharp_masking してから推論していた以前の処理
+    import cv2
+
+    from utils.image_util import masks_to_contours, predict_segmentation, unsharp_masking
+
+    image = cv2.imread(image_path)
+    result = predict_segmentation(unsharp_masking(image, 3, 3, 2, 2, 3))
+    polygons = result.masks.xy if result.masks else []
+    return masks_to_contours(image, polygons)
+
+
+def make_fixture(directory, width, height, fmt):
+    """
+    灰色の背景に明るい物体（bench.fixtures.make_polygons のポリゴン）を描いた画像を作る
+    """
+    import cv2
+
+    from bench.fixtures import make_polygons
+
+    path = os.path.join(directory, f"{width}x{height}.{fmt}")
+    if not os.path.exists(path):
+        rng = np.random.default_rng(0)
+        image = rng.integers(90, 110, size=(height, width, 3), dtype=np.uint8)
+        for polygon in make_polygons(width, height, 8):
+            cv2.fillPoly(image, [polygon.astype(np.int32)], (230, 220, 210))
+        cv2.imwrite(path, image)
+    return path
+
+
+def iou_with_objects(contours, width, height):
+    import cv2
+
+    from bench.fixtures import make_polygons
+
+    truth = np.zeros((height, width), dtype=np.uint8)
+    cv2.fillPoly(truth, [p.astype(np.int32) for p in make_polygons(width, height, 8)], 255)
+    mask = np.zeros_like(truth)
+    cv2.fillPoly(mask, contours, 255)
+    truth, mask = truth > 0, mask > 0
+    return float((truth & mask).sum() / (truth | mask).sum())
+
+
+def run_variant(path, variant):
+    """
+    1つの処理を実行し、処理時間とピークメモリを返す（別のプロセスで呼ばれる）
+    """
+    setup_django()
+    from bench.stub_model import install_stub_model
+    from utils.image_util import get_contours
+
+    install_stub_model()
+    size = dict(VARIANTS)[variant]
+    reset_peak_rss()
+    baseline = current_rss_mb()
+    started = time.process_time()
+    with Timer() as timer:
+        if size is None:
+            contours = legacy_get_contours(path)
+        else:
+            contours = get_contours(path, size=size)
+    result = {
+        "wall_s": timer.elapsed,
+        "cpu_s": time.process_time() - started,
+        "peak_mb": peak_rss_since_reset_mb() - baseline,
+    }
+
+    from PIL import Image
+
+    with Image.open(path) as image:
+        result["iou"] = iou_with_objects(contours, *image.size)
+    return result
+
+
+def measure(path, variant):
+    output = subprocess.run(
+        [
+            sys.executable,
+            "-m",
+            "bench.contour_resolution",
+            "--worker",
+            json.dumps({"path": path, "variant": variant}),
+        ],
+        cwd=BACKEND_DIR,
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--megapixels", type=float, default=24)
+    parser.add_argument("--formats", default="jpg,png")
+    parser.add_argument("--fixtures", help="directory to keep generated images in")
+    parser.add_argument("--worker", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        options = json.loads(args.worker)
+        print(json.dumps(run_variant(options["path"], options["variant"])))
+        return
+
+    # 3:2 の画像にする
+    width = int(round((args.megapixels * 1e6 * 1.5) ** 0.5))
+    height = int(round(width / 1.5))
+
+    rows = []
+    with tempfile.TemporaryDirectory() as temporary:
+        directory = args.fixtures or temporary
+        os.makedirs(directory, exist_ok=True)
+        for fmt in args.formats.split(","):
+            path = make_fixture(directory, width, height, fmt)
+            for name, _ in VARIANTS:
+                result = measure(path, name)
+                rows.append(
+                    [
+                        fmt,
+                        name,
+                        f"{result['wall_s']:.2f}",
+                        f"{result['cpu_s']:.2f}",
+                        f"{result['peak_mb']:.0f}",
+                        f"{result['iou']:.4f}",
+                    ]
+                )
+
+    print(f"image={width}x{height} ({width * height / 1e6:.1f} MP) cpus={os.cpu_count()}")
+    print_table(["format", "variant", "wall_s", "cpu_s", "peak_mb", "iou"], rows)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+"""
+ベンチマーク用の合成データ（音声・画像）を作る
+
+同じ引数からは常に同じデータができるよう、乱数のシードを固定している。
+"""
+
+import os
+
+import cv2
+import numpy as np
+
+# 拡張子 → soundfile のフォーマットとサブタイプ
+AUDIO_FORMATS = {
+    "wav": ("WAV", "PCM_16"),
+    "flac": ("FLAC", "PCM_16"),
+    "ogg": ("OGG", "VORBIS"),
+    "mp3": ("MP3", "MPEG_LAYER_III"),
+}
+
+IMAGE_MODES = ("rgb", "rgba")
+
+
+class FixtureUnavailableError(Exception):
+    """
+    この環境では作成できないデータ（libsndfile が MP3 に対応していない場合など）
+    """
+
+
+def audio_name(signal, sr, channels, seconds, fmt):
+    return f"{signal}-{sr}hz-{channels}ch-{seconds:g}s.{fmt}"
+
+
+def make_signal(signal, sr, channels, seconds, seed=0):
+    """
+    波形を作る
+
+    :param signal: "sine"（チャンネルごとに周波数の異なる正弦波）または "noise"（ホワイトノイズ）
+    :return: 波形（(samples, channels)、float32）
+    """
+    samples = int(sr * seconds)
+    if signal == "sine":
+        t = np.arange(samples) / sr
+        y = np.stack(
+            [0.3 * np.sin(2 * np.pi * (220 + 110 * c) * t) for c in range(channels)], axis=1
+        )
+    elif signal == "noise":
+        y = 0.1 * np.random.default_rng(seed).standard_normal((samples, channels))
+    else:
+        raise ValueError(f"Unknown signal: {signal}")
+    return y.astype(np.float32)
+
+
+def make_audio(directory, signal, sr, channels, seconds, fmt):
+    """
+    音声ファイルを作る（既にある場合は作り直さない）
+
+    :return: 作成したファイルのパス
+    :raises FixtureUnavailableError: この環境で書き込めない形式の場合
+    """
+    import soundfile as sf
+
+    path = os.path.join(directory, audio_name(signal, sr, channels, seconds, fmt))
+    if os.path.exists(path):
+        return path
+
+    sf_format, subtype = AUDIO_FORMATS[fmt]
+    if sf_format not in sf.available_formats():
+        raise FixtureUnavailableError(f"libsndfile cannot write {fmt}")
+    try:
+        sf.write(
+            path, make_signal(signal, sr, channels, seconds), sr, format=sf_format, subtype=subtype
+        )
+    except (sf.LibsndfileError, RuntimeError) as e:
+        if os.path.exists(path):
+            os.remove(path)
+        raise FixtureUnavailableError(f"libsndfile cannot write {fmt}: {e}") from e
+    return path
+
+
+def image_name(width, height, mode):
+    return f"{width}x{height}-{mode}.png"
+
+
+def make_polygons(width, height, objects, seed=0):
+    """
+    ランダムな位置・大きさの星形のポリゴンを作る（result.masks.xy と同じ形式）
+    """
+    rng = np.random.default_rng(seed)
+    polygons = []
+    for _ in range(objects):
+        radius = rng.uniform(0.03, 0.15) * min(width, height)
+        cx = rng.uniform(radius, width - radius)
+        cy = rng.uniform(radius, height - radius)
+        angles = np.linspace(0, 2 * np.pi, 200, endpoint=False)
+        r = radius * (1 + 0.3 * np.sin(5 * angles + rng.uniform(0, np.pi)))
+        polygons.append(
+            np.stack([cx + r * np.cos(angles), cy + r * np.sin(angles)], axis=1).astype(
+                np.float32
+            )
+        )
+    return polygons
+
+
+def make_image(directory, width, height, mode, objects=8):
+    """
+    ノイズの背景に物体（make_polygons のポリゴン）を描いた PNG 画像を作る
+
+    :param mode: "rgb" または "rgba"（RGBA の場合は物体の外側を半透明にする）
+    :return: 作成したファイルのパス
+    """
+    path = os.path.join(directory, image_name(width, height, mode))
+    if os.path.exists(path):
+        return path
+
+    rng = np.random.default_rng(0)
+    image = rng.integers(0, 256, size=(height, width, 3), dtype=np.uint8)
+    polygons = [p.astype(np.int32) for p in make_polygons(width, height, objects)]
+    for polygon in polygons:
+        color = tuple(int(c) for c in rng.integers(32, 256, size=3))
+        cv2.fillPoly(image, [polygon], color)
+
+    if mode == "rgba":
+        alpha = np.full((height, width), 128, dtype=np.uint8)
+        cv2.fillPoly(alpha, polygons, 255)
+        image = np.dstack([image, alpha])
+    elif mode != "rgb":
+        raise ValueError(f"Unknown image mode: {mode}")
+
+    cv2.imwrite(path, image)
+    return path
@@ -0,0 +1,180 @@
+"""
+大きな画像を小さな輪郭で切り抜くときの、ピークメモリと処理時間を比較する
+
+    python -m bench.image_clip --megapixels 50 --formats png,jpg,bmp --radius 0.05
+
+画像全体を配列にしてからマスクしていた以前の処理と、輪郭を囲む矩形だけを読み込む処理
+（元画像と同じ大きさで返す場合・矩形に切り抜く場合・矩形を透明な PNG で返す場合）を比較する。
+ピークメモリは処理ごとに別のプロセスで1回だけ実行して測り、処理を始める前のメモリ使用量を差し引く。
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+import numpy as np
+
+from bench.common import (
+    BACKEND_DIR,
+    Timer,
+    current_rss_mb,
+    peak_rss_since_reset_mb,
+    print_table,
+    reset_peak_rss,
+    setup_django,
+)
+
+# (名前, crop, transparent)
+VARIANTS = [
+    ("legacy", None, None),
+    ("roi", False, False),
+    ("crop", True, False),
+    ("crop+transparent", True, True),
+]
+
+
+def legacy_clip_image_array(image_path, contours):
+    # 比較用: 画像全体を配列にし、画像全体の大きさのマスクで切り抜いていた以前の処理
+    import cv2
+    from PIL import Image
+
+    image_np = np.array(Image.open(image_path))
+    if image_np.shape[2] == 4:
+        image_bgr = cv2.cvtColor(image_np[:, :, :3], cv2.COLOR_RGB2BGR)
+        alpha_channel = image_np[:, :, 3]
+    else:
+        image_bgr = cv2.cvtColor(image_np, cv2.COLOR_RGB2BGR)
+
+    height, width = image_bgr.shape[:2]
+    mask = np.zeros((height, width), dtype=np.uint8)
+    polygons = [np.array(contour, np.int32).reshape(-1, 1, 2) for contour in contours]
+    cv2.fillPoly(mask, polygons, 255)
+    cutout_bgr = cv2.bitwise_and(image_bgr, image_bgr, mask=mask)
+    if image_np.shape[2] == 4:
+        cutout_alpha = cv2.bitwise_and(alpha_channel, alpha_channel, mask=mask)
+        return cv2.merge((cutout_bgr, cutout_alpha))
+    return cutout_bgr
+
+
+def make_fixture(directory, width, height, fmt):
+    """
+    グラデーションにノイズを加えた画像を作る（PNG が現実的な大きさになるよう、ノイズは弱くする）
+    """
+    import cv2
+
+    path = os.path.join(directory, f"{width}x{height}.{fmt}")
+    if os.path.exists(path):
+        return path
+    rng = np.random.default_rng(0)
+    x = np.linspace(0, 255, width, dtype=np.float32)
+    y = np.linspace(0, 255, height, dtype=np.float32)[:, None]
+    image = np.empty((height, width, 3), dtype=np.uint8)
+    for channel, (a, b) in enumerate(((1.0, 0.0), (0.0, 1.0), (0.5, 0.5))):
+        noise = rng.integers(0, 8, size=(height, width), dtype=np.uint8)
+        image[:, :, channel] = (a * x + b * y).astype(np.uint8) + noise
+    cv2.imwrite(path, image)
+    return path
+
+
+def make_contour(width, height, radius):
+    # 画像の中央に、短辺の radius 倍の半径の星形を置く
+    angles = np.linspace(0, 2 * np.pi, 200, endpoint=False)
+    r = radius * min(width, height) * (1 + 0.3 * np.sin(5 * angles))
+    points = np.stack([width / 2 + r * np.cos(angles), height / 2 + r * np.sin(angles)], axis=1)
+    return points.astype(int).tolist()
+
+
+def run_variant(path, contour, variant):
+    """
+    1つの処理を実行し、処理時間とピークメモリを返す（別のプロセスで呼ばれる）
+    """
+    setup_django()
+    from utils.image_util import clip_image_array, encode_image
+
+    name, crop, transparent = next(v for v in VARIANTS if v[0] == variant)
+    reset_peak_rss()
+    baseline = current_rss_mb()
+    extension = ".png" if transparent else os.path.splitext(path)[1]
+    with Timer() as clip_timer:
+        if name == "legacy":
+            cutout = legacy_clip_image_array(path, [contour])
+        else:
+            cutout = clip_image_array(path, [contour], crop=crop, transparent=transparent)
+    with Timer() as encode_timer:
+        data = encode_image(cutout, extension)
+    return {
+        "clip_s": clip_timer.elapsed,
+        "encode_s": encode_timer.elapsed,
+        "peak_mb": peak_rss_since_reset_mb() - baseline,
+        "shape": list(cutout.shape),
+        "bytes": len(data),
+    }
+
+
+def measure(path, contour, variant):
+    output = subprocess.run(
+        [
+            sys.executable,
+            "-m",
+            "bench.image_clip",
+            "--worker",
+            json.dumps({"path": path, "contour": contour, "variant": variant}),
+        ],
+        cwd=BACKEND_DIR,
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--megapixels", type=float, default=50)
+    parser.add_argument("--formats", default="png,jpg,bmp")
+    parser.add_argument("--radius", type=float, default=0.05, help="polygon radius / short side")
+    parser.add_argument("--fixtures", help="directory to keep generated images in")
+    parser.add_argument("--worker", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        options = json.loads(args.worker)
+        print(json.dumps(run_variant(options["path"], options["contour"], options["variant"])))
+        return
+
+    # 3:2 の画像にする
+    width = int(round((args.megapixels * 1e6 * 1.5) ** 0.5))
+    height = int(round(width / 1.5))
+    contour = make_contour(width, height, args.radius)
+
+    rows = []
+    with tempfile.TemporaryDirectory() as temporary:
+        directory = args.fixtures or temporary
+        os.makedirs(directory, exist_ok=True)
+        for fmt in args.formats.split(","):
+            path = make_fixture(directory, width, height, fmt)
+            for name, *_ in VARIANTS:
+                result = measure(path, contour, name)
+                rows.append(
+                    [
+                        fmt,
+                        name,
+                        f"{result['clip_s']:.2f}",
+                        f"{result['encode_s']:.2f}",
+                        f"{result['peak_mb']:.0f}",
+                        f"{result['shape'][1]}x{result['shape'][0]}",
+                        f"{result['bytes'] / 1e6:.1f}",
+                    ]
+                )
+
+    print(f"image={width}x{height} ({width * height / 1e6:.1f} MP) radius={args.radius:g}")
+    print_table(
+        ["format", "variant", "clip_s", "encode_s", "peak_mb", "output", "output_mb"], rows
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""
+大きな画像から複数の物体を切り抜くときの、物体ごとに切り抜く処理とまとめて切り抜く処理を比較する
+
+    python -m bench.image_objects --megapixels 50 --objects 5 --formats png,jpg
+
+物体ごとに clip-image を呼んでいた場合（物体の数だけ画像を読み込む）と、
+画像を1回だけ読み込んで物体ごとの透明な PNG を zip・スプライトシートにまとめる処理を比較する。
+"""
+
+import argparse
+import os
+import tempfile
+
+import numpy as np
+
+from bench.common import Timer, print_table, setup_django
+from bench.image_clip import make_fixture
+
+
+def make_contours(width, height, count, radius=0.08):
+    # 画像の中に count 個の星形を横に並べる
+    contours = []
+    angles = np.linspace(0, 2 * np.pi, 200, endpoint=False)
+    for i in range(count):
+        cx, cy = width * (i + 0.5) / count, height * (0.3 + 0.4 * (i % 2))
+        r = radius * min(width, height) * (1 + 0.3 * np.sin(5 * angles))
+        points = np.stack([cx + r * np.cos(angles), cy + r * np.sin(angles)], axis=1)
+        contours.append(points.astype(int).tolist())
+    return contours
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--megapixels", type=float, default=50)
+    parser.add_argument("--objects", type=int, default=5)
+    parser.add_argument("--formats", default="png,jpg")
+    parser.add_argument("--repeat", type=int, default=2)
+    parser.add_argument("--fixtures", help="directory to keep generated images in")
+    args = parser.parse_args()
+
+    setup_django()
+    from utils.image_util import clip_image_array, clip_objects_to_bytes, encode_image
+
+    width = int(round((args.megapixels * 1e6 * 1.5) ** 0.5))
+    height = int(round(width / 1.5))
+    contours = make_contours(width, height, args.objects)
+    cpus = os.cpu_count()
+
+    def separately(path):
+        # 比較用: 物体ごとに切り抜きを呼ぶ（crop + 透明な PNG）
+        for contour in contours:
+            encode_image(clip_image_array(path, [contour], crop=True, transparent=True), ".png")
+
+    variants = [
+        ("per-object", separately),
+        ("zip/1 thread", lambda path: clip_objects_to_bytes(path, contours, "zip", workers=1)),
+        (f"zip/{cpus} workers", lambda path: clip_objects_to_bytes(path, contours, "zip")),
+        ("sprite", lambda path: clip_objects_to_bytes(path, contours, "sprite")),
+    ]
+
+    rows = []
+    with tempfile.TemporaryDirectory() as temporary:
+        directory = args.fixtures or temporary
+        os.makedirs(directory, exist_ok=True)
+        for fmt in args.formats.split(","):
+            path = make_fixture(directory, width, height, fmt)
+            for name, run in variants:
+                timings = []
+                for _ in range(args.repeat):
+                    with Timer() as timer:
+                        run(path)
+                    timings.append(timer.elapsed)
+                rows.append([fmt, name, f"{min(timings):.2f}"])
+
+    print(f"image={width}x{height} ({width * height / 1e6:.1f} MP) objects={args.objects}")
+    print_table(["format", "variant", "best_s"], rows)
+
+
+if __name__ == "__main__":
+    main()
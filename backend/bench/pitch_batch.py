@@ -0,0 +1,103 @@
+"""
+複数のピッチシフトを一度に作成する処理と、1つずつ順番に作成する処理を比較する
+
+    python -m bench.pitch_batch --minutes 1,5 --pitches=-2,-1,1,2 --format wav
+
+順番に作成する場合はシフトごとにデコード・STFT・エンコードを行う（serve_wav_file を
+N 回呼ぶのと同じ）。一度に作成する場合はデコードと STFT を共有し、シフトを並列に処理する。
+"""
+
+import argparse
+import os
+import statistics
+import tempfile
+
+from bench.common import Timer, print_table, setup_django
+from bench.pitch_pipeline import make_fixture
+
+
+def sequential(input_file, output_format, pitches, workers):
+    from utils.audio_probe import probe_audio
+    from utils.audio_util import pitch_shift_to_bytes
+
+    for pitch in pitches:
+        # 1回ごとに別リクエストとして probe からやり直す
+        pitch_shift_to_bytes(input_file, output_format, pitch, probe=probe_audio(input_file))
+
+
+def batch(input_file, output_format, pitches, workers):
+    from utils.audio_probe import probe_audio
+    from utils.audio_util import pitch_shift_batch_to_bytes
+
+    pitch_shift_batch_to_bytes(
+        input_file,
+        output_format,
+        pitches,
+        "bench",
+        probe=probe_audio(input_file),
+        workers=workers,
+    )
+
+
+IMPLEMENTATIONS = {
+    "sequential": sequential,
+    "batch": batch,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--minutes", default="1,5")
+    parser.add_argument("--pitches", default="-2,-1,1,2")
+    parser.add_argument("--format", default="wav")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    setup_django()
+    from utils.audio_io import audio_format
+
+    pitches = [int(p) for p in args.pitches.split(",")]
+    rows = []
+    with tempfile.TemporaryDirectory() as directory:
+        for minutes in [float(m) for m in args.minutes.split(",")]:
+            wav_path = os.path.join(directory, f"{minutes:g}min.wav")
+            make_fixture(wav_path, minutes)
+            input_file = wav_path
+            if args.format != "wav":
+                from utils.audio_io import decode_audio, encode_audio
+
+                input_file = os.path.join(directory, f"{minutes:g}min.{args.format}")
+                y, sr = decode_audio(wav_path)
+                with open(input_file, "wb") as f:
+                    f.write(encode_audio(y, sr, args.format))
+
+            timings = {}
+            for name, implementation in IMPLEMENTATIONS.items():
+                # 初回は librosa の遅延読み込みなどを含むので計測しない
+                implementation(input_file, audio_format(input_file), pitches[:1], args.workers)
+                elapsed = []
+                for _ in range(args.repeat):
+                    with Timer() as timer:
+                        implementation(
+                            input_file, audio_format(input_file), pitches, args.workers
+                        )
+                    elapsed.append(timer.elapsed)
+                timings[name] = statistics.median(elapsed)
+
+            for name, elapsed in timings.items():
+                rows.append(
+                    [
+                        f"{minutes:g}",
+                        len(pitches),
+                        name,
+                        f"{elapsed:.2f}",
+                        f"{timings['sequential'] / elapsed:.2f}x",
+                    ]
+                )
+
+    print_table(["minutes", "pitches", "impl", "wall_s", "speedup"], rows)
+
+
+if __name__ == "__main__":
+    main()
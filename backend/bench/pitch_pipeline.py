@@ -0,0 +1,129 @@
+"""
+ピッチシフトの一時ファイル経由の旧処理と、メモリ上の単一パス処理を比較する
+
+    python -m bench.pitch_pipeline --minutes 1,5,30 --format wav
+
+処理ごとに新しいプロセスを起動し、経過時間とピークメモリ（RSS）を計測する。
+旧処理（legacy）の計測には pydub が必要（アプリでは使わないので requirements.txt には含めていない）。
+"""
+
+import argparse
+import importlib.util
+import multiprocessing
+import os
+import tempfile
+
+import numpy as np
+
+from bench.common import Timer, peak_rss_mb, print_table, setup_django
+
+
+def legacy_apply_pitch_shift(input_file, output_file, n_steps, n_fft=2048, hop_length=512):
+    # 比較用: 一時 WAV を経由していた以前の apply_pitch_shift と is_audio_file の組み合わせ
+    import librosa
+    import soundfile as sf
+    from django.core.files.temp import NamedTemporaryFile
+    from pydub import AudioSegment
+
+    AudioSegment.from_file(input_file)
+
+    input_extension = os.path.splitext(input_file)[1].lower()
+    audio = AudioSegment.from_file(input_file)
+    temp_wav_file = NamedTemporaryFile(suffix=".wav").name
+    audio.export(temp_wav_file, format="wav")
+    y, sr = librosa.load(temp_wav_file, sr=None)
+    y_shifted = librosa.effects.pitch_shift(
+        y=y, sr=sr, n_steps=n_steps, n_fft=n_fft, hop_length=hop_length
+    )
+    shifted_wav_file = NamedTemporaryFile(suffix=".wav").name
+    sf.write(shifted_wav_file, y_shifted, sr)
+    shifted_audio = AudioSegment.from_file(shifted_wav_file, format="wav")
+    shifted_audio.export(output_file, format=input_extension[1:])
+
+
+def pipeline_apply_pitch_shift(input_file, output_file, n_steps):
+    from utils.audio_io import audio_format
+    from utils.audio_util import pitch_shift_to_bytes
+
+    data = pitch_shift_to_bytes(input_file, audio_format(input_file), n_steps)
+    with open(output_file, "wb") as f:
+        f.write(data)
+
+
+IMPLEMENTATIONS = {
+    "legacy": legacy_apply_pitch_shift,
+    "pipeline": pipeline_apply_pitch_shift,
+}
+
+
+def make_fixture(path, minutes, sr=44100, channels=2):
+    import soundfile as sf
+
+    # 長いファイルでもメモリを使いすぎないよう1秒ずつ書き込む
+    t = np.arange(sr) / sr
+    second = np.stack(
+        [0.3 * np.sin(2 * np.pi * (220 + 110 * c) * t) for c in range(channels)], axis=1
+    ).astype(np.float32)
+    with sf.SoundFile(path, "w", samplerate=sr, channels=channels) as f:
+        for _ in range(int(minutes * 60)):
+            f.write(second)
+
+
+def _worker(name, input_file, output_file, n_steps, results):
+    setup_django()
+    with Timer() as timer:
+        IMPLEMENTATIONS[name](input_file, output_file, n_steps)
+    results.put((timer.elapsed, peak_rss_mb()))
+
+
+def measure(name, input_file, n_steps):
+    context = multiprocessing.get_context("spawn")
+    results = context.Queue()
+    output_file = input_file + f".{name}" + os.path.splitext(input_file)[1]
+    process = context.Process(
+        target=_worker, args=(name, input_file, output_file, n_steps, results)
+    )
+    process.start()
+    elapsed, peak = results.get()
+    process.join()
+    os.remove(output_file)
+    return elapsed, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--minutes", default="1,5,30")
+    parser.add_argument("--format", default="wav")
+    parser.add_argument("--n-steps", type=int, default=2)
+    args = parser.parse_args()
+
+    names = list(IMPLEMENTATIONS)
+    if importlib.util.find_spec("pydub") is None:
+        print("pydub is not installed; skipping legacy")
+        names.remove("legacy")
+
+    rows = []
+    with tempfile.TemporaryDirectory() as directory:
+        for minutes in [float(m) for m in args.minutes.split(",")]:
+            wav_path = os.path.join(directory, f"{minutes:g}min.wav")
+            make_fixture(wav_path, minutes)
+            input_file = wav_path
+            if args.format != "wav":
+                import soundfile as sf
+                from utils.audio_io import encode_audio
+
+                setup_django()
+                input_file = os.path.join(directory, f"{minutes:g}min.{args.format}")
+                y, sr = sf.read(wav_path, dtype="float32")
+                with open(input_file, "wb") as f:
+                    f.write(encode_audio(y, sr, args.format))
+
+            for name in names:
+                elapsed, peak = measure(name, input_file, args.n_steps)
+                rows.append([f"{minutes:g}", name, f"{elapsed:.2f}", f"{peak:.0f}"])
+
+    print_table(["minutes", "impl", "wall_s", "peak_rss_mb"], rows)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""
+ピッチシフトの品質プロファイルと方式ごとに、処理時間と音質の差を比較する
+
+    python -m bench.pitch_quality --seconds 30 --sr 44100 --channels 2 --pitch 3
+
+各設定でデコード・ピッチシフト・エンコードを行い（pitch_shift_to_bytes）、
+quality=full の phase-vocoder を基準に経過時間の比と、基準との差を求める。
+音質の差は、出力をモノラル・AUDIO_PREVIEW_SAMPLE_RATE にそろえてから、
+対数振幅スペクトログラムの平均二乗誤差（dB）で表す（小さいほど基準に近い）。
+"""
+
+import argparse
+import io
+import os
+import statistics
+import tempfile
+
+import numpy as np
+
+from bench.common import Timer, print_table, setup_django
+from bench.fixtures import make_audio
+
+# (名前, engine, mono, サンプリングレートを下げるか)
+SETUPS = [
+    ("full/phase-vocoder", "phase-vocoder", False, False),
+    ("full/wsola", "wsola", False, False),
+    ("mono/phase-vocoder", "phase-vocoder", True, False),
+    ("fast/phase-vocoder", "phase-vocoder", True, True),
+    ("fast/wsola", "wsola", True, True),
+]
+
+
+def spectrum_db(data, sample_rate):
+    import librosa
+    import soundfile as sf
+
+    from utils.audio_util import resample_audio
+
+    y, sr = sf.read(io.BytesIO(data), dtype="float32", always_2d=True)
+    y, sr = resample_audio(y.mean(axis=1), sr, sample_rate)
+    return librosa.amplitude_to_db(np.abs(librosa.stft(y, n_fft=2048)), ref=1.0, top_db=80)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--signal", default="sine")
+    parser.add_argument("--seconds", type=float, default=30)
+    parser.add_argument("--sr", type=int, default=44100)
+    parser.add_argument("--channels", type=int, default=2)
+    parser.add_argument("--pitch", type=int, default=3)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    setup_django()
+    from django.conf import settings
+
+    from utils.audio_util import pitch_shift_to_bytes
+
+    rows = []
+    with tempfile.TemporaryDirectory() as directory:
+        path = make_audio(directory, args.signal, args.sr, args.channels, args.seconds, "wav")
+        timings, outputs = {}, {}
+        for name, engine, mono, reduce_rate in SETUPS:
+            options = {
+                "engine": engine,
+                "mono": mono,
+                "sample_rate": settings.AUDIO_PREVIEW_SAMPLE_RATE if reduce_rate else None,
+            }
+            # 初回は librosa の遅延読み込みなどを含むので計測しない
+            outputs[name] = pitch_shift_to_bytes(path, "wav", args.pitch, **options)
+            elapsed = []
+            for _ in range(args.repeat):
+                with Timer() as timer:
+                    pitch_shift_to_bytes(path, "wav", args.pitch, **options)
+                elapsed.append(timer.elapsed)
+            timings[name] = statistics.median(elapsed)
+
+        baseline_name = SETUPS[0][0]
+        baseline = spectrum_db(outputs[baseline_name], settings.AUDIO_PREVIEW_SAMPLE_RATE)
+        for name, *_ in SETUPS:
+            spectrum = spectrum_db(outputs[name], settings.AUDIO_PREVIEW_SAMPLE_RATE)
+            frames = min(spectrum.shape[1], baseline.shape[1])
+            error = np.sqrt(np.mean((spectrum[:, :frames] - baseline[:, :frames]) ** 2))
+            rows.append(
+                [
+                    name,
+                    f"{timings[name]:.2f}",
+                    f"{args.seconds / timings[name]:.0f}",
+                    f"{timings[baseline_name] / timings[name]:.2f}x",
+                    f"{error:.1f}",
+                ]
+            )
+
+    print(
+        f"signal={args.signal} sr={args.sr} channels={args.channels} "
+        f"seconds={args.seconds:g} pitch={args.pitch} cpus={os.cpu_count()}"
+    )
+    print_table(["setup", "wall_s", "audio_s/s", "speedup", "spec_rmse_db"], rows)
+
+
+if __name__ == "__main__":
+    main()
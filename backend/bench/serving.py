@@ -0,0 +1,220 @@
+"""
+サーバーの起動方法ごとに、API のスループット（requests/sec）とレイテンシを比較する
+
+    python -m bench.serving --setups runserver,gunicorn-default,gunicorn,gunicorn-asgi \\
+        --endpoint clip-audio --concurrency 8 --duration 20 --repeat 3
+
+setup は次のとおり。
+
+- runserver: 以前の Dockerfile と同じ manage.py runserver
+- gunicorn-default: 以前の Procfile と同じ設定なしの gunicorn（sync ワーカー 1つ）
+- gunicorn: gunicorn.conf.py の設定（preload・gthread・スレッド数の制限）
+- gunicorn-asgi: gunicorn.conf.py の設定で、uvicorn のワーカーと config.asgi を使う
+
+サーバーはそれぞれ別プロセスで起動し、結果のキャッシュは無効にする。
+"""
+
+import argparse
+import http.client
+import os
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+
+from bench.common import BACKEND_DIR, percentile, print_table
+from bench.fixtures import make_audio
+
+SETUPS = {
+    "runserver": (
+        [sys.executable, "manage.py", "runserver", "--noreload", "127.0.0.1:{port}"],
+        {},
+    ),
+    "gunicorn-default": (
+        ["gunicorn", "--config", os.devnull, "--bind", "127.0.0.1:{port}", "config.wsgi"],
+        {},
+    ),
+    "gunicorn": (["gunicorn", "--bind", "127.0.0.1:{port}", "config.wsgi"], {}),
+    "gunicorn-asgi": (
+        ["gunicorn", "--bind", "127.0.0.1:{port}", "config.asgi"],
+        {"GUNICORN_WORKER_CLASS": "uvicorn_worker.UvicornWorker"},
+    ),
+}
+
+# (URL, フォームの値)
+ENDPOINTS = {
+    "clip-audio": ("/api/clip-audio/", {"start": "1", "end": "6"}),
+    "serve-wav": ("/api/serve-wav/", {"pitch": "2"}),
+}
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def multipart(fields, file_name, data):
+    boundary = uuid.uuid4().hex
+    parts = []
+    for name, value in fields.items():
+        parts.append(
+            f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode()
+        )
+    parts.append(
+        (
+            f'--{boundary}\r\nContent-Disposition: form-data; name="file"; filename="{file_name}"\r\n'
+            "Content-Type: application/octet-stream\r\n\r\n"
+        ).encode()
+        + data
+        + b"\r\n"
+    )
+    parts.append(f"--{boundary}--\r\n".encode())
+    return b"".join(parts), f"multipart/form-data; boundary={boundary}"
+
+
+def wait_until_ready(port, process, timeout=120):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError("server exited during startup")
+        try:
+            connection = http.client.HTTPConnection("127.0.0.1", port, timeout=5)
+            connection.request("GET", "/metrics")
+            connection.getresponse().read()
+            return
+        except OSError:
+            time.sleep(0.5)
+    raise RuntimeError("server did not start in time")
+
+
+def load(port, url, body, content_type, concurrency, duration, warmup):
+    """
+    concurrency 個のクライアントから duration 秒間リクエストを送り続ける
+    """
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+    started = time.monotonic()
+    measure_from = started + warmup
+    stop_at = measure_from + duration
+
+    def client():
+        connection = None
+        while time.monotonic() < stop_at:
+            if connection is None:
+                connection = http.client.HTTPConnection("127.0.0.1", port, timeout=300)
+            request_started = time.monotonic()
+            try:
+                connection.request("POST", url, body, {"Content-Type": content_type})
+                response = connection.getresponse()
+                response.read()
+                ok = response.status == 200
+                if response.getheader("Connection", "").lower() == "close":
+                    connection.close()
+                    connection = None
+            except (OSError, http.client.HTTPException) as e:
+                ok = False
+                connection = None
+                response = e
+            finished = time.monotonic()
+            if request_started < measure_from:
+                continue
+            with lock:
+                if ok:
+                    latencies.append(finished - request_started)
+                else:
+                    errors.append(getattr(response, "status", str(response)))
+
+    threads = [threading.Thread(target=client) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, errors, duration
+
+
+def run_setup(name, endpoint, fixture, concurrency, duration, warmup):
+    command, extra_env = SETUPS[name]
+    port = free_port()
+    env = {
+        **os.environ,
+        "SECRET_KEY": os.environ.get("SECRET_KEY", "bench"),
+        "RESULT_CACHE_BACKEND": "none",
+        "DJANGO_SETTINGS_MODULE": "config.settings",
+        **extra_env,
+    }
+    process = subprocess.Popen(
+        [part.format(port=port) for part in command],
+        cwd=BACKEND_DIR,
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+        start_new_session=True,
+    )
+    try:
+        wait_until_ready(port, process)
+        url, fields = ENDPOINTS[endpoint]
+        with open(fixture, "rb") as f:
+            body, content_type = multipart(fields, os.path.basename(fixture), f.read())
+        return load(port, url, body, content_type, concurrency, duration, warmup)
+    finally:
+        os.killpg(process.pid, signal.SIGTERM)
+        try:
+            process.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            os.killpg(process.pid, signal.SIGKILL)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--setups", default=",".join(SETUPS))
+    parser.add_argument("--endpoint", choices=sorted(ENDPOINTS), default="clip-audio")
+    parser.add_argument("--seconds", type=float, default=30, help="length of the audio fixture")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--duration", type=float, default=20)
+    parser.add_argument("--warmup", type=float, default=5)
+    parser.add_argument("--repeat", type=int, default=1, help="runs per setup (interleaved)")
+    args = parser.parse_args()
+
+    names = args.setups.split(",")
+    results = {name: ([], [], 0.0) for name in names}
+    with tempfile.TemporaryDirectory() as directory:
+        fixture = make_audio(directory, "sine", 44100, 2, args.seconds, "wav")
+        # 1つの CPU では結果のばらつきが大きいので、setup を交互に繰り返して合計する
+        for _ in range(args.repeat):
+            for name in names:
+                latencies, errors, duration = run_setup(
+                    name, args.endpoint, fixture, args.concurrency, args.duration, args.warmup
+                )
+                total_latencies, total_errors, total_duration = results[name]
+                results[name] = (
+                    total_latencies + latencies,
+                    total_errors + errors,
+                    total_duration + duration,
+                )
+
+    rows = []
+    for name, (latencies, errors, duration) in results.items():
+        rows.append(
+            [
+                name,
+                len(latencies),
+                len(errors),
+                f"{len(latencies) / duration:.2f}",
+                f"{percentile(latencies, 50) * 1000:.0f}",
+                f"{percentile(latencies, 90) * 1000:.0f}",
+                f"{percentile(latencies, 99) * 1000:.0f}",
+            ]
+        )
+
+    print(f"endpoint={args.endpoint} concurrency={args.concurrency} cpus={os.cpu_count()}")
+    print_table(["setup", "ok", "errors", "req/s", "p50_ms", "p90_ms", "p99_ms"], rows)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,38 @@
+"""
+YOLO の重みを使わずに輪郭抽出を計測するためのスタブのモデル
+
+画像の大きさから bench.fixtures.make_polygons と同じポリゴンを返すので、
+make_image で作った画像の物体の位置と一致する。推論そのものの時間は含まれない。
+"""
+
+from types import SimpleNamespace
+
+from bench.fixtures import make_polygons
+from utils.model_registry import MODEL_WEIGHTS
+
+
+class StubSegmentationModel:
+    def __init__(self, objects=8):
+        self.objects = objects
+
+    def __call__(self, images, verbose=False):
+        if not isinstance(images, list):
+            images = [images]
+        return [self._result(image) for image in images]
+
+    def _result(self, image):
+        height, width = image.shape[:2]
+        polygons = make_polygons(width, height, self.objects)
+        return SimpleNamespace(masks=SimpleNamespace(xy=polygons))
+
+
+def install_stub_model(objects=8):
+    """
+    すべてのモデルサイズにスタブのモデルを登録する（setup_django の後に呼ぶ）
+    """
+    from utils.model_registry import registry
+
+    model = StubSegmentationModel(objects)
+    for size in MODEL_WEIGHTS:
+        registry.install(model, size=size)
+    return model
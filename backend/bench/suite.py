@@ -0,0 +1,534 @@
+"""
+audio_util・image_util の処理と API をまとめて計測し、結果を JSON に保存する
+
+    python -m bench.suite run --profile quick --output bench-results/base.json
+    python -m bench.suite run --profile quick --output bench-results/new.json --filter "audio.*"
+    python -m bench.suite compare bench-results/base.json bench-results/new.json --threshold 0.1
+
+計測に使う音声・画像はすべて合成して作り（bench.fixtures）、YOLO の重みの代わりにスタブの
+モデル（bench.stub_model）を使うので、ネットワークに接続せずに実行できる。
+
+処理ごとに経過時間（wall）・CPU 時間・スループットの中央値を repeat 回の計測から求め、
+ピークメモリは tracemalloc を有効にした別の1回で計測する（NumPy の配列も含まれる）。
+API の音声処理はジョブのワーカープロセスで実行されるため、CPU 時間とピークメモリには
+Web プロセスの分しか含まれない。
+
+compare は2つの結果を処理名で対応させ、中央値が threshold を超えて悪化した処理を
+REGRESSION として表示し、1つでもあれば終了コード 1 で終了する。
+"""
+
+import argparse
+import fnmatch
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from typing import Callable
+
+from bench.common import BACKEND_DIR, peak_rss_mb, percentile, print_table, setup_django
+from bench.fixtures import FixtureUnavailableError, make_audio, make_image, make_polygons
+
+# (信号, サンプリングレート, チャンネル数, 秒数, 形式)
+QUICK_AUDIO = [
+    ("sine", 44100, 2, 10, "wav"),
+    ("sine", 44100, 2, 10, "flac"),
+    ("sine", 44100, 2, 10, "ogg"),
+    ("sine", 44100, 2, 10, "mp3"),
+    ("noise", 22050, 1, 10, "wav"),
+    ("noise", 48000, 1, 10, "flac"),
+]
+FULL_AUDIO = [
+    (signal, sr, channels, 30, fmt)
+    for signal in ("sine", "noise")
+    for sr in (22050, 44100, 48000)
+    for channels in (1, 2)
+    for fmt in ("wav", "flac", "ogg", "mp3")
+] + [("sine", 44100, 2, 180, fmt) for fmt in ("wav", "flac", "ogg", "mp3")]
+
+# (幅, 高さ, モード)
+QUICK_IMAGES = [
+    (1280, 720, "rgb"),
+    (1280, 720, "rgba"),
+    (4000, 3000, "rgb"),
+]
+FULL_IMAGES = [
+    (width, height, mode)
+    for width, height in ((640, 480), (1920, 1080), (4000, 3000), (8000, 6000))
+    for mode in ("rgb", "rgba")
+]
+
+PROFILES = {
+    "quick": {"audio": QUICK_AUDIO, "images": QUICK_IMAGES},
+    "full": {"audio": FULL_AUDIO, "images": FULL_IMAGES},
+}
+
+# 切り取りとピッチシフトのパラメータ
+CLIP_RANGE = (1.0, 6.0)
+PITCH_STEPS = 2
+STUB_OBJECTS = 8
+
+
+@dataclass
+class Case:
+    """
+    計測する処理
+
+    :param name: 処理名（compare で結果を対応させるキー）
+    :param run: 計測する関数（引数なし）
+    :param work: 1回の処理量（スループットの分子）
+    :param unit: 処理量の単位（例: "audio_s", "mpx", "files", "requests"）
+    """
+
+    name: str
+    run: Callable
+    work: float
+    unit: str
+    params: dict = field(default_factory=dict)
+
+
+def configure_environment(work_dir):
+    """
+    計測が再現できるよう、キャッシュを無効にした設定で Django を読み込む
+    """
+    os.environ.setdefault("SECRET_KEY", "bench")
+    os.environ.setdefault("RESULT_CACHE_BACKEND", "none")
+    os.environ.setdefault("JOB_DIR", os.path.join(work_dir, "jobs"))
+    os.environ.setdefault("YOLO_PRELOAD", "false")
+    setup_django()
+
+    from django.test.utils import setup_test_environment
+
+    # テストクライアントのホスト名（testserver）を許可する
+    setup_test_environment()
+
+
+def audio_cases(path, spec, output_dir):
+    from django.conf import settings
+    from utils.audio_peaks import compute_peaks
+    from utils.audio_stream import AudioBlockReader
+    from utils.audio_util import (
+        apply_pitch_shift,
+        check_audio_file,
+        clip_audio_file,
+        is_audio_file,
+    )
+
+    signal, sr, channels, seconds, fmt = spec
+    label = os.path.basename(path)
+    params = {"signal": signal, "sr": sr, "channels": channels, "seconds": seconds, "format": fmt}
+    output = os.path.join(output_dir, f"out.{fmt}")
+    start, end = CLIP_RANGE
+
+    def probe():
+        if not is_audio_file(path):
+            raise RuntimeError(f"{label} was not recognized as audio")
+
+    return [
+        Case(f"audio.is_audio_file[{label}]", probe, 1, "files", params),
+        Case(
+            f"audio.clip_audio_file[{label}]",
+            lambda: clip_audio_file(path, output, start, end),
+            end - start,
+            "audio_s",
+            params,
+        ),
+        Case(
+            f"audio.apply_pitch_shift[{label}]",
+            lambda: apply_pitch_shift(path, output, PITCH_STEPS),
+            seconds,
+            "audio_s",
+            params,
+        ),
+        # quality=full（全チャンネルを元のサンプリングレートで処理）と quality=fast（プレビュー）
+        Case(
+            f"audio.pitch_shift_full[{label}]",
+            lambda: apply_pitch_shift(
+                path, output, PITCH_STEPS, engine=settings.AUDIO_FULL_ENGINE, mono=False
+            ),
+            seconds,
+            "audio_s",
+            params,
+        ),
+        Case(
+            f"audio.pitch_shift_preview[{label}]",
+            lambda: apply_pitch_shift(
+                path,
+                output,
+                PITCH_STEPS,
+                engine=settings.AUDIO_PREVIEW_ENGINE,
+                sample_rate=settings.AUDIO_PREVIEW_SAMPLE_RATE,
+            ),
+            seconds,
+            "audio_s",
+            params,
+        ),
+        Case(
+            f"audio.compute_peaks[{label}]",
+            lambda: compute_peaks(
+                AudioBlockReader(
+                    path, settings.AUDIO_STREAM_BLOCK_SIZE, check_audio_file(path), mono=False
+                ),
+                settings.AUDIO_PEAKS_SAMPLES_PER_PEAK,
+            ),
+            seconds,
+            "audio_s",
+            params,
+        ),
+    ]
+
+
+def largest_contour(width, height):
+    import cv2
+
+    polygons = make_polygons(width, height, STUB_OBJECTS)
+    return max(polygons, key=cv2.contourArea).astype(int).tolist()
+
+
+def image_cases(path, spec, output_dir):
+    import cv2
+    from utils.image_util import get_contours, image_clip, unsharp_masking
+
+    width, height, mode = spec
+    label = os.path.basename(path)
+    params = {"width": width, "height": height, "mode": mode}
+    megapixels = width * height / 1e6
+    image = cv2.imread(path)
+    contour = largest_contour(width, height)
+    output = os.path.join(output_dir, "out.png")
+
+    return [
+        Case(
+            f"image.unsharp_masking[{label}]",
+            lambda: unsharp_masking(image, 3, 3, 2, 2, 3),
+            megapixels,
+            "mpx",
+            params,
+        ),
+        Case(
+            f"image.get_contours[{label}]",
+            lambda: get_contours(path),
+            megapixels,
+            "mpx",
+            params,
+        ),
+        Case(
+            f"image.image_clip[{label}]",
+            lambda: image_clip(path, output, contour),
+            megapixels,
+            "mpx",
+            params,
+        ),
+        # 輪郭を囲む矩形だけを透明な PNG で返す
+        Case(
+            f"image.image_clip_crop[{label}]",
+            lambda: image_clip(path, output, contour, crop=True, transparent=True),
+            megapixels,
+            "mpx",
+            params,
+        ),
+    ]
+
+
+def post(client, url, path, **data):
+    """
+    ファイルを送信し、レスポンスの本文をすべて読み込む（200 以外は例外にする）
+    """
+    from django.core.files.uploadedfile import SimpleUploadedFile
+
+    with open(path, "rb") as f:
+        upload = SimpleUploadedFile(os.path.basename(path), f.read())
+    response = client.post(url, {"file": upload, **data})
+    body = (
+        b"".join(response.streaming_content) if response.streaming else response.content
+    )
+    if response.status_code != 200:
+        raise RuntimeError(f"{url} returned {response.status_code}: {body[:200]!r}")
+    return body
+
+
+def http_cases(audio_path, audio_spec, image_path, image_spec):
+    from django.test import Client
+
+    client = Client()
+    cases = []
+    if audio_path is not None:
+        label = os.path.basename(audio_path)
+        start, end = CLIP_RANGE
+        cases += [
+            Case(
+                f"http.serve_wav[{label}]",
+                lambda: post(client, "/api/serve-wav/", audio_path, pitch=PITCH_STEPS),
+                1,
+                "requests",
+                {"seconds": audio_spec[3], "format": audio_spec[4]},
+            ),
+            Case(
+                f"http.serve_wav_preview[{label}]",
+                lambda: post(
+                    client, "/api/serve-wav/", audio_path, pitch=PITCH_STEPS, quality="fast"
+                ),
+                1,
+                "requests",
+                {"seconds": audio_spec[3], "format": audio_spec[4]},
+            ),
+            Case(
+                f"http.clip_audio[{label}]",
+                lambda: post(client, "/api/clip-audio/", audio_path, start=start, end=end),
+                1,
+                "requests",
+                {"seconds": audio_spec[3], "format": audio_spec[4]},
+            ),
+        ]
+    if image_path is not None:
+        label = os.path.basename(image_path)
+        contour = json.dumps(largest_contour(*image_spec[:2]))
+        params = {"width": image_spec[0], "height": image_spec[1], "mode": image_spec[2]}
+        cases += [
+            Case(
+                f"http.get_image_contours[{label}]",
+                lambda: post(client, "/api/get-image-contours/", image_path),
+                1,
+                "requests",
+                params,
+            ),
+            Case(
+                f"http.clip_image[{label}]",
+                lambda: post(client, "/api/clip-image/", image_path, contours=contour),
+                1,
+                "requests",
+                params,
+            ),
+        ]
+    return cases
+
+
+def build_cases(profile, fixture_dir, output_dir):
+    """
+    合成データを作り、計測する処理の一覧と作成できなかったデータの一覧を返す
+    """
+    cases = []
+    skipped = []
+    first_audio = first_image = None
+
+    for spec in PROFILES[profile]["audio"]:
+        try:
+            path = make_audio(fixture_dir, *spec)
+        except FixtureUnavailableError as e:
+            skipped.append({"fixture": "-".join(map(str, spec)), "reason": str(e)})
+            continue
+        if first_audio is None:
+            first_audio = (path, spec)
+        cases += audio_cases(path, spec, output_dir)
+
+    for spec in PROFILES[profile]["images"]:
+        path = make_image(fixture_dir, *spec, objects=STUB_OBJECTS)
+        if first_image is None:
+            first_image = (path, spec)
+        cases += image_cases(path, spec, output_dir)
+
+    # API はリクエストごとのオーバーヘッドを見るため、最初のデータでだけ計測する
+    audio_path, audio_spec = first_audio or (None, None)
+    image_path, image_spec = first_image or (None, None)
+    cases += http_cases(audio_path, audio_spec, image_path, image_spec)
+    return cases, skipped
+
+
+def measure(case, repeat, warmup):
+    for _ in range(warmup):
+        case.run()
+
+    wall = []
+    cpu = []
+    for _ in range(repeat):
+        wall_started = time.perf_counter()
+        cpu_started = time.process_time()
+        case.run()
+        wall.append(time.perf_counter() - wall_started)
+        cpu.append(time.process_time() - cpu_started)
+
+    tracemalloc.start()
+    try:
+        case.run()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    median = statistics.median(wall)
+    return {
+        "wall_s": median,
+        "wall_min_s": min(wall),
+        "wall_p90_s": percentile(wall, 90),
+        "cpu_s": statistics.median(cpu),
+        "peak_alloc_mb": peak / (1024 * 1024),
+        "throughput": case.work / median if median > 0 else None,
+        "throughput_unit": f"{case.unit}/s",
+        "samples_s": wall,
+    }
+
+
+def environment_info(args):
+    import cv2
+    import django
+    import librosa
+    import numpy
+    import soundfile
+
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            cwd=BACKEND_DIR,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+
+    return {
+        "created": datetime.now(timezone.utc).isoformat(),
+        "commit": commit,
+        "profile": args.profile,
+        "repeat": args.repeat,
+        "warmup": args.warmup,
+        "filter": args.filter,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "versions": {
+            "numpy": numpy.__version__,
+            "librosa": librosa.__version__,
+            "soundfile": soundfile.__version__,
+            "libsndfile": soundfile.__libsndfile_version__,
+            "opencv": cv2.__version__,
+            "django": django.__version__,
+        },
+    }
+
+
+def run(args):
+    with tempfile.TemporaryDirectory() as work_dir:
+        configure_environment(work_dir)
+        from bench.stub_model import install_stub_model
+
+        install_stub_model(STUB_OBJECTS)
+
+        fixture_dir = args.fixtures or os.path.join(work_dir, "fixtures")
+        output_dir = os.path.join(work_dir, "output")
+        os.makedirs(fixture_dir, exist_ok=True)
+        os.makedirs(output_dir, exist_ok=True)
+
+        cases, skipped = build_cases(args.profile, fixture_dir, output_dir)
+        if args.filter:
+            cases = [case for case in cases if fnmatch.fnmatch(case.name, args.filter)]
+
+        results = []
+        rows = []
+        for case in cases:
+            result = {"name": case.name, "params": case.params}
+            try:
+                result.update(measure(case, args.repeat, args.warmup))
+                rows.append(
+                    [
+                        case.name,
+                        f"{result['wall_s'] * 1000:.1f}",
+                        f"{result['cpu_s'] * 1000:.1f}",
+                        f"{result['peak_alloc_mb']:.1f}",
+                        f"{result['throughput']:.2f} {result['throughput_unit']}",
+                    ]
+                )
+            except Exception as e:
+                result["error"] = f"{type(e).__name__}: {e}"
+                rows.append([case.name, "error", "-", "-", result["error"][:60]])
+            results.append(result)
+
+    report = {
+        "environment": environment_info(args),
+        "skipped_fixtures": skipped,
+        "results": results,
+        "peak_rss_mb": peak_rss_mb(),
+    }
+    print_table(["case", "wall_ms", "cpu_ms", "peak_alloc_mb", "throughput"], rows)
+    for item in skipped:
+        print(f"skipped {item['fixture']}: {item['reason']}")
+
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"saved {args.output}")
+    return 0
+
+
+def compare(args):
+    with open(args.base) as f:
+        base = {r["name"]: r for r in json.load(f)["results"]}
+    with open(args.new) as f:
+        new = {r["name"]: r for r in json.load(f)["results"]}
+
+    rows = []
+    regressions = 0
+    for name in sorted(base.keys() | new.keys()):
+        before = base.get(name, {}).get(args.metric)
+        after = new.get(name, {}).get(args.metric)
+        if before is None or after is None:
+            status = "missing" if name not in base or name not in new else "error"
+            rows.append([name, fmt_metric(before), fmt_metric(after), "-", status])
+            continue
+
+        change = after / before - 1 if before > 0 else 0.0
+        # ごく短い処理は誤差で大きく変動するので、絶対値の差も見る
+        significant = abs(after - before) >= args.min_delta
+        if change > args.threshold and significant:
+            status = "REGRESSION"
+            regressions += 1
+        elif change < -args.threshold and significant:
+            status = "improved"
+        else:
+            status = ""
+        rows.append([name, fmt_metric(before), fmt_metric(after), f"{change:+.1%}", status])
+
+    print_table(["case", f"base {args.metric}", f"new {args.metric}", "change", ""], rows)
+    print(f"{regressions} regression(s) over {args.threshold:.0%}")
+    return 1 if regressions else 0
+
+
+def fmt_metric(value):
+    return "-" if value is None else f"{value:.4g}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = subparsers.add_parser("run", help="run the benchmarks")
+    run_parser.add_argument("--profile", choices=sorted(PROFILES), default="quick")
+    run_parser.add_argument("--repeat", type=int, default=3)
+    run_parser.add_argument("--warmup", type=int, default=1)
+    run_parser.add_argument("--filter", help='glob pattern on case names, e.g. "image.*"')
+    run_parser.add_argument("--fixtures", help="directory to keep generated fixtures in")
+    run_parser.add_argument("--output", help="path of the JSON report")
+    run_parser.set_defaults(func=run)
+
+    compare_parser = subparsers.add_parser("compare", help="compare two JSON reports")
+    compare_parser.add_argument("base")
+    compare_parser.add_argument("new")
+    compare_parser.add_argument("--metric", default="wall_s", choices=["wall_s", "cpu_s", "peak_alloc_mb"])
+    compare_parser.add_argument("--threshold", type=float, default=0.1)
+    compare_parser.add_argument(
+        "--min-delta", type=float, default=0.002, help="ignore absolute changes below this"
+    )
+    compare_parser.set_defaults(func=compare)
+
+    args = parser.parse_args()
+    sys.exit(args.func(args))
+
+
+if __name__ == "__main__":
+    main()
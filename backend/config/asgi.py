@@ -12,5 +12,11 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "config.settings")
+# ツールの API を、処理をスレッドプールとジョブのワーカーに任せる非同期のビューにする
+os.environ.setdefault("ASYNC_VIEWS", "true")
 
 application = get_asgi_application()
+
+from utils.runtime import preload_app  # noqa: E402
+
+preload_app()
@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/4.2/ref/settings/
 """
 
 import os
+import tempfile
 import environ
 from pathlib import Path
 
@@ -153,3 +154,187 @@ STATICFILES_DIRS = [
 
 DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 DATA_UPLOAD_MAX_MEMORY_SIZE = 1048576
+# アップロードできるファイルサイズの上限（バイト、受信しながら確認する）
+UPLOAD_MAX_SIZE = env.int("UPLOAD_MAX_SIZE", default=200 * 1024 * 1024)
+# これより大きいアップロードは一時ファイルに保存する（ジョブの入力にはハードリンクで渡す）
+FILE_UPLOAD_MAX_MEMORY_SIZE = env.int("FILE_UPLOAD_MAX_MEMORY_SIZE", default=2621440)
+# ハードリンクできるよう、JOB_DIR と同じファイルシステム上のディレクトリを指定する
+FILE_UPLOAD_TEMP_DIR = env("FILE_UPLOAD_TEMP_DIR", default=None)
+FILE_UPLOAD_HANDLERS = [
+    "utils.uploads.MaxSizeUploadHandler",
+    "django.core.files.uploadhandler.MemoryFileUploadHandler",
+    "django.core.files.uploadhandler.TemporaryFileUploadHandler",
+]
+# 取り込んだアップロードの保存先（アップロードトークンで再アップロードせずに参照する）
+# ハードリンクできるよう、JOB_DIR と同じファイルシステム上のディレクトリを指定する
+UPLOAD_STORE_DIR = env(
+    "UPLOAD_STORE_DIR", default=os.path.join(tempfile.gettempdir(), "audio_tools_uploads")
+)
+# アップロードトークンの有効期限（秒、最後に使われてから）
+UPLOAD_TOKEN_TTL = env.int("UPLOAD_TOKEN_TTL", default=60 * 60)
+
+# YOLO セグメンテーションモデルの設定
+# モデルサイズ（n/s/m）
+YOLO_MODEL_SIZE = env("YOLO_MODEL_SIZE", default="m")
+# ワーカー起動時にモデルを読み込んでウォームアップするか
+YOLO_PRELOAD = env.bool("YOLO_PRELOAD", default=False)
+# 同時リクエストをまとめて推論する待ち合わせ時間（ミリ秒）。0 の場合はまとめない
+YOLO_BATCH_WINDOW_MS = env.int("YOLO_BATCH_WINDOW_MS", default=0)
+# 1回のバッチ推論でまとめる最大画像数
+YOLO_BATCH_MAX_SIZE = env.int("YOLO_BATCH_MAX_SIZE", default=8)
+# マスクから輪郭を求める方法: exact（画素から輪郭を求める）/ polygon（モデルのポリゴンを使う）
+CONTOUR_METHOD = env("CONTOUR_METHOD", default="exact")
+# 輪郭を単純化する許容誤差（ピクセル）。0 の場合は単純化しない
+CONTOUR_EPSILON = env.float("CONTOUR_EPSILON", default=0.0)
+# 輪郭抽出で画像を読み込むときの長辺の目安（ピクセル）。これより大きい画像は 1/2・1/4・1/8 に
+# 縮小してデコードし、輪郭を元の大きさに戻す。0 の場合は元の大きさで読み込む
+CONTOUR_INFERENCE_SIZE = env.int("CONTOUR_INFERENCE_SIZE", default=640)
+
+# ログの出力（リクエストごとの段階別の処理時間などを出力する）
+LOG_LEVEL = env("LOG_LEVEL", default="INFO")
+LOGGING = {
+    "version": 1,
+    "disable_existing_loggers": False,
+    "formatters": {
+        "simple": {"format": "%(asctime)s %(levelname)s %(name)s %(message)s"},
+    },
+    "handlers": {
+        "console": {"class": "logging.StreamHandler", "formatter": "simple"},
+    },
+    "loggers": {
+        "app": {"handlers": ["console"], "level": LOG_LEVEL},
+        "utils": {"handlers": ["console"], "level": LOG_LEVEL},
+    },
+}
+
+# ピッチシフトを逐次返却する場合に一度にデコードするサンプル数
+AUDIO_STREAM_BLOCK_SIZE = env.int("AUDIO_STREAM_BLOCK_SIZE", default=65536)
+# 受け付ける音声ファイルの再生時間の上限（秒）。0 の場合は制限しない
+AUDIO_MAX_DURATION = env.int("AUDIO_MAX_DURATION", default=0)
+# 複数のピッチシフトを一度に作成する場合のシフト数の上限
+AUDIO_BATCH_MAX_STEPS = env.int("AUDIO_BATCH_MAX_STEPS", default=12)
+# 複数のピッチシフトを並列に処理するスレッド数。0 の場合は WORKER_CPU_THREADS（未設定の場合は CPU 数）
+AUDIO_BATCH_WORKERS = env.int("AUDIO_BATCH_WORKERS", default=0)
+# 波形の概形（peaks）の最も細かい解像度で、1つの peak にまとめるサンプル数
+AUDIO_PEAKS_SAMPLES_PER_PEAK = env.int("AUDIO_PEAKS_SAMPLES_PER_PEAK", default=256)
+# ピッチシフトの品質（リクエストの quality で選ぶ）
+#   fast: プレビュー用。サンプリングレートを下げてモノラルにし、AUDIO_PREVIEW_ENGINE で処理する
+#   full: 元のサンプリングレートと全チャンネルのまま、AUDIO_FULL_ENGINE でチャンネルごとに並列に処理する
+AUDIO_DEFAULT_QUALITY = env("AUDIO_DEFAULT_QUALITY", default="full")
+AUDIO_PREVIEW_SAMPLE_RATE = env.int("AUDIO_PREVIEW_SAMPLE_RATE", default=22050)
+# ピッチシフトの方式: phase-vocoder（高品質）/ wsola（時間領域で数倍速い）
+AUDIO_PREVIEW_ENGINE = env("AUDIO_PREVIEW_ENGINE", default="wsola")
+AUDIO_FULL_ENGINE = env("AUDIO_FULL_ENGINE", default="phase-vocoder")
+# 出力形式ごとのエンコーダーの設定（"形式=値" をカンマ区切りで指定する。例: "mp3=128,m4a=160"）
+# ビットレート（kbps）。mp3 は libsndfile、それ以外の形式は ffmpeg の -b:a に渡す
+# （既定値は以前の ffmpeg の既定値と同じ。指定のない形式はエンコーダーの既定値になる）
+AUDIO_ENCODER_BITRATES = env.dict(
+    "AUDIO_ENCODER_BITRATES",
+    cast={"value": int},
+    default={"mp3": 128, "m4a": 128, "mp4": 128, "aac": 128},
+)
+# 圧縮レベル（0〜1）。flac は大きいほど小さく遅くなり（0 が最も速い）、
+# ogg（Vorbis）は大きいほど低音質で小さくなる（既定値は libsndfile の既定値と同じ）
+AUDIO_ENCODER_COMPRESSION = env.dict(
+    "AUDIO_ENCODER_COMPRESSION", cast={"value": float}, default={"flac": 0.625, "ogg": 0.6}
+)
+# libsndfile で書き出せない形式（m4a など）のために起動しておく ffmpeg のプロセス数
+# （形式・サンプリングレート・チャンネル数の組み合わせごと）。0 の場合はエンコードのたびに起動する
+AUDIO_FFMPEG_POOL_SIZE = env.int("AUDIO_FFMPEG_POOL_SIZE", default=2)
+
+# 処理結果のキャッシュ（アップロード内容のハッシュと処理のパラメータをキーにする）
+# バックエンド: disk（ローカルディスク）/ django（Django のキャッシュ）/ none（無効）
+RESULT_CACHE_BACKEND = env("RESULT_CACHE_BACKEND", default="disk")
+RESULT_CACHE_DIR = env(
+    "RESULT_CACHE_DIR", default=os.path.join(tempfile.gettempdir(), "audio_tools_cache")
+)
+# disk バックエンドの合計サイズの上限（バイト）
+RESULT_CACHE_MAX_SIZE = env.int("RESULT_CACHE_MAX_SIZE", default=512 * 1024 * 1024)
+# 有効期限（秒）。0 の場合は期限なし
+RESULT_CACHE_TTL = env.int("RESULT_CACHE_TTL", default=24 * 60 * 60)
+# django バックエンドで使うキャッシュのエイリアス
+RESULT_CACHE_ALIAS = env("RESULT_CACHE_ALIAS", default="default")
+
+# ダウンロードする処理結果の保存先（内容の SHA-256 を ID にして /api/results/<ID>/ から返す）
+RESULT_STORE_DIR = env(
+    "RESULT_STORE_DIR", default=os.path.join(tempfile.gettempdir(), "audio_tools_results")
+)
+# 合計サイズの上限（バイト）。超えた場合は最後に参照された時刻が古いものから削除する
+RESULT_STORE_MAX_SIZE = env.int("RESULT_STORE_MAX_SIZE", default=2 * 1024 * 1024 * 1024)
+# 保存期間（秒）。0 の場合は期限なし
+RESULT_STORE_TTL = env.int("RESULT_STORE_TTL", default=24 * 60 * 60)
+# 結果のレスポンスの Cache-Control（内容が変わらない ID なので immutable。CDN に置く場合は public にする）
+RESULT_STORE_CACHE_CONTROL = env(
+    "RESULT_STORE_CACHE_CONTROL", default="private, max-age=86400, immutable"
+)
+# ファイルの送信をフロントのプロキシに任せる方式
+#   "": Django（gunicorn）から送る / x-accel-redirect: nginx / x-sendfile: Apache（mod_xsendfile）など
+RESULT_STORE_SENDFILE = env("RESULT_STORE_SENDFILE", default="")
+# X-Accel-Redirect で渡す URL の接頭辞（nginx で RESULT_STORE_DIR を alias した internal の location）
+RESULT_STORE_ACCEL_PREFIX = env("RESULT_STORE_ACCEL_PREFIX", default="/protected/results/")
+
+# 重い処理を実行するジョブの設定
+JOB_DIR = env("JOB_DIR", default=os.path.join(tempfile.gettempdir(), "audio_tools_jobs"))
+# 音声処理を実行するワーカープロセス数（Web のワーカーごと）
+# 0 の場合は CPU コア数 ÷ WEB_CONCURRENCY（マシン全体でコア数を超えないようにする）
+JOB_PROCESS_WORKERS = env.int("JOB_PROCESS_WORKERS", default=0) or max(
+    1, (os.cpu_count() or 1) // max(1, env.int("WEB_CONCURRENCY", default=1))
+)
+# プロセス内で実行する処理（共有している YOLO モデルを使う）のスレッド数
+JOB_THREAD_WORKERS = env.int("JOB_THREAD_WORKERS", default=2)
+JOB_THREAD_OPERATIONS = ["image-contours"]
+# 実行待ち・実行中のジョブ数の上限（超えた場合は 429 を返す）
+JOB_MAX_PENDING = env.int("JOB_MAX_PENDING", default=16)
+# 完了したジョブを保存しておく時間（秒）
+JOB_RETENTION = env.int("JOB_RETENTION", default=60 * 60)
+# 同期 API でジョブの完了を待つ時間（秒）。超えた場合はジョブをキャンセルして 504 を返す
+JOB_SYNC_TIMEOUT = env.int("JOB_SYNC_TIMEOUT", default=300)
+
+# 処理のコスト（ジョブのワーカーでの処理時間の見積もり、秒）による受け付けの制御（utils/admission.py）
+# 実行中・実行待ちにできるコストの合計（サーバー全体）。0 の場合は制御しない
+# Web のワーカー間では状態を共有しないので、各ワーカーは WEB_CONCURRENCY で割った分を使う
+ADMISSION_BUDGET = env.float("ADMISSION_BUDGET", default=120.0)
+# 1つのクライアントが使える予算の割合（超えた場合は待たせずに 429 を返す）
+ADMISSION_CLIENT_SHARE = env.float("ADMISSION_CLIENT_SHARE", default=0.5)
+# この秒数以下と見積もった処理は待たせずに通す
+ADMISSION_CHEAP_COST = env.float("ADMISSION_CHEAP_COST", default=0.5)
+# 予算が空くまで待つ時間の上限（秒）。超えた場合は 429 を返す
+# 待っている間はリクエストのスレッド（gunicorn の threads）を使うので短くしておく
+ADMISSION_MAX_WAIT = env.float("ADMISSION_MAX_WAIT", default=2.0)
+# 予算が空くまで待たせるリクエスト数の上限（Web のワーカーごと）。超えた分はすぐに 429 を返す
+ADMISSION_MAX_WAITING = env.int("ADMISSION_MAX_WAITING", default=1)
+# クライアントを区別する request.META のキー（プロキシの後ろでは "HTTP_X_FORWARDED_FOR" など）
+ADMISSION_CLIENT_HEADER = env("ADMISSION_CLIENT_HEADER", default="REMOTE_ADDR")
+# コスト = 処理ごとの固定のコスト + 処理量1あたりのコスト × 処理量（"処理名=秒" のカンマ区切り）
+# 処理量は音声では処理するサンプル数（再生時間 × チャンネル数 × サンプリングレート）、
+# 画像ではメガピクセル。既定値は 1 CPU で python -m bench.admission calibrate を実行して求めた
+# （image-contours の固定のコストは計測に含まれない YOLO の推論の分）
+ADMISSION_BASE_COSTS = env.dict(
+    "ADMISSION_BASE_COSTS", cast={"value": float}, default={"image-contours": 0.3}
+)
+ADMISSION_UNIT_COSTS = env.dict(
+    "ADMISSION_UNIT_COSTS",
+    cast={"value": float},
+    default={
+        "pitch-shift": 3.4e-7,
+        "pitch-shift-batch": 1.5e-7,
+        "clip-audio": 1.7e-8,
+        "audio-peaks": 7e-8,
+        "image-contours": 0.053,
+        "clip-image": 0.02,
+    },
+)
+# 処理量1あたりのコストを実際の処理時間で補正するときの重み（指数移動平均）。0 の場合は補正しない
+ADMISSION_CALIBRATION_WEIGHT = env.float("ADMISSION_CALIBRATION_WEIGHT", default=0.1)
+
+# 本番のサーバー（gunicorn、config/gunicorn.conf.py）の設定
+# Web のワーカー数（gunicorn.conf.py が起動時に設定する）
+WEB_CONCURRENCY = env.int("WEB_CONCURRENCY", default=1)
+# 起動時に読み込んでおくモジュール（fork したワーカー間でメモリを共有する）
+PRELOAD_MODULES = env.list("PRELOAD_MODULES", default=[])
+# 1プロセスあたりの BLAS / OpenMP / PyTorch / OpenCV のスレッド数。0 の場合は制限しない
+WORKER_CPU_THREADS = env.int("WORKER_CPU_THREADS", default=0)
+# 非同期のビューを使うか（config/asgi.py から起動した場合は有効になる）
+ASYNC_VIEWS = env.bool("ASYNC_VIEWS", default=False)
+# 非同期のビューから同期の処理を実行するスレッド数
+ASYNC_EXECUTOR_THREADS = env.int("ASYNC_EXECUTOR_THREADS", default=32)
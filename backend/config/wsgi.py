@@ -7,3 +7,12 @@ os.environ.setdefault("DJANGO_SETTINGS_MODULE", "config.settings")
 
 application = get_wsgi_application()
 application = WhiteNoise(application)
+
+# gunicorn ではアップロードされたファイルの読み込みを速くする
+from utils.runtime import fast_gunicorn_input, preload_app  # noqa: E402
+
+application = fast_gunicorn_input(application)
+
+# 重いモジュールとモデルを読み込んでおき、初回リクエストの待ち時間をなくす
+# （gunicorn の preload_app ではマスタープロセスで読み込み、ワーカー間で共有する）
+preload_app()
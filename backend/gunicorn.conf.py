@@ -0,0 +1,81 @@
+# 本番用の gunicorn の設定（backend ディレクトリで gunicorn を起動すると読み込まれる）
+#
+#   WSGI: gunicorn config.wsgi
+#   ASGI: GUNICORN_WORKER_CLASS=uvicorn_worker.UvicornWorker gunicorn config.asgi
+#
+# マスタープロセスで重いモジュール（librosa・PyTorch・ultralytics など）とモデルを読み込んでから
+# ワーカーを fork するので、読み込み時間とメモリ（重みなど）をワーカー間で共有できる。
+# ジョブのプロセス数は CPU コア数をワーカー数で割った数にして、マシン全体でコア数を超えないようにする。
+# BLAS / OpenMP / PyTorch / OpenCV のスレッド数は、CPU コア数をプロセスの合計数で割った数に制限する。
+import gc
+import glob
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from utils.runtime import limit_threads, threads_per_worker  # noqa: E402
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '8000')}"
+workers = int(os.environ.get("WEB_CONCURRENCY") or os.cpu_count() or 1)
+# 設定値 WEB_CONCURRENCY として、ワーカー数で分ける設定（ADMISSION_BUDGET など）に使う
+os.environ["WEB_CONCURRENCY"] = str(workers)
+worker_class = os.environ.get("GUNICORN_WORKER_CLASS", "gthread")
+# gthread ワーカーのスレッド数（処理の待ち時間の間に他のリクエストを受け付ける）
+threads = int(os.environ.get("GUNICORN_THREADS", "4"))
+# 同期 API はジョブの完了（JOB_SYNC_TIMEOUT）まで待つので、それより長くする
+timeout = int(os.environ.get("GUNICORN_TIMEOUT", "330"))
+graceful_timeout = 30
+keepalive = 5
+max_requests = int(os.environ.get("GUNICORN_MAX_REQUESTS", "0"))
+max_requests_jitter = max_requests // 10
+preload_app = True
+accesslog = "-"
+errorlog = "-"
+
+# 各ワーカーが起動するジョブのプロセス数（設定値 JOB_PROCESS_WORKERS）
+job_processes = int(os.environ.get("JOB_PROCESS_WORKERS") or threads_per_worker(workers))
+os.environ["JOB_PROCESS_WORKERS"] = str(job_processes)
+
+cpu_threads = int(
+    os.environ.get("WORKER_CPU_THREADS") or threads_per_worker(workers * job_processes)
+)
+# 設定値 WORKER_CPU_THREADS として、ワーカーが起動するジョブのプロセスにも引き継ぐ
+os.environ["WORKER_CPU_THREADS"] = str(cpu_threads)
+
+# 複数のワーカーのメトリクスを集計できるよう、値をファイルに書き出す（前回の起動時の値は消す）
+metrics_dir = os.environ.setdefault(
+    "PROMETHEUS_MULTIPROC_DIR", os.path.join(tempfile.gettempdir(), "audio_tools_metrics")
+)
+os.makedirs(metrics_dir, exist_ok=True)
+for path in glob.glob(os.path.join(metrics_dir, "*.db")):
+    os.remove(path)
+
+# ツールの処理に使うモジュールを fork 前に読み込む（既に設定されている場合はそれを使う）。
+# フロントエンドだけを返すワーカーでは PRELOAD_MODULES を空にすると、すぐに起動できる
+os.environ.setdefault(
+    "PRELOAD_MODULES", "app.tools.audio,app.tools.image,librosa.effects,ultralytics"
+)
+
+# マスタープロセスでは OpenMP のスレッドプールを作らない
+# （fork 前に複数スレッドで実行すると、fork したワーカーで OpenMP が止まることがある）
+limit_threads(1)
+
+
+def when_ready(server):
+    # 読み込み済みのオブジェクトを GC の対象から外し、ワーカーでページがコピーされないようにする
+    gc.collect()
+    gc.freeze()
+
+
+def post_fork(server, worker):
+    # ワーカーと、ワーカーが起動するジョブのプロセスのスレッド数を設定する
+    limit_threads(cpu_threads)
+
+
+def child_exit(server, worker):
+    # 終了したワーカーの値を Prometheus のメトリクスの集計から外す
+    from utils.metrics import mark_process_dead
+
+    mark_process_dead(worker.pid)
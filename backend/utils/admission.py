@@ -0,0 +1,259 @@
+import itertools
+import math
+import threading
+import time
+from dataclasses import dataclass
+from typing import Optional
+
+from django.conf import settings
+from utils import metrics
+
+# Retry-After の上限（秒）
+MAX_RETRY_AFTER = 300
+
+
+class AdmissionRejectedError(Exception):
+    """
+    混雑しているため受け付けなかったリクエスト（429 と Retry-After を返す）
+    """
+
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class CostModel:
+    """
+    処理のコスト（ジョブのワーカーでの処理時間の見積もり、秒）を base + unit × 処理量 で求めるクラス
+
+    処理量は音声では処理するサンプル数（再生時間 × チャンネル数 × サンプリングレート）、
+    画像ではメガピクセル。unit は実際の処理時間から指数移動平均で補正する（calibrate）。
+    """
+
+    def __init__(self, base_costs, unit_costs, weight=0.1):
+        """
+        :param base_costs: 処理名ごとの固定のコスト（秒）
+        :param unit_costs: 処理名ごとの処理量1あたりのコスト（秒）
+        :param weight: 補正で新しい計測値に掛ける重み（0 の場合は補正しない）
+        """
+        self.base_costs = dict(base_costs)
+        self.unit_costs = dict(unit_costs)
+        self.weight = weight
+        self._lock = threading.Lock()
+        for operation, unit in self.unit_costs.items():
+            metrics.set_cost_coefficient(operation, unit)
+
+    def estimate(self, operation, units):
+        """
+        :param units: 処理量（不明な場合は None。固定のコストだけになる）
+        """
+        cost = self.base_costs.get(operation, 0.0)
+        if units:
+            with self._lock:
+                cost += self.unit_costs.get(operation, 0.0) * units
+        return cost
+
+    def calibrate(self, operation, units, seconds):
+        """
+        実際の処理時間から処理量1あたりのコストを補正する
+        """
+        if not self.weight or not units or operation not in self.unit_costs:
+            return
+        observed = max(0.0, seconds - self.base_costs.get(operation, 0.0)) / units
+        with self._lock:
+            unit = (1 - self.weight) * self.unit_costs[operation] + self.weight * observed
+            self.unit_costs[operation] = unit
+        metrics.set_cost_coefficient(operation, unit)
+
+    def coefficients(self):
+        with self._lock:
+            return dict(self.unit_costs)
+
+
+@dataclass(eq=False)
+class Ticket:
+    """
+    受け付けたリクエスト（処理が終わったら AdmissionController.release に渡す）
+    """
+
+    operation: str
+    client: str
+    units: Optional[float]
+    cost: float
+    # 予算に数えるか（安い処理は数えずに通す）
+    counted: bool
+    sequence: int = 0
+    released: bool = False
+
+
+class AdmissionController:
+    """
+    処理のコストを見積もり、ジョブの投入前に受け付けるかを決めるクラス
+
+    - 見積もりが cheap_cost 以下の処理は待たせずに通す（予算にも数えない）
+    - 実行中・実行待ちの処理のコストの合計が budget を超える場合は、空くまで最大 max_wait 秒待たせ、
+      空かなければ 429 にする。待っている間は、実行中のコストが最も少ないクライアントを先に通す。
+      待たせるのは max_waiting 件まで（リクエストのスレッドを使い切らないよう、超えた分はすぐに 429）
+    - 1つのクライアントが予算の client_share を超えて使う場合は、待たせずに 429 にする
+      （実行中のものがないクライアントの最初の1件は、大きくても予算が空くのを待って通す）
+
+    状態はプロセスの中だけで持つ。get_admission_controller はサーバー全体の予算を
+    Web のワーカー数で分けるので、ワーカーをまたいでも合計と1つのクライアントの分は予算を超えない。
+    """
+
+    def __init__(
+        self,
+        model,
+        budget,
+        client_share=0.5,
+        cheap_cost=0.5,
+        max_wait=2.0,
+        max_waiting=1,
+        drain_rate=1,
+    ):
+        """
+        :param model: CostModel
+        :param budget: 実行中・実行待ちにできるコストの合計（秒）。0 の場合は制限しない
+        :param client_share: 1つのクライアントが使える予算の割合
+        :param cheap_cost: 待たせずに通すコストの上限（秒）
+        :param max_wait: 予算が空くまで待つ時間の上限（秒）
+        :param max_waiting: 予算が空くまで待たせるリクエスト数の上限（0 の場合は待たせない）
+        :param drain_rate: 1秒あたりに処理できるコスト（ワーカー数）。Retry-After の見積もりに使う
+        """
+        self.model = model
+        self.budget = budget
+        self.client_share = client_share
+        self.cheap_cost = cheap_cost
+        self.max_wait = max_wait
+        self.max_waiting = max_waiting
+        self.drain_rate = max(1, drain_rate)
+        self.in_flight = 0.0
+        self._clients = {}
+        self._waiting = []
+        self._sequence = itertools.count()
+        self._condition = threading.Condition()
+
+    def admit(self, operation, client, units):
+        """
+        処理を受け付ける（予算が空くまで待つことがある）
+
+        :param client: クライアントの識別子（IP アドレスなど）
+        :param units: 処理量（CostModel を参照）
+        :return: Ticket
+        :raises AdmissionRejectedError: 受け付けられない場合
+        """
+        cost = self.model.estimate(operation, units)
+        if not self.budget or cost <= self.cheap_cost:
+            metrics.observe_admission(operation, "bypassed")
+            return Ticket(operation, client, units, cost, counted=False)
+
+        ticket = Ticket(operation, client, units, cost, counted=True)
+        with self._condition:
+            used = self._clients.get(client, 0.0)
+            if used and used + cost > self.budget * self.client_share:
+                metrics.observe_admission(operation, "rejected")
+                raise AdmissionRejectedError(
+                    "Too many requests are being processed. Please try again later.",
+                    self._retry_after(used),
+                )
+
+            ticket.sequence = next(self._sequence)
+            self._waiting.append(ticket)
+            deadline = time.monotonic() + self.max_wait
+            deferred = False
+            try:
+                while not self._can_start(ticket):
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0 or (not deferred and len(self._waiting) > self.max_waiting):
+                        metrics.observe_admission(operation, "rejected")
+                        raise AdmissionRejectedError(
+                            "Server is busy. Please try again later.",
+                            self._retry_after(self.in_flight + cost - self.budget),
+                        )
+                    deferred = True
+                    self._condition.wait(remaining)
+            finally:
+                self._waiting.remove(ticket)
+                # 先頭が入れ替わるので、待っている他のリクエストにも確認させる
+                self._condition.notify_all()
+
+            self.in_flight += cost
+            self._clients[client] = self._clients.get(client, 0.0) + cost
+            metrics.set_admission_in_flight(self.in_flight)
+        metrics.observe_admission(operation, "deferred" if deferred else "admitted")
+        return ticket
+
+    def release(self, ticket, seconds=None):
+        """
+        処理の終了を記録する（2回目以降の呼び出しは何もしない）
+
+        :param seconds: ジョブのワーカーでの処理時間（None の場合はコストの補正をしない）
+        """
+        with self._condition:
+            if ticket.released:
+                return
+            ticket.released = True
+            if ticket.counted:
+                self.in_flight = max(0.0, self.in_flight - ticket.cost)
+                used = self._clients.get(ticket.client, 0.0) - ticket.cost
+                if used > 1e-9:
+                    self._clients[ticket.client] = used
+                else:
+                    self._clients.pop(ticket.client, None)
+                if not self._clients:
+                    self.in_flight = 0.0
+                metrics.set_admission_in_flight(self.in_flight)
+                self._condition.notify_all()
+        if seconds is not None:
+            self.model.calibrate(ticket.operation, ticket.units, seconds)
+
+    def _can_start(self, ticket):
+        # 実行中のコストが最も少ないクライアント（同じなら先に来たもの）から順に通す
+        head = min(
+            self._waiting, key=lambda t: (self._clients.get(t.client, 0.0), t.sequence)
+        )
+        if head is not ticket:
+            return False
+        # 予算より大きい処理も、他に実行中のものがなければ通す
+        return not self._clients or self.in_flight + ticket.cost <= self.budget
+
+    def _retry_after(self, excess):
+        return min(MAX_RETRY_AFTER, max(1, math.ceil(excess / self.drain_rate)))
+
+
+def client_id(request):
+    """
+    リクエストのクライアントの識別子（ADMISSION_CLIENT_HEADER の値。カンマ区切りの場合は先頭）
+    """
+    value = request.META.get(settings.ADMISSION_CLIENT_HEADER) or "-"
+    return value.split(",")[0].strip()
+
+
+_controller = None
+_controller_lock = threading.Lock()
+
+
+def get_admission_controller():
+    """
+    設定値 ADMISSION_* からプロセス共通のコントローラーを作成して返す
+
+    予算（ADMISSION_BUDGET）はサーバー全体の値なので、Web のワーカー数（WEB_CONCURRENCY）で分ける。
+    """
+    global _controller
+    with _controller_lock:
+        if _controller is None:
+            model = CostModel(
+                settings.ADMISSION_BASE_COSTS,
+                settings.ADMISSION_UNIT_COSTS,
+                weight=settings.ADMISSION_CALIBRATION_WEIGHT,
+            )
+            _controller = AdmissionController(
+                model,
+                settings.ADMISSION_BUDGET / max(1, settings.WEB_CONCURRENCY),
+                client_share=settings.ADMISSION_CLIENT_SHARE,
+                cheap_cost=settings.ADMISSION_CHEAP_COST,
+                max_wait=settings.ADMISSION_MAX_WAIT,
+                max_waiting=settings.ADMISSION_MAX_WAITING,
+                drain_rate=settings.JOB_PROCESS_WORKERS,
+            )
+        return _controller
@@ -0,0 +1,347 @@
+import io
+import os
+import subprocess
+
+import numpy as np
+import soundfile as sf
+from django.conf import settings
+
+from utils.audio_probe import AudioProbeError, probe_audio
+from utils.ffmpeg_pool import get_ffmpeg_pool
+
+# libsndfile で直接読み書きできる形式（拡張子 → soundfile のフォーマット名）
+SOUNDFILE_FORMATS = {
+    "wav": "WAV",
+    "flac": "FLAC",
+    "ogg": "OGG",
+    "aiff": "AIFF",
+    "aif": "AIFF",
+}
+
+# ffmpeg で扱う形式（拡張子 → ffmpeg のフォーマット名と追加オプション）
+FFMPEG_FORMATS = {
+    "mp3": ("mp3", []),
+    "m4a": ("ipod", ["-movflags", "frag_keyframe+empty_moov"]),
+    "mp4": ("mp4", ["-movflags", "frag_keyframe+empty_moov"]),
+    "aac": ("adts", []),
+    "webm": ("webm", []),
+    "opus": ("opus", []),
+    "ogg": ("ogg", []),
+    "flac": ("flac", []),
+}
+
+# libsndfile で MP3 を書き出せるサンプリングレートと、その MPEG のバージョンのビットレートの範囲（kbps）
+MP3_BITRATE_RANGES = {
+    **dict.fromkeys((32000, 44100, 48000), (32, 320)),
+    **dict.fromkeys((16000, 22050, 24000), (8, 160)),
+    **dict.fromkeys((8000, 11025, 12000), (8, 64)),
+}
+
+# 圧縮レベル（0〜1）を指定できる libsndfile の形式
+COMPRESSION_FORMATS = {"flac", "ogg"}
+
+# 再エンコードせずにストリームコピーで切り取れる形式
+STREAM_COPY_FORMATS = {"mp3", "m4a", "mp4", "aac", "ogg", "opus", "webm", "flac"}
+
+MIME_TYPES = {
+    "wav": "audio/wav",
+    "flac": "audio/flac",
+    "ogg": "audio/ogg",
+    "aiff": "audio/aiff",
+    "aif": "audio/aiff",
+    "mp3": "audio/mpeg",
+    "m4a": "audio/mp4",
+    "mp4": "audio/mp4",
+    "aac": "audio/aac",
+    "webm": "audio/webm",
+    "opus": "audio/opus",
+}
+
+
+class AudioDecodeError(Exception):
+    pass
+
+
+class AudioEncodeError(Exception):
+    pass
+
+
+def audio_format(file_name):
+    """
+    ファイル名の拡張子から形式名を取得する（例: "song.MP3" → "mp3"）
+    """
+    return os.path.splitext(file_name)[1].lower().lstrip(".")
+
+
+def audio_mime_type(fmt):
+    return MIME_TYPES.get(fmt, "application/octet-stream")
+
+
+def decode_audio(input_file, mono=True, probe=None):
+    """
+    オーディオファイルを一度だけデコードして NumPy 配列に読み込む
+
+    libsndfile が対応している形式は soundfile で直接読み込み、
+    それ以外は ffmpeg の標準出力からパイプで PCM を受け取る。
+
+    :param input_file: 入力ファイルのパス
+    :param mono: True の場合はモノラルにミックスダウンする
+    :param probe: probe_audio の結果（あれば ffmpeg でのデコードに再利用する）
+    :return: (波形 [float32, モノラルは (samples,), それ以外は (samples, channels)], サンプリングレート)
+    """
+    try:
+        y, sr = _decode_with_soundfile(input_file, mono)
+    except (sf.LibsndfileError, RuntimeError):
+        y, sr = _decode_with_ffmpeg(input_file, probe)
+        if mono:
+            y = _downmix(y)
+
+    if y.shape[0] == 0:
+        raise AudioDecodeError("Audio file has no samples.")
+    return np.ascontiguousarray(y), sr
+
+
+def _downmix(y):
+    # librosa.load と同じく全チャンネルの平均でモノラル化する
+    return y.mean(axis=1, dtype=np.float32) if y.shape[1] > 1 else y[:, 0]
+
+
+def _decode_with_soundfile(input_file, mono, blocksize=65536):
+    with sf.SoundFile(input_file) as f:
+        if not mono or f.channels == 1 or f.frames <= 0:
+            y = f.read(dtype="float32", always_2d=True)
+            return (_downmix(y) if mono else y), f.samplerate
+
+        # 多チャンネルを一度に読み込まず、ブロックごとにモノラル化して書き込む
+        y = np.empty(f.frames, dtype=np.float32)
+        position = 0
+        for block in f.blocks(blocksize=blocksize, dtype="float32", always_2d=True):
+            y[position : position + len(block)] = _downmix(block)
+            position += len(block)
+        return y[:position], f.samplerate
+
+
+def _decode_with_ffmpeg(input_file, probe=None, start_time=None, duration=None):
+    try:
+        probe = probe or probe_audio(input_file)
+    except AudioProbeError:
+        raise AudioDecodeError("Selected file is not a audio file.")
+
+    channels = probe.channels
+    # ヘッダから見積もったサンプル数で出力バッファを先に確保しておく
+    # （指定された長さがファイルより長くても、ファイルの残りの分より多くは確保しない。
+    # ヘッダの見積もりが短かった場合は読みながら拡張する）
+    estimated = probe.estimated_frames or probe.sample_rate * 60
+    if start_time:
+        estimated = max(0, estimated - int(start_time * probe.sample_rate))
+    if duration is not None:
+        estimated = min(estimated, int(duration * probe.sample_rate))
+    buffer = np.empty((estimated + probe.sample_rate) * channels * 4, dtype=np.uint8)
+    size = 0
+
+    # -i より前に -ss を指定し、開始位置までシークしてからデコードする
+    seek = []
+    if start_time is not None:
+        seek += ["-ss", str(start_time)]
+    if duration is not None:
+        seek += ["-t", str(duration)]
+    try:
+        process = subprocess.Popen(
+            ["ffmpeg", "-v", "error", *seek, "-i", input_file, "-vn", "-f", "f32le", "-"],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+        )
+    except OSError:
+        raise AudioDecodeError("Selected file is not a audio file.")
+
+    with process:
+        while True:
+            if size == len(buffer):
+                # 見積もりより長い場合は拡張する
+                buffer = np.concatenate([buffer, np.empty(len(buffer) // 2, np.uint8)])
+            read = process.stdout.readinto(memoryview(buffer[size:]))
+            if not read:
+                break
+            size += read
+    if process.returncode != 0:
+        raise AudioDecodeError("Selected file is not a audio file.")
+
+    frame_bytes = 4 * channels
+    y = buffer[: size - size % frame_bytes].view("<f4").reshape(-1, channels)
+    return y, probe.sample_rate
+
+
+def decode_audio_range(input_file, start_time, duration, mono=True, probe=None):
+    """
+    指定した範囲だけをデコードする
+
+    libsndfile の形式はフレーム位置へシークして必要な分だけ読み込み、
+    それ以外は ffmpeg の入力シーク（-ss / -t）で範囲外をデコードしない。
+
+    :param input_file: 入力ファイルのパス
+    :param start_time: 開始位置（秒）
+    :param duration: 長さ（秒）
+    :param mono: True の場合はモノラルにミックスダウンする
+    :param probe: probe_audio の結果
+    :return: (波形, サンプリングレート)
+    """
+    try:
+        with sf.SoundFile(input_file) as f:
+            sr = f.samplerate
+            start_frame = min(int(start_time * sr), f.frames)
+            end_frame = min(int((start_time + duration) * sr), f.frames)
+            f.seek(start_frame)
+            y = f.read(max(0, end_frame - start_frame), dtype="float32", always_2d=True)
+    except (sf.LibsndfileError, RuntimeError):
+        y, sr = _decode_with_ffmpeg(input_file, probe, start_time, duration)
+
+    if mono:
+        y = _downmix(y)
+    return np.ascontiguousarray(y), sr
+
+
+def copy_audio_range(input_file, fmt, start_time, duration):
+    """
+    再エンコードせずに指定範囲のストリームをコピーする（精度はコーデックのフレーム単位）
+
+    :param input_file: 入力ファイルのパス
+    :param fmt: 出力形式（拡張子）
+    :param start_time: 開始位置（秒）
+    :param duration: 長さ（秒）
+    :return: 切り取ったファイルのバイト列
+    """
+    ffmpeg_format, options = FFMPEG_FORMATS.get(fmt, (fmt, []))
+    command = [
+        "ffmpeg",
+        "-v",
+        "error",
+        "-ss",
+        str(start_time),
+        "-t",
+        str(duration),
+        "-i",
+        input_file,
+        "-vn",
+        "-c:a",
+        "copy",
+        *options,
+        "-f",
+        ffmpeg_format,
+        "-",
+    ]
+    try:
+        process = subprocess.run(command, capture_output=True, check=True)
+    except (OSError, subprocess.CalledProcessError) as e:
+        raise AudioEncodeError(f"Failed to copy audio stream as {fmt}: {e}")
+    return process.stdout
+
+
+def encoder_settings(fmt):
+    """
+    出力形式ごとのエンコーダーの設定（設定値 AUDIO_ENCODER_BITRATES・AUDIO_ENCODER_COMPRESSION）
+
+    :param fmt: 出力形式（拡張子）
+    :return: {"bitrate": kbps または None, "compression_level": 0〜1 または None}
+    """
+    return {
+        "bitrate": getattr(settings, "AUDIO_ENCODER_BITRATES", {}).get(fmt),
+        "compression_level": getattr(settings, "AUDIO_ENCODER_COMPRESSION", {}).get(fmt),
+    }
+
+
+def soundfile_options(fmt, sr, options=None):
+    """
+    libsndfile でプロセス内でエンコードする場合の soundfile の引数を返す
+
+    MP3 は libsndfile が LAME 付きでビルドされていて、MP3 のサンプリングレートの場合に限る。
+
+    :param fmt: 出力形式（拡張子）
+    :param sr: サンプリングレート
+    :param options: encoder_settings の結果（None の場合は設定値）
+    :return: soundfile.write / SoundFile に渡す引数。libsndfile で書き出せない場合は None
+    """
+    options = options or encoder_settings(fmt)
+    if fmt in SOUNDFILE_FORMATS:
+        kwargs = {"format": SOUNDFILE_FORMATS[fmt]}
+        if fmt in COMPRESSION_FORMATS and options["compression_level"] is not None:
+            kwargs["compression_level"] = options["compression_level"]
+        return kwargs
+
+    if fmt == "mp3" and sr in MP3_BITRATE_RANGES and "MP3" in sf.available_formats():
+        kwargs = {"format": "MP3", "subtype": "MPEG_LAYER_III"}
+        if options["bitrate"]:
+            # libsndfile は固定ビットレートの場合、圧縮レベルを範囲内のビットレートに線形に対応させる
+            low, high = MP3_BITRATE_RANGES[sr]
+            bitrate = min(max(options["bitrate"], low), high)
+            # 1.0 はエラーになるため、最低のビットレートより少しだけ小さくする
+            kwargs["compression_level"] = min((high - bitrate) / (high - low), 0.999)
+            kwargs["bitrate_mode"] = "CONSTANT"
+        return kwargs
+    return None
+
+
+def ffmpeg_encode_command(sr, channels, fmt, options=None):
+    """
+    標準入力の PCM（float32）を fmt にエンコードして標準出力に書く ffmpeg のコマンドライン
+    """
+    # 未知の形式は ffmpeg のフォーマット名としてそのまま渡す（pydub の export と同じ挙動）
+    ffmpeg_format, format_options = FFMPEG_FORMATS.get(fmt, (fmt, []))
+    options = options or encoder_settings(fmt)
+    bitrate = ["-b:a", f"{options['bitrate']}k"] if options["bitrate"] else []
+    return [
+        "ffmpeg",
+        "-v",
+        "error",
+        "-f",
+        "f32le",
+        "-ar",
+        str(sr),
+        "-ac",
+        str(channels),
+        "-i",
+        "-",
+        *bitrate,
+        *format_options,
+        "-f",
+        ffmpeg_format,
+        "-",
+    ]
+
+
+def encode_audio(y, sr, fmt, options=None):
+    """
+    波形を指定形式にエンコードしてバイト列で返す（一時ファイルは使わない）
+
+    libsndfile で書き出せる形式（WAV・FLAC・OGG・AIFF と、対応していれば MP3）はプロセス内で
+    エンコードし、それ以外（m4a など）は事前に起動しておいた ffmpeg（utils.ffmpeg_pool）に渡す。
+
+    :param y: 波形（(samples,) または (samples, channels)）
+    :param sr: サンプリングレート
+    :param fmt: 出力形式（拡張子）
+    :param options: encoder_settings の結果（None の場合は設定値）
+    :return: エンコード済みのバイト列
+    """
+    options = options or encoder_settings(fmt)
+    kwargs = soundfile_options(fmt, sr, options)
+    if kwargs is not None:
+        buffer = io.BytesIO()
+        sf.write(buffer, y, sr, **kwargs)
+        return buffer.getvalue()
+
+    return _encode_with_ffmpeg(y, sr, fmt, options)
+
+
+def _encode_with_ffmpeg(y, sr, fmt, options):
+    channels = 1 if y.ndim == 1 else y.shape[1]
+    pcm = np.ascontiguousarray(y, dtype="<f4").tobytes()
+    command = ffmpeg_encode_command(sr, channels, fmt, options)
+    try:
+        process = get_ffmpeg_pool().acquire(command)
+    except OSError as e:
+        raise AudioEncodeError(f"Failed to encode audio as {fmt}: {e}")
+    output, _ = process.communicate(pcm)
+    if process.returncode != 0:
+        raise AudioEncodeError(
+            f"Failed to encode audio as {fmt}: ffmpeg exited with status {process.returncode}"
+        )
+    return output
@@ -0,0 +1,167 @@
+import struct
+
+import numpy as np
+
+# 波形の概形（peaks）のバイナリ形式のシグネチャ
+MAGIC = b"PKS1"
+
+CONTENT_TYPE = "application/x-audio-peaks"
+
+# ヘッダ: シグネチャ, 解像度の数, サンプリングレート, 全サンプル数
+HEADER = struct.Struct("<4sHIQ")
+# 解像度ごと: 1つの peak あたりのサンプル数, peak の数
+LEVEL = struct.Struct("<II")
+
+
+class PeaksFormatError(Exception):
+    pass
+
+
+class PeaksBuilder:
+    """
+    デコードしたブロックを順に受け取り、一定のサンプル数ごとの最小値・最大値を求めるクラス
+
+    複数チャンネルの場合は全チャンネルの最小値・最大値を使う（平均すると逆相の成分が消えるため）。
+
+    :param samples_per_peak: 1つの peak にまとめるサンプル数
+    """
+
+    def __init__(self, samples_per_peak):
+        self.samples_per_peak = samples_per_peak
+        self.frames = 0
+        self._low = np.zeros(0, dtype=np.float32)
+        self._high = np.zeros(0, dtype=np.float32)
+        self._mins = []
+        self._maxs = []
+
+    def add(self, block):
+        """
+        :param block: 波形（(samples,) または (samples, channels)）
+        """
+        block = np.asarray(block, dtype=np.float32)
+        self.frames += len(block)
+        low = block.min(axis=1) if block.ndim == 2 else block
+        high = block.max(axis=1) if block.ndim == 2 else block
+
+        # 前のブロックの端数とつなげ、samples_per_peak ごとにまとめる
+        low = np.concatenate([self._low, low])
+        high = np.concatenate([self._high, high])
+        usable = len(low) // self.samples_per_peak * self.samples_per_peak
+        if usable:
+            self._mins.append(low[:usable].reshape(-1, self.samples_per_peak).min(axis=1))
+            self._maxs.append(high[:usable].reshape(-1, self.samples_per_peak).max(axis=1))
+        self._low, self._high = low[usable:], high[usable:]
+
+    def finish(self):
+        """
+        :return: (最小値の配列, 最大値の配列)（末尾の端数も1つの peak にする）
+        """
+        mins, maxs = list(self._mins), list(self._maxs)
+        if len(self._low):
+            mins.append(self._low.min(keepdims=True))
+            maxs.append(self._high.max(keepdims=True))
+        if not mins:
+            return np.zeros(0, dtype=np.float32), np.zeros(0, dtype=np.float32)
+        return np.concatenate(mins), np.concatenate(maxs)
+
+
+def build_levels(mins, maxs, samples_per_peak, factor=4, min_peaks=512, max_levels=8):
+    """
+    最も細かい peaks から、factor 倍ずつ粗くした複数の解像度を作る
+
+    :param mins: 最小値の配列
+    :param maxs: 最大値の配列
+    :param samples_per_peak: mins / maxs の 1つの peak あたりのサンプル数
+    :param factor: 解像度ごとにまとめる peak の数
+    :param min_peaks: peak の数がこれ以下になったら、それより粗い解像度は作らない
+    :param max_levels: 解像度の数の上限
+    :return: (1つの peak あたりのサンプル数, 最小値, 最大値) のリスト（細かい順）
+    """
+    levels = [(samples_per_peak, mins, maxs)]
+    while len(levels) < max_levels and len(mins) > min_peaks:
+        starts = np.arange(0, len(mins), factor)
+        mins = np.minimum.reduceat(mins, starts)
+        maxs = np.maximum.reduceat(maxs, starts)
+        samples_per_peak *= factor
+        levels.append((samples_per_peak, mins, maxs))
+    return levels
+
+
+def _to_int16(values):
+    return np.clip(np.round(values * 32767), -32768, 32767).astype("<i2")
+
+
+def encode_peaks(levels, sr, frames):
+    """
+    複数の解像度の peaks をバイナリ形式にする
+
+    形式（リトルエンディアン）: ヘッダ（シグネチャ "PKS1"、解像度の数 uint16、
+    サンプリングレート uint32、全サンプル数 uint64）の後に、解像度ごとに
+    （1つの peak あたりのサンプル数 uint32、peak の数 uint32）を並べ、
+    続けて解像度ごとに (最小値, 最大値) の int16 の組を peak の数だけ並べる（-1.0〜1.0 を ±32767 にする）。
+
+    :param levels: build_levels の結果
+    :param sr: サンプリングレート
+    :param frames: 全サンプル数
+    :return: バイト列
+    """
+    parts = [HEADER.pack(MAGIC, len(levels), sr, frames)]
+    parts += [LEVEL.pack(samples_per_peak, len(mins)) for samples_per_peak, mins, _ in levels]
+    for _, mins, maxs in levels:
+        pairs = np.empty((len(mins), 2), dtype="<i2")
+        pairs[:, 0] = _to_int16(mins)
+        pairs[:, 1] = _to_int16(maxs)
+        parts.append(pairs.tobytes())
+    return b"".join(parts)
+
+
+def decode_peaks(data):
+    """
+    encode_peaks の形式を読み込む
+
+    :return: (サンプリングレート, 全サンプル数, [(1つの peak あたりのサンプル数, (n, 2) の int16 配列), ...])
+    :raises PeaksFormatError: 形式が正しくない場合
+    """
+    if len(data) < HEADER.size:
+        raise PeaksFormatError("Truncated peaks data.")
+    magic, n_levels, sr, frames = HEADER.unpack_from(data)
+    if magic != MAGIC:
+        raise PeaksFormatError("Invalid peaks data.")
+
+    offset = HEADER.size
+    table = []
+    for _ in range(n_levels):
+        if offset + LEVEL.size > len(data):
+            raise PeaksFormatError("Truncated peaks data.")
+        table.append(LEVEL.unpack_from(data, offset))
+        offset += LEVEL.size
+
+    levels = []
+    for samples_per_peak, count in table:
+        size = count * 4
+        if offset + size > len(data):
+            raise PeaksFormatError("Truncated peaks data.")
+        pairs = np.frombuffer(data, dtype="<i2", count=count * 2, offset=offset).reshape(-1, 2)
+        levels.append((samples_per_peak, pairs))
+        offset += size
+    return sr, frames, levels
+
+
+def compute_peaks(reader, samples_per_peak=256, progress=None, total=None):
+    """
+    音声を1回のデコードで読み込みながら peaks を求め、バイナリ形式で返す
+
+    :param reader: utils.audio_stream.AudioBlockReader（mono=False でもよい）
+    :param samples_per_peak: 最も細かい解像度の 1つの peak あたりのサンプル数
+    :param progress: 進捗（0〜1）を受け取る関数
+    :param total: 進捗の計算に使う全サンプル数の見積もり
+    :return: encode_peaks の形式のバイト列
+    """
+    builder = PeaksBuilder(samples_per_peak)
+    for block in reader:
+        builder.add(block)
+        if progress is not None and total:
+            progress(min(1.0, builder.frames / total))
+    mins, maxs = builder.finish()
+    levels = build_levels(mins, maxs, samples_per_peak)
+    return encode_peaks(levels, reader.sr, builder.frames)
@@ -0,0 +1,178 @@
+import json
+import subprocess
+from dataclasses import dataclass
+from typing import Optional
+
+import soundfile as sf
+
+# 先頭バイトで判定できる音声形式
+AUDIO_SIGNATURES = [
+    (0, b"fLaC", "flac"),
+    (0, b"OggS", "ogg"),
+    (0, b"ID3", "mp3"),
+    (0, b"#!AMR", "amr"),
+    (0, b"\x1a\x45\xdf\xa3", "webm"),
+    (0, b".snd", "au"),
+    (4, b"ftyp", "mp4"),
+]
+
+# 音声ではないことが先頭バイトで分かる形式（ffprobe を起動せずに弾く）
+NON_AUDIO_SIGNATURES = [
+    b"\x89PNG",
+    b"\xff\xd8\xff",
+    b"GIF8",
+    b"%PDF",
+    b"PK\x03\x04",
+    b"\x7fELF",
+    b"BM",
+]
+
+# soundfile（libsndfile）でヘッダを読める形式
+SOUNDFILE_PROBE_FORMATS = {"wav", "flac", "ogg", "aiff", "au"}
+
+# soundfile のサブタイプとビット深度の対応
+SUBTYPE_BIT_DEPTHS = {
+    "PCM_S8": 8,
+    "PCM_U8": 8,
+    "PCM_16": 16,
+    "PCM_24": 24,
+    "PCM_32": 32,
+    "FLOAT": 32,
+    "DOUBLE": 64,
+}
+
+
+class AudioProbeError(Exception):
+    pass
+
+
+@dataclass(frozen=True)
+class AudioProbe:
+    """
+    デコードせずにヘッダから読み取ったオーディオファイルの情報
+    """
+
+    format: str
+    codec: str
+    sample_rate: int
+    channels: int
+    duration: Optional[float]
+    frames: Optional[int] = None
+    bit_depth: Optional[int] = None
+
+    @property
+    def estimated_frames(self):
+        """
+        デコード後のサンプル数（ヘッダに無い場合は再生時間から見積もる）
+        """
+        if self.frames is not None:
+            return self.frames
+        if self.duration is not None:
+            return int(self.duration * self.sample_rate)
+        return None
+
+
+def sniff_format(header):
+    """
+    ファイル先頭のバイト列から形式を判定する
+
+    :param header: ファイル先頭のバイト列（64バイト程度）
+    :return: 形式名。判定できない場合は None、音声でないと分かる場合は False
+    """
+    if header[:4] in (b"RIFF", b"RF64") and header[8:12] == b"WAVE":
+        return "wav"
+    if header[:4] == b"FORM" and header[8:12] in (b"AIFF", b"AIFC"):
+        return "aiff"
+    for offset, signature, fmt in AUDIO_SIGNATURES:
+        if header[offset : offset + len(signature)] == signature:
+            return fmt
+    if len(header) >= 2 and header[0] == 0xFF and header[1] & 0xE0 == 0xE0:
+        # フレーム同期ワード: layer のビットが 00 なら ADTS（AAC）、それ以外は MPEG オーディオ
+        return "aac" if header[1] & 0x06 == 0 else "mp3"
+    if any(header.startswith(signature) for signature in NON_AUDIO_SIGNATURES):
+        return False
+    return None
+
+
+def probe_audio(input_file):
+    """
+    ヘッダだけを読んでオーディオファイルの情報を取得する
+
+    先頭バイトで形式を判定し、libsndfile の形式は soundfile で、
+    それ以外は ffprobe でコンテナとコーデックの情報を読み取る。
+
+    :param input_file: 入力ファイルのパス
+    :return: AudioProbe
+    :raises AudioProbeError: 音声ファイルでない場合
+    """
+    try:
+        with open(input_file, "rb") as f:
+            header = f.read(64)
+    except OSError:
+        raise AudioProbeError("Selected file is not a audio file.")
+
+    fmt = sniff_format(header)
+    if fmt is False or not header:
+        raise AudioProbeError("Selected file is not a audio file.")
+
+    if fmt is None or fmt in SOUNDFILE_PROBE_FORMATS:
+        try:
+            return _probe_with_soundfile(input_file)
+        except (sf.LibsndfileError, RuntimeError):
+            pass
+    return _probe_with_ffprobe(input_file)
+
+
+def _probe_with_soundfile(input_file):
+    info = sf.info(input_file)
+    if info.samplerate <= 0 or info.channels <= 0:
+        raise AudioProbeError("Selected file is not a audio file.")
+    return AudioProbe(
+        format=info.format.lower(),
+        codec=info.subtype.lower(),
+        sample_rate=info.samplerate,
+        channels=info.channels,
+        duration=info.frames / info.samplerate,
+        frames=info.frames,
+        bit_depth=SUBTYPE_BIT_DEPTHS.get(info.subtype),
+    )
+
+
+def _probe_with_ffprobe(input_file):
+    try:
+        process = subprocess.run(
+            [
+                "ffprobe",
+                "-v",
+                "error",
+                "-select_streams",
+                "a:0",
+                "-show_entries",
+                "format=format_name,duration"
+                ":stream=codec_name,sample_rate,channels,duration,"
+                "bits_per_sample,bits_per_raw_sample",
+                "-of",
+                "json",
+                input_file,
+            ],
+            capture_output=True,
+            check=True,
+        )
+        result = json.loads(process.stdout)
+        stream = result["streams"][0]
+        sample_rate = int(stream["sample_rate"])
+        channels = int(stream["channels"])
+    except (OSError, subprocess.CalledProcessError, KeyError, IndexError, ValueError):
+        raise AudioProbeError("Selected file is not a audio file.")
+
+    container = result.get("format", {})
+    duration = stream.get("duration") or container.get("duration")
+    bit_depth = int(stream.get("bits_per_raw_sample") or stream.get("bits_per_sample") or 0)
+    return AudioProbe(
+        format=container.get("format_name", "").split(",")[0],
+        codec=stream.get("codec_name", ""),
+        sample_rate=sample_rate,
+        channels=channels,
+        duration=float(duration) if duration not in (None, "N/A") else None,
+        bit_depth=bit_depth or None,
+    )
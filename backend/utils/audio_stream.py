@@ -0,0 +1,806 @@
+import struct
+import subprocess
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import librosa
+import numpy as np
+import soundfile as sf
+import soxr
+
+from utils.audio_io import (
+    AudioDecodeError,
+    encoder_settings,
+    ffmpeg_encode_command,
+    soundfile_options,
+)
+from utils.audio_probe import AudioProbeError, probe_audio
+from utils.ffmpeg_pool import get_ffmpeg_pool
+
+
+class _StreamingShifter:
+    """
+    時間伸縮した波形をリサンプルで元の長さに戻すピッチシフトを、ブロック単位で行う共通部分
+
+    サブクラスは _stretch（入力ブロックを受け取り、確定した時間伸縮後のサンプルを返す）を実装する。
+    出力はリサンプラの状態をブロック間で引き継ぎ、入力の合計長と同じ長さにそろえる。
+
+    :param sr: サンプリングレート
+    :param n_steps: ピッチシフトする半音の数
+    """
+
+    def __init__(self, sr, n_steps):
+        self.sr = sr
+        self.rate = 2.0 ** (-float(n_steps) / 12)
+        self._n_input = 0
+        self._n_stretched = 0
+
+        # リサンプル（時間伸縮した波形を元の長さに戻す）
+        self._resampler = soxr.ResampleStream(
+            float(sr) / self.rate, sr, 1, dtype="float32", quality="HQ"
+        )
+        self._n_output = 0
+        self.finished = False
+
+    def process(self, block, last=False):
+        """
+        入力ブロックを処理し、確定した出力サンプルを返す
+
+        :param block: 入力波形（モノラル float32）
+        :param last: 最後のブロックの場合は True
+        :return: 出力波形（入力の合計長と同じ長さになるまで順次返す）
+        """
+        if self.finished:
+            raise RuntimeError(f"{type(self).__name__} has already been flushed.")
+
+        block = np.asarray(block, dtype=np.float32)
+        self._n_input += len(block)
+        stretched = self._stretch(block, last)
+        output = self._resampler.resample_chunk(stretched, last=last)
+
+        # 出力を入力と同じ長さにそろえる
+        remaining = self._n_input - self._n_output
+        output = output[:remaining]
+        if last:
+            self.finished = True
+            output = np.concatenate(
+                [output, np.zeros(remaining - len(output), dtype=np.float32)]
+            )
+        self._n_output += len(output)
+        return output
+
+    def flush(self):
+        return self.process(np.zeros(0, dtype=np.float32), last=True)
+
+    def _stretch(self, block, last):
+        raise NotImplementedError
+
+    def _count_stretched(self, samples, last):
+        # 最後のブロックでは、時間伸縮後の長さ（入力の長さ / rate）に切り詰めるかゼロで埋める
+        if last:
+            length = int(round(self._n_input / self.rate))
+            samples = samples[: max(0, length - self._n_stretched)]
+            samples = np.concatenate(
+                [
+                    samples,
+                    np.zeros(length - self._n_stretched - len(samples), dtype=np.float32),
+                ]
+            )
+        self._n_stretched += len(samples)
+        return samples
+
+
+class StreamingPitchShifter(_StreamingShifter):
+    """
+    ブロック単位で入力を受け取り、一定のメモリでピッチシフトを行うクラス（フェーズボコーダ）
+
+    librosa.effects.pitch_shift と同じ処理（STFT → フェーズボコーダ → ISTFT → リサンプル）を
+    状態を持ったまま逐次実行する。位相の累積・ISTFT の重ね合わせ・リサンプラの状態を
+    ブロック間で引き継ぐため、ブロック境界でも全体を一度に処理した場合とほぼ同じ結果になる。
+
+    :param sr: サンプリングレート
+    :param n_steps: ピッチシフトする半音の数
+    :param n_fft: FFTのウィンドウサイズ
+    :param hop_length: ストライド（移動間隔）
+    """
+
+    def __init__(self, sr, n_steps, n_fft=2048, hop_length=512):
+        super().__init__(sr, n_steps)
+        self.n_fft = n_fft
+        self.hop_length = hop_length
+
+        self.window = librosa.filters.get_window("hann", n_fft, fftbins=True).astype(
+            np.float32
+        )
+        self.window_sq = self.window**2
+        self.phi_advance = hop_length * librosa.fft_frequencies(sr=2 * np.pi, n_fft=n_fft)
+
+        # 解析（STFT）: center=True と同じく先頭に n_fft // 2 のゼロを詰める
+        self._input = np.zeros(n_fft // 2, dtype=np.float32)
+        self._input_offset = 0
+        self._frames = np.zeros((n_fft // 2 + 1, 0), dtype=np.complex64)
+        self._frame_offset = 0
+        self._n_frames = 0
+
+        # フェーズボコーダ
+        self._step = 0
+        self._phase_acc = None
+
+        # 合成（ISTFT の重ね合わせ）
+        self._ola = np.zeros(n_fft, dtype=np.float32)
+        self._envelope = np.zeros(n_fft, dtype=np.float32)
+        self._ola_offset = 0
+        self._n_synth_frames = 0
+
+    def _stretch(self, block, last):
+        self._input = np.concatenate([self._input, block])
+        if last:
+            # center=True の末尾のゼロ詰め
+            self._input = np.concatenate(
+                [self._input, np.zeros(self.n_fft // 2, dtype=np.float32)]
+            )
+
+        self._analyze(last)
+        return self._synthesize(self._vocode(last), last)
+
+    def _analyze(self, last):
+        n_fft, hop = self.n_fft, self.hop_length
+        available = self._input_offset + len(self._input)
+        total = 1 + self._n_input // hop if last else None
+
+        count = 0
+        while (self._n_frames + count) * hop + n_fft <= available and (
+            total is None or self._n_frames + count < total
+        ):
+            count += 1
+        if count == 0:
+            return
+
+        start = self._n_frames * hop - self._input_offset
+        frames = librosa.util.frame(
+            self._input[start : start + (count - 1) * hop + n_fft],
+            frame_length=n_fft,
+            hop_length=hop,
+        )
+        spectrum = np.fft.rfft(frames * self.window[:, None], axis=0).astype(np.complex64)
+        self._frames = np.concatenate([self._frames, spectrum], axis=1)
+        self._n_frames += count
+
+        # 以降のフレームで使わない入力を捨てる
+        drop = self._n_frames * hop - self._input_offset
+        self._input = self._input[drop:]
+        self._input_offset += drop
+
+    def _column(self, index):
+        position = index - self._frame_offset
+        if position < self._frames.shape[1]:
+            return self._frames[:, position]
+        # 最終フレームより後ろはゼロ（librosa.phase_vocoder のゼロ詰めと同じ）
+        return np.zeros(self._frames.shape[0], dtype=np.complex64)
+
+    def _vocode(self, last):
+        stretched = []
+        while True:
+            step = self._step * self.rate
+            index = int(step)
+            if last:
+                if step >= self._n_frames:
+                    break
+            elif index + 1 >= self._n_frames:
+                break
+
+            current, following = self._column(index), self._column(index + 1)
+            if self._phase_acc is None:
+                self._phase_acc = np.angle(current)
+
+            alpha = np.mod(step, 1.0)
+            mag = (1.0 - alpha) * np.abs(current) + alpha * np.abs(following)
+            stretched.append(librosa.util.phasor(self._phase_acc, mag=mag))
+
+            dphase = np.angle(following) - np.angle(current) - self.phi_advance
+            dphase = dphase - 2.0 * np.pi * np.round(dphase / (2.0 * np.pi))
+            self._phase_acc += self.phi_advance + dphase
+            self._step += 1
+
+        # 次のステップで使わない解析フレームを捨てる
+        drop = int(self._step * self.rate) - self._frame_offset
+        if drop > 0:
+            self._frames = self._frames[:, drop:]
+            self._frame_offset += drop
+        return stretched
+
+    def _synthesize(self, stretched, last):
+        n_fft, hop = self.n_fft, self.hop_length
+        finalized = []
+        for column in stretched:
+            position = self._n_synth_frames * hop - self._ola_offset
+            needed = position + n_fft
+            if needed > len(self._ola):
+                grow = needed - len(self._ola)
+                self._ola = np.concatenate([self._ola, np.zeros(grow, dtype=np.float32)])
+                self._envelope = np.concatenate(
+                    [self._envelope, np.zeros(grow, dtype=np.float32)]
+                )
+            frame = np.fft.irfft(column, n=n_fft).astype(np.float32) * self.window
+            self._ola[position:needed] += frame
+            self._envelope[position:needed] += self.window_sq
+            self._n_synth_frames += 1
+
+        # 以降のフレームが重ならない位置までは確定している
+        if last:
+            ready = len(self._ola)
+        else:
+            ready = max(0, self._n_synth_frames * hop - self._ola_offset)
+        if ready:
+            samples = self._ola[:ready].copy()
+            envelope = self._envelope[:ready]
+            nonzero = envelope > librosa.util.tiny(envelope)
+            samples[nonzero] /= envelope[nonzero]
+            finalized.append(samples)
+            self._ola = self._ola[ready:]
+            self._envelope = self._envelope[ready:]
+            self._ola_offset += ready
+
+        samples = np.concatenate(finalized) if finalized else np.zeros(0, np.float32)
+        # center=True の先頭のゼロ詰め分を取り除き、ISTFT の length に合わせる
+        start = self._ola_offset - len(samples)
+        skip = max(0, n_fft // 2 - start)
+        return self._count_stretched(samples[skip:], last)
+
+
+class StreamingWsolaShifter(_StreamingShifter):
+    """
+    ブロック単位で入力を受け取り、WSOLA（時間領域の重ね合わせ）でピッチシフトを行うクラス
+
+    フレームを切り出す位置を、直前のフレームの続きと最も相関が高い位置に少しずらしながら
+    重ね合わせて時間伸縮し、リサンプルで元の長さに戻す。FFT による位相の計算がないため
+    フェーズボコーダより数倍速く、打楽器の立ち上がりもぼやけにくい。一方で、和音や残響の多い
+    音源ではフレームの継ぎ目でうなりや二重に聞こえることがあるため、プレビュー向け。
+
+    :param sr: サンプリングレート
+    :param n_steps: ピッチシフトする半音の数
+    :param frame_seconds: フレームの長さ（秒、2 のべき乗のサンプル数に丸める）
+    :param decimation: 位置の探索で間引く間隔（粗く探索してから、元のサンプル単位で合わせ直す）
+    """
+
+    def __init__(self, sr, n_steps, frame_seconds=0.04, decimation=4):
+        super().__init__(sr, n_steps)
+        self.frame_length = 1 << max(4, int(round(np.log2(frame_seconds * sr))))
+        self.synthesis_hop = self.frame_length // 2
+        self.analysis_hop = self.synthesis_hop * self.rate
+        self.tolerance = self.frame_length // 4
+        self.decimation = decimation
+        self.window = librosa.filters.get_window(
+            "hann", self.frame_length, fftbins=True
+        ).astype(np.float32)
+
+        # 解析: フレームの中心を入力の位置に合わせ、その前も探索できるようにゼロを詰める
+        self._input = np.zeros(self.frame_length // 2 + self.tolerance, dtype=np.float32)
+        self._input_offset = 0
+        self._n_frames = 0
+        self._previous = None
+
+        # 合成（重ね合わせ）: 先頭の frame_length // 2 はフレームの中心を合わせるために捨てる
+        self._ola = np.zeros(self.frame_length, dtype=np.float32)
+        self._ola_offset = 0
+
+    def _stretch(self, block, last):
+        n, hop, tolerance = self.frame_length, self.synthesis_hop, self.tolerance
+        self._input = np.concatenate([self._input, block])
+
+        total = None
+        if last:
+            # 時間伸縮後の末尾までフレームで覆い、足りない入力はゼロとして扱う
+            total = -(-(int(round(self._n_input / self.rate)) + n // 2) // hop)
+            needed = int(round((total - 1) * self.analysis_hop)) + 2 * tolerance + n
+            shortage = needed - self._input_offset - len(self._input)
+            if shortage > 0:
+                self._input = np.concatenate(
+                    [self._input, np.zeros(shortage, dtype=np.float32)]
+                )
+
+        available = self._input_offset + len(self._input)
+        first = self._n_frames
+        frames = []
+        while True:
+            start = int(round(self._n_frames * self.analysis_hop))
+            if total is not None:
+                if self._n_frames >= total:
+                    break
+            elif start + 2 * tolerance + n > available:
+                break
+
+            position = self._align(start)
+            frames.append(self._input[position - self._input_offset :][:n])
+            self._previous = position
+            self._n_frames += 1
+
+        if frames:
+            # フレームの間隔は長さのちょうど半分なので、前半と後半に分けてまとめて重ね合わせる
+            frames = np.stack(frames) * self.window
+            offset = first * hop - self._ola_offset
+            length = len(frames) * hop
+            if offset + length + hop > len(self._ola):
+                self._ola = np.concatenate(
+                    [self._ola, np.zeros(offset + length + hop - len(self._ola), np.float32)]
+                )
+            self._ola[offset : offset + length] += frames[:, :hop].reshape(-1)
+            self._ola[offset + hop : offset + hop + length] += frames[:, hop:].reshape(-1)
+
+        # 次のフレームの探索と、直前のフレームの続きに使わない入力を捨てる
+        keep = int(round(self._n_frames * self.analysis_hop))
+        if self._previous is not None:
+            keep = min(keep, self._previous + hop)
+        drop = max(0, keep - self._input_offset)
+        self._input = self._input[drop:]
+        self._input_offset += drop
+
+        # 以降のフレームが重ならない位置までは確定している
+        ready = len(self._ola) if last else self._n_frames * hop - self._ola_offset
+        samples = self._ola[:ready].copy()
+        self._ola = self._ola[ready:]
+        skip = max(0, n // 2 - self._ola_offset)
+        self._ola_offset += ready
+        return self._count_stretched(samples[skip:], last)
+
+    def _align(self, start):
+        """
+        探索範囲（start から 2 * tolerance）の中で、直前のフレームの続きと
+        最も相関が高いフレームの開始位置を返す
+        """
+        if self._previous is None:
+            return start + self.tolerance
+
+        hop, tolerance, step = self.synthesis_hop, self.tolerance, self.decimation
+        base = self._input_offset
+        natural = self._input[self._previous + hop - base :][:hop]
+        region = self._input[start - base : start - base + 2 * tolerance + hop]
+
+        # 間引いた波形で粗く探索する
+        correlation = np.correlate(_decimate(region, step), _decimate(natural, step), "valid")
+        coarse = start + int(np.argmax(correlation)) * step
+
+        # 前後 decimation サンプルの範囲を元のサンプル単位で探索する
+        low = max(start, coarse - step)
+        high = min(start + 2 * tolerance, coarse + step)
+        candidates = np.lib.stride_tricks.sliding_window_view(
+            self._input[low - base : high - base + hop], hop
+        )
+        return low + int(np.argmax(candidates @ natural))
+
+
+def _decimate(y, step):
+    # step サンプルごとの平均（相関の探索に使うだけなので、簡易なローパスで十分）
+    return y[: len(y) // step * step].reshape(-1, step).mean(axis=1)
+
+
+# ピッチシフトの方式（品質の高い順）
+#   phase-vocoder: librosa.effects.pitch_shift と同じ。和音や残響も自然だが、FFT の分だけ遅い
+#   wsola: 時間領域の重ね合わせ。数倍速いが、複雑な音源では継ぎ目にうなりが出ることがある
+PITCH_ENGINES = {
+    "phase-vocoder": StreamingPitchShifter,
+    "wsola": StreamingWsolaShifter,
+}
+
+
+class MultiChannelShifter:
+    """
+    チャンネルごとにシフタを作成し、(samples, channels) のブロックを並列にピッチシフトするクラス
+
+    NumPy の FFT・行列演算と soxr は GIL を解放するので、スレッドでチャンネルを並列に処理できる。
+
+    :param shifters: チャンネルごとのシフタのリスト
+    :param workers: 並列に処理するスレッド数（None の場合はチャンネル数）
+    """
+
+    def __init__(self, shifters, workers=None):
+        self.shifters = shifters
+        self.sr = shifters[0].sr
+        self._executor = None
+        workers = min(len(shifters), workers or len(shifters))
+        if workers > 1:
+            self._executor = ThreadPoolExecutor(
+                max_workers=workers, thread_name_prefix="channel"
+            )
+
+    def process(self, block, last=False):
+        block = np.asarray(block, dtype=np.float32).reshape(-1, len(self.shifters))
+
+        def run(channel):
+            return self.shifters[channel].process(block[:, channel], last=last)
+
+        channels = range(len(self.shifters))
+        if self._executor is None:
+            outputs = [run(channel) for channel in channels]
+        else:
+            outputs = list(self._executor.map(run, channels))
+        if last:
+            self.close()
+        # 各チャンネルの入力の長さは同じなので、出力の長さもそろう
+        return np.stack(outputs, axis=1)
+
+    def flush(self):
+        return self.process(np.zeros((0, len(self.shifters)), dtype=np.float32), last=True)
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+
+def create_shifter(sr, n_steps, engine="phase-vocoder", channels=1, workers=None):
+    """
+    ブロック単位でピッチシフトを行うシフタを作成する
+
+    :param sr: サンプリングレート
+    :param n_steps: ピッチシフトする半音の数
+    :param engine: ピッチシフトの方式（PITCH_ENGINES のキー）
+    :param channels: チャンネル数（2 以上の場合は (samples, channels) のブロックを受け取る）
+    :param workers: チャンネルを並列に処理するスレッド数
+    :return: process(block, last) / flush() を持つシフタ
+    """
+    try:
+        shifter_class = PITCH_ENGINES[engine]
+    except KeyError:
+        raise ValueError(f"Unknown pitch shift engine: {engine}")
+    if channels == 1:
+        return shifter_class(sr, n_steps)
+    return MultiChannelShifter(
+        [shifter_class(sr, n_steps) for _ in range(channels)], workers=workers
+    )
+
+
+class AudioBlockReader:
+    """
+    オーディオファイルをブロック単位でデコードするクラス（float32）
+
+    ファイルはインスタンス作成時に開くため、後から元の一時ファイルが削除されても読み込める。
+
+    :param input_file: 入力ファイルのパス
+    :param blocksize: 一度にデコードするサンプル数
+    :param probe: probe_audio の結果
+    :param mono: True の場合はモノラルにミックスダウンした (samples,) のブロックを返す。
+        False の場合は (samples, channels) のブロックを返す（元がモノラルの場合は (samples,)）
+    :param sample_rate: 指定した場合、元のサンプリングレートがそれより高ければ
+        ブロックごとにリサンプルして下げる（sr・frames もリサンプル後の値になる）
+    """
+
+    def __init__(self, input_file, blocksize=65536, probe=None, mono=True, sample_rate=None):
+        self.blocksize = blocksize
+        self._process = None
+        try:
+            self._soundfile = sf.SoundFile(input_file)
+            self.sr = self._soundfile.samplerate
+            self._file_channels = self._soundfile.channels
+            self.frames = self._soundfile.frames
+        except (sf.LibsndfileError, RuntimeError):
+            self._soundfile = None
+            try:
+                probe = probe or probe_audio(input_file)
+            except AudioProbeError:
+                raise AudioDecodeError("Selected file is not a audio file.")
+            self.sr, self._file_channels = probe.sample_rate, probe.channels
+            self.frames = None
+            try:
+                self._process = subprocess.Popen(
+                    ["ffmpeg", "-v", "error", "-i", input_file, "-vn", "-f", "f32le", "-"],
+                    stdout=subprocess.PIPE,
+                    stderr=subprocess.DEVNULL,
+                )
+            except OSError:
+                raise AudioDecodeError("Selected file is not a audio file.")
+        self.channels = 1 if mono else self._file_channels
+
+        self._resampler = None
+        if sample_rate and sample_rate < self.sr:
+            self._resampler = soxr.ResampleStream(
+                self.sr, sample_rate, self.channels, dtype="float32", quality="HQ"
+            )
+            if self.frames is not None:
+                self.frames = int(round(self.frames * sample_rate / self.sr))
+            self.sr = sample_rate
+
+    def __iter__(self):
+        if self._resampler is None:
+            yield from self._iter_decoded()
+            return
+
+        produced = 0
+        for block in self._iter_decoded():
+            block = self._resampler.resample_chunk(block)
+            produced += len(block)
+            if len(block):
+                yield block
+        empty = np.zeros((0,) if self.channels == 1 else (0, self.channels), np.float32)
+        block = self._resampler.resample_chunk(empty, last=True)
+        if self.frames is not None:
+            # WAV のヘッダに書いたサンプル数とそろえる
+            block = block[: max(0, self.frames - produced)]
+            padding = self.frames - produced - len(block)
+            if padding > 0:
+                block = np.concatenate(
+                    [block, np.zeros((padding, *block.shape[1:]), dtype=np.float32)]
+                )
+        if len(block):
+            yield block
+
+    def _iter_decoded(self):
+        try:
+            if self._soundfile is not None:
+                for block in self._soundfile.blocks(
+                    blocksize=self.blocksize, dtype="float32", always_2d=True
+                ):
+                    yield self._channels(block)
+                return
+
+            frame_bytes = 4 * self._file_channels
+            while True:
+                data = self._process.stdout.read(self.blocksize * frame_bytes)
+                if not data:
+                    break
+                # 端数のバイトが届いた場合は続きを読み足す
+                while len(data) % frame_bytes:
+                    more = self._process.stdout.read(frame_bytes - len(data) % frame_bytes)
+                    if not more:
+                        data = data[: len(data) - len(data) % frame_bytes]
+                        break
+                    data += more
+                block = np.frombuffer(data, dtype="<f4").reshape(-1, self._file_channels)
+                yield self._channels(block)
+            if self._process.wait() != 0:
+                raise AudioDecodeError("Selected file is not a audio file.")
+        finally:
+            self.close()
+
+    def _channels(self, block):
+        if self.channels == 1:
+            return block.mean(axis=1, dtype=np.float32)
+        return np.ascontiguousarray(block, dtype=np.float32)
+
+    def close(self):
+        if self._soundfile is not None:
+            self._soundfile.close()
+        if self._process is not None and self._process.poll() is None:
+            self._process.kill()
+            self._process.wait()
+
+
+def iter_pitch_shift(reader, n_steps, engine="phase-vocoder", workers=None):
+    """
+    デコードしたブロックを順にピッチシフトし、確定した出力ブロックを返すジェネレータ
+    """
+    shifter = create_shifter(
+        reader.sr, n_steps, engine=engine, channels=reader.channels, workers=workers
+    )
+    for block in reader:
+        output = shifter.process(block)
+        if len(output):
+            yield output
+    output = shifter.flush()
+    if len(output):
+        yield output
+
+
+# 閉じるときのヘッダの更新がなくても再生できる libsndfile の形式（プロセス内で逐次エンコードする）
+STREAMABLE_SOUNDFILE_FORMATS = {"flac", "ogg", "mp3"}
+
+# 長さが分からない WAV のヘッダに書くサイズ（ffmpeg などは「最後まで」として扱う）
+UNKNOWN_WAV_SIZE = 0xFFFFFFFF
+
+
+def wav_header(n_samples, sr, channels=1, sample_width=2):
+    """
+    PCM WAV のヘッダを作成する
+
+    :param n_samples: サンプル数（None の場合は長さが分からないものとして最大のサイズを書く）
+    """
+    if n_samples is None:
+        riff_size, data_size = UNKNOWN_WAV_SIZE, UNKNOWN_WAV_SIZE - 36
+    else:
+        data_size = n_samples * channels * sample_width
+        riff_size = 36 + data_size
+    return (
+        b"RIFF"
+        + struct.pack("<I", riff_size)
+        + b"WAVE"
+        + b"fmt "
+        + struct.pack(
+            "<IHHIIHH",
+            16,
+            1,
+            channels,
+            sr,
+            sr * channels * sample_width,
+            channels * sample_width,
+            sample_width * 8,
+        )
+        + b"data"
+        + struct.pack("<I", data_size)
+    )
+
+
+def to_pcm16(block):
+    return (np.clip(block, -1.0, 1.0) * 32767).astype("<i2").tobytes()
+
+
+class _StreamingSink:
+    """
+    libsndfile の書き出し先にするファイルオブジェクト（書き込まれたバイト列を先頭から順に取り出す）
+
+    取り出した位置より前への書き込み（閉じるときのヘッダの更新）は捨てる。
+    """
+
+    def __init__(self):
+        self._position = 0
+        self._size = 0
+        self._taken = 0
+        self._pending = bytearray()
+
+    def write(self, data):
+        end = self._position + len(data)
+        start = max(self._position, self._taken)
+        if start < end:
+            offset = start - self._taken
+            if len(self._pending) < offset:
+                self._pending.extend(bytes(offset - len(self._pending)))
+            self._pending[offset : end - self._taken] = data[start - self._position :]
+        self._position = end
+        self._size = max(self._size, end)
+        return len(data)
+
+    def readinto(self, buffer):
+        # 読み返せるのはまだ取り出していない部分だけ（取り出した部分は空として扱う）
+        offset = self._position - self._taken
+        if offset < 0:
+            return 0
+        data = self._pending[offset : offset + len(buffer)]
+        buffer[: len(data)] = data
+        self._position += len(data)
+        return len(data)
+
+    def seek(self, offset, whence=0):
+        base = {0: 0, 1: self._position, 2: self._size}[whence]
+        self._position = base + offset
+        return self._position
+
+    def tell(self):
+        return self._position
+
+    def take(self):
+        """
+        まだ取り出していないバイト列を返す
+        """
+        data = bytes(self._pending[: self._size - self._taken])
+        self._taken = self._size
+        self._pending.clear()
+        return data
+
+
+def iter_encoded(blocks, sr, fmt, n_samples=None, channels=1, options=None):
+    """
+    波形のブロック（(samples,) または (samples, channels)）を順にエンコードし、
+    出来たバイト列から返すジェネレータ
+
+    WAV はヘッダを先に書いて PCM をそのまま返し、FLAC・OGG・MP3 は libsndfile でプロセス内で
+    エンコードする。それ以外の形式は ffmpeg（utils.ffmpeg_pool）の標準入力に PCM を流し込み、
+    標準出力を順に返す。
+
+    :param options: encoder_settings の結果（None の場合は設定値）
+    """
+    if fmt == "wav":
+        yield wav_header(n_samples, sr, channels=channels)
+        for block in blocks:
+            yield to_pcm16(block)
+        return
+
+    options = options or encoder_settings(fmt)
+    kwargs = soundfile_options(fmt, sr, options)
+    if fmt in STREAMABLE_SOUNDFILE_FORMATS and kwargs is not None:
+        yield from _iter_soundfile_encoded(blocks, sr, channels, kwargs, n_samples)
+        return
+
+    process = get_ffmpeg_pool().acquire(ffmpeg_encode_command(sr, channels, fmt, options))
+    errors = []
+
+    def feed():
+        # 標準出力の読み出しと並行して PCM を書き込む（パイプの詰まりを防ぐ）
+        try:
+            for block in blocks:
+                process.stdin.write(np.ascontiguousarray(block, dtype="<f4").tobytes())
+        except Exception as e:
+            errors.append(e)
+        finally:
+            try:
+                process.stdin.close()
+            except BrokenPipeError:
+                pass
+
+    writer = threading.Thread(target=feed, daemon=True)
+    writer.start()
+    try:
+        while True:
+            data = process.stdout.read(65536)
+            if not data:
+                break
+            yield data
+        writer.join()
+        if process.wait() != 0 or errors:
+            raise errors[0] if errors else RuntimeError(f"ffmpeg failed to encode {fmt}.")
+    finally:
+        if process.poll() is None:
+            process.kill()
+            process.wait()
+        process.stdout.close()
+
+
+def _iter_soundfile_encoded(blocks, sr, channels, kwargs, n_samples=None):
+    sink = _StreamingSink()
+    first = True
+    with sf.SoundFile(sink, "w", sr, channels, **kwargs) as f:
+        for block in blocks:
+            f.write(block)
+            data = sink.take()
+            if data and first and kwargs["format"] == "FLAC" and n_samples:
+                # 閉じるときに書かれるサンプル数を、分かっていれば先に書いておく
+                # （0 のまま（長さ不明）だと libsndfile では読み込めない）
+                data = flac_set_total_samples(data, n_samples)
+            if data:
+                first = False
+                yield data
+    data = sink.take()
+    if data:
+        yield data
+
+
+def flac_set_total_samples(data, n_samples):
+    """
+    FLAC の先頭（"fLaC" と STREAMINFO）のサンプル数（36 ビット）を書き換える
+
+    :param data: FLAC の先頭から STREAMINFO の終わり（42 バイト目）までを含むバイト列
+    :param n_samples: 1チャンネルあたりのサンプル数
+    """
+    data = bytearray(data)
+    # STREAMINFO の 14 バイト目の下位 4 ビットと続く 4 バイト（先頭の 4 ビットはビット深度）
+    data[21] = (data[21] & 0xF0) | ((n_samples >> 32) & 0x0F)
+    data[22:26] = struct.pack(">I", n_samples & 0xFFFFFFFF)
+    return bytes(data)
+
+
+def stream_pitch_shift(
+    input_file,
+    output_format,
+    n_steps,
+    blocksize=65536,
+    probe=None,
+    engine="phase-vocoder",
+    mono=True,
+    sample_rate=None,
+    workers=None,
+):
+    """
+    ピッチシフトした結果をエンコード済みのバイト列として順に返すジェネレータを作成する
+
+    入力ファイルはこの関数の呼び出し時に開くため、戻り値をレスポンスに渡した後に
+    一時ファイルが削除されても問題ない。
+
+    :param input_file: 入力ファイルのパス
+    :param output_format: 出力形式（拡張子）
+    :param n_steps: ピッチシフトする半音の数
+    :param blocksize: 一度にデコードするサンプル数
+    :param probe: probe_audio の結果
+    :param engine: ピッチシフトの方式（PITCH_ENGINES のキー）
+    :param mono: True の場合はモノラルにミックスダウンして処理する
+    :param sample_rate: 処理するサンプリングレートの上限（None の場合は元のまま）
+    :param workers: チャンネルを並列に処理するスレッド数
+    :return: バイト列のジェネレータ
+    """
+    reader = AudioBlockReader(
+        input_file, blocksize=blocksize, probe=probe, mono=mono, sample_rate=sample_rate
+    )
+    return iter_encoded(
+        iter_pitch_shift(reader, n_steps, engine=engine, workers=workers),
+        reader.sr,
+        output_format,
+        n_samples=reader.frames,
+        channels=reader.channels,
+    )
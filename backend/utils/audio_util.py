@@ -1,70 +1,308 @@
+import io
 import os
+import zipfile
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
 import librosa
-import soundfile as sf
-from pydub import AudioSegment
-from django.core.files.temp import NamedTemporaryFile
+import numpy as np
+import soxr
+from utils.audio_io import (
+    STREAM_COPY_FORMATS,
+    audio_format,
+    copy_audio_range,
+    decode_audio,
+    decode_audio_range,
+    encode_audio,
+)
+from utils.audio_probe import AudioProbeError, probe_audio
+from utils.audio_stream import PITCH_ENGINES
+
 
+class AudioTooLongError(Exception):
+    pass
 
-def apply_pitch_shift(input_file, output_file, n_steps, n_fft=2048, hop_length=512):
+
+def shift_pitch(
+    y, sr, n_steps, n_fft=2048, hop_length=512, engine="phase-vocoder", workers=None
+):
     """
-    任意のオーディオ形式に対応したピッチシフト処理を行う関数
+    NumPy 配列の波形にピッチシフトを適用する
 
-    :param input_file: 入力ファイルのパス
-    :param output_file: 出力ファイルのパス
+    :param y: 波形（(samples,) または (samples, channels)）
+    :param sr: サンプリングレート
     :param n_steps: ピッチシフトする半音の数
+    :param n_fft: FFTのウィンドウサイズ（phase-vocoder のみ）
+    :param hop_length: ストライド（移動間隔、phase-vocoder のみ）
+    :param engine: ピッチシフトの方式（audio_stream.PITCH_ENGINES のキー）
+    :param workers: 複数チャンネルを並列に処理するスレッド数（None の場合はチャンネル数）
+    :return: ピッチシフト後の波形（入力と同じ形）
+    """
+    if engine not in PITCH_ENGINES:
+        raise ValueError(f"Unknown pitch shift engine: {engine}")
+
+    if y.ndim == 2:
+        # チャンネルごとに並列で処理する（NumPy の FFT と soxr は GIL を解放する）
+        channels = [np.ascontiguousarray(y[:, c]) for c in range(y.shape[1])]
+        with ThreadPoolExecutor(max_workers=workers or len(channels)) as executor:
+            shifted = executor.map(
+                lambda channel: shift_pitch(
+                    channel, sr, n_steps, n_fft=n_fft, hop_length=hop_length, engine=engine
+                ),
+                channels,
+            )
+            return np.stack(list(shifted), axis=1)
+
+    if engine == "phase-vocoder":
+        return librosa.effects.pitch_shift(
+            y=y, sr=sr, n_steps=n_steps, n_fft=n_fft, hop_length=hop_length
+        )
+    return PITCH_ENGINES[engine](sr, n_steps).process(y, last=True)
+
+
+def resample_audio(y, sr, sample_rate):
+    """
+    サンプリングレートが sample_rate より高い場合だけ下げる
+
+    :param y: 波形（(samples,) または (samples, channels)）
+    :param sr: サンプリングレート
+    :param sample_rate: サンプリングレートの上限（None の場合は何もしない）
+    :return: (波形, サンプリングレート)
+    """
+    if not sample_rate or sample_rate >= sr:
+        return y, sr
+    return soxr.resample(y, sr, sample_rate, quality="HQ"), sample_rate
+
+
+def shift_pitch_multi(y, sr, steps, n_fft=2048, hop_length=512, workers=None):
+    """
+    同じ波形に複数のピッチシフトを適用する（STFT は一度だけ計算して共有する）
+
+    librosa.effects.pitch_shift の STFT → フェーズボコーダ → ISTFT → リサンプルのうち、
+    入力の STFT はシフト量によらないため一度だけ計算し、残りをシフトごとに並列で実行する。
+
+    :param y: 波形
+    :param sr: サンプリングレート
+    :param steps: ピッチシフトする半音の数のリスト
     :param n_fft: FFTのウィンドウサイズ
     :param hop_length: ストライド（移動間隔）
+    :param workers: 並列に処理するスレッド数（None の場合は CPU 数）
+    :return: 半音の数からピッチシフト後の波形を返すイテレータ（完了した順）
     """
-    # 入力ファイルの拡張子を取得
-    input_extension = os.path.splitext(input_file)[1].lower()
+    steps = list(dict.fromkeys(steps))
+    stft = None
+    if any(n_steps != 0 for n_steps in steps):
+        stft = librosa.stft(y, n_fft=n_fft, hop_length=hop_length)
+
+    def shift(n_steps):
+        if n_steps == 0:
+            return y.copy()
+        rate = 2.0 ** (-float(n_steps) / 12)
+        stretched = librosa.istft(
+            librosa.phase_vocoder(stft, rate=rate, hop_length=hop_length, n_fft=n_fft),
+            n_fft=n_fft,
+            hop_length=hop_length,
+            dtype=y.dtype,
+            length=int(round(y.shape[-1] / rate)),
+        )
+        shifted = librosa.resample(stretched, orig_sr=float(sr) / rate, target_sr=sr)
+        return librosa.util.fix_length(shifted, size=y.shape[-1])
 
-    # 入力ファイルを AudioSegment で読み込む
-    audio = AudioSegment.from_file(input_file)
+    # NumPy の FFT と soxr は GIL を解放するので、スレッドで並列に処理できる
+    with ThreadPoolExecutor(max_workers=workers or os.cpu_count()) as executor:
+        futures = {executor.submit(shift, n_steps): n_steps for n_steps in steps}
+        for future in as_completed(futures):
+            yield futures[future], future.result()
 
-    # WAV に変換して一時保存
-    temp_wav_file = NamedTemporaryFile(suffix=".wav").name
-    audio.export(temp_wav_file, format="wav")
 
-    # WAV ファイルを librosa で読み込む
-    y, sr = librosa.load(temp_wav_file, sr=None)
+def pitch_shift_batch_to_bytes(
+    input_file,
+    output_format,
+    steps,
+    file_name,
+    probe=None,
+    workers=None,
+    progress=None,
+):
+    """
+    一度デコードした音声から複数のピッチシフトを作成し、zip にまとめて返す
+
+    :param input_file: 入力ファイルのパス
+    :param output_format: 出力形式（拡張子）
+    :param steps: ピッチシフトする半音の数のリスト
+    :param file_name: zip 内のファイル名に使う元のファイル名（拡張子なし）
+    :param probe: probe_audio の結果
+    :param workers: 並列に処理するスレッド数
+    :param progress: 進捗（0〜1）を受け取る関数
+    :return: zip のバイト列（ファイル名は "<元の名前>_+2.<拡張子>" の形式）
+    """
+    y, sr = decode_audio(input_file, probe=probe)
+    steps = list(dict.fromkeys(steps))
+
+    def encode(n_steps, y_shifted):
+        return n_steps, encode_audio(y_shifted, sr, output_format)
+
+    results = {}
+    # エンコード（ffmpeg の場合は別プロセス）もシフトごとに並列で行う
+    with ThreadPoolExecutor(max_workers=workers or os.cpu_count()) as executor:
+        futures = [
+            executor.submit(encode, n_steps, y_shifted)
+            for n_steps, y_shifted in shift_pitch_multi(y, sr, steps, workers=workers)
+        ]
+        for future in as_completed(futures):
+            n_steps, data = future.result()
+            results[n_steps] = data
+            if progress is not None:
+                progress(len(results) / len(steps))
+
+    # 圧縮済みの音声が多いので、zip では圧縮しない
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", compression=zipfile.ZIP_STORED) as archive:
+        for n_steps in steps:
+            archive.writestr(f"{file_name}_{n_steps:+d}.{output_format}", results[n_steps])
+    return buffer.getvalue()
+
+
+def pitch_shift_to_bytes(
+    input_file,
+    output_format,
+    n_steps,
+    n_fft=2048,
+    hop_length=512,
+    probe=None,
+    engine="phase-vocoder",
+    mono=True,
+    sample_rate=None,
+    workers=None,
+):
+    """
+    デコード・ピッチシフト・エンコードをそれぞれ一度だけ行い、結果をバイト列で返す
+
+    :param input_file: 入力ファイルのパス
+    :param output_format: 出力形式（拡張子、例: "mp3"）
+    :param n_steps: ピッチシフトする半音の数
+    :param n_fft: FFTのウィンドウサイズ
+    :param hop_length: ストライド（移動間隔）
+    :param probe: probe_audio の結果（デコードの設定に再利用する）
+    :param engine: ピッチシフトの方式（audio_stream.PITCH_ENGINES のキー）
+    :param mono: True の場合はモノラルにミックスダウンして処理する
+    :param sample_rate: 処理するサンプリングレートの上限（None の場合は元のまま）
+    :param workers: 複数チャンネルを並列に処理するスレッド数
+    :return: エンコード済みのバイト列
+    """
+    # 入力ファイルを NumPy 配列に一度だけデコードする
+    y, sr = decode_audio(input_file, mono=mono, probe=probe)
+    y, sr = resample_audio(y, sr, sample_rate)
 
     # ピッチシフトを適用
-    y_shifted = librosa.effects.pitch_shift(
-        y=y, sr=sr, n_steps=n_steps, n_fft=n_fft, hop_length=hop_length
+    y_shifted = shift_pitch(
+        y, sr, n_steps, n_fft=n_fft, hop_length=hop_length, engine=engine, workers=workers
     )
 
-    # ピッチシフト後の WAV を保存
-    shifted_wav_file = NamedTemporaryFile(suffix=".wav").name
-    sf.write(shifted_wav_file, y_shifted, sr)
+    # 元の形式にメモリ上でエンコードする
+    return encode_audio(y_shifted, sr, output_format)
 
-    # 元の形式に変換して出力
-    shifted_audio = AudioSegment.from_file(shifted_wav_file, format="wav")
-    shifted_audio.export(
-        output_file, format=input_extension[1:]
-    )  # 拡張子を使用して元の形式に戻す
 
-    print(f"ピッチシフト後の音声を保存しました: {output_file}")
+def apply_pitch_shift(
+    input_file,
+    output_file,
+    n_steps,
+    n_fft=2048,
+    hop_length=512,
+    engine="phase-vocoder",
+    mono=True,
+    sample_rate=None,
+):
+    """
+    任意のオーディオ形式に対応したピッチシフト処理を行う関数
 
+    :param input_file: 入力ファイルのパス
+    :param output_file: 出力ファイルのパス
+    :param n_steps: ピッチシフトする半音の数
+    :param n_fft: FFTのウィンドウサイズ
+    :param hop_length: ストライド（移動間隔）
+    :param engine: ピッチシフトの方式（audio_stream.PITCH_ENGINES のキー）
+    :param mono: True の場合はモノラルにミックスダウンして処理する
+    :param sample_rate: 処理するサンプリングレートの上限（None の場合は元のまま）
+    """
+    # 拡張子を使用して元の形式に戻す
+    data = pitch_shift_to_bytes(
+        input_file,
+        audio_format(input_file),
+        n_steps,
+        n_fft=n_fft,
+        hop_length=hop_length,
+        engine=engine,
+        mono=mono,
+        sample_rate=sample_rate,
+    )
+    with open(output_file, "wb") as f:
+        f.write(data)
 
-# オーディオファイルを切り取る
-def clip_audio_file(input_file, output_file, start_time, end_time):
-    # オーディオを読み込む
-    y, sr = librosa.load(input_file, sr=None)
 
-    # サンプル単位で切り取る
-    start_sample = int(start_time * sr)
-    end_sample = int(end_time * sr)
-    clipped_audio = y[start_sample:end_sample]
+# オーディオファイルを切り取る
+def clip_audio_file(
+    input_file, output_file, start_time, end_time, probe=None, stream_copy=False
+):
+    data = clip_audio_to_bytes(
+        input_file,
+        audio_format(output_file),
+        start_time,
+        end_time,
+        probe=probe,
+        stream_copy=stream_copy,
+    )
 
     # 切り取ったオーディオを保存
-    sf.write(output_file, clipped_audio, sr)
+    with open(output_file, "wb") as f:
+        f.write(data)
+
+
+def clip_audio_to_bytes(
+    input_file, output_format, start_time, end_time, probe=None, stream_copy=False
+):
+    """
+    指定した範囲だけをデコードしてオーディオを切り取り、結果をバイト列で返す
+
+    :param input_file: 入力ファイルのパス
+    :param output_format: 出力形式（拡張子）
+    :param start_time: 開始位置（秒）
+    :param end_time: 終了位置（秒）
+    :param probe: probe_audio の結果
+    :param stream_copy: True の場合、可能であれば再エンコードせずにコピーする
+    :return: エンコード済みのバイト列
+    """
+    duration = max(0, end_time - start_time)
 
+    # 圧縮形式はフレーム単位でそのままコピーできる（フレーム境界の精度になる）
+    if stream_copy and output_format in STREAM_COPY_FORMATS:
+        return copy_audio_range(input_file, output_format, start_time, duration)
 
-# オーディオファイルかどうかチェックする
+    y, sr = decode_audio_range(input_file, start_time, duration, probe=probe)
+    return encode_audio(y, sr, output_format)
+
+
+# オーディオファイルかどうかチェックする（ヘッダのみを読み、デコードはしない）
 def is_audio_file(file_path):
     try:
-        # AudioSegment でファイルを読み込む
-        AudioSegment.from_file(file_path)
+        probe_audio(file_path)
         return True
-    except Exception:
+    except AudioProbeError:
         return False
+
+
+def check_audio_file(file_path, max_duration=None):
+    """
+    オーディオファイルかどうかと再生時間の上限をヘッダだけで確認する
+
+    :param file_path: 入力ファイルのパス
+    :param max_duration: 再生時間の上限（秒）。None の場合は確認しない
+    :return: probe_audio の結果（後続のデコードに再利用する）
+    :raises AudioProbeError: 音声ファイルでない場合
+    :raises AudioTooLongError: 再生時間が上限を超える場合
+    """
+    probe = probe_audio(file_path)
+    if max_duration and probe.duration is not None and probe.duration > max_duration:
+        raise AudioTooLongError(
+            f"The audio file is too long. Please select a file under {max_duration / 60:g} minutes."
+        )
+    return probe
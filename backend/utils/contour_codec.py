@@ -0,0 +1,197 @@
+import base64
+import gzip
+import json
+
+import numpy as np
+
+try:
+    import brotli
+except ImportError:  # brotli は任意の依存
+    brotli = None
+
+# 輪郭のバイナリ形式のシグネチャ
+MAGIC = b"CTR1"
+
+CONTENT_TYPE = "application/x-contours"
+COMPACT_FORMAT = "delta-varint"
+
+# これより小さいレスポンスは圧縮しない（バイト）
+COMPRESS_MIN_SIZE = 1024
+
+
+class ContourFormatError(Exception):
+    pass
+
+
+def _zigzag(values):
+    values = values.astype(np.int64)
+    return ((values << 1) ^ (values >> 63)).astype(np.uint64)
+
+
+def _unzigzag(values):
+    values = values.astype(np.int64)
+    return (values >> 1) ^ -(values & 1)
+
+
+def _encode_varints(values):
+    # 符号なし整数を LEB128 の可変長整数の並びにする（1つずつ処理せず配列で計算する）
+    values = values.astype(np.uint64)
+    lengths = np.ones(len(values), dtype=np.int64)
+    for bits in (7, 14, 21, 28, 35, 42, 49, 56, 63):
+        lengths += values >= np.uint64(1 << bits)
+
+    offsets = np.cumsum(lengths) - lengths
+    out = np.zeros(int(lengths.sum()), dtype=np.uint8)
+    for k in range(int(lengths.max(initial=0))):
+        selected = lengths > k
+        byte = (values[selected] >> np.uint64(7 * k)) & np.uint64(0x7F)
+        more = (lengths[selected] > k + 1).astype(np.uint64) << np.uint64(7)
+        out[offsets[selected] + k] = (byte | more).astype(np.uint8)
+    return out.tobytes()
+
+
+def _decode_varints(data):
+    data = np.frombuffer(data, dtype=np.uint8)
+    if len(data) == 0:
+        return np.zeros(0, dtype=np.uint64)
+    if data[-1] & 0x80:
+        raise ContourFormatError("Truncated contour data.")
+
+    ends = np.flatnonzero(data < 0x80)
+    starts = np.concatenate([[0], ends[:-1] + 1])
+    lengths = ends - starts + 1
+    if lengths.max() > 10:
+        raise ContourFormatError("Invalid contour data.")
+
+    groups = np.repeat(np.arange(len(ends)), lengths)
+    positions = np.arange(len(data)) - np.repeat(starts, lengths)
+    parts = (data & 0x7F).astype(np.uint64) << (np.uint64(7) * positions.astype(np.uint64))
+    values = np.zeros(len(ends), dtype=np.uint64)
+    # 各バイトの寄与するビットは重ならないので、OR で合成できる
+    np.bitwise_or.at(values, groups, parts)
+    return values
+
+
+def encode_contours(contours):
+    """
+    輪郭のリストをコンパクトなバイナリ形式にする
+
+    形式: シグネチャ "CTR1" の後に、可変長整数（LEB128）で
+    輪郭の数・各輪郭の点の数・全点の座標の差分（x, y の順、ジグザグ符号化）を並べる。
+    座標は直前の点（最初の点は原点）からの差分なので、密な輪郭ほど小さくなる。
+
+    :param contours: 輪郭（(N, 1, 2) や (N, 2) の配列）のリスト
+    :return: バイト列
+    """
+    arrays = [np.asarray(contour, dtype=np.int64).reshape(-1, 2) for contour in contours]
+    counts = np.array([len(contours)] + [len(a) for a in arrays], dtype=np.int64)
+    points = np.concatenate(arrays) if arrays else np.zeros((0, 2), dtype=np.int64)
+    deltas = np.diff(points, axis=0, prepend=np.zeros((1, 2), dtype=np.int64))
+    return (
+        MAGIC
+        + _encode_varints(counts.astype(np.uint64))
+        + _encode_varints(_zigzag(deltas.reshape(-1)))
+    )
+
+
+def decode_contours(data):
+    """
+    encode_contours の結果を輪郭のリストに戻す
+
+    :param data: バイト列
+    :return: 輪郭（(N, 1, 2) の int32 配列）のリスト
+    :raises ContourFormatError: 形式が正しくない場合
+    """
+    if not data.startswith(MAGIC):
+        raise ContourFormatError("Invalid contour data.")
+    values = _decode_varints(data[len(MAGIC) :])
+    if len(values) == 0:
+        raise ContourFormatError("Invalid contour data.")
+
+    n_contours = int(values[0])
+    counts = values[1 : 1 + n_contours].astype(np.int64)
+    deltas = _unzigzag(values[1 + n_contours :])
+    if len(counts) != n_contours or len(deltas) != 2 * counts.sum():
+        raise ContourFormatError("Invalid contour data.")
+
+    if n_contours == 0:
+        return []
+    points = np.cumsum(deltas.reshape(-1, 2), axis=0).astype(np.int32)
+    return [
+        contour.reshape(-1, 1, 2) for contour in np.split(points, np.cumsum(counts)[:-1])
+    ]
+
+
+def contours_to_json(contours):
+    """
+    輪郭のリストを以前の JSON 形式（[[[x, y]], ...] のリスト）の文字列にする
+    """
+    return json.dumps([np.asarray(contour).tolist() for contour in contours])
+
+
+def contours_from_json(text):
+    """
+    フロントエンドから送られた JSON 形式の輪郭を読み込む
+    """
+    try:
+        return json.loads(text)
+    except json.JSONDecodeError:
+        raise ContourFormatError("Invalid contour data.")
+
+
+def encode_contours_base64(contours):
+    return base64.b64encode(encode_contours(contours)).decode("ascii")
+
+
+def decode_contours_base64(text):
+    try:
+        data = base64.b64decode(text, validate=True)
+    except ValueError:
+        raise ContourFormatError("Invalid contour data.")
+    return decode_contours(data)
+
+
+def accepted_encodings(accept_encoding):
+    """
+    Accept-Encoding をコーディングごとの q 値にする（q=0 は受け付けないことを表す）
+
+    :return: {コーディング（小文字）: q 値}
+    """
+    accepted = {}
+    for token in (accept_encoding or "").split(","):
+        coding, *params = [part.strip() for part in token.split(";")]
+        if not coding:
+            continue
+        q = 1.0
+        for param in params:
+            name, _, value = param.partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        accepted[coding.lower()] = q
+    return accepted
+
+
+def compress(data, accept_encoding):
+    """
+    Accept-Encoding に応じてレスポンスを圧縮する
+
+    q 値が 0 のコーディングは使わない。br と gzip の両方を受け付ける場合は q 値の大きい方
+    （同じなら br）を使う。「*」は指定のないコーディングの q 値になる。
+
+    :return: (圧縮後のバイト列, Content-Encoding。圧縮しない場合は None)
+    """
+    if len(data) < COMPRESS_MIN_SIZE:
+        return data, None
+    accepted = accepted_encodings(accept_encoding)
+    default = accepted.get("*", 0.0)
+    candidates = ["br", "gzip"] if brotli is not None else ["gzip"]
+    qualities = {coding: accepted.get(coding, default) for coding in candidates}
+    coding = max(candidates, key=lambda c: qualities[c])
+    if qualities[coding] <= 0:
+        return data, None
+    if coding == "br":
+        return brotli.compress(data, quality=5), "br"
+    return gzip.compress(data, compresslevel=6), "gzip"
@@ -0,0 +1,131 @@
+import atexit
+import os
+import subprocess
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+
+
+class FfmpegPool:
+    """
+    ffmpeg のプロセスを事前に起動しておき、エンコードのたびに起動を待たずに使うプール
+
+    ffmpeg は1つのプロセスで1つの出力しか書けないため、プロセスは1回ごとに使い捨てにし、
+    使った分はバックグラウンドで起動し直して補充する（プロセスの起動はリクエストの外で行われる）。
+    起動しておくプロセスはコマンドライン（形式・サンプリングレート・チャンネル数など）ごとに分け、
+    最近使った max_commands 種類だけを残す。
+    """
+
+    def __init__(self, size=2, max_commands=4):
+        """
+        :param size: コマンドラインごとに起動しておくプロセス数（0 の場合は毎回起動する）
+        :param max_commands: 起動しておくコマンドラインの種類数の上限
+        """
+        self.size = size
+        self.max_commands = max_commands
+        self._idle = OrderedDict()
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+
+    def acquire(self, command):
+        """
+        コマンドラインに対応するプロセスを取り出す（起動済みのものがなければ起動する）
+
+        標準入力・標準出力はパイプ、標準エラー出力は捨てる。
+        取り出したプロセスは呼び出し側で終了まで待つこと。
+
+        :param command: ffmpeg のコマンドライン（リスト）
+        :return: subprocess.Popen
+        """
+        key = tuple(command)
+        process = None
+        with self._lock:
+            self._reset_after_fork()
+            idle = self._idle.get(key, [])
+            while idle and process is None:
+                candidate = idle.pop()
+                # 待機中に終了したプロセスは使わない
+                if candidate.poll() is None:
+                    process = candidate
+            if self.size > 0:
+                self._idle[key] = idle
+                self._idle.move_to_end(key)
+                self._evict()
+        if process is None:
+            process = _spawn(key)
+        if self.size > 0:
+            threading.Thread(target=self._refill, args=(key,), daemon=True).start()
+        return process
+
+    def close(self):
+        """
+        待機中のプロセスをすべて終了する
+        """
+        with self._lock:
+            idle, self._idle = self._idle, OrderedDict()
+        for processes in idle.values():
+            _terminate(processes)
+
+    def _refill(self, key):
+        while True:
+            with self._lock:
+                idle = self._idle.get(key)
+                if idle is None or len(idle) >= self.size:
+                    return
+            try:
+                process = _spawn(key)
+            except OSError:
+                return
+            with self._lock:
+                idle = self._idle.get(key)
+                if idle is not None and len(idle) < self.size:
+                    idle.append(process)
+                    continue
+            # 補充している間に追い出された、または埋まった場合
+            _terminate([process])
+            return
+
+    def _evict(self):
+        while len(self._idle) > self.max_commands:
+            _, processes = self._idle.popitem(last=False)
+            _terminate(processes)
+
+    def _reset_after_fork(self):
+        # fork した子プロセスは親が起動したプロセスを使わない（親のパイプを閉じずに手放す）
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._idle = OrderedDict()
+
+
+def _spawn(key):
+    return subprocess.Popen(
+        list(key),
+        stdin=subprocess.PIPE,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL,
+    )
+
+
+def _terminate(processes):
+    for process in processes:
+        process.kill()
+        process.wait()
+        process.stdin.close()
+        process.stdout.close()
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_ffmpeg_pool():
+    """
+    設定（AUDIO_FFMPEG_POOL_SIZE）に従ったプロセス内で共有のプールを返す
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = FfmpegPool(size=getattr(settings, "AUDIO_FFMPEG_POOL_SIZE", 2))
+            atexit.register(_pool.close)
+        return _pool
@@ -0,0 +1,129 @@
+import numpy as np
+from PIL import Image, ImageFile
+
+# PIL の raw デコーダの rawmode ごとの 1画素のバイト数
+# （この rawmode で保存されている画像は、必要な行・列だけをファイルから読む）
+RAW_PIXEL_BYTES = {
+    "L": 1,
+    "LA": 2,
+    "RGB": 3,
+    "BGR": 3,
+    "RGBA": 4,
+    "BGRA": 4,
+    "RGBX": 4,
+    "BGRX": 4,
+}
+
+# 透明度を持つ（RGBA として読み込む）モード
+ALPHA_MODES = {"RGBA", "LA", "PA", "RGBa", "La"}
+
+
+def image_mode(image):
+    """
+    画像を読み込むときのモードを返す（透明度を持つ画像は RGBA、それ以外は RGB）
+
+    :param image: PIL.Image.open で開いた画像（まだ読み込んでいなくてよい）
+    """
+    if image.mode in ALPHA_MODES or "transparency" in image.info:
+        return "RGBA"
+    return "RGB"
+
+
+def image_megapixels(image_path):
+    """
+    画像のヘッダだけを読み、画素数（メガピクセル）を返す
+
+    :return: メガピクセル。画像として読めない場合は None
+    """
+    try:
+        with Image.open(image_path) as image:
+            width, height = image.size
+    except (OSError, ValueError, Image.DecompressionBombError):
+        return None
+    return width * height / 1e6
+
+
+def read_window(image, box):
+    """
+    画像の一部（box の範囲）だけを NumPy 配列として読み込む
+
+    非圧縮の形式（BMP・PPM・非圧縮の TIFF など）は box に含まれる行・列だけをファイルから読むので、
+    メモリ使用量は画像全体ではなく box の大きさに比例する。
+    PNG（インターレースなし）は box の下端の行までだけをデコードし、それ以外の形式（JPEG など）は
+    画像全体を1回だけデコードしてから切り出す。
+
+    :param image: PIL.Image.open で開いた（まだ読み込んでいない）画像。読み込み後は使えなくなる
+    :param box: 読み込む範囲 (x0, y0, x1, y1)
+    :return: (高さ, 幅, チャンネル) の配列（チャンネルは image_mode の RGB または RGBA）
+    """
+    mode = image_mode(image)
+    window = _read_raw_window(image, box)
+    if window is None:
+        _limit_rows(image, box[3])
+        window = image.crop(box)
+    if window.mode != mode:
+        window = window.convert(mode)
+    return np.asarray(window)
+
+
+def _read_raw_window(image, box):
+    """
+    非圧縮の画像のタイル（PIL の image.tile）を box と重なる部分に置き換えて読み込む
+
+    :return: box の大きさの画像。非圧縮でない場合は None
+    """
+    if not image.tile or any(tile[0] != "raw" for tile in image.tile):
+        return None
+
+    x0, y0, x1, y1 = box
+    tiles = []
+    for _, (tx0, ty0, tx1, ty1), offset, args in image.tile:
+        # args は rawmode だけ、または (rawmode, 1行のバイト数, 行の向き)
+        args = args if isinstance(args, tuple) else (args,)
+        rawmode = args[0]
+        stride = args[1] if len(args) > 1 else 0
+        orientation = args[2] if len(args) > 2 else 1
+        pixel_bytes = RAW_PIXEL_BYTES.get(rawmode)
+        if pixel_bytes is None:
+            return None
+
+        # タイルと box の重なる範囲
+        ix0, iy0 = max(tx0, x0), max(ty0, y0)
+        ix1, iy1 = min(tx1, x1), min(ty1, y1)
+        if ix0 >= ix1 or iy0 >= iy1:
+            continue
+
+        stride = stride or (tx1 - tx0) * pixel_bytes
+        # 重なる範囲の先頭の行（下から上に並ぶ形式（BMP）では一番下の行）のファイル上の位置
+        row = iy0 - ty0 if orientation > 0 else ty1 - iy1
+        tiles.append(
+            _tile(
+                "raw",
+                (ix0 - x0, iy0 - y0, ix1 - x0, iy1 - y0),
+                offset + row * stride + (ix0 - tx0) * pixel_bytes,
+                (rawmode, stride, orientation),
+            )
+        )
+
+    # 画像の大きさを box に変えて、重なるタイルだけをデコードする
+    image._size = (x1 - x0, y1 - y0)
+    image.tile = tiles
+    image.load()
+    return image
+
+
+def _limit_rows(image, rows):
+    """
+    PNG の場合、先頭から rows 行だけをデコードするようにする（それ以降の行は読まない）
+    """
+    if len(image.tile) != 1 or image.tile[0][0] != "zip" or image.info.get("interlace"):
+        return
+    _, (x0, y0, x1, _), offset, args = image.tile[0]
+    image._size = (image.width, rows)
+    image.tile = [_tile("zip", (x0, y0, x1, rows), offset, args)]
+
+
+def _tile(*fields):
+    # Pillow 11.1 以降はタイルを名前付きタプル（ImageFile._Tile）で扱う
+    tile_class = getattr(ImageFile, "_Tile", None)
+    return tile_class(*fields) if tile_class is not None else fields
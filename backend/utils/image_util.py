@@ -1,11 +1,17 @@
-import sys
+import io
+import json
+import os
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+
 import cv2
 import numpy as np
 
-from ultralytics import YOLO
-from PIL import Image
-
-np.set_printoptions(threshold=sys.maxsize)
+from django.conf import settings
+from PIL import Image, ExifTags
+from utils.image_io import image_mode, read_window
+from utils.inference_batcher import get_batcher
+from utils.model_registry import MODEL_WEIGHTS, registry
 
 
 def unsharp_masking(img, kx, ky, sigx, sigy, k):
@@ -17,60 +23,569 @@ def unsharp_masking(img, kx, ky, sigx, sigy, k):
     return result
 
 
-def get_contours(image_path):
-    image = cv2.imread(image_path)
-    im_th_tz = unsharp_masking(image, 3, 3, 2, 2, 3)
-    model = YOLO("yolov8m-seg.pt")
-    results = model(im_th_tz)
+def sharpen(img, ksize=3, sigma=2, k=3):
+    """
+    unsharp_masking(img, ksize, ksize, sigma, sigma, k) と同じ処理を1回の畳み込みで行う
+
+    元画像 + k × (元画像 - ぼかした画像) を1つのカーネル (1 + k) × δ - k × ガウシアン にまとめるので、
+    中間の配列を作らない（結果は unsharp_masking と同じく int16、丸めの差は ±1 程度）。
+    """
+    gaussian = cv2.getGaussianKernel(ksize, sigma)
+    kernel = -k * (gaussian @ gaussian.T)
+    kernel[ksize // 2, ksize // 2] += 1 + k
+    return cv2.filter2D(img, cv2.CV_16S, kernel)
+
+
+ORIENTATION_TAG = ExifTags.Base.Orientation
+
+# 縮小してデコードする倍率と cv2.imread のフラグ（JPEG は DCT の段階で縮小される）
+REDUCED_READ_FLAGS = {
+    2: cv2.IMREAD_REDUCED_COLOR_2,
+    4: cv2.IMREAD_REDUCED_COLOR_4,
+    8: cv2.IMREAD_REDUCED_COLOR_8,
+}
+
+
+def reduction_factor(width, height, size):
+    """
+    長辺が size を下回らない範囲で最も大きい縮小の倍率（1, 2, 4, 8）を返す
+    """
+    factor = 1
+    while factor < 8 and size > 0 and max(width, height) / (factor * 2) >= size:
+        factor *= 2
+    return factor
+
+
+def load_inference_image(image_path, size=None):
+    """
+    輪郭抽出（推論）に使う画像を読み込む
+
+    モデルは長辺 640 ピクセル程度に縮小して推論するので、それより十分大きい画像は
+    縮小してデコードする（JPEG は画像全体を展開しない）。
+
+    :param size: 長辺の目安（None の場合は設定値 CONTOUR_INFERENCE_SIZE）
+    :return: (画像（BGR）, (横の倍率, 縦の倍率))。倍率は元画像の座標 ÷ 読み込んだ画像の座標。
+        画像として読み込めない場合、画像は None
+    """
+    if size is None:
+        size = getattr(settings, "CONTOUR_INFERENCE_SIZE", 0)
+
+    width = height = None
+    try:
+        # ヘッダだけを読む（cv2.imread と同じく EXIF の向きを反映した大きさにする）
+        with Image.open(image_path) as header:
+            width, height = header.size
+            if header.getexif().get(ORIENTATION_TAG) in (5, 6, 7, 8):
+                width, height = height, width
+    except (OSError, ValueError):
+        pass
+
+    factor = reduction_factor(width, height, size) if width else 1
+    if factor == 1:
+        return cv2.imread(image_path), (1.0, 1.0)
+
+    image = cv2.imread(image_path, REDUCED_READ_FLAGS[factor])
+    if image is None:
+        return None, (1.0, 1.0)
+    return image, (width / image.shape[1], height / image.shape[0])
+
+
+def scale_contours(contours, scale):
+    """
+    縮小した画像で求めた輪郭（画素の座標）を元画像の座標に戻す
+
+    縮小した画像の1画素は元画像の scale 画素分にあたるので、輪郭の各点を画素の中心に対応させたうえで、
+    領域の外側に向かって画素の端まで（(scale - 1) / 2 画素）広げる。
+
+    :param contours: 輪郭（OpenCV の形式 (N, 1, 2)）のリスト
+    :param scale: (横の倍率, 縦の倍率)
+    """
+    scale = np.asarray(scale, dtype=np.float64)
+    if np.all(scale == 1):
+        return contours
+
+    scaled = []
+    for contour in contours:
+        points = contour.reshape(-1, 2).astype(np.float64)
+        # 前後の点から求めた接線を回転させた外向きの法線（findContours の輪郭は、外側の輪郭も
+        # 穴の輪郭も領域を左手に見る向きなので (-dy, dx) が領域の外側）
+        tangent = np.roll(points, -1, axis=0) - np.roll(points, 1, axis=0)
+        normal = np.stack([-tangent[:, 1], tangent[:, 0]], axis=1)
+        # 斜めの角でも縦横それぞれ画素の端まで広げる
+        length = np.abs(normal).max(axis=1, keepdims=True)
+        normal = np.divide(normal, length, out=np.zeros_like(normal), where=length > 0)
+        points = (points + 0.5) * scale - 0.5 + normal * (scale - 1) / 2
+        scaled.append(np.round(points).astype(np.int32).reshape(-1, 1, 2))
+    return scaled
+
+
+def model_version(model_size=None):
+    """
+    結果のキャッシュキーに使うモデルの識別子（重みファイル名）を返す
+    """
+    return MODEL_WEIGHTS[registry.resolve_size(model_size)]
+
+
+def predict_segmentation(image, model_size=None):
+    """
+    1枚の画像に対してセグメンテーション推論を行う
+
+    YOLO_BATCH_WINDOW_MS が設定されている場合は、同時に届いたリクエストと
+    まとめてバッチ推論する。
+
+    :param image: 推論対象の画像（NumPy配列）
+    :param model_size: モデルサイズ（n/s/m）
+    :return: ultralytics の Results
+    """
+    size = registry.resolve_size(model_size)
+    window_ms = getattr(settings, "YOLO_BATCH_WINDOW_MS", 0)
+    if window_ms <= 0:
+        # プロセス内で共有しているモデルを使う（初回のみ読み込み）
+        return registry.predict(image, size=size)[0]
+
+    batcher = get_batcher(
+        size,
+        lambda images: registry.predict(images, size=size),
+        window_ms=window_ms,
+        max_batch=getattr(settings, "YOLO_BATCH_MAX_SIZE", 8),
+    )
+    return batcher.predict(image)
+
+
+def get_contours(image_path, model_size=None, method=None, epsilon=None, size=None):
+    """
+    画像から物体の輪郭を抽出する
+
+    大きい画像は縮小して読み込み、縮小した画像だけを鮮鋭化して推論する（load_inference_image）。
+    輪郭は元画像の座標で返す。
+
+    :param image_path: 画像ファイルのパス
+    :param model_size: モデルサイズ（n/s/m）
+    :param method: 輪郭の求め方（None の場合は設定値 CONTOUR_METHOD）
+    :param epsilon: 輪郭を単純化する許容誤差（ピクセル、None の場合は設定値 CONTOUR_EPSILON）
+    :param size: 読み込むときの長辺の目安（None の場合は設定値 CONTOUR_INFERENCE_SIZE）
+    :return: 輪郭（OpenCV の形式 (N, 1, 2)）のリスト
+    """
+    image, scale = load_inference_image(image_path, size)
+    result = predict_segmentation(sharpen(image), model_size=model_size)
+
+    polygons = result.masks.xy if result.masks else []
+    return inference_contours(image, polygons, scale, method=method, epsilon=epsilon)
+
+
+def inference_contours(image, polygons, scale, method=None, epsilon=None):
+    """
+    推論に使った（縮小した）画像の座標のポリゴンから、元画像の座標の輪郭を求める
+
+    :param image: 推論に使った画像（BGR）
+    :param polygons: 物体ごとのポリゴン（image の座標、result.masks.xy）
+    :param scale: load_inference_image が返した倍率
+    :param method: masks_to_contours と同じ
+    :param epsilon: 元画像の座標での cv2.approxPolyDP の許容誤差（ピクセル）
+    :return: 輪郭（OpenCV の形式 (N, 1, 2)）のリスト
+    """
+    if method is None:
+        method = getattr(settings, "CONTOUR_METHOD", "exact")
+    if epsilon is None:
+        epsilon = getattr(settings, "CONTOUR_EPSILON", 0)
+
+    # モデルのポリゴンは画素の端を基準にした連続の座標なので、そのまま拡大できる
+    scaled = [np.asarray(polygon, dtype=np.float64).reshape(-1, 2) * scale for polygon in polygons]
+    if method == "polygon" or np.all(np.asarray(scale) == 1):
+        contours = masks_to_contours(image, scaled, method=method, epsilon=0)
+    elif method == "exact":
+        contours = []
+        for polygon, full_size in zip(polygons, scaled):
+            if len(polygon) and not _has_background(image, polygon):
+                # ポリゴンの内側に黒い画素がなければ、元の大きさで求める輪郭はポリゴンを塗った領域の
+                # 輪郭になるので、拡大したポリゴンをそのまま使う
+                contours.append(full_size.astype(np.int32).reshape(-1, 1, 2))
+            else:
+                traced = masks_to_contours(image, [polygon], method=method, epsilon=0)
+                contours.extend(scale_contours(traced, scale))
+    else:
+        raise ValueError(f"Unknown contour method: {method}")
+
+    if epsilon > 0:
+        contours = [cv2.approxPolyDP(contour, epsilon, True) for contour in contours]
+    return contours
+
+
+def masks_to_contours(image, polygons, method=None, epsilon=None):
+    """
+    YOLO が出力したマスクのポリゴンから輪郭を求める
+
+    method には次のいずれかを指定する。
+
+    - "exact": 物体ごとにポリゴンを塗りつぶし、元画像の黒い画素を除いた領域の輪郭を求める。
+      処理は物体のバウンディングボックスの範囲だけで行う（画像全体で行っていた以前の処理と同じ結果）
+    - "polygon": モデルが低解像度のマスクから求めたポリゴンをそのまま使う（画素の走査をしない）
+
+    :param image: 元画像（BGR）
+    :param polygons: 物体ごとのポリゴン（元画像の座標、result.masks.xy）
+    :param method: "exact" または "polygon"
+    :param epsilon: cv2.approxPolyDP の許容誤差（ピクセル）。0 の場合は単純化しない
+    :return: 輪郭（OpenCV の形式 (N, 1, 2)）のリスト
+    """
+    if method is None:
+        method = getattr(settings, "CONTOUR_METHOD", "exact")
+    if epsilon is None:
+        epsilon = getattr(settings, "CONTOUR_EPSILON", 0)
+
+    if method == "polygon":
+        contours = [
+            np.array(polygon, dtype=np.int32).reshape(-1, 1, 2)
+            for polygon in polygons
+            if len(polygon)
+        ]
+    elif method == "exact":
+        contours = _trace_masks(image, polygons)
+    else:
+        raise ValueError(f"Unknown contour method: {method}")
+
+    if epsilon > 0:
+        contours = [cv2.approxPolyDP(contour, epsilon, True) for contour in contours]
+    return contours
+
+
+def _has_background(image, polygon):
+    """
+    ポリゴンの内側に、_trace_masks が除く黒い画素（グレースケールで 1 以下）があるか
+    """
+    contour = np.array(polygon, dtype=np.int32)
+    height, width = image.shape[:2]
+    x, y, w, h = cv2.boundingRect(contour)
+    x0, y0 = max(x, 0), max(y, 0)
+    x1, y1 = min(x + w, width), min(y + h, height)
+    if x0 >= x1 or y0 >= y1:
+        return True
+
+    mask = np.zeros((y1 - y0, x1 - x0), dtype=np.uint8)
+    cv2.fillPoly(mask, [contour], 255, offset=(-x0, -y0))
+    gray = cv2.cvtColor(image[y0:y1, x0:x1], cv2.COLOR_BGR2GRAY)
+    return bool(np.any((mask > 0) & (gray <= 1)))
+
+
+def _trace_masks(image, polygons):
+    height, width = image.shape[:2]
+    # 元画像の黒くない画素（グレースケールで 1 より大きい画素）は画像全体で一度だけ求める
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    foreground = np.where(gray > 1, np.uint8(255), np.uint8(0))
 
     contours = []
-    for i, mask in enumerate(results[0].masks.xy if results[0].masks else []):
-        contour = np.array(mask, dtype=np.int32)  # 形状を整える
-        mask_img = np.zeros_like(image[:, :, 0])
-        cv2.fillPoly(mask_img, [contour], 255)  # 輪郭部分を白に塗りつぶす
-
-        # 元画像にマスクを適用
-        masked_img = cv2.bitwise_and(image, image, mask=mask_img)
-        gray = cv2.cvtColor(masked_img, cv2.COLOR_BGR2GRAY)
-        _, thresh = cv2.threshold(gray, 1, 255, cv2.THRESH_BINARY)
-        cons = cv2.findContours(thresh, cv2.RETR_TREE, cv2.CHAIN_APPROX_NONE)[0]
+    for polygon in polygons:
+        contour = np.array(polygon, dtype=np.int32)  # 形状を整える
+        if len(contour) == 0:
+            continue
+
+        # ポリゴンのバウンディングボックス（外周に 1 画素の余白を付ける）だけを処理する
+        x, y, w, h = cv2.boundingRect(contour)
+        x0, y0 = max(x - 1, 0), max(y - 1, 0)
+        x1, y1 = min(x + w + 1, width), min(y + h + 1, height)
+        if x0 >= x1 or y0 >= y1:
+            continue
+
+        mask_img = np.zeros((y1 - y0, x1 - x0), dtype=np.uint8)
+        cv2.fillPoly(mask_img, [contour], 255, offset=(-x0, -y0))  # 輪郭部分を白に塗りつぶす
+        cv2.bitwise_and(mask_img, foreground[y0:y1, x0:x1], dst=mask_img)
+        cons = cv2.findContours(
+            mask_img, cv2.RETR_TREE, cv2.CHAIN_APPROX_NONE, offset=(x0, y0)
+        )[0]
         contours.extend(cons)
 
     return contours
 
 
-def image_clip(image_path, output_path, contours):
-    # PILで画像を開き、NumPy配列に変換
-    original_image = Image.open(image_path)
-    image_np = np.array(original_image)
+def image_clip(image_path, output_path, contours, crop=False, transparent=False):
+    # 切り抜いた画像を保存
+    cv2.imwrite(output_path, clip_image_array(image_path, contours, crop, transparent))
+
+
+def encode_image(image, extension):
+    """
+    画像を拡張子の形式でメモリ上にエンコードする
+
+    :param image: 画像（NumPy配列、BGR または BGRA）
+    :param extension: 拡張子（例: ".png"）
+    :return: エンコード済みのバイト列
+    """
+    ok, buffer = cv2.imencode(extension.lower(), image)
+    if not ok:
+        raise ValueError(f"Could not encode image as {extension}")
+    return buffer.tobytes()
+
+
+def polygons_box(polygons, width, height):
+    """
+    ポリゴンをすべて囲む矩形を、画像の範囲に収めて返す
+
+    :param polygons: ポリゴン（int32 の配列 (N, 1, 2)）のリスト
+    :return: (x0, y0, x1, y1)。画像と重ならない場合は None
+    """
+    points = [polygon.reshape(-1, 2) for polygon in polygons if len(polygon)]
+    if not points:
+        return None
+    points = np.concatenate(points)
+    x0, y0 = np.maximum(points.min(axis=0), 0)
+    x1, y1 = np.minimum(points.max(axis=0) + 1, (width, height))
+    if x0 >= x1 or y0 >= y1:
+        return None
+    return int(x0), int(y0), int(x1), int(y1)
+
+
+def contour_objects(polygons):
+    """
+    輪郭を物体ごと（外側の輪郭とその穴の輪郭）にまとめる
+
+    findContours の RETR_CCOMP の階層と同じく、別の輪郭に完全に含まれる輪郭をその穴とし、
+    穴の中の輪郭は別の物体とする。一部だけが重なる輪郭は別々の物体になる。
+
+    :param polygons: ポリゴン（int32 の配列 (N, 1, 2)）のリスト
+    :return: (外側の輪郭, [穴の輪郭, ...]) のリスト（外側の輪郭の順）
+    """
+    areas = [abs(cv2.contourArea(polygon)) if len(polygon) else 0.0 for polygon in polygons]
+    # 大きい順に並べ、自分より大きい輪郭のうち最も内側で自分を含むものを親にする
+    order = sorted(range(len(polygons)), key=lambda i: -areas[i])
+    parent = [-1] * len(polygons)
+    depth = [0] * len(polygons)
+    for position, i in enumerate(order):
+        for j in reversed(order[:position]):
+            if areas[j] > areas[i] and _contains(polygons[j], polygons[i]):
+                parent[i], depth[i] = j, depth[j] + 1
+                break
+
+    objects = {i: (polygons[i], []) for i in range(len(polygons)) if depth[i] % 2 == 0}
+    for i in range(len(polygons)):
+        if depth[i] % 2 == 1:
+            objects[parent[i]][1].append(polygons[i])
+    return list(objects.values())
+
+
+def _contains(outer, inner, max_points=256):
+    # 外接矩形で絞り込んでから、内側の輪郭の頂点（多い場合は間引く）がすべて外側の輪郭上か内側にあるかを調べる
+    if not len(outer) or not len(inner):
+        return False
+    ox, oy, ow, oh = cv2.boundingRect(outer)
+    ix, iy, iw, ih = cv2.boundingRect(inner)
+    if ix < ox or iy < oy or ix + iw > ox + ow or iy + ih > oy + oh:
+        return False
+    points = inner.reshape(-1, 2)
+    points = points[:: max(1, len(points) // max_points)]
+    return all(
+        cv2.pointPolygonTest(outer, (float(x), float(y)), False) >= 0 for x, y in points
+    )
+
+
+def label_objects(objects, box):
+    """
+    物体ごとの領域を1枚のラベル画像（box の範囲）に塗る
+
+    物体 k の領域（外側の輪郭の内側で、穴の内側を除く）の画素を k + 1 にする。
+    物体どうしが重なる部分は後の物体になる。
+
+    :param objects: contour_objects の結果
+    :param box: ラベル画像の範囲 (x0, y0, x1, y1)
+    :return: ラベル画像（int32、背景は 0）
+    """
+    x0, y0, x1, y1 = box
+    labels = np.zeros((y1 - y0, x1 - x0), dtype=np.int32)
+    for k, (outer, holes) in enumerate(objects):
+        object_box = _object_box(outer, box)
+        if object_box is None:
+            continue
+        # 物体の外接矩形の範囲だけでマスクを作り、ラベル画像に書き込む
+        bx0, by0, bx1, by1 = object_box
+        mask = np.zeros((by1 - by0, bx1 - bx0), dtype=np.uint8)
+        cv2.fillPoly(mask, [outer, *holes], 255, offset=(-bx0, -by0))
+        labels[by0 - y0 : by1 - y0, bx0 - x0 : bx1 - x0][mask > 0] = k + 1
+    return labels
+
+
+def _object_box(outer, box):
+    # 物体の外側の輪郭を囲む矩形のうち box に含まれる範囲
+    object_box = polygons_box([outer], box[2], box[3])
+    if object_box is None:
+        return None
+    bx0, by0 = max(object_box[0], box[0]), max(object_box[1], box[1])
+    if bx0 >= object_box[2] or by0 >= object_box[3]:
+        return None
+    return bx0, by0, object_box[2], object_box[3]
 
-    # RGB → BGRに変換（色の問題解決）
-    if image_np.shape[2] == 4:
-        # RGBAの場合
-        image_bgr = cv2.cvtColor(image_np[:, :, :3], cv2.COLOR_RGB2BGR)
-        alpha_channel = image_np[:, :, 3]
-    else:
-        image_bgr = cv2.cvtColor(image_np, cv2.COLOR_RGB2BGR)
 
-    # shape確認
-    height, width = image_bgr.shape[:2]
+def _read_polygons_window(image_path, polygons):
+    # ポリゴンをすべて囲む矩形の範囲だけを読み込む
+    with Image.open(image_path) as image:
+        width, height = image.size
+        mode = image_mode(image)
+        box = polygons_box(polygons, width, height)
+        window = read_window(image, box) if box is not None else None
+    return window, box, (width, height), mode
 
-    # マスクを作成（黒背景）
-    mask = np.zeros((height, width), dtype=np.uint8)
 
-    # 輪郭の領域を白に塗る
-    contours = np.array(contours, np.int32)
-    cv2.fillPoly(mask, [contours], 255)
+def _to_polygons(contours):
+    # 1つの輪郭だけが渡された場合も受け付ける
+    if len(contours) and np.ndim(contours[0]) == 1:
+        contours = [contours]
+    return [np.array(contour, np.int32).reshape(-1, 1, 2) for contour in contours]
 
-    # マスクを適用して物体以外を黒くする
-    cutout_bgr = cv2.bitwise_and(image_bgr, image_bgr, mask=mask)
 
-    # RGBA対応の場合
-    if image_np.shape[2] == 4:
-        cutout_alpha = cv2.bitwise_and(alpha_channel, alpha_channel, mask=mask)
-        cutout = cv2.merge((cutout_bgr, cutout_alpha))
+def clip_image_array(image_path, contours, crop=False, transparent=False):
+    """
+    画像を輪郭に沿って切り抜く（輪郭の外側は黒、RGBA の場合は透明になる）
+
+    画像のうち輪郭を囲む矩形の範囲だけを読み込み、マスクもその範囲だけで作る
+    （非圧縮の形式は、その範囲の画素だけをファイルから読む。utils.image_io.read_window）。
+    複数の輪郭は物体ごとにまとめ（contour_objects）、穴を除いたすべての物体の領域を切り抜く。
+
+    :param crop: 輪郭を囲む矩形の大きさで返すか（False の場合は元画像と同じ大きさ）
+    :param transparent: 輪郭の外側を透明にするか（RGB の画像も BGRA で返す）
+    :return: 切り抜いた画像（NumPy配列、BGR または BGRA）。輪郭が画像と重ならない場合、
+        crop では 1×1 の画像
+    """
+    polygons = _to_polygons(contours)
+    window, box, (width, height), mode = _read_polygons_window(image_path, polygons)
+    channels = 4 if transparent or mode == "RGBA" else 3
+    if box is None:
+        return np.zeros((1, 1, channels) if crop else (height, width, channels), np.uint8)
+
+    # 物体の領域を白に塗ったマスク（矩形の範囲だけ）
+    x0, y0, x1, y1 = box
+    labels = label_objects(contour_objects(polygons), box)
+    mask = cv2.compare(labels, 0, cv2.CMP_GT)
+
+    # RGB → BGRに変換し、物体以外を黒くする
+    image_bgr = cv2.cvtColor(window[:, :, :3], cv2.COLOR_RGB2BGR)
+    cutout = cv2.bitwise_and(image_bgr, image_bgr, mask=mask)
+    if channels == 4:
+        alpha = mask if window.shape[2] == 3 else np.minimum(window[:, :, 3], mask)
+        cutout = cv2.merge((cutout, alpha))
+
+    if crop:
+        return cutout
+
+    # 元画像と同じ大きさの黒（透明）の画像に貼り付ける
+    result = np.zeros((height, width, channels), dtype=np.uint8)
+    result[y0:y1, x0:x1] = cutout
+    return result
+
+
+def clip_objects(image_path, contours, workers=None):
+    """
+    画像を1回だけ読み込み、物体ごとに外接矩形の大きさの透明な画像として切り抜く
+
+    輪郭は物体ごとにまとめ（contour_objects）、すべての物体を1枚のラベル画像に塗ってから
+    物体ごとの切り抜きを並列に作る。
+
+    :param image_path: 画像のパス
+    :param contours: 輪郭のリスト（穴の輪郭を含んでよい）
+    :param workers: 並列に処理するスレッド数（None の場合は CPU 数）
+    :return: (物体の番号, 切り抜いた画像（BGRA）, 元画像での位置 (x, y)) のリスト。
+        画像と重ならない物体は含まない
+    """
+    polygons = _to_polygons(contours)
+    window, box, _, _ = _read_polygons_window(image_path, polygons)
+    if box is None:
+        return []
+    objects = contour_objects(polygons)
+    labels = label_objects(objects, box)
+    x0, y0 = box[:2]
+
+    def cut(k):
+        object_box = _object_box(objects[k][0], box)
+        if object_box is None:
+            return None
+        bx0, by0, bx1, by1 = object_box
+        region = (slice(by0 - y0, by1 - y0), slice(bx0 - x0, bx1 - x0))
+        mask = cv2.compare(labels[region], k + 1, cv2.CMP_EQ)
+        if not cv2.countNonZero(mask):
+            # ほかの物体にすべて覆われている場合
+            return None
+        pixels = window[region]
+        image_bgr = cv2.cvtColor(pixels[:, :, :3], cv2.COLOR_RGB2BGR)
+        cutout = cv2.bitwise_and(image_bgr, image_bgr, mask=mask)
+        alpha = mask if pixels.shape[2] == 3 else np.minimum(pixels[:, :, 3], mask)
+        return k, cv2.merge((cutout, alpha)), (bx0, by0)
+
+    with ThreadPoolExecutor(max_workers=workers or os.cpu_count()) as executor:
+        results = list(executor.map(cut, range(len(objects))))
+    return [result for result in results if result is not None]
+
+
+def pack_sprite(images, padding=1):
+    """
+    画像を1枚のスプライトシートに並べる（高さの順に行に詰める）
+
+    :param images: 画像（BGRA）のリスト
+    :param padding: 画像どうしの間隔（ピクセル）
+    :return: (スプライトシート（BGRA）, 各画像の左上の位置 (x, y) のリスト)
+    """
+    if not images:
+        return np.zeros((1, 1, 4), dtype=np.uint8), []
+    # 全体がおおよそ正方形になる幅にする（最も幅の広い画像よりは狭くしない）
+    area = sum((image.shape[0] + padding) * (image.shape[1] + padding) for image in images)
+    sheet_width = max(max(image.shape[1] for image in images), int(np.ceil(np.sqrt(area))))
+
+    positions = [None] * len(images)
+    x = y = row_height = 0
+    for i in sorted(range(len(images)), key=lambda i: -images[i].shape[0]):
+        height, width = images[i].shape[:2]
+        if x and x + width > sheet_width:
+            x, y, row_height = 0, y + row_height + padding, 0
+        positions[i] = (x, y)
+        x += width + padding
+        row_height = max(row_height, height)
+
+    sheet = np.zeros((y + row_height, sheet_width, 4), dtype=np.uint8)
+    for image, (px, py) in zip(images, positions):
+        sheet[py : py + image.shape[0], px : px + image.shape[1]] = image
+    return sheet, positions
+
+
+def clip_objects_to_bytes(image_path, contours, package, extension=".png", workers=None):
+    """
+    物体ごとに切り抜いた画像を zip にまとめて返す
+
+    zip には、元画像での各物体の位置を書いた manifest.json を入れる。
+
+    - package="zip": 物体ごとの画像（object_001.png など）
+    - package="sprite": すべての物体を並べた1枚の画像（sprite.png など）。
+      manifest の sprite_x・sprite_y がスプライトシート内の位置
+
+    :param package: "zip" または "sprite"
+    :param extension: 画像の形式（透明にできる ".png" または ".webp"）
+    :param workers: 並列に処理するスレッド数（None の場合は CPU 数）
+    :return: zip のバイト列
+    """
+    with Image.open(image_path) as image:
+        width, height = image.size
+    clipped = clip_objects(image_path, contours, workers=workers)
+    manifest = {"image": {"width": width, "height": height}, "objects": []}
+    for k, cutout, (x, y) in clipped:
+        manifest["objects"].append(
+            {"index": k, "x": x, "y": y, "width": cutout.shape[1], "height": cutout.shape[0]}
+        )
+
+    files = {}
+    if package == "sprite":
+        sheet, positions = pack_sprite([cutout for _, cutout, _ in clipped])
+        name = "sprite" + extension
+        manifest["sprite"] = name
+        for entry, (sx, sy) in zip(manifest["objects"], positions):
+            entry["sprite_x"], entry["sprite_y"] = sx, sy
+        files[name] = encode_image(sheet, extension)
     else:
-        cutout = cutout_bgr
+        names = [f"object_{k + 1:03d}{extension}" for k, _, _ in clipped]
+        for entry, name in zip(manifest["objects"], names):
+            entry["file"] = name
+        # 物体ごとのエンコードも並列に行う
+        with ThreadPoolExecutor(max_workers=workers or os.cpu_count()) as executor:
+            encoded = executor.map(lambda c: encode_image(c[1], extension), clipped)
+            files.update(zip(names, encoded))
 
-    # 切り抜いた画像を保存
-    cv2.imwrite(output_path, cutout)
+    # 圧縮済みの画像なので、zip では圧縮しない
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", compression=zipfile.ZIP_STORED) as archive:
+        archive.writestr("manifest.json", json.dumps(manifest, indent=2))
+        for name, data in files.items():
+            archive.writestr(name, data)
+    return buffer.getvalue()
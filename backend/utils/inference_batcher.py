@@ -0,0 +1,120 @@
+import logging
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+
+logger = logging.getLogger(__name__)
+
+# batch_sizes に残す直近のバッチの数
+BATCH_SIZE_HISTORY = 1000
+
+
+class InferenceBatcher:
+    """
+    同時に届いた推論リクエストをまとめて1回のバッチ推論で処理するクラス
+
+    最初のリクエストが届いてから window_ms 経過するか、max_batch 件集まった時点で
+    predict_fn を呼び出し、結果をそれぞれのリクエストに返す。
+
+    :param predict_fn: 画像のリストを受け取り、同じ順序で結果のリストを返す関数
+    :param window_ms: リクエストを待ち合わせる時間（ミリ秒）
+    :param max_batch: 1回の推論でまとめる最大件数
+    """
+
+    def __init__(self, predict_fn, window_ms=20, max_batch=8):
+        if max_batch < 1:
+            raise ValueError("max_batch must be 1 or greater.")
+        self.predict_fn = predict_fn
+        self.window = max(window_ms, 0) / 1000
+        self.max_batch = max_batch
+        self._queue = queue.Queue()
+        self._thread = None
+        self._start_lock = threading.Lock()
+        # 直近のバッチの件数（ベンチマークなどで平均のバッチサイズを見るため。上限を超えたら古いものから捨てる）
+        self.batch_sizes = deque(maxlen=BATCH_SIZE_HISTORY)
+
+    def submit(self, image):
+        """
+        推論リクエストを登録する
+
+        :param image: 推論対象の画像
+        :return: 推論結果を受け取る Future
+        """
+        self._ensure_started()
+        future = Future()
+        self._queue.put((image, future))
+        return future
+
+    def predict(self, image, timeout=None):
+        """
+        推論リクエストを登録し、結果が返るまで待つ
+        """
+        return self.submit(image).result(timeout=timeout)
+
+    def _ensure_started(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._start_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(
+                    target=self._run, name="inference-batcher", daemon=True
+                )
+                self._thread.start()
+
+    def _collect(self):
+        # 最初の1件が届くまでは待ち続ける
+        batch = [self._queue.get()]
+        deadline = time.perf_counter() + self.window
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.perf_counter()
+            try:
+                if remaining > 0:
+                    batch.append(self._queue.get(timeout=remaining))
+                else:
+                    # 待ち合わせ時間を過ぎても、既に届いている分はまとめる
+                    batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            # キャンセル済みのリクエストは推論しない
+            batch = [
+                (image, future)
+                for image, future in batch
+                if future.set_running_or_notify_cancel()
+            ]
+            if not batch:
+                continue
+
+            self.batch_sizes.append(len(batch))
+            try:
+                results = self.predict_fn([image for image, _ in batch])
+            except Exception as e:
+                logger.exception("Batched inference failed")
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+
+            for (_, future), result in zip(batch, results):
+                future.set_result(result)
+
+
+_batchers = {}
+_batchers_lock = threading.Lock()
+
+
+def get_batcher(size, predict_fn, window_ms, max_batch):
+    """
+    モデルサイズごとに共有するバッチャーを取得する
+    """
+    with _batchers_lock:
+        batcher = _batchers.get(size)
+        if batcher is None:
+            batcher = InferenceBatcher(predict_fn, window_ms=window_ms, max_batch=max_batch)
+            _batchers[size] = batcher
+        return batcher
@@ -0,0 +1,200 @@
+import numpy as np
+from django.conf import settings
+
+from utils.audio_io import audio_mime_type, encode_audio
+from utils.audio_peaks import CONTENT_TYPE as PEAKS_CONTENT_TYPE
+from utils.audio_peaks import compute_peaks
+from utils.audio_stream import AudioBlockReader, create_shifter
+from utils.audio_util import (
+    check_audio_file,
+    clip_audio_to_bytes,
+    pitch_shift_batch_to_bytes,
+)
+from utils.contour_codec import CONTENT_TYPE as CONTOUR_CONTENT_TYPE
+from utils.contour_codec import (
+    contours_from_json,
+    decode_contours_base64,
+    encode_contours,
+)
+
+
+def pitch_shift(input_file, params, progress):
+    """
+    ピッチシフトのジョブ（ブロックごとに処理して進捗を報告する）
+    """
+    with progress.stage("probe"):
+        probe = check_audio_file(input_file, max_duration=settings.AUDIO_MAX_DURATION)
+
+    with progress.stage("decode"):
+        # 品質の指定に従い、モノラルへのミックスダウンとリサンプルもブロックごとに行う
+        reader = AudioBlockReader(
+            input_file,
+            blocksize=settings.AUDIO_STREAM_BLOCK_SIZE,
+            probe=probe,
+            mono=params.get("mono", True),
+            sample_rate=params.get("sample_rate"),
+        )
+        blocks_in = iter(reader)
+    shifter = create_shifter(
+        reader.sr,
+        params["pitch"],
+        engine=params.get("engine", "phase-vocoder"),
+        channels=reader.channels,
+        workers=settings.WORKER_CPU_THREADS or None,
+    )
+    # 進捗は処理するサンプリングレートでのサンプル数で数える
+    total = reader.frames or (probe.estimated_frames or 0) * reader.sr / probe.sample_rate
+
+    # デコードとピッチシフトはブロックごとに交互に行うので、それぞれの時間を積算する
+    blocks = []
+    processed = 0
+    while True:
+        with progress.stage("decode"):
+            block = next(blocks_in, None)
+        if block is None:
+            break
+        with progress.stage("dsp"):
+            blocks.append(shifter.process(block))
+        processed += len(block)
+        if total:
+            # エンコードの分を残しておく
+            progress(0.9 * processed / total)
+    with progress.stage("dsp"):
+        blocks.append(shifter.flush())
+
+    with progress.stage("encode"):
+        data = encode_audio(np.concatenate(blocks), reader.sr, params["format"])
+    return data, audio_mime_type(params["format"])
+
+
+def pitch_shift_batch(input_file, params, progress):
+    """
+    複数のピッチシフトをまとめて作成するジョブ（結果は zip）
+    """
+    with progress.stage("probe"):
+        probe = check_audio_file(input_file, max_duration=settings.AUDIO_MAX_DURATION)
+
+    # シフトごとのエンコードは処理と並列に行うので、まとめて計測する
+    with progress.stage("process"):
+        data = pitch_shift_batch_to_bytes(
+            input_file,
+            params["format"],
+            params["pitches"],
+            params["file_name"],
+            probe=probe,
+            workers=settings.AUDIO_BATCH_WORKERS or settings.WORKER_CPU_THREADS or None,
+            progress=progress,
+        )
+    return data, "application/zip"
+
+
+def clip_audio(input_file, params, progress):
+    """
+    オーディオの切り取りのジョブ
+    """
+    with progress.stage("probe"):
+        probe = check_audio_file(input_file, max_duration=settings.AUDIO_MAX_DURATION)
+    progress(0.1)
+
+    # 指定範囲のデコードとエンコードは1回の処理で行う
+    with progress.stage("process"):
+        data = clip_audio_to_bytes(
+            input_file,
+            params["format"],
+            params["start"],
+            params["end"],
+            probe=probe,
+            stream_copy=params.get("stream_copy", False),
+        )
+    return data, audio_mime_type(params["format"])
+
+
+def audio_peaks(input_file, params, progress):
+    """
+    波形の概形（複数の解像度の peaks）を求めるジョブ（デコードは1回だけ行う）
+    """
+    with progress.stage("probe"):
+        probe = check_audio_file(input_file, max_duration=settings.AUDIO_MAX_DURATION)
+
+    # デコードと peaks の計算はブロックごとに交互に行うので、まとめて計測する
+    with progress.stage("process"):
+        reader = AudioBlockReader(
+            input_file, blocksize=settings.AUDIO_STREAM_BLOCK_SIZE, probe=probe, mono=False
+        )
+        data = compute_peaks(
+            reader,
+            params["samples_per_peak"],
+            progress=progress,
+            total=reader.frames or probe.estimated_frames,
+        )
+    return data, PEAKS_CONTENT_TYPE
+
+
+def image_contours(input_file, params, progress):
+    """
+    画像の輪郭抽出のジョブ（結果は輪郭のバイナリ形式）
+    """
+    from utils.image_util import (
+        inference_contours,
+        load_inference_image,
+        predict_segmentation,
+        sharpen,
+    )
+
+    progress(0.1)
+    # get_contours と同じ処理を、段階ごとに計測しながら行う
+    with progress.stage("decode"):
+        image, scale = load_inference_image(input_file)
+        if image is None:
+            raise ValueError("Selected file is not a image file.")
+    with progress.stage("inference"):
+        result = predict_segmentation(sharpen(image))
+    with progress.stage("contours"):
+        polygons = result.masks.xy if result.masks else []
+        contours = inference_contours(image, polygons, scale)
+    with progress.stage("encode"):
+        data = encode_contours(contours)
+    return data, CONTOUR_CONTENT_TYPE
+
+
+def clip_image(input_file, params, progress):
+    """
+    画像の切り抜きのジョブ
+    """
+    from utils.image_util import clip_image_array, clip_objects_to_bytes, encode_image
+
+    progress(0.1)
+    with progress.stage("process"):
+        if "contours_blob" in params:
+            contours = decode_contours_base64(params["contours_blob"])
+        else:
+            contours = contours_from_json(params["contours"])
+        if params.get("package", "image") != "image":
+            # 画像を1回だけ読み込み、物体ごとの切り抜きとエンコードを並列に行う
+            data = clip_objects_to_bytes(
+                input_file,
+                contours,
+                params["package"],
+                extension=params["extension"],
+                workers=settings.WORKER_CPU_THREADS or None,
+            )
+            return data, params["content_type"]
+        cutout = clip_image_array(
+            input_file, contours, crop=params["crop"], transparent=params["transparent"]
+        )
+
+    # 一時ファイルを経由せずにメモリ上でエンコードする
+    with progress.stage("encode"):
+        data = encode_image(cutout, params["extension"])
+    return data, params["content_type"]
+
+
+# ジョブの処理名と関数の対応
+OPERATIONS = {
+    "pitch-shift": pitch_shift,
+    "pitch-shift-batch": pitch_shift_batch,
+    "clip-audio": clip_audio,
+    "audio-peaks": audio_peaks,
+    "image-contours": image_contours,
+    "clip-image": clip_image,
+}
@@ -0,0 +1,432 @@
+import json
+import logging
+import multiprocessing
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+
+from django.conf import settings
+from utils import metrics
+
+logger = logging.getLogger(__name__)
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+FINISHED_STATUSES = {DONE, FAILED, CANCELLED}
+
+JOB_ID_PATTERN = re.compile(r"^[0-9a-f]{32}$")
+
+# 進捗をファイルに書き込む最短間隔（秒）
+PROGRESS_INTERVAL = 0.2
+
+
+class JobQueueFullError(Exception):
+    pass
+
+
+class JobNotFoundError(Exception):
+    pass
+
+
+class JobCancelledError(Exception):
+    pass
+
+
+class JobTimeoutError(Exception):
+    pass
+
+
+class JobStore:
+    """
+    ジョブの状態・入力・結果をディレクトリに保存するクラス
+
+    gunicorn の複数ワーカーやワーカープロセスから同じジョブを参照できるよう、
+    状態はジョブごとの state.json に保存する。キャンセル要求は別ファイルで表す。
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def job_dir(self, job_id):
+        if not JOB_ID_PATTERN.match(job_id or ""):
+            raise JobNotFoundError(job_id)
+        return os.path.join(self.directory, job_id)
+
+    def create(self, operation, params):
+        job_id = uuid.uuid4().hex
+        os.makedirs(self.job_dir(job_id))
+        now = time.time()
+        self._write(
+            job_id,
+            {
+                "id": job_id,
+                "operation": operation,
+                "params": params,
+                "status": QUEUED,
+                "progress": 0.0,
+                "error": None,
+                "created": now,
+                "updated": now,
+            },
+        )
+        return job_id
+
+    def read(self, job_id):
+        try:
+            with open(os.path.join(self.job_dir(job_id), "state.json")) as f:
+                state = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            raise JobNotFoundError(job_id)
+        if state["status"] not in FINISHED_STATUSES and self.is_cancel_requested(job_id):
+            state["status"] = CANCELLED
+        return state
+
+    def update(self, job_id, **fields):
+        state = self.read(job_id)
+        state.update(fields, updated=time.time())
+        self._write(job_id, state)
+        return state
+
+    def _write(self, job_id, state):
+        # 読み込み途中のファイルを見せないよう、一時ファイルに書いてから置き換える
+        directory = self.job_dir(job_id)
+        fd, temp_path = tempfile.mkstemp(dir=directory, suffix=".json")
+        with os.fdopen(fd, "w") as f:
+            json.dump(state, f)
+        os.replace(temp_path, os.path.join(directory, "state.json"))
+
+    def input_path(self, job_id):
+        state = self.read(job_id)
+        return os.path.join(self.job_dir(job_id), "input" + state["params"].get("extension", ""))
+
+    def save_input(self, job_id, file):
+        """
+        アップロードされたファイルをジョブの入力として保存する（一時ファイルはコピーしない）
+        """
+        from utils.uploads import save_upload
+
+        path = self.input_path(job_id)
+        save_upload(file, path)
+        return path
+
+    def result_path(self, job_id):
+        """
+        結果のファイルのパス（結果は utils.result_store に内容の ID で保存している）
+        """
+        from utils.result_store import get_result_store
+
+        return get_result_store().path(self.read(job_id).get("result_id"))
+
+    def save_result(self, job_id, data, content_type):
+        from utils.result_store import get_result_store
+
+        filename = download_filename(self.read(job_id)["params"], content_type)
+        result_id = get_result_store().save(data, content_type, filename)
+        self.update(job_id, content_type=content_type, size=len(data), result_id=result_id)
+
+    def request_cancel(self, job_id):
+        open(os.path.join(self.job_dir(job_id), "cancel"), "w").close()
+
+    def is_cancel_requested(self, job_id):
+        return os.path.exists(os.path.join(self.job_dir(job_id), "cancel"))
+
+    def delete(self, job_id):
+        shutil.rmtree(self.job_dir(job_id), ignore_errors=True)
+
+    def cleanup(self, retention):
+        """
+        保存期間を過ぎたジョブを削除する
+        """
+        now = time.time()
+        for job_id in os.listdir(self.directory):
+            if not JOB_ID_PATTERN.match(job_id):
+                continue
+            try:
+                state = self.read(job_id)
+            except JobNotFoundError:
+                continue
+            if now - state["updated"] > retention:
+                self.delete(job_id)
+
+
+class ProgressReporter:
+    """
+    処理の進捗をジョブの状態に書き込み、キャンセル要求があれば処理を中断させる
+
+    stage() で囲んだ段階の処理時間は、ジョブの完了時に状態の timings に保存する。
+    """
+
+    def __init__(self, store, job_id):
+        self.store = store
+        self.job_id = job_id
+        self.timings = {}
+        self._last = 0.0
+
+    @contextmanager
+    def stage(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - started
+            self.timings[name] = self.timings.get(name, 0.0) + elapsed
+
+    def __call__(self, fraction):
+        if self.store.is_cancel_requested(self.job_id):
+            raise JobCancelledError(self.job_id)
+        now = time.monotonic()
+        if now - self._last >= PROGRESS_INTERVAL:
+            self._last = now
+            self.store.update(self.job_id, progress=round(min(max(fraction, 0.0), 1.0), 3))
+
+
+def user_error_message(error):
+    """
+    ユーザーに返してよいエラーメッセージを返す（それ以外は汎用のメッセージにする）
+    """
+    from utils.audio_io import AudioDecodeError
+    from utils.audio_probe import AudioProbeError
+    from utils.audio_util import AudioTooLongError
+
+    if isinstance(error, (AudioDecodeError, AudioProbeError)):
+        return "Selected file is not a audio file."
+    if isinstance(error, AudioTooLongError):
+        return str(error)
+    return "Something went wrong. Please try again."
+
+
+def download_filename(params, content_type):
+    """
+    結果をダウンロードするときのファイル名（zip の場合は拡張子を付ける）
+    """
+    filename = params.get("file_name") or "result"
+    if content_type == "application/zip":
+        filename += ".zip"
+    return filename
+
+
+def run_job(directory, job_id):
+    """
+    ジョブを実行して結果を保存する（ワーカープロセス・スレッドで呼ばれる）
+
+    :return: 結果の Content-Type。キャンセルされた場合は None
+    """
+    from utils.job_operations import OPERATIONS
+
+    store = JobStore(directory)
+    state = store.read(job_id)
+    if state["status"] == CANCELLED:
+        return None
+
+    store.update(job_id, status=RUNNING, started=time.time())
+    progress = ProgressReporter(store, job_id)
+    try:
+        operation = OPERATIONS[state["operation"]]
+        data, content_type = operation(store.input_path(job_id), state["params"], progress)
+        store.save_result(job_id, data, content_type)
+        store.update(job_id, status=DONE, progress=1.0, timings=progress.timings)
+        metrics.observe_job(state["operation"], DONE)
+        return content_type
+    except JobCancelledError:
+        store.update(job_id, status=CANCELLED)
+        metrics.observe_job(state["operation"], CANCELLED)
+        return None
+    except Exception as e:
+        logger.exception("Job %s (%s) failed", job_id, state["operation"])
+        store.update(job_id, status=FAILED, error=user_error_message(e))
+        metrics.observe_job(state["operation"], FAILED)
+        raise
+
+
+def _init_worker_process():
+    # spawn したワーカープロセスで Django の設定を読み込む
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "config.settings")
+
+    import django
+
+    django.setup()
+
+    if settings.WORKER_CPU_THREADS:
+        from utils.runtime import limit_threads
+
+        limit_threads(settings.WORKER_CPU_THREADS)
+
+
+class JobManager:
+    """
+    ジョブをワーカープールに投入し、待ち行列の長さを制限するクラス
+
+    音声処理は別プロセスのプールで実行する。YOLO の推論はプロセス内で共有している
+    モデルとバッチ推論を使えるよう、スレッドプールで実行する。
+    """
+
+    def __init__(self, store, process_workers, thread_workers, max_pending, thread_operations=()):
+        self.store = store
+        self.process_workers = process_workers
+        self.thread_workers = thread_workers
+        self.max_pending = max_pending
+        self.thread_operations = set(thread_operations)
+        self._process_pool = None
+        self._thread_pool = None
+        self._futures = {}
+        self._lock = threading.Lock()
+        self._last_cleanup = 0.0
+
+    @property
+    def pending(self):
+        with self._lock:
+            return len(self._futures)
+
+    def create(self, operation, file, params):
+        """
+        ジョブを作成し、アップロードされたファイルを入力として保存する
+
+        :return: (ジョブID, 入力ファイルのパス)
+        """
+        # 保存期間を過ぎたジョブを定期的に削除する
+        now = time.monotonic()
+        if now - self._last_cleanup > 60:
+            self._last_cleanup = now
+            self.store.cleanup(settings.JOB_RETENTION)
+
+        job_id = self.store.create(operation, params)
+        return job_id, self.store.save_input(job_id, file)
+
+    def enqueue(self, job_id):
+        """
+        ジョブをワーカープールに投入する
+
+        :raises JobQueueFullError: 待ち行列が上限に達している場合
+        :return: 実行結果（Content-Type）を受け取る Future
+        """
+        operation = self.store.read(job_id)["operation"]
+        with self._lock:
+            if len(self._futures) >= self.max_pending:
+                raise JobQueueFullError("Server is busy. Please try again later.")
+            try:
+                future = self._pool(operation).submit(run_job, self.store.directory, job_id)
+            except BrokenProcessPool:
+                # ワーカープロセスが異常終了した（OOM Killer など）プールには投入できないので、
+                # プールを作り直して投入し直す
+                logger.warning("Process pool is broken; recreating it")
+                self._process_pool.shutdown(wait=False, cancel_futures=True)
+                self._process_pool = None
+                future = self._pool(operation).submit(run_job, self.store.directory, job_id)
+            self._futures[job_id] = future
+            metrics.set_queue_depth(len(self._futures))
+        future.add_done_callback(lambda f: self._forget(job_id, f))
+        return future
+
+    def run(self, job_id, timeout=None):
+        """
+        ジョブを投入して完了まで待ち、結果のバイト列を返す（同期 API 用）
+
+        :return: (結果のバイト列, Content-Type)
+        :raises JobTimeoutError: timeout 秒以内に終わらなかった場合（ジョブはキャンセルする）
+        """
+        future = self.enqueue(job_id)
+        try:
+            content_type = future.result(timeout=timeout)
+        except FutureTimeoutError:
+            # 実行中の場合は次の進捗報告で中断する
+            self.cancel(job_id)
+            raise JobTimeoutError(job_id)
+        if content_type is None:
+            raise JobCancelledError(job_id)
+        with open(self.store.result_path(job_id), "rb") as f:
+            return f.read(), content_type
+
+    def cancel(self, job_id):
+        """
+        ジョブのキャンセルを要求する（実行前なら実行されず、実行中なら次の進捗報告で中断する）
+        """
+        self.store.request_cancel(job_id)
+        with self._lock:
+            future = self._futures.get(job_id)
+        if future is not None and future.cancel():
+            self.store.update(job_id, status=CANCELLED)
+        return self.store.read(job_id)
+
+    def when_done(self, job_id, callback):
+        """
+        ジョブが終わったときに callback(job_id) を呼ぶ（実行待ち・実行中でなければすぐに呼ぶ）
+        """
+        with self._lock:
+            future = self._futures.get(job_id)
+        if future is None:
+            callback(job_id)
+        else:
+            # 既に終わっている場合はすぐに呼ばれる
+            future.add_done_callback(lambda _: callback(job_id))
+
+    def delete_when_done(self, job_id):
+        """
+        ジョブのディレクトリを削除する（実行待ち・実行中の場合は、終わってから削除する）
+        """
+        self.when_done(job_id, self.store.delete)
+
+    def _forget(self, job_id, future=None):
+        if future is not None and not future.cancelled():
+            error = future.exception()
+            if isinstance(error, BrokenProcessPool):
+                # 実行中にワーカープロセスが落ちたジョブは、状態を更新できないまま終わっている
+                try:
+                    state = self.store.update(
+                        job_id, status=FAILED, error=user_error_message(error)
+                    )
+                    metrics.observe_job(state["operation"], FAILED)
+                except JobNotFoundError:
+                    pass
+        with self._lock:
+            self._futures.pop(job_id, None)
+            metrics.set_queue_depth(len(self._futures))
+
+    def _pool(self, operation):
+        if operation in self.thread_operations:
+            if self._thread_pool is None:
+                self._thread_pool = ThreadPoolExecutor(
+                    max_workers=self.thread_workers, thread_name_prefix="job"
+                )
+            return self._thread_pool
+
+        if self._process_pool is None:
+            self._process_pool = ProcessPoolExecutor(
+                max_workers=self.process_workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker_process,
+            )
+        return self._process_pool
+
+
+_job_manager = None
+_job_manager_lock = threading.Lock()
+
+
+def get_job_manager():
+    """
+    設定値 JOB_* からプロセス共通のジョブマネージャーを作成して返す
+    """
+    global _job_manager
+    with _job_manager_lock:
+        if _job_manager is None:
+            store = JobStore(settings.JOB_DIR)
+            _job_manager = JobManager(
+                store,
+                process_workers=settings.JOB_PROCESS_WORKERS,
+                thread_workers=settings.JOB_THREAD_WORKERS,
+                max_pending=settings.JOB_MAX_PENDING,
+                thread_operations=settings.JOB_THREAD_OPERATIONS,
+            )
+        return _job_manager
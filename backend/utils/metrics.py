@@ -0,0 +1,158 @@
+import os
+import resource
+import sys
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+
+# gunicorn の複数ワーカーやジョブのワーカープロセスの値を集計する場合は、
+# 起動前に環境変数 PROMETHEUS_MULTIPROC_DIR に空のディレクトリを指定する
+MULTIPROC_ENV = "PROMETHEUS_MULTIPROC_DIR"
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+SIZE_BUCKETS = tuple(10**exponent * factor for exponent in range(4, 9) for factor in (1, 2.5, 5))
+DURATION_BUCKETS = (5, 15, 30, 60, 120, 300, 600, 1200, 1800, 3600)
+
+REQUEST_DURATION = Histogram(
+    "audio_tools_request_duration_seconds",
+    "Time spent handling a tool request",
+    ["operation", "status"],
+    buckets=LATENCY_BUCKETS,
+)
+STAGE_DURATION = Histogram(
+    "audio_tools_stage_duration_seconds",
+    "Time spent in each stage of a tool request (ingest, probe, decode, dsp, inference, ...)",
+    ["operation", "stage"],
+    buckets=LATENCY_BUCKETS,
+)
+INPUT_SIZE = Histogram(
+    "audio_tools_input_size_bytes",
+    "Size of uploaded inputs",
+    ["operation"],
+    buckets=SIZE_BUCKETS,
+)
+INPUT_DURATION = Histogram(
+    "audio_tools_input_duration_seconds",
+    "Duration of uploaded audio inputs",
+    ["operation"],
+    buckets=DURATION_BUCKETS,
+)
+CACHE_REQUESTS = Counter(
+    "audio_tools_cache_requests_total",
+    "Result cache lookups",
+    ["operation", "result"],
+)
+JOBS = Counter(
+    "audio_tools_jobs_total",
+    "Finished jobs",
+    ["operation", "status"],
+)
+JOB_QUEUE_DEPTH = Gauge(
+    "audio_tools_job_queue_depth",
+    "Jobs queued or running",
+    multiprocess_mode="livesum",
+)
+ADMISSIONS = Counter(
+    "audio_tools_admissions_total",
+    "Admission decisions for tool requests (admitted, deferred, bypassed, rejected)",
+    ["operation", "result"],
+)
+ADMISSION_IN_FLIGHT = Gauge(
+    "audio_tools_admission_in_flight_seconds",
+    "Estimated cost of admitted requests that are queued or running",
+    multiprocess_mode="livesum",
+)
+COST_COEFFICIENT = Gauge(
+    "audio_tools_cost_coefficient_seconds",
+    "Calibrated cost per unit (sample or megapixel) used for admission",
+    ["operation"],
+    multiprocess_mode="liveall",
+)
+PEAK_RSS = Gauge(
+    "audio_tools_peak_rss_bytes",
+    "Peak resident set size of the process",
+    ["role"],
+    multiprocess_mode="livemax",
+)
+
+
+def peak_rss_bytes():
+    """
+    プロセスのピークメモリ使用量（バイト）を返す
+    """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS はバイト、Linux はキロバイト単位
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def sample_peak_rss(role):
+    PEAK_RSS.labels(role=role).set(peak_rss_bytes())
+
+
+def observe_stage(operation, stage, seconds):
+    STAGE_DURATION.labels(operation=operation, stage=stage).observe(seconds)
+
+
+def observe_request(operation, status, seconds, cache):
+    REQUEST_DURATION.labels(operation=operation, status=str(status)).observe(seconds)
+    if cache is not None:
+        CACHE_REQUESTS.labels(operation=operation, result=cache).inc()
+    sample_peak_rss("web")
+
+
+def observe_input(operation, size, duration):
+    if size is not None:
+        INPUT_SIZE.labels(operation=operation).observe(size)
+    if duration is not None:
+        INPUT_DURATION.labels(operation=operation).observe(duration)
+
+
+def observe_job(operation, status):
+    JOBS.labels(operation=operation, status=status).inc()
+    sample_peak_rss("worker")
+
+
+def set_queue_depth(depth):
+    JOB_QUEUE_DEPTH.set(depth)
+
+
+def observe_admission(operation, result):
+    ADMISSIONS.labels(operation=operation, result=result).inc()
+
+
+def set_admission_in_flight(seconds):
+    ADMISSION_IN_FLIGHT.set(seconds)
+
+
+def set_cost_coefficient(operation, seconds):
+    COST_COEFFICIENT.labels(operation=operation).set(seconds)
+
+
+def render_metrics():
+    """
+    Prometheus のテキスト形式で現在の値を返す
+
+    :return: (本文のバイト列, Content-Type)
+    """
+    if os.environ.get(MULTIPROC_ENV):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
+
+
+def mark_process_dead(pid):
+    """
+    終了したプロセスの live 系の値を集計から外す（gunicorn の child_exit から呼ぶ）
+    """
+    if os.environ.get(MULTIPROC_ENV):
+        multiprocess.mark_process_dead(pid)
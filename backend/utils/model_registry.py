@@ -0,0 +1,130 @@
+import logging
+import threading
+import time
+
+import numpy as np
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# モデルサイズと重みファイルの対応
+MODEL_WEIGHTS = {
+    "n": "yolov8n-seg.pt",
+    "s": "yolov8s-seg.pt",
+    "m": "yolov8m-seg.pt",
+}
+
+# ウォームアップ推論に使う画像サイズ
+WARMUP_IMAGE_SIZE = 640
+
+
+class ModelRegistry:
+    """
+    プロセス内で YOLO セグメンテーションモデルを一度だけ読み込み、リクエスト間で共有するクラス
+
+    モデルの推論はスレッドセーフではないため、モデルごとのロックで直列化する。
+    """
+
+    def __init__(self):
+        self._models = {}
+        self._inference_locks = {}
+        self._load_lock = threading.Lock()
+        self.timings = {}
+
+    def resolve_size(self, size=None):
+        size = size or getattr(settings, "YOLO_MODEL_SIZE", "m")
+        if size not in MODEL_WEIGHTS:
+            raise ValueError(
+                f"Unknown YOLO model size: {size} (choose from {', '.join(MODEL_WEIGHTS)})"
+            )
+        return size
+
+    def get(self, size=None):
+        """
+        モデルを取得する（未ロードの場合は読み込みとウォームアップを行う）
+
+        :param size: モデルサイズ（n/s/m）。省略時は設定値 YOLO_MODEL_SIZE
+        :return: YOLO モデル
+        """
+        size = self.resolve_size(size)
+        model = self._models.get(size)
+        if model is not None:
+            return model
+
+        with self._load_lock:
+            # 他のスレッドが先に読み込んでいる場合はそれを使う
+            if size not in self._models:
+                model = self._load(size)
+                # ロックのない間に predict がモデルを取得しないよう、ロックを先に登録する
+                self._inference_locks.setdefault(size, threading.Lock())
+                self._models[size] = model
+            return self._models[size]
+
+    def predict(self, images, size=None):
+        """
+        共有モデルで推論を行う
+
+        :param images: 画像（NumPy配列）または画像のリスト
+        :param size: モデルサイズ（n/s/m）
+        :return: ultralytics の Results のリスト
+        """
+        size = self.resolve_size(size)
+        model = self.get(size)
+        with self._inference_locks[size]:
+            return model(images, verbose=False)
+
+    def install(self, model, size=None):
+        """
+        読み込み済みのモデルを登録する（ベンチマークでスタブのモデルを使う場合など）
+
+        :param model: model(images, verbose=False) で Results のリストを返す呼び出し可能オブジェクト
+        :param size: モデルサイズ（n/s/m）
+        """
+        size = self.resolve_size(size)
+        with self._load_lock:
+            self._inference_locks.setdefault(size, threading.Lock())
+            self._models[size] = model
+
+    def is_loaded(self, size=None):
+        return self.resolve_size(size) in self._models
+
+    def _load(self, size):
+        from ultralytics import YOLO
+
+        started = time.perf_counter()
+        model = YOLO(MODEL_WEIGHTS[size])
+        loaded = time.perf_counter()
+
+        # 初回推論のグラフ構築・メモリ確保をここで済ませておく
+        dummy = np.zeros((WARMUP_IMAGE_SIZE, WARMUP_IMAGE_SIZE, 3), dtype=np.uint8)
+        model(dummy, verbose=False)
+        warmed = time.perf_counter()
+
+        self.timings[size] = {
+            "weights": MODEL_WEIGHTS[size],
+            "load_ms": (loaded - started) * 1000,
+            "warmup_ms": (warmed - loaded) * 1000,
+        }
+        logger.info(
+            "YOLO model loaded: size=%s load_ms=%.1f warmup_ms=%.1f",
+            size,
+            self.timings[size]["load_ms"],
+            self.timings[size]["warmup_ms"],
+        )
+        return model
+
+
+# プロセス共通のレジストリ
+registry = ModelRegistry()
+
+
+def preload_models(sizes=None):
+    """
+    ワーカー起動時にモデルを読み込んでおく
+
+    :param sizes: 読み込むモデルサイズのリスト。省略時は設定値 YOLO_MODEL_SIZE のみ
+    :return: サイズごとの読み込み・ウォームアップ時間
+    """
+    for size in sizes or [None]:
+        registry.get(size)
+    return dict(registry.timings)
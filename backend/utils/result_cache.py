@@ -0,0 +1,277 @@
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+
+def hash_upload(file):
+    """
+    アップロードされたファイルの内容から SHA-256 を求める
+
+    同じリクエストの中で何度も読まないよう、求めたハッシュは file.content_hash に保存する。
+
+    :param file: Django の UploadedFile
+    :return: 16進数のハッシュ文字列
+    """
+    content_hash = getattr(file, "content_hash", None)
+    if content_hash:
+        return content_hash
+    digest = hashlib.sha256()
+    for chunk in file.chunks():
+        digest.update(chunk)
+    file.seek(0)
+    file.content_hash = digest.hexdigest()
+    return file.content_hash
+
+
+def cache_key(operation, content_hash, **params):
+    """
+    処理名・入力のハッシュ・パラメータからキャッシュキーを作成する
+    """
+    payload = json.dumps(
+        {"operation": operation, "content": content_hash, "params": params},
+        sort_keys=True,
+        default=str,
+    )
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+class DiskCacheBackend:
+    """
+    ローカルディスクに結果を保存するキャッシュ（合計サイズを超えたら古い順に削除する）
+
+    ファイルの mtime を作成時刻（TTL 判定用）、atime を最終参照時刻（LRU 判定用）として使う。
+    合計サイズは書き込みのたびに足していき、上限を超えたときか、前回から evict_interval 秒
+    経ったときだけディレクトリを走査して数え直す（他のプロセスが書いた分もそこで数える）。
+    走査はファイルロックで複数のプロセスのうち1つだけが行う。
+    """
+
+    # 書き込み途中の一時ファイルの接尾辞（走査では数えず、temp_max_age 秒を過ぎたら削除する）
+    temp_suffix = ".tmp"
+    temp_max_age = 60 * 60
+
+    def __init__(self, directory, max_size, ttl=None, evict_interval=60):
+        self.directory = directory
+        self.max_size = max_size
+        self.ttl = ttl
+        self.evict_interval = evict_interval
+        self._lock = threading.Lock()
+        # 合計サイズの見積もり（None の場合は次の書き込みで走査して数える）
+        self._size = None
+        self._scanned_at = 0.0
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], key)
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            stat = os.stat(path)
+            if self.ttl and time.time() - stat.st_mtime > self.ttl:
+                os.remove(path)
+                return None
+            with open(path, "rb") as f:
+                data = f.read()
+            # 参照時刻だけを更新する
+            os.utime(path, (time.time(), stat.st_mtime))
+            return data
+        except FileNotFoundError:
+            return None
+
+    def set(self, key, value):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        try:
+            replaced = os.stat(path).st_size
+        except FileNotFoundError:
+            replaced = 0
+        # 書き込み途中のファイルを読まれないよう、一時ファイルに書いてから置き換える
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=self.temp_suffix)
+        with os.fdopen(fd, "wb") as f:
+            f.write(value)
+        os.replace(temp_path, path)
+
+        with self._lock:
+            if self._size is not None:
+                self._size += len(value) - replaced
+            due = (
+                self._size is None
+                or self._size > self.max_size
+                or time.monotonic() - self._scanned_at > self.evict_interval
+            )
+        if due:
+            self._evict()
+
+    def delete(self, key):
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    def _evict(self):
+        with self._lock, open(os.path.join(self.directory, ".lock"), "a") as lock_file:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                # 他のプロセスが走査している
+                return
+
+            entries = []
+            total = 0
+            now = time.time()
+            for root, _, files in os.walk(self.directory):
+                for name in files:
+                    path = os.path.join(root, name)
+                    if name.endswith(self.temp_suffix):
+                        # 書き込み中に終了したプロセスが残した一時ファイル
+                        self._remove_stale_temp(path, now)
+                        continue
+                    # 付随するファイル（拡張子のあるもの）は本体と一緒に削除する
+                    if "." in name:
+                        continue
+                    try:
+                        stat = os.stat(path)
+                    except FileNotFoundError:
+                        continue
+                    if self.ttl and now - stat.st_mtime > self.ttl:
+                        self._remove(path)
+                        continue
+                    entries.append((stat.st_atime, stat.st_size, path))
+                    total += stat.st_size
+
+            # 最後に参照された時刻が古いものから削除する
+            entries.sort()
+            for _, size, path in entries:
+                if total <= self.max_size:
+                    break
+                self._remove(path)
+                total -= size
+
+            self._size = total
+            self._scanned_at = time.monotonic()
+
+    def _remove_stale_temp(self, path, now):
+        try:
+            if now - os.stat(path).st_mtime > self.temp_max_age:
+                os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+class DjangoCacheBackend:
+    """
+    Django のキャッシュフレームワークに結果を保存するキャッシュ
+    """
+
+    def __init__(self, alias="default", ttl=None):
+        from django.core.cache import caches
+
+        self.cache = caches[alias]
+        self.ttl = ttl
+
+    def get(self, key):
+        return self.cache.get(f"result:{key}")
+
+    def set(self, key, value):
+        self.cache.set(f"result:{key}", value, timeout=self.ttl)
+
+    def delete(self, key):
+        self.cache.delete(f"result:{key}")
+
+
+class ResultCache:
+    """
+    処理結果（バイト列）をキャッシュし、ヒット数とミス数を記録するクラス
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        try:
+            value = self.backend.get(key)
+        except Exception:
+            # キャッシュの障害で処理自体を失敗させない
+            logger.exception("Result cache lookup failed")
+            value = None
+        with self._lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return value
+
+    def set(self, key, value):
+        try:
+            self.backend.set(key, value)
+        except Exception:
+            logger.exception("Result cache store failed")
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / total if total else 0.0,
+            }
+
+
+class NullCacheBackend:
+    """
+    キャッシュを無効にする場合のバックエンド
+    """
+
+    def get(self, key):
+        return None
+
+    def set(self, key, value):
+        pass
+
+    def delete(self, key):
+        pass
+
+
+_result_cache = None
+_result_cache_lock = threading.Lock()
+
+
+def get_result_cache():
+    """
+    設定値 RESULT_CACHE_* からプロセス共通のキャッシュを作成して返す
+    """
+    global _result_cache
+    with _result_cache_lock:
+        if _result_cache is None:
+            backend = settings.RESULT_CACHE_BACKEND
+            ttl = settings.RESULT_CACHE_TTL or None
+            if backend == "disk":
+                backend = DiskCacheBackend(
+                    settings.RESULT_CACHE_DIR, settings.RESULT_CACHE_MAX_SIZE, ttl=ttl
+                )
+            elif backend == "django":
+                backend = DjangoCacheBackend(settings.RESULT_CACHE_ALIAS, ttl=ttl)
+            elif backend == "none":
+                backend = NullCacheBackend()
+            else:
+                raise ValueError(f"Unknown RESULT_CACHE_BACKEND: {backend}")
+            _result_cache = ResultCache(backend)
+        return _result_cache
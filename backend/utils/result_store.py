@@ -0,0 +1,121 @@
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+
+from django.conf import settings
+from utils.result_cache import DiskCacheBackend
+
+RESULT_ID_PATTERN = re.compile(r"^[0-9a-f]{64}$")
+
+
+class ResultNotFoundError(Exception):
+    pass
+
+
+def result_id(data):
+    """
+    結果の内容から ID（SHA-256）を求める
+    """
+    return hashlib.sha256(data).hexdigest()
+
+
+class ResultStore(DiskCacheBackend):
+    """
+    処理結果のファイルを内容から求めた ID で保存するクラス
+
+    同じ内容には同じ ID が付くので、ID をそのまま強い ETag として使える。
+    保存期間（ttl）と合計サイズの上限（max_size）は DiskCacheBackend と同じく、
+    作成時刻と最終参照時刻で判定する。Content-Type とファイル名は「ID.json」に保存する。
+    """
+
+    def path(self, result_id):
+        """
+        結果のファイルのパス
+
+        :raises ResultNotFoundError: ID の形式が正しくない場合
+        """
+        if not RESULT_ID_PATTERN.match(result_id or ""):
+            raise ResultNotFoundError(result_id)
+        return self._path(result_id)
+
+    def relative_path(self, result_id):
+        """
+        保存先のディレクトリからの相対パス（X-Accel-Redirect などに使う）
+        """
+        return os.path.relpath(self.path(result_id), self.directory)
+
+    def save(self, data, content_type, filename):
+        """
+        結果を保存して ID を返す（同じ内容が保存済みの場合は書き込まず、保存期間だけを延ばす）
+        """
+        key = result_id(data)
+        path = self.path(key)
+        self._write_meta(key, {"content_type": content_type, "filename": filename})
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            self.set(key, data)
+        return key
+
+    def info(self, result_id):
+        """
+        保存した結果の情報を返す（最終参照時刻を更新する）
+
+        :return: {"path", "size", "mtime", "content_type", "filename"}
+        :raises ResultNotFoundError: 保存されていない、または保存期間を過ぎている場合
+        """
+        path = self.path(result_id)
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            raise ResultNotFoundError(result_id)
+        if self.ttl and time.time() - stat.st_mtime > self.ttl:
+            self.delete(result_id)
+            raise ResultNotFoundError(result_id)
+        os.utime(path, (time.time(), stat.st_mtime))
+
+        meta = {"content_type": "application/octet-stream", "filename": None}
+        try:
+            with open(path + ".json") as f:
+                meta.update(json.load(f))
+        except (FileNotFoundError, json.JSONDecodeError):
+            pass
+        return {"path": path, "size": stat.st_size, "mtime": stat.st_mtime, **meta}
+
+    def delete(self, result_id):
+        self._remove(self._path(result_id))
+
+    def _remove(self, path):
+        super()._remove(path)
+        super()._remove(path + ".json")
+
+    def _write_meta(self, key, meta):
+        path = self._path(key) + ".json"
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # 書き込み途中のファイルを読まれないよう、一時ファイルに書いてから置き換える
+        temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}{self.temp_suffix}"
+        with open(temp_path, "w") as f:
+            json.dump(meta, f)
+        os.replace(temp_path, path)
+
+
+_result_store = None
+_result_store_lock = threading.Lock()
+
+
+def get_result_store():
+    """
+    設定値 RESULT_STORE_* からプロセス共通の保存先を作成して返す
+    """
+    global _result_store
+    with _result_store_lock:
+        if _result_store is None:
+            _result_store = ResultStore(
+                settings.RESULT_STORE_DIR,
+                settings.RESULT_STORE_MAX_SIZE,
+                ttl=settings.RESULT_STORE_TTL or None,
+            )
+        return _result_store
@@ -0,0 +1,124 @@
+import importlib
+import logging
+import os
+import sys
+
+logger = logging.getLogger(__name__)
+
+# ネイティブのスレッドプールのスレッド数を決める環境変数（ライブラリの読み込み時に参照される）
+THREAD_ENV_VARS = (
+    "OMP_NUM_THREADS",
+    "OPENBLAS_NUM_THREADS",
+    "MKL_NUM_THREADS",
+    "VECLIB_MAXIMUM_THREADS",
+    "NUMEXPR_NUM_THREADS",
+)
+
+
+def threads_per_worker(workers, cpus=None):
+    """
+    ワーカーごとに割り当てるスレッド数（CPU コア数をワーカー数で割った数、最低 1）を返す
+    """
+    cpus = cpus or os.cpu_count() or 1
+    return max(1, cpus // max(1, workers))
+
+
+def limit_threads(threads):
+    """
+    BLAS / OpenMP / PyTorch / OpenCV のスレッド数を制限する
+
+    環境変数も設定するので、これから読み込むライブラリや、このプロセスから起動する
+    ワーカープロセスにも同じ制限がかかる。既に読み込まれているライブラリには直接設定する。
+
+    :param threads: スレッド数
+    """
+    for name in THREAD_ENV_VARS:
+        os.environ[name] = str(threads)
+
+    if "torch" in sys.modules:
+        sys.modules["torch"].set_num_threads(threads)
+    if "cv2" in sys.modules:
+        sys.modules["cv2"].setNumThreads(threads)
+    try:
+        from threadpoolctl import threadpool_limits
+    except ImportError:
+        return
+    threadpool_limits(limits=threads)
+
+
+def preload_modules(names):
+    """
+    重いモジュールを読み込んでおく（gunicorn の preload_app で fork 前に読み込み、
+    ワーカー間でメモリをコピーオンライトで共有する）
+
+    :param names: モジュール名のリスト。読み込めないモジュールは警告を出して無視する
+    """
+    for name in names:
+        try:
+            importlib.import_module(name)
+        except ImportError as e:
+            logger.warning("Could not preload %s: %s", name, e)
+
+
+def preload_app():
+    """
+    設定値 PRELOAD_MODULES・YOLO_PRELOAD に従ってモジュールとモデルを読み込む
+    （config.wsgi / config.asgi の読み込み時に呼ぶ）
+    """
+    from django.conf import settings
+
+    preload_modules(settings.PRELOAD_MODULES)
+
+    # ワーカー起動時にモデルを読み込んでおき、初回リクエストの待ち時間をなくす
+    if settings.YOLO_PRELOAD:
+        from utils.model_registry import preload_models
+
+        preload_models()
+
+
+class GunicornInput:
+    """
+    gunicorn の wsgi.input（gunicorn.http.body.Body）を包み、サイズを指定した read を速くするクラス
+
+    Body.read は 1KB ずつ読んでバッファを作り直すので、アップロードされた数 MB のファイルを
+    Django が 64KB ずつ読むと、コピーに 1 リクエストあたり数十ミリ秒かかる。
+    サイズを指定した read は Body のバッファに残っている分を返してから、残りを reader から直接読む。
+    """
+
+    def __init__(self, body):
+        self.body = body
+
+    def read(self, size=None):
+        if size is None or size < 0:
+            return self.body.read()
+        buffered = self.body.buf.tell()
+        if buffered >= size:
+            return self.body.read(size)
+        data = self.body.read(buffered) if buffered else b""
+        return data + self.body.reader.read(size - len(data))
+
+    def readline(self, size=None):
+        return self.body.readline(size)
+
+    def readlines(self, size=None):
+        return self.body.readlines(size)
+
+    def __iter__(self):
+        return iter(self.body)
+
+
+def fast_gunicorn_input(application):
+    """
+    gunicorn で実行する場合に wsgi.input を GunicornInput に置き換える WSGI アプリケーションを返す
+    """
+    try:
+        from gunicorn.http.body import Body
+    except ImportError:
+        return application
+
+    def wrapper(environ, start_response):
+        if isinstance(environ.get("wsgi.input"), Body):
+            environ["wsgi.input"] = GunicornInput(environ["wsgi.input"])
+        return application(environ, start_response)
+
+    return wrapper
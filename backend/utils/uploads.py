@@ -0,0 +1,218 @@
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+
+from django.conf import settings
+from django.core.files.uploadedfile import UploadedFile
+from django.core.files.uploadhandler import FileUploadHandler
+
+UPLOAD_TOKEN_PATTERN = re.compile(r"^[0-9a-f]{64}$")
+
+
+class UploadTooLargeError(Exception):
+    pass
+
+
+class UploadNotFoundError(Exception):
+    pass
+
+
+def upload_too_large_message():
+    return (
+        "The file is too large. "
+        f"Please select a file under {settings.UPLOAD_MAX_SIZE // (1024 * 1024)}MB."
+    )
+
+
+class MaxSizeUploadHandler(FileUploadHandler):
+    """
+    アップロードのサイズを受信しながら確認し、上限を超えたら読み込みを中断するハンドラー
+
+    FILE_UPLOAD_HANDLERS の先頭に置き、受け取ったデータはそのまま後続のハンドラー
+    （メモリ・一時ファイル）に渡す。上限（UPLOAD_MAX_SIZE）はファイルごとに確認する。
+    リクエスト全体は、Content-Length が上限とファイル以外の分（DATA_UPLOAD_MAX_MEMORY_SIZE）の
+    合計を超える場合に本文を読む前に中断する。
+    """
+
+    def __init__(self, request=None):
+        super().__init__(request)
+        self.received = 0
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self.received = 0
+
+    def handle_raw_input(
+        self, input_data, META, content_length, boundary, encoding=None
+    ):
+        # ファイル以外のフィールドとマルチパートの区切りの分だけ余裕を持たせる
+        limit = settings.UPLOAD_MAX_SIZE + settings.DATA_UPLOAD_MAX_MEMORY_SIZE
+        if content_length and content_length > limit:
+            raise UploadTooLargeError(upload_too_large_message())
+        return None
+
+    def receive_data_chunk(self, raw_data, start):
+        self.received += len(raw_data)
+        if self.received > settings.UPLOAD_MAX_SIZE:
+            raise UploadTooLargeError(upload_too_large_message())
+        return raw_data
+
+    def file_complete(self, file_size):
+        return None
+
+
+def save_upload(file, path):
+    """
+    アップロードされたファイルを指定したパスに保存する
+
+    Django が一時ファイルに保存している場合は、コピーせずにハードリンクを作る
+    （同じファイルシステム上にない場合はコピーする）。メモリ上にある場合はそのまま書き込む。
+
+    :param file: Django の UploadedFile
+    :param path: 保存先のパス
+    """
+    if hasattr(file, "temporary_file_path"):
+        try:
+            os.link(file.temporary_file_path(), path)
+            return
+        except OSError:
+            shutil.copyfile(file.temporary_file_path(), path)
+            return
+
+    file.seek(0)
+    with open(path, "wb") as f:
+        for chunk in file.chunks():
+            f.write(chunk)
+
+
+class StoredUpload(UploadedFile):
+    """
+    アップロードストアに保存済みのファイル（リクエストの UploadedFile の代わりに使う）
+
+    temporary_file_path を返すので、ジョブの入力にはコピーせずにハードリンクされる。
+    内容のハッシュは分かっているので、hash_upload でファイルを読み直さない。
+    """
+
+    def __init__(self, path, name, content_hash):
+        super().__init__(file=None, name=name, size=os.path.getsize(path))
+        self.path = path
+        self.content_hash = content_hash
+
+    def temporary_file_path(self):
+        return self.path
+
+    def chunks(self, chunk_size=None):
+        with open(self.path, "rb") as f:
+            while True:
+                data = f.read(chunk_size or self.DEFAULT_CHUNK_SIZE)
+                if not data:
+                    return
+                yield data
+
+
+class UploadStore:
+    """
+    取り込んだアップロードを、内容のハッシュ（アップロードトークン）をキーにして保存するクラス
+
+    同じ内容のファイルには同じトークンが付く。トークンを指定したリクエストは保存済みの
+    ファイルを入力に使うので、同じファイルを再びアップロードする必要がない。
+    最後に使われてから ttl 秒を過ぎたファイルは削除する。
+
+    :param directory: 保存先のディレクトリ（ハードリンクできるよう JOB_DIR と同じファイルシステム上）
+    :param ttl: 保存期間（秒）
+    """
+
+    def __init__(self, directory, ttl):
+        self.directory = directory
+        self.ttl = ttl
+        self._last_cleanup = 0.0
+        os.makedirs(directory, exist_ok=True)
+
+    def _dir(self, token):
+        if not UPLOAD_TOKEN_PATTERN.match(token or ""):
+            raise UploadNotFoundError(token)
+        return os.path.join(self.directory, token)
+
+    def save(self, file):
+        """
+        アップロードされたファイルを保存し、トークンを返す（保存済みの場合は保存期間を延ばす）
+
+        :param file: Django の UploadedFile
+        :return: アップロードトークン
+        """
+        from utils.result_cache import hash_upload
+
+        self.cleanup()
+        token = hash_upload(file)
+        directory = self._dir(token)
+        if os.path.isdir(directory):
+            os.utime(directory)
+            return token
+
+        # 保存の途中を見せないよう、一時ディレクトリに保存してから名前を変える
+        temp_dir = tempfile.mkdtemp(dir=self.directory, prefix=".upload-")
+        try:
+            save_upload(file, os.path.join(temp_dir, "input"))
+            with open(os.path.join(temp_dir, "name"), "w") as f:
+                f.write(file.name)
+            os.rename(temp_dir, directory)
+        except OSError:
+            # 同じファイルが同時に保存された場合は、先に保存されたものを使う
+            shutil.rmtree(temp_dir, ignore_errors=True)
+            if not os.path.isdir(directory):
+                raise
+        return token
+
+    def open(self, token):
+        """
+        トークンから保存済みのファイルを返す
+
+        :raises UploadNotFoundError: トークンが正しくないか、保存期間を過ぎた場合
+        """
+        directory = self._dir(token)
+        try:
+            if time.time() - os.stat(directory).st_mtime > self.ttl:
+                shutil.rmtree(directory, ignore_errors=True)
+                raise UploadNotFoundError(token)
+            with open(os.path.join(directory, "name")) as f:
+                name = f.read()
+            os.utime(directory)
+        except FileNotFoundError:
+            raise UploadNotFoundError(token)
+        return StoredUpload(os.path.join(directory, "input"), name, token)
+
+    def cleanup(self):
+        """
+        保存期間を過ぎたファイルを削除する（1分に1回まで）
+        """
+        now = time.time()
+        if now - self._last_cleanup < 60:
+            return
+        self._last_cleanup = now
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            try:
+                expired = now - os.stat(path).st_mtime > self.ttl
+            except FileNotFoundError:
+                continue
+            # 書き込み途中のまま残った一時ディレクトリも消す
+            if expired and (UPLOAD_TOKEN_PATTERN.match(name) or name.startswith(".upload-")):
+                shutil.rmtree(path, ignore_errors=True)
+
+
+_upload_store = None
+_upload_store_lock = threading.Lock()
+
+
+def get_upload_store():
+    """
+    設定値 UPLOAD_STORE_DIR・UPLOAD_TOKEN_TTL からプロセス共通のストアを作成して返す
+    """
+    global _upload_store
+    with _upload_store_lock:
+        if _upload_store is None:
+            _upload_store = UploadStore(settings.UPLOAD_STORE_DIR, settings.UPLOAD_TOKEN_TTL)
+        return _upload_store
@@ -3,10 +3,12 @@ import React, { useEffect, useRef, useState } from "react";
 import ErrorMsg from "../common/ErrorMsg";
 import ga from "../common/GAUtils";
 import MultiRangeSlider from "../common/MultiRangeSlider";
+import { parsePeaks } from "../common/peaks";
 import { formatTime, isAudioFile } from "../common/utils";
 import { FaCirclePlay } from "react-icons/fa6";
 import { FaGripLinesVertical } from "react-icons/fa";
 import { IoPlaySkipBack } from "react-icons/io5";
+import Waveform from "./Waveform";
 
 const trackEvent = ga.trackEventBuilder("Clipper");
 
@@ -24,6 +26,8 @@ function Clipper() {
   const [currentTime, setCurrentTime] = useState(null);
   const [isPlaying, setIsPlaying] = useState(false);
   const [minValueChanged, setMinValueChanged] = useState(false);
+  const [peaks, setPeaks] = useState(null); // 波形の概形
+  const [uploadToken, setUploadToken] = useState(null); // 取り込み済みのファイルのトークン
   const audioRef = useRef(null); // Audioタグの参照
   const audioEndedRef = useRef(null); // Audioタグの参照
   const min = 0;
@@ -37,6 +41,59 @@ function Clipper() {
     };
   }, []);
 
+  /**
+   * 波形の概形を取得する（取り込んだファイルのトークンも受け取る）
+   * @param {*} target
+   */
+  function loadPeaks(target) {
+    setPeaks(null);
+    setUploadToken(null);
+
+    const formData = new FormData();
+    formData.append("file", target);
+    fetch("/api/audio-peaks/", { method: "POST", body: formData })
+      .then(async (response) => {
+        if (!response.ok) {
+          throw new Error();
+        }
+        const token = response.headers.get("X-Upload-Token");
+        return { token, data: parsePeaks(await response.arrayBuffer()) };
+      })
+      .then(({ token, data }) => {
+        setPeaks(data);
+        setUploadToken(token);
+      })
+      // 波形は補助的な表示のため、取得できなくても切り取りはファイルを送って行う
+      .catch(() => {});
+  }
+
+  /**
+   * 切り取りを依頼する（トークンが期限切れの場合はファイルを送り直す）
+   * @param {boolean} useToken
+   */
+  function requestClip(useToken) {
+    const formData = new FormData();
+    if (useToken) {
+      formData.append("upload_token", uploadToken);
+    } else {
+      formData.append("file", file);
+    }
+    formData.append("start", minValue);
+    formData.append("end", maxValue);
+
+    return fetch("/api/clip-audio/", {
+      method: "POST",
+      body: formData,
+      responseType: "blob", // バイナリデータとしてレスポンスを受け取る
+    }).then((response) => {
+      if (!response.ok && useToken) {
+        setUploadToken(null);
+        return requestClip(false);
+      }
+      return response;
+    });
+  }
+
   /**
    * オーディオファイルを切り取り、ダウンロードする
    * @param {*} e
@@ -55,18 +112,8 @@ function Clipper() {
       });
     }, 1000);
 
-    // FormDataを作成
-    const formData = new FormData();
-    formData.append("file", file);
-    formData.append("start", minValue);
-    formData.append("end", maxValue);
-
     // 切り取り処理
-    fetch("/api/clip-audio/", {
-      method: "POST",
-      body: formData,
-      responseType: "blob", // バイナリデータとしてレスポンスを受け取る
-    })
+    requestClip(Boolean(uploadToken))
       .then(async (response) => {
         if (!response.ok) {
           const errorData = await response.json();
@@ -198,6 +245,7 @@ function Clipper() {
 
     setError(null);
     setFile(target);
+    loadPeaks(target);
     setFadeIn(false);
     setTimeout(() => {
       setFadeIn(true);
@@ -293,6 +341,15 @@ function Clipper() {
             <p className="text font-bold">
               You can now play or clip the audio file!
             </p>
+            {peaks && (
+              <div className="w-full mt-6 flex justify-center">
+                <Waveform
+                  peaks={peaks}
+                  start={max ? (minValue / max) * 100 : 0}
+                  end={max ? (maxValue / max) * 100 : 100}
+                />
+              </div>
+            )}
             <div className="w-full mt-8">
               <MultiRangeSlider
                 min={min}
@@ -0,0 +1,55 @@
+import React, { useEffect, useRef } from "react";
+import { selectLevel } from "../common/peaks";
+
+/**
+ * 波形の概形を描画する
+ * @param {*} peaks parsePeaks の結果
+ * @param {number} start 選択範囲の開始（0〜100）
+ * @param {number} end 選択範囲の終了（0〜100）
+ */
+function Waveform({ peaks, start, end }) {
+  const canvasRef = useRef(null);
+
+  useEffect(() => {
+    const canvas = canvasRef.current;
+    if (!canvas || !peaks || !peaks.levels.length) {
+      return;
+    }
+
+    const ratio = window.devicePixelRatio || 1;
+    const width = Math.floor(canvas.clientWidth * ratio);
+    const height = Math.floor(canvas.clientHeight * ratio);
+    canvas.width = width;
+    canvas.height = height;
+
+    const ctx = canvas.getContext("2d");
+    ctx.clearRect(0, 0, width, height);
+
+    const { data } = selectLevel(peaks, width);
+    const count = data.length / 2;
+    const middle = height / 2;
+    const from = (start / 100) * width;
+    const to = (end / 100) * width;
+
+    for (let x = 0; x < width; x++) {
+      // このピクセルに入る peak の最小値・最大値
+      const first = Math.floor((x / width) * count);
+      const last = Math.max(first + 1, Math.floor(((x + 1) / width) * count));
+      let low = 0;
+      let high = 0;
+      for (let i = first; i < last && i < count; i++) {
+        low = Math.min(low, data[i * 2]);
+        high = Math.max(high, data[i * 2 + 1]);
+      }
+
+      ctx.fillStyle = x >= from && x <= to ? "#60a5fa" : "#4b5563";
+      const top = middle - (high / 32767) * middle;
+      const bottom = middle - (low / 32767) * middle;
+      ctx.fillRect(x, top, 1, Math.max(1, bottom - top));
+    }
+  }, [peaks, start, end]);
+
+  return <canvas ref={canvasRef} className="w-full max-w-2xl h-20" />;
+}
+
+export default Waveform;
@@ -0,0 +1,53 @@
+// 波形の概形（/api/audio-peaks/ のバイナリ形式、utils/audio_peaks.py）の読み込み
+
+const MAGIC = "PKS1";
+const HEADER_SIZE = 18; // シグネチャ(4) + 解像度の数(2) + サンプリングレート(4) + 全サンプル数(8)
+const LEVEL_SIZE = 8; // 1つの peak あたりのサンプル数(4) + peak の数(4)
+
+/**
+ * peaks のバイナリを読み込む
+ * @param {ArrayBuffer} buffer
+ * @returns {{sampleRate: number, frames: number, levels: {samplesPerPeak: number, data: Int16Array}[]}}
+ *   data は (最小値, 最大値) の組を並べたもの（±32767 が ±1.0）
+ */
+export function parsePeaks(buffer) {
+  const view = new DataView(buffer);
+  const magic = String.fromCharCode(
+    ...new Uint8Array(buffer, 0, Math.min(4, buffer.byteLength))
+  );
+  if (buffer.byteLength < HEADER_SIZE || magic !== MAGIC) {
+    throw new Error("Invalid peaks data.");
+  }
+
+  const count = view.getUint16(4, true);
+  const sampleRate = view.getUint32(6, true);
+  const frames = Number(view.getBigUint64(10, true));
+
+  let offset = HEADER_SIZE + count * LEVEL_SIZE;
+  const levels = [];
+  for (let i = 0; i < count; i++) {
+    const entry = HEADER_SIZE + i * LEVEL_SIZE;
+    const samplesPerPeak = view.getUint32(entry, true);
+    const peaks = view.getUint32(entry + 4, true);
+    // Int16Array はオフセットが2の倍数である必要があるため、コピーして切り出す
+    const data = new Int16Array(buffer.slice(offset, offset + peaks * 4));
+    levels.push({ samplesPerPeak, data });
+    offset += peaks * 4;
+  }
+  return { sampleRate, frames, levels };
+}
+
+/**
+ * 表示する幅に合う解像度を選ぶ（1ピクセルに1つ以上の peak がある中で最も粗いもの）
+ * @param {*} peaks parsePeaks の結果
+ * @param {number} width 表示する幅（ピクセル）
+ */
+export function selectLevel(peaks, width) {
+  let selected = peaks.levels[0];
+  for (const level of peaks.levels) {
+    if (level.data.length / 2 >= width) {
+      selected = level;
+    }
+  }
+  return selected;
+}
@@ -19,6 +19,9 @@ function Clipper() {
   const [scaleY, setScaleY] = useState(1);
   const [shapeType, setShapeType] = useState("SQUARE");
   const [fadeIn, setFadeIn] = useState(false);
+  const [crop, setCrop] = useState(true); // 図形を囲む矩形の大きさで切り抜くか
+  const [transparent, setTransparent] = useState(true); // 図形の外側を透明にするか（PNG）
+  const [separate, setSeparate] = useState(false); // 図形ごとに切り抜いて zip で受け取るか
   const contourCache = useRef([]);
 
   useEffect(() => {
@@ -130,6 +133,14 @@ function Clipper() {
     const formData = new FormData();
     formData.append("file", file);
     formData.append("contours", JSON.stringify(scaledContours));
+    formData.append("crop", crop);
+    if (transparent) {
+      formData.append("output_format", "png");
+    }
+    if (separate) {
+      // 図形ごとの透明な画像と manifest.json を zip で受け取る
+      formData.append("package", "zip");
+    }
 
     // 切り取り処理
     fetch("/api/clip-image/", {
@@ -150,7 +161,9 @@ function Clipper() {
         const url = URL.createObjectURL(blob);
         const a = document.createElement("a");
         a.href = url;
-        a.download = name + "_clipped";
+        a.download = separate
+          ? name + "_objects.zip"
+          : name + "_clipped" + (transparent ? ".png" : "");
         document.body.appendChild(a);
         a.click();
         document.body.removeChild(a);
@@ -251,6 +264,36 @@ function Clipper() {
                 ))}
               </div>
             )}
+            <div className="flex flex-col gap-2 w-full mt-8">
+              <div>Output</div>
+              <label className="label cursor-pointer">
+                <span className="label-text">Crop to shape</span>
+                <input
+                  type="checkbox"
+                  className="checkbox checkbox-accent"
+                  checked={crop}
+                  onChange={(e) => setCrop(e.target.checked)}
+                />
+              </label>
+              <label className="label cursor-pointer">
+                <span className="label-text">Transparent (PNG)</span>
+                <input
+                  type="checkbox"
+                  className="checkbox checkbox-accent"
+                  checked={transparent}
+                  onChange={(e) => setTransparent(e.target.checked)}
+                />
+              </label>
+              <label className="label cursor-pointer">
+                <span className="label-text">Each shape separately (zip)</span>
+                <input
+                  type="checkbox"
+                  className="checkbox checkbox-accent"
+                  checked={separate}
+                  onChange={(e) => setSeparate(e.target.checked)}
+                />
+              </label>
+            </div>
             <div className="w-full mt-12">
               <div className="btn w-full" onClick={() => popContours()}>
                 Back
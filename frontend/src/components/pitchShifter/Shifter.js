@@ -9,16 +9,15 @@ function Shifter() {
   const [file, setFile] = useState(null);
   const [pitch, setPitch] = useState(undefined);
   const [audioUrl, setAudioUrl] = useState(null);
+  const [fullAudioUrl, setFullAudioUrl] = useState(null);
   const [fadeIn, setFadeIn] = useState(false);
   const [loading, setLoading] = useState(false);
   const [progress, setProgress] = useState(0);
   const [error, setError] = useState(null);
 
-  function fetchWavFile(e) {
-    trackEvent({ action: "fetchWavFile" });
+  // ピッチ変更処理（quality: fast はプレビュー用、full は元の音質）
+  function requestShift(quality) {
     setLoading(true);
-    setAudioUrl(null);
-    setFadeIn(false);
     setProgress(0);
     setError(null);
 
@@ -34,9 +33,9 @@ function Shifter() {
     const formData = new FormData();
     formData.append("file", file);
     formData.append("pitch", pitch);
+    formData.append("quality", quality);
 
-    // ピッチ変更処理
-    fetch("/api/serve-wav/", {
+    return fetch("/api/serve-wav/", {
       method: "POST",
       body: formData,
       responseType: "blob", // バイナリデータとしてレスポンスを受け取る
@@ -48,34 +47,57 @@ function Shifter() {
         }
         return response.blob();
       })
-      .then((blob) => {
-        const audioUrl = window.URL.createObjectURL(blob); // ブラウザで再生可能な URL を作成
+      .then((blob) => window.URL.createObjectURL(blob)) // ブラウザで再生可能な URL を作成
+      .finally(() => {
+        setLoading(false);
+        clearInterval(interval);
+      });
+  }
 
+  function fetchWavFile(e) {
+    trackEvent({ action: "fetchWavFile" });
+    setAudioUrl(null);
+    setFullAudioUrl(null);
+    setFadeIn(false);
+
+    // 試聴用に、サンプリングレートを下げたモノラルの結果を先に受け取る
+    requestShift("fast")
+      .then((audioUrl) => {
         // State に URL を保存
         setAudioUrl(audioUrl);
         setTimeout(() => {
           setFadeIn(true);
         }, 100);
       })
-      .catch((error) => setError(error.message))
-      .finally(() => {
-        setLoading(false);
-        clearInterval(interval);
-      });
+      .catch((error) => setError(error.message));
   }
 
+  const download = (url) => {
+    const name = file.name.substring(0, file.name.lastIndexOf("."));
+    const link = document.createElement("a"); // <a>要素を作成
+    link.href = url; // オーディオの URL を設定
+    link.download = name + (pitch < 0 ? "m" : "") + pitch; // ダウンロードファイル名を設定
+    link.click(); // 自動的にクリックしてダウンロードを開始
+    link.remove();
+  };
+
   const handleDownload = () => {
     trackEvent({ action: "fetchWavFile" });
 
     if (!audioUrl || !file) {
       return;
     }
-    const name = file.name.substring(0, file.name.lastIndexOf("."));
-    const link = document.createElement("a"); // <a>要素を作成
-    link.href = audioUrl; // オーディオの URL を設定
-    link.download = name + (pitch < 0 ? "m" : "") + pitch; // ダウンロードファイル名を設定
-    link.click(); // 自動的にクリックしてダウンロードを開始
-    link.remove();
+    if (fullAudioUrl) {
+      download(fullAudioUrl);
+      return;
+    }
+    // ダウンロードは元のサンプリングレートと全チャンネルで作成する
+    requestShift("full")
+      .then((url) => {
+        setFullAudioUrl(url);
+        download(url);
+      })
+      .catch((error) => setError(error.message));
   };
 
   return (